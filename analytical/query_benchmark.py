@@ -0,0 +1,667 @@
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# (query file, database it runs against)
+DEFAULT_SOURCES = [
+    (os.path.join(HERE, 'README.sql'), os.path.join(HERE, 'analytical.db')),
+    (os.path.join(HERE, '..', 'joins', 'README.md'), os.path.join(HERE, '..', 'joins', 'joins.db'))
+]
+_LABEL = re.compile(r"^\s*--\s*(Q\d+)\b", re.IGNORECASE)
+_STARTS_QUERY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_CODE_BLOCK = re.compile(r"<pre>(.*?)</pre>|```(?:sql)?[ \t]*\n(.*?)```", re.IGNORECASE | re.DOTALL)
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COLUMN_REF = re.compile(r"\b(?:([A-Za-z_]\w*)\s*\.\s*)?([A-Za-z_]\w*)\b")
+_FROM_CLAUSE = re.compile(
+    r"\bFROM\b([^()]*?)(?=\bWHERE\b|\bGROUP\b|\bORDER\b|\bHAVING\b|\bLIMIT\b|\bUNION\b|\bON\b|"
+    r"\b(?:INNER|LEFT|RIGHT|FULL|CROSS|NATURAL)\b|\bJOIN\b|[()]|$)", re.IGNORECASE | re.DOTALL)
+_JOIN_TABLE = re.compile(r"\bJOIN\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+_NOT_ALIAS = {'ON', 'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'USING', 'GROUP',
+              'ORDER', 'LIMIT', 'UNION', 'HAVING'}
+_DAY_EQUALS = re.compile(
+    r"(?:strftime\s*\(\s*['\"]%Y-%m-%d['\"]\s*,\s*([A-Za-z_][\w.]*)\s*\)|DATE\s*\(\s*([A-Za-z_][\w.]*)\s*\))"
+    r"\s*=\s*'(\d{4}-\d{2}-\d{2})'", re.IGNORECASE)
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile; None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def _split_args(text: str) -> List[str]:
+    """Function arguments split on top-level commas, ignoring commas in literals and nested calls"""
+    parts, depth, current, quoted = [], 0, [], False
+    for ch in text:
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == ',' and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+            continue
+        elif not quoted:
+            depth += (ch == '(') - (ch == ')')
+        current.append(ch)
+    parts.append(''.join(current).strip())
+    return parts
+
+
+def _replace_calls(sql: str, name: str, replace: Callable[[List[str]], str]) -> str:
+    """Replace every call NAME(args) with replace(args), innermost calls included"""
+    pattern = re.compile(rf"\b{name}\s*\(", re.IGNORECASE)
+    while True:
+        match = pattern.search(sql)
+        if not match:
+            return sql
+        depth, end = 0, None
+        for i in range(match.end() - 1, len(sql)):
+            depth += (sql[i] == '(') - (sql[i] == ')')
+            if depth == 0:
+                end = i
+                break
+        if end is None:
+            return sql
+        args = [_replace_calls(a, name, replace) for a in _split_args(sql[match.end():end])]
+        sql = sql[:match.start()] + replace(args) + sql[end + 1:]
+
+
+def port_to_sqlite(sql: str) -> str:
+    """MySQL functions the exercises use, written the SQLite way: CONCAT -> ||, DATE_FORMAT -> strftime"""
+    sql = _replace_calls(sql, 'CONCAT', lambda args: '(' + ' || '.join(args) + ')')
+    return _replace_calls(sql, 'DATE_FORMAT', lambda args: f"strftime({args[1]}, {args[0]})")
+
+
+def sargable_dates(sql: str) -> Optional[str]:
+    """
+    strftime('%Y-%m-%d', col) = 'day' (or DATE(col) = 'day') as a range on the column itself
+
+    The function hides the column from any index; col >= 'day' AND col < 'next day' can use one.
+    Only equivalent for ISO 'YYYY-MM-DD HH:MM:SS' text, which is how the exercise tables store times.
+    """
+    def to_range(match):
+        column = match.group(1) or match.group(2)
+        day = date.fromisoformat(match.group(3))
+        return f"({column} >= '{day}' AND {column} < '{day + timedelta(days=1)}')"
+    rewritten = _DAY_EQUALS.sub(to_range, sql)
+    return rewritten if rewritten != sql else None
+
+
+# Rewrites tried on every query; each returns the rewritten text, or None when it doesn't apply
+REWRITES: Dict[str, Callable[[str], Optional[str]]] = {
+    'sargable_date': sargable_dates
+}
+
+
+def _code_lines(path: str) -> List[Tuple[Optional[int], str]]:
+    """(line number, text) of the SQL in a file: all of a .sql file, the <pre> / ``` blocks of a .md file"""
+    with open(path) as f:
+        text = f.read()
+    if not path.endswith('.md'):
+        return list(enumerate(text.split('\n'), start=1))
+    lines = []
+    for match in _CODE_BLOCK.finditer(text):
+        first = text.count('\n', 0, match.start()) + 1
+        body = match.group(1) if match.group(1) is not None else match.group(2)
+        lines.extend((first + i, line) for i, line in enumerate(body.split('\n')))
+        lines.append((None, '--'))  # the end of a block ends any statement in it
+    return lines
+
+
+def _candidates(lines: List[Tuple[Optional[int], str]]) -> List[Tuple[Optional[str], List[Tuple[int, str]]]]:
+    """
+    Runs of lines that may hold statements, with the Qn label of the comment block above them
+
+    A run starts at a line beginning with SELECT or WITH and ends at a comment, a ';', or a line
+    reading just OR (the exercises list alternative answers that way).
+    """
+    runs, current = [], []
+    label, block_label, in_comment_block, in_block_comment = None, None, False, False
+
+    def close():
+        if current:
+            runs.append((label, list(current)))
+            current.clear()
+
+    for lineno, line in lines:
+        stripped = line.strip()
+        if in_block_comment:
+            in_block_comment = '*/' not in stripped
+            continue
+        if stripped.startswith('/*'):
+            close()
+            in_block_comment = '*/' not in stripped
+            continue
+        if stripped.startswith('--'):
+            close()
+            if not in_comment_block:
+                in_comment_block, block_label = True, None
+            match = _LABEL.match(stripped)
+            if match:
+                block_label = match.group(1).upper()
+            continue
+        if in_comment_block and stripped:
+            in_comment_block, label = False, block_label
+        if stripped.upper() == 'OR':
+            close()
+            continue
+        if not current and not _STARTS_QUERY.match(line):
+            continue
+        code = line.split('--', 1)[0].rstrip()
+        current.append((lineno, code))
+        if code.endswith(';'):
+            close()
+    close()
+    return runs
+
+
+def _plan(conn, sql: str) -> List[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def _compile_error(conn, sql: str) -> Optional[str]:
+    try:
+        _plan(conn, sql)
+        return None
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        return str(e)
+
+
+def extract_queries(path: str, conn) -> List[Dict]:
+    """
+    The statements of a query file, checked against the database they run on
+
+    The files mix statements with prose, unterminated statements and MySQL-only syntax, so each
+    run of lines is cut at the longest prefix SQLite can compile, and the rest of the run is
+    searched again. A statement that only compiles after port_to_sqlite is kept with ported=True;
+    one that never compiles is kept with its error, so the report shows what was skipped.
+
+    Returns:
+        [{name, source, line, sql, runnable_sql, ported, error}]
+    """
+    source = os.path.basename(path)
+    queries, seen, counts = [], set(), {}
+    for label, run in _candidates(_code_lines(path)):
+        i = 0
+        while i < len(run):
+            if not _STARTS_QUERY.match(run[i][1]):
+                i += 1
+                continue
+            found = None
+            for j in range(len(run), i, -1):
+                sql = '\n'.join(text for _, text in run[i:j]).strip().rstrip(';').strip()
+                for runnable, ported in ((sql, False), (port_to_sqlite(sql), True)):
+                    if _compile_error(conn, runnable) is None:
+                        found = (j, sql, runnable, ported, None)
+                        break
+                if found:
+                    break
+            if found is None:
+                sql = '\n'.join(text for _, text in run[i:]).strip().rstrip(';').strip()
+                found = (len(run), sql, None, False, _compile_error(conn, port_to_sqlite(sql)))
+            j, sql, runnable, ported, error = found
+            key = ' '.join((runnable or sql).lower().split())
+            if key not in seen:
+                seen.add(key)
+                name = label or f"line {run[i][0]}"
+                counts[name] = counts.get(name, 0) + 1
+                if counts[name] > 1:
+                    name = f"{name}.{counts[name]}"
+                queries.append({'name': name, 'source': source, 'line': run[i][0], 'sql': sql,
+                                'runnable_sql': runnable, 'ported': ported, 'error': error})
+            i = j
+    return queries
+
+
+def scale_table(conn, table: str, rows: int) -> int:
+    """
+    Grow a table to rows by repeating its rows with new integer primary keys; returns the row count
+
+    Every other column is copied as it is, so filters keep their selectivity and joins still match.
+
+    Raises:
+        ValueError: If the table has no single integer primary key to offset
+    """
+    current = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    if not current or rows <= current:
+        return current
+    info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    keys = [c for c in info if c[5]]
+    if len(keys) != 1 or 'INT' not in (keys[0][2] or '').upper():
+        raise ValueError(f"{table} has no single integer primary key, so its rows can't be repeated")
+    key = keys[0][1]
+    low, high = conn.execute(f'SELECT MIN("{key}"), MAX("{key}") FROM "{table}"').fetchone()
+    stride = high - low + 1
+    columns = ', '.join(f'"{c[1]}"' for c in info)
+    values = ', '.join(f'"{c[1]}" + copy * {stride}' if c[1] == key else f'"{c[1]}"' for c in info)
+    copies = math.ceil(rows / current) - 1
+    conn.execute(f"""
+        INSERT INTO "{table}" ({columns})
+        WITH RECURSIVE copies(copy) AS (SELECT 1 UNION ALL SELECT copy + 1 FROM copies WHERE copy < {copies})
+        SELECT {values} FROM copies, (SELECT * FROM "{table}")
+        LIMIT {rows - current}
+        """)
+    conn.commit()
+    return rows
+
+
+class QueryBenchmark:
+    def __init__(self,
+                 sources: List[Tuple[str, str]] = None,
+                 scale: Dict[str, int] = None,
+                 runs: int = 5,
+                 warmup: int = 1,
+                 timeout: float = 30.0,
+                 min_speedup: float = 1.1,
+                 min_saving: float = 0.001,
+                 work_dir: str = None):
+        """
+        Time the exercise queries on scaled copies of their databases, and find indexes and rewrites that help
+
+        Each database is copied (never changed in place), its tables grown to the scale row counts
+        and ANALYZEd. Every query is timed as written, with each rewrite, and with each candidate
+        index the advisor derives from its plan; a change only counts if the query returns the same
+        rows and its p50 improves by min_speedup. The indexes that won for some query are then added
+        one at a time to the whole workload, and kept only if the workload gets faster: an index
+        that helps one query can lead the planner astray on another, and the report names any query
+        that ends up slower than it was written.
+
+        Args:
+            sources: (query file, database) pairs; analytical/README.sql and joins/README.md by default
+            scale: {table: rows} to grow tables to, e.g. {'Bookings': 1000000}; names match any database
+            runs: Timed executions per query and variant
+            warmup: Untimed executions first, so every variant starts with a warm page cache
+            timeout: Seconds before one execution is interrupted; the variant is reported as timed out
+            min_speedup: p50 ratio (before / after) an index or rewrite needs to be recommended
+            min_saving: Seconds of p50 it must also save; keeps timer noise on tiny tables out
+            work_dir: Where the database copies go; a temporary directory removed afterwards when omitted
+        """
+        self.sources = sources or DEFAULT_SOURCES
+        self.scale = {t.lower(): rows for t, rows in (scale or {}).items()}
+        self.runs = runs
+        self.warmup = warmup
+        self.timeout = timeout
+        self.min_speedup = min_speedup
+        self.min_saving = min_saving
+        self.work_dir = work_dir
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def prepare_database(self, db_path: str, work_dir: str) -> Tuple[str, Dict[str, int]]:
+        """Copy the database, grow the scaled tables and ANALYZE; returns the copy and its table sizes"""
+        copy = os.path.join(work_dir, os.path.basename(db_path))
+        shutil.copyfile(db_path, copy)
+        conn = sqlite3.connect(copy)
+        try:
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                                 "AND name NOT LIKE 'sqlite_%'")]
+            sizes = {}
+            for table in tables:
+                target = self.scale.get(table.lower())
+                sizes[table] = scale_table(conn, table, target) if target else \
+                    conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        return copy, sizes
+
+    def measure(self, conn, sql: str) -> Dict:
+        """
+        Time one statement
+
+        Returns:
+            Dictionary with p50/p95/p99/mean seconds, rows, an order-insensitive checksum of the result
+            (floats rounded, so a different summation order doesn't count as a different answer), the
+            EXPLAIN QUERY PLAN lines, and status ('success', 'timeout' or 'error')
+        """
+        result = {'plan': _plan(conn, sql), 'status': 'success'}
+        latencies = []
+        for i in range(self.warmup + self.runs):
+            deadline = time.monotonic() + self.timeout
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+            started = time.perf_counter()
+            try:
+                rows = conn.execute(sql).fetchall()
+            except sqlite3.OperationalError as e:
+                result.update({'status': 'timeout' if 'interrupt' in str(e) else 'error', 'error': str(e)})
+                break
+            finally:
+                conn.set_progress_handler(None, 0)
+            if i >= self.warmup:
+                latencies.append(time.perf_counter() - started)
+        else:
+            normalized = (tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows)
+            result.update({'rows': len(rows), 'checksum': sum(hash(row) for row in normalized) & (2 ** 64 - 1)})
+        result.update({
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies) if latencies else None
+        })
+        return result
+
+    @staticmethod
+    def _table_refs(conn, sql: str) -> Dict[str, str]:
+        """{alias or name (lower-cased): table} for the database tables a statement reads"""
+        tables = {r[0].lower(): r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        masked = _LITERAL.sub("''", sql)
+        items = [item.split() for clause in _FROM_CLAUSE.findall(masked) for item in clause.split(',')]
+        items += [[m.group(1)] + ([m.group(2)] if m.group(2) else []) for m in _JOIN_TABLE.finditer(masked)]
+        refs = {}
+        for item in items:
+            if not item or item[0].lower() not in tables:
+                continue
+            table = tables[item[0].lower()]
+            refs[item[0].lower()] = table
+            alias = item[-1] if len(item) > 1 and item[-1].upper() not in _NOT_ALIAS else None
+            if alias:
+                refs[alias.lower()] = table
+        return refs
+
+    def candidate_indexes(self, conn, sql: str, plan: List[str]) -> List[Tuple[str, Tuple[str, ...]]]:
+        """
+        Indexes worth trying for a statement: (table, columns)
+
+        Only tables the plan scans in full, or builds an automatic index on, are considered. For each,
+        the columns compared with = (joins included) lead, then the first range column; the covering
+        variants add every other column the statement reads from the table, so the table itself isn't
+        visited at all.
+        """
+        refs = self._table_refs(conn, sql)
+        scanned = set()
+        for line in plan:
+            match = re.match(r"(?:SCAN|SEARCH)\s+(\w+)(.*)", line)
+            if match and (line.startswith('SCAN') or 'AUTOMATIC' in match.group(2)) \
+                    and 'COVERING INDEX' not in match.group(2).replace('AUTOMATIC COVERING INDEX', ''):
+                table = refs.get(match.group(1).lower())
+                if table:
+                    scanned.add(table)
+
+        masked = _LITERAL.sub("''", sql)
+        columns = {t: [r[1] for r in conn.execute(f'PRAGMA table_info("{t}")')] for t in set(refs.values())}
+        candidates = []
+        for table in sorted(scanned):
+            own = {c.lower(): c for c in columns[table]}
+            others = {c.lower() for t, cols in columns.items() if t != table for c in cols}
+            equal, ranged, read = [], [], []
+            for match in _COLUMN_REF.finditer(masked):
+                qualifier, name = match.group(1), match.group(2).lower()
+                if name not in own:
+                    continue
+                if qualifier is not None and refs.get(qualifier.lower()) != table:
+                    continue
+                if qualifier is None and name in others:
+                    continue  # ambiguous without a qualifier
+                column = own[name]
+                before = masked[:match.start()].rstrip()
+                after = masked[match.end():].lstrip()
+                if re.match(r"=(?!=)|IN\s*\(", after, re.IGNORECASE) or (before.endswith('=') and
+                                                                        not before.endswith(('<=', '>=', '!='))):
+                    bucket = equal
+                elif re.match(r"[<>]|BETWEEN\b", after, re.IGNORECASE) or before.endswith(('<', '>', '<=', '>=')):
+                    bucket = ranged
+                else:
+                    bucket = read
+                if column not in bucket:
+                    bucket.append(column)
+            ranged = [c for c in ranged if c not in equal]
+            rest = [c for c in read if c not in equal and c not in ranged] + ranged[1:]
+            variants = [equal, equal + ranged[:1], equal + ranged[:1] + rest, ranged[:1] + equal + rest]
+            if len(equal) > 1:
+                variants.append([equal[1], equal[0]] + equal[2:] + ranged[:1] + rest)
+            for cols in variants:
+                cols = tuple(cols[:6])
+                if cols and (table, cols) not in candidates:
+                    candidates.append((table, cols))
+        return candidates
+
+    @staticmethod
+    def _index_name(table: str, cols: Tuple[str, ...]) -> str:
+        return f"qb_{table}_{'_'.join(cols)}".lower()
+
+    @staticmethod
+    def _create_index(conn, name: str, table: str, cols: List[str]):
+        columns = ', '.join(f'"{c}"' for c in cols)
+        conn.execute(f'CREATE INDEX "{name}" ON "{table}" ({columns})')
+        conn.execute(f'ANALYZE "{name}"')
+
+    def _variants(self, query: Dict) -> Dict[str, str]:
+        """The statement as written (ported if it had to be) and with each rewrite that applies"""
+        variants = {'original': query['runnable_sql']}
+        for name, rewrite in REWRITES.items():
+            rewritten = rewrite(query['runnable_sql'])
+            if rewritten:
+                variants[name] = rewritten
+        return variants
+
+    def benchmark_source(self, query_file: str, db_path: str, work_dir: str) -> Dict:
+        """Extract, time and advise on one query file against its database"""
+        copy, sizes = self.prepare_database(db_path, work_dir)
+        conn = sqlite3.connect(copy)
+        try:
+            queries = extract_queries(query_file, conn)
+            runnable = [q for q in queries if q['runnable_sql']]
+            self.logger.info(f"{os.path.basename(query_file)}: {len(runnable)} of {len(queries)} statements "
+                             f"run on SQLite; tables {sizes}")
+            candidates = {}
+            for q in runnable:
+                q['variants'] = self._variants(q)
+                q['results'] = {}
+                for variant, sql in q['variants'].items():
+                    q['results'][(variant, None)] = self.measure(conn, sql)
+                    for candidate in self.candidate_indexes(conn, sql, q['results'][(variant, None)]['plan']):
+                        candidates.setdefault(candidate, set()).add(id(q))
+
+            indexes = []
+            for (table, cols), users in candidates.items():
+                name = self._index_name(table, cols)
+                started = time.monotonic()
+                self._create_index(conn, name, table, list(cols))
+                indexes.append({'name': name, 'table': table, 'columns': list(cols),
+                                'build_seconds': time.monotonic() - started})
+                self.logger.info(f"Trying index {name} on {len(users)} statements")
+                for q in runnable:
+                    if id(q) in users:
+                        for variant, sql in q['variants'].items():
+                            q['results'][(variant, name)] = self.measure(conn, sql)
+                conn.execute(f'DROP INDEX "{name}"')
+                conn.execute("ANALYZE")
+
+            report = [self._advise(q) for q in queries]
+            combined = self._combined(conn, report, indexes)
+        finally:
+            conn.close()
+        return {
+            'source': os.path.basename(query_file),
+            'database': os.path.basename(db_path),
+            'table_rows': sizes,
+            'queries': report,
+            'indexes_tried': indexes,
+            'recommended_indexes': [i for i in indexes if i['name'] in combined['indexes']],
+            'combined': combined
+        }
+
+    def _advise(self, query: Dict) -> Dict:
+        """The query's baseline and the fastest variant that returns the same rows"""
+        entry = {k: query[k] for k in ('name', 'source', 'line', 'sql', 'ported', 'error')}
+        if not query['runnable_sql']:
+            entry['status'] = 'skipped'
+            return entry
+        baseline = query['results'][('original', None)]
+        entry.update({'status': baseline['status'], 'baseline': self._summary(baseline), 'best': None,
+                      'variants': []})
+        if baseline['status'] != 'success':
+            return entry
+        best = None
+        for (variant, index), result in query['results'].items():
+            same = result['status'] == 'success' and result['checksum'] == baseline['checksum']
+            speedup = baseline['p50'] / result['p50'] if same and result['p50'] else None
+            summary = {'rewrite': None if variant == 'original' else variant, 'index': index,
+                       'same_result': same, 'speedup': speedup, **self._summary(result)}
+            if variant != 'original' or index:
+                entry['variants'].append(summary)
+            if speedup and speedup >= self.min_speedup and baseline['p50'] - result['p50'] >= self.min_saving \
+                    and (best is None or speedup > best['speedup']):
+                best = summary
+        entry['best'] = best
+        entry['best_sql'] = query['variants'][best['rewrite'] or 'original'] if best else None
+        return entry
+
+    @staticmethod
+    def _summary(result: Dict) -> Dict:
+        return {k: result.get(k) for k in ('status', 'p50', 'p95', 'p99', 'mean', 'rows', 'plan', 'error')}
+
+    def _workload(self, conn, report: List[Dict]) -> Dict[str, Dict]:
+        """Every runnable query in its best form (rewritten where a rewrite won), timed as things stand"""
+        return {e['name']: self.measure(conn, e['best_sql'] or self._baseline_sql(e))
+                for e in report if e['status'] == 'success'}
+
+    @staticmethod
+    def _total(results: Dict[str, Dict]) -> float:
+        return sum(r['p50'] if r['status'] == 'success' else math.inf for r in results.values())
+
+    def _combined(self, conn, report: List[Dict], indexes: List[Dict]) -> Dict:
+        """
+        Build up the index set greedily over the whole workload
+
+        The indexes that won for some query are tried in order of the p50 they saved, each kept only if
+        the summed p50 of all queries drops by min_saving. Returns the kept indexes, the rejected ones,
+        the per-query p50 before (as written, no indexes) and after (best form, kept indexes), and the
+        queries that got slower by min_speedup and min_saving all the same.
+        """
+        saved = {}
+        for entry in report:
+            if entry.get('best') and entry['best']['index']:
+                name = entry['best']['index']
+                saved[name] = saved.get(name, 0.0) + entry['baseline']['p50'] - entry['best']['p50']
+        by_name = {i['name']: i for i in indexes}
+        current = self._workload(conn, report)
+        kept, rejected = [], []
+        for name in sorted(saved, key=saved.get, reverse=True):
+            index = by_name[name]
+            self._create_index(conn, name, index['table'], index['columns'])
+            trial = self._workload(conn, report)
+            if self._total(current) - self._total(trial) >= self.min_saving:
+                kept.append(name)
+                current = trial
+                continue
+            rejected.append(name)
+            conn.execute(f'DROP INDEX "{name}"')
+            conn.execute("ANALYZE")
+        before = {e['name']: e['baseline']['p50'] for e in report if e['status'] == 'success'}
+        after = {name: r['p50'] for name, r in current.items()}
+        slower = [q for q, p50 in after.items() if p50 is None or
+                  (p50 >= before[q] * self.min_speedup and p50 - before[q] >= self.min_saving)]
+        for entry in report:
+            if entry['name'] in current:
+                entry['combined'] = self._summary(current[entry['name']])
+        return {
+            'indexes': kept,
+            'rejected': rejected,
+            'slower': slower,
+            'per_query_p50_before': before,
+            'per_query_p50_after': after,
+            'p50_sum_before': sum(before.values()),
+            'p50_sum_after': self._total(current)
+        }
+
+    @staticmethod
+    def _baseline_sql(entry: Dict) -> str:
+        return port_to_sqlite(entry['sql']) if entry['ported'] else entry['sql']
+
+    def run(self) -> List[Dict]:
+        """
+        Benchmark every source
+
+        Returns:
+            One report per source: table sizes, per-query baseline and best variant (rewrite and/or
+            index, with speedup and plans), the indexes tried and recommended, and the workload's summed
+            p50 with every recommended index in place
+        """
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix='query_benchmark_')
+        try:
+            return [self.benchmark_source(query_file, db_path, work_dir) for query_file, db_path in self.sources]
+        finally:
+            if not self.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    @staticmethod
+    def format_report(reports: List[Dict]) -> str:
+        def ms(value):
+            return '-' if value is None else f"{value * 1000:.2f}"
+
+        lines = []
+        for report in reports:
+            sizes = ', '.join(f"{t} {n:,}" for t, n in report['table_rows'].items())
+            lines.append(f"{report['source']} on {report['database']} ({sizes})")
+            lines.append(f"{'query':<12} {'rows':>8} {'p50 ms':>9} {'p99 ms':>9} {'best ms':>9} {'speedup':>8} "
+                         f"{'combined':>9}  best change")
+            lines.append('-' * 100)
+            combined = report['combined']
+            for entry in report['queries']:
+                if entry['status'] == 'skipped':
+                    continue
+                base, best = entry['baseline'], entry['best']
+                change = '-'
+                if best:
+                    change = ' + '.join(filter(None, [best['rewrite'], best['index']]))
+                elif entry['status'] != 'success':
+                    change = entry['status']
+                rows = base['rows'] if base['rows'] is not None else '-'
+                speedup = f"{best['speedup']:.1f}x" if best else '-'
+                lines.append(f"{entry['name']:<12} {rows:>8} {ms(base['p50']):>9} {ms(base['p99']):>9} "
+                             f"{ms(best['p50'] if best else None):>9} {speedup:>8} "
+                             f"{ms(combined['per_query_p50_after'].get(entry['name'])):>9}  "
+                             f"{change}{' (ported)' if entry['ported'] else ''}")
+            skipped = [e for e in report['queries'] if e['status'] == 'skipped']
+            if skipped:
+                lines.append("Skipped (not SQLite): " + ', '.join(f"{e['name']} ({e['error']})" for e in skipped))
+            for index in report['recommended_indexes']:
+                lines.append(f"Recommended: CREATE INDEX {index['name']} ON {index['table']} "
+                             f"({', '.join(index['columns'])})")
+            if combined['rejected']:
+                lines.append(f"Not kept (no workload gain): {', '.join(combined['rejected'])}")
+            if combined['slower']:
+                lines.append(f"Slower than written with these indexes: {', '.join(combined['slower'])}")
+            lines.append(f"Workload p50 sum: {ms(combined['p50_sum_before'])} ms -> "
+                         f"{ms(combined['p50_sum_after'])} ms with the rewrites and recommended indexes")
+            lines.append('')
+        return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exercise queries and suggest indexes")
+    parser.add_argument('--rows', nargs='*', default=['Bookings=200000'],
+                        help="Grow tables to these row counts, e.g. Bookings=1000000 orders=50000")
+    parser.add_argument('--runs', type=int, default=5, help="Timed executions per query and variant")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30.0, help="Seconds before one execution is stopped")
+    parser.add_argument('--min-speedup', type=float, default=1.1)
+    parser.add_argument('--min-saving-ms', type=float, default=1.0)
+    parser.add_argument('--output', help="Also write the full results, plans included, to this JSON file")
+    args = parser.parse_args()
+
+    benchmark = QueryBenchmark(
+        scale={table: int(rows) for table, rows in (item.split('=') for item in args.rows)},
+        runs=args.runs,
+        warmup=args.warmup,
+        timeout=args.timeout,
+        min_speedup=args.min_speedup,
+        min_saving=args.min_saving_ms / 1000
+    )
+    results = benchmark.run()
+    print(QueryBenchmark.format_report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
@@ -0,0 +1,454 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+# Error codes worth retrying a StartQueryExecution on
+_THROTTLED = ('TooManyRequestsException', 'ThrottlingException')
+
+
+class AthenaQueryError(Exception):
+    """Raised when an Athena query ends FAILED or CANCELLED, or its results can't be read"""
+
+
+def sql_literal(value) -> str:
+    """A Python value as Athena (Trino) literal text, for ExecutionParameters"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}'"
+    if isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def like_contains(value: str, escape: str = '\\') -> str:
+    """LIKE pattern matching value anywhere, with % and _ in value taken literally (use ESCAPE '\\')"""
+    escaped = value.replace(escape, escape * 2).replace('%', escape + '%').replace('_', escape + '_')
+    return f"%{escaped}%"
+
+
+def normalize_sql(sql: str) -> str:
+    """Query text with comments dropped and whitespace and case folded outside string literals"""
+    pieces = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(pieces), 2):
+        text = re.sub(r"--[^\n]*", ' ', pieces[i])
+        text = re.sub(r"/\*.*?\*/", ' ', text, flags=re.DOTALL)
+        pieces[i] = re.sub(r"\s+", ' ', text).lower()
+    return ''.join(pieces).strip().rstrip(';').strip()
+
+
+def _error_code(error: Exception) -> Optional[str]:
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class ResultCache:
+    def __init__(self, path: str = None, ttl_seconds: float = 24 * 3600, open_window_ttl_seconds: float = 300):
+        """
+        Maps a query (normalised text, parameters and partition range) to the QueryExecutionId
+        that already answered it, so repeating an investigation reads the old output from S3
+        instead of scanning the logs again
+
+        Args:
+            path: JSON file the cache persists to between runs; in memory only when omitted
+            ttl_seconds: How long an answer for a closed partition range stays valid
+            open_window_ttl_seconds: The same for ranges reaching today or later, or with no range,
+                                     whose logs are still arriving
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.open_window_ttl_seconds = open_window_ttl_seconds
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(sql: str, parameters: List[str] = None, partition_range: Tuple = None) -> str:
+        payload = json.dumps([normalize_sql(sql), list(parameters or []),
+                              [str(p) for p in partition_range] if partition_range else None])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _ttl(self, partition_range: Optional[Tuple]) -> float:
+        if not partition_range:
+            return self.open_window_ttl_seconds
+        end = partition_range[-1]
+        end = end.date() if isinstance(end, datetime) else end
+        if not isinstance(end, date):
+            end = date.fromisoformat(str(end)[:10])
+        return self.open_window_ttl_seconds if end >= datetime.now(timezone.utc).date() else self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() < entry['expires']:
+                return entry['query_execution_id']
+            return None
+
+    def put(self, key: str, query_execution_id: str, partition_range: Tuple = None):
+        with self._lock:
+            self._entries[key] = {'query_execution_id': query_execution_id,
+                                  'expires': time.time() + self._ttl(partition_range)}
+            self._save()
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with open(self.path, 'w') as f:
+            json.dump({k: e for k, e in self._entries.items() if e['expires'] > now}, f, indent=2)
+
+
+class AthenaClient:
+    def __init__(self,
+                 database: str,
+                 output_location: str,
+                 workgroup: str = 'primary',
+                 client=None,
+                 region_name: str = None,
+                 max_concurrent: int = 5,
+                 poll_initial: float = 0.25,
+                 poll_max: float = 5.0,
+                 page_size: int = 1000,
+                 cache: ResultCache = None,
+                 timeout: float = 1800):
+        """
+        Athena queries with parameters, backoff polling, concurrent submission, paged results and reuse
+
+        Args:
+            database: Default database for the queries
+            output_location: s3:// prefix Athena writes results to
+            workgroup: Athena workgroup
+            client: boto3 Athena client, or any object with the same methods (athena_stub.AthenaStub);
+                    boto3.client('athena') when omitted
+            region_name: Region for the default boto3 client
+            max_concurrent: Queries in flight at once in execute_many (Athena's account limit on
+                            active DML queries is typically 20-25)
+            poll_initial: First polling delay in seconds; doubles per poll up to poll_max, with full jitter
+            poll_max: Longest delay between polls
+            page_size: Rows per get_query_results call (at most 1000)
+            cache: Result cache; None disables reuse
+            timeout: Seconds to wait for a query before stopping it
+        """
+        if client is None:
+            import boto3
+            client = boto3.client('athena', region_name=region_name)
+        self.client = client
+        self.database = database
+        self.output_location = output_location
+        self.workgroup = workgroup
+        self.max_concurrent = max_concurrent
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.page_size = min(page_size, 1000)
+        self.cache = cache
+        self.timeout = timeout
+        self._rng = random.Random()
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _delay(self, attempt: int) -> float:
+        """Full jitter: uniform over [0, min(poll_max, poll_initial * 2^attempt)], never below a tenth of poll_initial"""
+        ceiling = min(self.poll_max, self.poll_initial * (2 ** attempt))
+        return max(self.poll_initial / 10, self._rng.uniform(0, ceiling))
+
+    # --- submission ----------------------------------------------------
+
+    def _cached_execution(self, key: str) -> Optional[Dict]:
+        """The cached execution if it succeeded and its output is still readable, else None"""
+        execution_id = self.cache.get(key) if self.cache else None
+        if not execution_id:
+            return None
+        try:
+            execution = self.client.get_query_execution(QueryExecutionId=execution_id)['QueryExecution']
+            if execution['Status']['State'] != 'SUCCEEDED':
+                raise AthenaQueryError(f"cached query is {execution['Status']['State']}")
+            # A one-row read proves the output file is still in S3 (lifecycle rules may have removed it)
+            self.client.get_query_results(QueryExecutionId=execution_id, MaxResults=1)
+        except Exception as e:
+            self.logger.info(f"Cached result {execution_id} can't be reused ({str(e)}); running the query again")
+            self.cache.discard(key)
+            return None
+        return execution
+
+    def submit(self, sql: str, parameters: List = None, partition_range: Tuple = None) -> Dict:
+        """
+        Start a query, or find the execution that already answered it
+
+        Args:
+            sql: Query text with ? placeholders
+            parameters: Python values for the placeholders, sent as ExecutionParameters, never
+                        interpolated into the text
+            partition_range: (first, last) partition values the query covers, part of the cache key
+
+        Returns:
+            Dictionary with query_execution_id, cached (True if reused) and the cache key
+        """
+        literals = [sql_literal(p) for p in parameters or []]
+        key = ResultCache.key(sql, literals, partition_range)
+        cached = self._cached_execution(key)
+        if cached:
+            return {'query_execution_id': cached['QueryExecutionId'], 'cached': True, 'key': key,
+                    'partition_range': partition_range}
+
+        request = {
+            'QueryString': sql,
+            'QueryExecutionContext': {'Database': self.database},
+            'ResultConfiguration': {'OutputLocation': self.output_location},
+            'WorkGroup': self.workgroup
+        }
+        if literals:
+            request['ExecutionParameters'] = literals
+        attempt = 0
+        while True:
+            try:
+                response = self.client.start_query_execution(**request)
+                break
+            except Exception as e:
+                if _error_code(e) not in _THROTTLED or attempt >= 8:
+                    raise
+                delay = self._delay(attempt + 2)
+                self.logger.info(f"Athena throttled the submission; retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+        return {'query_execution_id': response['QueryExecutionId'], 'cached': False, 'key': key,
+                'partition_range': partition_range}
+
+    # --- polling -------------------------------------------------------
+
+    @staticmethod
+    def _summary(execution: Dict, cached: bool = False) -> Dict:
+        status = execution['Status']
+        statistics = execution.get('Statistics', {})
+        return {
+            'status': 'success' if status['State'] == 'SUCCEEDED' else 'error',
+            'query_execution_id': execution['QueryExecutionId'],
+            'state': status['State'],
+            'error': status.get('StateChangeReason'),
+            'cached': cached,
+            # A reused result scans nothing now, whatever the original run scanned
+            'bytes_scanned': 0 if cached else statistics.get('DataScannedInBytes', 0),
+            'original_bytes_scanned': statistics.get('DataScannedInBytes', 0),
+            'engine_ms': statistics.get('EngineExecutionTimeInMillis'),
+            'total_ms': statistics.get('TotalExecutionTimeInMillis'),
+            'output_location': execution.get('ResultConfiguration', {}).get('OutputLocation')
+        }
+
+    def wait(self, query_execution_ids: List[str]) -> Iterator[Dict]:
+        """
+        Poll running queries until each finishes, yielding each as it completes
+
+        One batch_get_query_execution call covers up to 50 queries per poll, and the delay between
+        polls backs off with full jitter, so many concurrent waits don't poll in lockstep.
+        """
+        pending = list(dict.fromkeys(query_execution_ids))
+        started = time.monotonic()
+        attempt = 0
+        while pending:
+            finished = []
+            for i in range(0, len(pending), 50):
+                response = self.client.batch_get_query_execution(QueryExecutionIds=pending[i:i + 50])
+                for execution in response['QueryExecutions']:
+                    if execution['Status']['State'] in TERMINAL_STATES:
+                        finished.append(execution)
+            for execution in finished:
+                pending.remove(execution['QueryExecutionId'])
+                yield self._summary(execution)
+            if not pending:
+                return
+            if time.monotonic() - started > self.timeout:
+                for execution_id in pending:
+                    self.client.stop_query_execution(QueryExecutionId=execution_id)
+                raise AthenaQueryError(f"Timed out after {self.timeout}s waiting for {len(pending)} queries")
+            # Back off while nothing finishes; start again from short delays once something does
+            attempt = 0 if finished else attempt + 1
+            time.sleep(self._delay(attempt))
+
+    def execute(self, sql: str, parameters: List = None, partition_range: Tuple = None) -> Dict:
+        """
+        Run one query to completion
+
+        Raises:
+            AthenaQueryError: if the query fails or is cancelled
+        """
+        submitted = self.submit(sql, parameters, partition_range)
+        if submitted['cached']:
+            execution = self.client.get_query_execution(QueryExecutionId=submitted['query_execution_id'])
+            return self._summary(execution['QueryExecution'], cached=True)
+        result = next(self.wait([submitted['query_execution_id']]))
+        if result['status'] != 'success':
+            raise AthenaQueryError(f"Query {result['query_execution_id']} {result['state']}: {result['error']}")
+        if self.cache:
+            self.cache.put(submitted['key'], result['query_execution_id'], partition_range)
+        return result
+
+    def execute_many(self, queries: List[Dict]) -> Iterator[Dict]:
+        """
+        Run many queries with at most max_concurrent in flight, yielding each as it finishes
+
+        Args:
+            queries: Dicts with sql and optional parameters, partition_range and name
+
+        Yields:
+            The execute() summary plus name and index; failed queries come back with
+            status 'error' instead of raising, so one bad query doesn't lose the others.
+            Closing the generator early stops the queries still running.
+        """
+        waiting = list(enumerate(queries))
+        running: Dict[str, Tuple[int, Dict, Dict]] = {}
+        try:
+            yield from self._execute_window(waiting, running)
+        finally:
+            # The caller stopped early (a row limit reached, an error): don't leave queries scanning
+            for execution_id in running:
+                try:
+                    self.client.stop_query_execution(QueryExecutionId=execution_id)
+                except Exception as e:
+                    self.logger.warning(f"Could not stop query {execution_id}: {str(e)}")
+
+    def _execute_window(self, waiting: List[Tuple[int, Dict]], running: Dict[str, Tuple[int, Dict, Dict]]) -> Iterator[Dict]:
+        while waiting or running:
+            while waiting and len(running) < self.max_concurrent:
+                index, query = waiting.pop(0)
+                try:
+                    submitted = self.submit(query['sql'], query.get('parameters'), query.get('partition_range'))
+                except Exception as e:
+                    self.logger.error(f"Submitting query {query.get('name', index)} failed: {str(e)}")
+                    yield {'status': 'error', 'name': query.get('name'), 'index': index, 'error': str(e)}
+                    continue
+                if submitted['cached']:
+                    execution = self.client.get_query_execution(QueryExecutionId=submitted['query_execution_id'])
+                    yield {**self._summary(execution['QueryExecution'], cached=True),
+                           'name': query.get('name'), 'index': index}
+                    continue
+                running[submitted['query_execution_id']] = (index, query, submitted)
+            if not running:
+                continue
+            # Yield as soon as anything finishes so its slot is refilled
+            for result in self.wait(list(running)):
+                index, query, submitted = running.pop(result['query_execution_id'])
+                if result['status'] == 'success' and self.cache:
+                    self.cache.put(submitted['key'], result['query_execution_id'], submitted['partition_range'])
+                elif result['status'] != 'success':
+                    self.logger.error(f"Query {query.get('name', index)} {result['state']}: {result['error']}")
+                yield {**result, 'name': query.get('name'), 'index': index}
+                break
+
+    # --- results -------------------------------------------------------
+
+    @staticmethod
+    def _convert(value: Optional[str], athena_type: str):
+        if value is None:
+            return None
+        athena_type = athena_type.lower()
+        if athena_type in ('tinyint', 'smallint', 'integer', 'int', 'bigint'):
+            return int(value)
+        if athena_type in ('double', 'float', 'real'):
+            return float(value)
+        if athena_type.startswith('decimal'):
+            return Decimal(value)
+        if athena_type == 'boolean':
+            return value.lower() == 'true'
+        if athena_type == 'date':
+            return date.fromisoformat(value)
+        if athena_type.startswith('timestamp'):
+            return datetime.fromisoformat(value.replace(' UTC', ''))
+        return value
+
+    def iter_rows(self, query_execution_id: str, typed: bool = True) -> Iterator[Dict]:
+        """
+        Stream a query's rows page by page from get_query_results; only one page is held at a time
+
+        Args:
+            query_execution_id: A SUCCEEDED query
+            typed: Convert values by the result's column types (otherwise every value is a string)
+        """
+        token = None
+        columns = None
+        while True:
+            request = {'QueryExecutionId': query_execution_id, 'MaxResults': self.page_size}
+            if token:
+                request['NextToken'] = token
+            response = self.client.get_query_results(**request)
+            rows = response['ResultSet']['Rows']
+            if columns is None:
+                columns = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+                rows = rows[1:]  # The first page starts with the header row
+            for row in rows:
+                values = [field.get('VarCharValue') for field in row['Data']]
+                yield {c['Label']: self._convert(v, c['Type']) if typed else v for c, v in zip(columns, values)}
+            token = response.get('NextToken')
+            if not token:
+                return
+
+    def query(self, sql: str, parameters: List = None, partition_range: Tuple = None) -> Iterator[Dict]:
+        """execute() then iter_rows(): rows of one query as a generator"""
+        result = self.execute(sql, parameters, partition_range)
+        self.logger.info(f"Query {result['query_execution_id']} scanned {result['bytes_scanned']:,} bytes"
+                         f"{' (reused result)' if result['cached'] else ''}")
+        return self.iter_rows(result['query_execution_id'])
+
+    def query_s3_logs(self, table: str, request_param_value: str,
+                      event_names: Tuple[str, ...] = ('GetObject', 'PutObject'), limit: int = 100) -> Iterator[Dict]:
+        """
+        CloudTrail S3 data events whose requestparameters contain a value
+
+        The value is a query parameter, and %, _ in it match literally.
+        """
+        sql = f"""
+            SELECT eventtime, eventname, awsregion, sourceipaddress, useragent, requestparameters, responseelements
+            FROM {table}
+            WHERE eventname IN ({', '.join('?' for _ in event_names)})
+            AND requestparameters LIKE ? ESCAPE '\\'
+            LIMIT {int(limit)}
+            """
+        return self.query(sql, list(event_names) + [like_contains(request_param_value)])
+
+
+# Example usage
+if __name__ == "__main__":
+    import csv
+    import sys
+
+    athena = AthenaClient(
+        database='your_database_name',
+        output_location='s3://your-query-results-bucket/folder/',
+        cache=ResultCache('athena_result_cache.json')
+    )
+
+    # Rows stream straight to CSV; the whole result is never in memory
+    rows = athena.query_s3_logs('your_table_name', 'your_search_value')
+    first = next(rows, None)
+    if first:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(first))
+        writer.writeheader()
+        writer.writerow(first)
+        for row in rows:
+            writer.writerow(row)
+
+    # Several searches at once; repeats of earlier ones reuse their results
+    searches = [{'name': value,
+                 'sql': "SELECT COUNT(*) AS hits FROM your_table_name WHERE requestparameters LIKE ? ESCAPE '\\'",
+                 'parameters': [like_contains(value)]}
+                for value in ('bucket-a', 'bucket-b', 'bucket-c')]
+    for result in athena.execute_many(searches):
+        print(f"{result['name']}: {result['state']}, {result.get('bytes_scanned', 0):,} bytes scanned")
@@ -0,0 +1,321 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import collections
+import itertools
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class StubClientError(Exception):
+    """Stands in for botocore's ClientError: the error code is under response['Error']['Code']"""
+
+    def __init__(self, code: str, message: str, operation: str):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation: {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+_TYPES = {int: 'bigint', float: 'double', bool: 'boolean', str: 'varchar'}
+
+
+def _split_conjuncts(text: str) -> List[str]:
+    """Top-level AND terms of a condition (literals and parentheses respected); [text] if it has a top-level OR"""
+    terms, depth, start, i, quoted = [], 0, 0, 0, False
+    upper = text.upper()
+    while i < len(text):
+        ch = text[i]
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted:
+            if ch == '(':
+                depth += 1
+            elif ch == ')':
+                depth -= 1
+            elif depth == 0 and re.match(r"\bOR\b", upper[i:i + 3]) and (i == 0 or not upper[i - 1].isalnum()):
+                return [text.strip()]
+            elif depth == 0 and upper.startswith('AND', i) and (i == 0 or not upper[i - 1].isalnum()) \
+                    and (i + 3 >= len(text) or not upper[i + 3].isalnum()):
+                # BETWEEN x AND y keeps its AND
+                if not re.search(r"\bBETWEEN\s+\S+\s*$", upper[start:i]):
+                    terms.append(text[start:i].strip())
+                    start = i + 3
+        i += 1
+    terms.append(text[start:].strip())
+    return [t for t in terms if t]
+
+
+class AthenaStub:
+    def __init__(self,
+                 database: str = 'default',
+                 latency: float = 0.2,
+                 max_concurrent_queries: int = 20,
+                 seed_bytes_per_row: Optional[int] = None):
+        """
+        In-process stand-in for the boto3 Athena client, for exercising the Athena code without AWS
+
+        Tables are loaded with add_table(); queries run on SQLite in a background thread after
+        `latency` seconds, moving through QUEUED / RUNNING / SUCCEEDED like Athena's. The methods
+        the client uses are implemented with boto3's request and response shapes:
+        start_query_execution (with ExecutionParameters), get_query_execution,
+        batch_get_query_execution, get_query_results (paged with NextToken),
+        stop_query_execution and get_table_metadata. DataScannedInBytes counts only the
+        partitions the query's partition-column predicates leave, as Athena's partition pruning would.
+
+        Args:
+            database: Default database for unqualified table names
+            latency: Seconds each query takes
+            max_concurrent_queries: Active queries allowed before TooManyRequestsException
+            seed_bytes_per_row: Stored size per row; default is the row's JSON length
+        """
+        self.database = database
+        self.latency = latency
+        self.max_concurrent_queries = max_concurrent_queries
+        self.seed_bytes_per_row = seed_bytes_per_row
+        self.calls = collections.Counter()
+        self.executions: Dict[str, Dict] = {}
+        self.partition_columns: Dict[str, List[str]] = {}
+        self.tables: Dict[str, Dict] = {}
+
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db.create_function('json_extract_scalar', 2, self._json_extract_scalar, deterministic=True)
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _json_extract_scalar(document, path):
+        if document is None:
+            return None
+        try:
+            value = json.loads(document)
+        except ValueError:
+            return None
+        for part in re.findall(r"\.([^.\[\]]+)|\[(\d+)\]", path):
+            key, index = part
+            try:
+                value = value[int(index)] if index else value[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return None if isinstance(value, (dict, list)) else str(value)
+
+    def _table_name(self, name: str) -> str:
+        parts = name.lower().strip('"').split('.')
+        return '__'.join(parts if len(parts) > 1 else [self.database.lower()] + parts)
+
+    def add_table(self, name: str, rows: Iterable[Dict], partition_columns: Tuple[str, ...] = (),
+                  properties: Dict[str, str] = None):
+        """
+        Load a table; partition columns are stored like any other column
+
+        Args:
+            name: 'database.table' or 'table' (in the default database)
+            rows: Dicts with the same keys
+            partition_columns: Columns Athena would see as partition keys, for the bytes-scanned figure
+            properties: TBLPROPERTIES returned by get_table_metadata, e.g. partition projection settings
+        """
+        rows = list(rows)
+        if not rows:
+            raise ValueError(f"No rows for table {name}")
+        table = self._table_name(name)
+        columns = list(rows[0])
+        with self._lock:
+            self._db.execute(f'DROP TABLE IF EXISTS "{table}"')
+            column_sql = ', '.join(f'"{c}" {_TYPES.get(type(rows[0][c]), "varchar")}' for c in columns)
+            self._db.execute(f'CREATE TABLE "{table}" ({column_sql}, _bytes INTEGER)')
+            self._db.executemany(
+                f'INSERT INTO "{table}" VALUES ({", ".join("?" * (len(columns) + 1))})',
+                [[r.get(c) for c in columns] + [self.seed_bytes_per_row or len(json.dumps(r, default=str))]
+                 for r in rows])
+            self.partition_columns[table] = [c.lower() for c in partition_columns]
+            self.tables[table] = {
+                'Name': table.split('__', 1)[1],
+                'TableType': 'EXTERNAL_TABLE',
+                'Columns': [{'Name': c, 'Type': _TYPES.get(type(rows[0][c]), 'varchar')}
+                            for c in columns if c.lower() not in self.partition_columns[table]],
+                'PartitionKeys': [{'Name': c, 'Type': _TYPES.get(type(rows[0][c]), 'varchar')}
+                                  for c in columns if c.lower() in self.partition_columns[table]],
+                'Parameters': dict(properties or {})
+            }
+
+    # --- query execution -----------------------------------------------
+
+    def _error(self, code: str, message: str, operation: str):
+        raise StubClientError(code, message, operation)
+
+    def _substitute(self, sql: str, parameters: List[str]) -> str:
+        """ExecutionParameters replace each ? in turn, as SQL literal text"""
+        parameters = list(parameters or [])
+        pieces = re.split(r"('(?:[^']|'')*')", sql)
+        for i in range(0, len(pieces), 2):
+            parts = pieces[i].split('?')
+            if len(parts) - 1 > len(parameters):
+                self._error('InvalidRequestException', 'Not enough ExecutionParameters', 'StartQueryExecution')
+            pieces[i] = parts[0] + ''.join(parameters.pop(0) + part for part in parts[1:])
+        if parameters:
+            self._error('InvalidRequestException', 'Too many ExecutionParameters', 'StartQueryExecution')
+        return ''.join(pieces)
+
+    def _translate(self, sql: str, database: str) -> Tuple[str, List[str]]:
+        """database.table -> SQLite table names; returns the SQL and the tables read"""
+        tables = []
+
+        def table(match):
+            name = self._table_name(match.group(2) if '.' in match.group(2) else f"{database}.{match.group(2)}")
+            tables.append(name)
+            return f'{match.group(1)}"{name}"'
+
+        sql = re.sub(r"(\b(?:FROM|JOIN)\s+)([A-Za-z_][\w.\"]*)", table, sql, flags=re.IGNORECASE)
+        return sql, tables
+
+    def _scanned_bytes(self, sql: str, tables: List[str]) -> int:
+        """Bytes of the partitions left by WHERE terms on partition columns only"""
+        total = 0
+        match = re.search(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|\bUNION\b|$)", sql,
+                          re.IGNORECASE | re.DOTALL)
+        conjuncts = _split_conjuncts(match.group(1)) if match else []
+        for table in set(tables):
+            partition_columns = set(self.partition_columns.get(table, []))
+            terms = []
+            for term in conjuncts:
+                unquoted = re.sub(r"'(?:[^']|'')*'|\"[^\"]*\"", ' ', term)
+                identifiers = {i.lower() for i in re.findall(r"\b([A-Za-z_]\w*)\b", unquoted)}
+                identifiers -= {'and', 'or', 'not', 'in', 'between', 'like', 'is', 'null', 'date', 'timestamp'}
+                identifiers |= {i.lower() for i in re.findall(r"\"([^\"]+)\"", term)}
+                if identifiers and identifiers <= partition_columns:
+                    terms.append(term)
+            where = f" WHERE {' AND '.join(f'({t})' for t in terms)}" if terms else ''
+            with self._lock:
+                total += self._db.execute(f'SELECT COALESCE(SUM(_bytes), 0) FROM "{table}"{where}').fetchone()[0]
+        return total
+
+    def _run(self, execution_id: str):
+        execution = self.executions[execution_id]
+        time.sleep(self.latency / 2)
+        if execution['Status']['State'] == 'CANCELLED':
+            return
+        execution['Status']['State'] = 'RUNNING'
+        time.sleep(self.latency / 2)
+        started = time.monotonic()
+        try:
+            sql, tables = self._translate(execution['_sql'], execution['QueryExecutionContext']['Database'])
+            with self._lock:
+                cursor = self._db.execute(sql)
+                description = cursor.description or []
+                rows = cursor.fetchall()
+            scanned = self._scanned_bytes(sql, tables)
+        except (sqlite3.Error, StubClientError) as e:
+            execution['Status'].update({'State': 'FAILED', 'StateChangeReason': str(e),
+                                        'CompletionDateTime': datetime.now(timezone.utc)})
+            return
+        if execution['Status']['State'] == 'CANCELLED':
+            return
+        columns = [d[0] for d in description]
+        types = []
+        for i in range(len(columns)):
+            sample = next((r[i] for r in rows if r[i] is not None), '')
+            types.append(_TYPES.get(type(sample), 'varchar'))
+        execution['_columns'] = [{'Name': c, 'Label': c, 'Type': t} for c, t in zip(columns, types)]
+        execution['_rows'] = rows
+        execution['Statistics'].update({
+            'DataScannedInBytes': scanned,
+            'EngineExecutionTimeInMillis': int((time.monotonic() - started) * 1000 + self.latency * 500),
+            'TotalExecutionTimeInMillis': int(self.latency * 1000 + (time.monotonic() - started) * 1000)
+        })
+        execution['Status'].update({'State': 'SUCCEEDED', 'CompletionDateTime': datetime.now(timezone.utc)})
+
+    def start_query_execution(self, QueryString: str, QueryExecutionContext: Dict = None,
+                              ResultConfiguration: Dict = None, WorkGroup: str = 'primary',
+                              ExecutionParameters: List[str] = None, **kwargs) -> Dict:
+        self.calls['start_query_execution'] += 1
+        with self._lock:
+            active = sum(1 for e in self.executions.values() if e['Status']['State'] in ('QUEUED', 'RUNNING'))
+            if active >= self.max_concurrent_queries:
+                self._error('TooManyRequestsException', 'Too many active queries', 'StartQueryExecution')
+            execution_id = str(uuid.UUID(int=next(self._ids)))
+        sql = self._substitute(QueryString, ExecutionParameters)
+        output = (ResultConfiguration or {}).get('OutputLocation', 's3://stub-results/').rstrip('/')
+        self.executions[execution_id] = {
+            'QueryExecutionId': execution_id,
+            'Query': QueryString,
+            'ExecutionParameters': list(ExecutionParameters or []),
+            'QueryExecutionContext': {'Database': (QueryExecutionContext or {}).get('Database', self.database)},
+            'ResultConfiguration': {'OutputLocation': f"{output}/{execution_id}.csv"},
+            'WorkGroup': WorkGroup,
+            'Status': {'State': 'QUEUED', 'SubmissionDateTime': datetime.now(timezone.utc)},
+            'Statistics': {'DataScannedInBytes': 0, 'EngineExecutionTimeInMillis': 0, 'TotalExecutionTimeInMillis': 0},
+            '_sql': sql
+        }
+        threading.Thread(target=self._run, args=(execution_id,), daemon=True).start()
+        return {'QueryExecutionId': execution_id}
+
+    def _public(self, execution: Dict) -> Dict:
+        return {k: v for k, v in execution.items() if not k.startswith('_')}
+
+    def _execution(self, execution_id: str, operation: str) -> Dict:
+        execution = self.executions.get(execution_id)
+        if execution is None:
+            self._error('InvalidRequestException', f"QueryExecution {execution_id} was not found", operation)
+        return execution
+
+    def get_query_execution(self, QueryExecutionId: str) -> Dict:
+        self.calls['get_query_execution'] += 1
+        return {'QueryExecution': self._public(self._execution(QueryExecutionId, 'GetQueryExecution'))}
+
+    def batch_get_query_execution(self, QueryExecutionIds: List[str]) -> Dict:
+        self.calls['batch_get_query_execution'] += 1
+        if len(QueryExecutionIds) > 50:
+            self._error('InvalidRequestException', 'At most 50 QueryExecutionIds', 'BatchGetQueryExecution')
+        found = [self._public(self.executions[i]) for i in QueryExecutionIds if i in self.executions]
+        missing = [{'QueryExecutionId': i, 'ErrorCode': 'INVALID_INPUT', 'ErrorMessage': 'Not found'}
+                   for i in QueryExecutionIds if i not in self.executions]
+        return {'QueryExecutions': found, 'UnprocessedQueryExecutionIds': missing}
+
+    def stop_query_execution(self, QueryExecutionId: str) -> Dict:
+        self.calls['stop_query_execution'] += 1
+        execution = self._execution(QueryExecutionId, 'StopQueryExecution')
+        if execution['Status']['State'] in ('QUEUED', 'RUNNING'):
+            execution['Status'].update({'State': 'CANCELLED', 'CompletionDateTime': datetime.now(timezone.utc)})
+        return {}
+
+    def get_query_results(self, QueryExecutionId: str, MaxResults: int = 1000, NextToken: str = None) -> Dict:
+        """Rows as Athena pages them: the first page starts with the header row"""
+        self.calls['get_query_results'] += 1
+        execution = self._execution(QueryExecutionId, 'GetQueryResults')
+        state = execution['Status']['State']
+        if state != 'SUCCEEDED':
+            self._error('InvalidRequestException', f"Query has not yet finished. Current state: {state}",
+                        'GetQueryResults')
+        if execution.get('_expired'):
+            self._error('InvalidRequestException', f"Query results at {execution['ResultConfiguration']['OutputLocation']} "
+                                                   f"no longer exist", 'GetQueryResults')
+        if MaxResults > 1000:
+            self._error('InvalidRequestException', 'MaxResults must be at most 1000', 'GetQueryResults')
+        columns = execution['_columns']
+        rows = [[{'VarCharValue': c['Label']} for c in columns]] + [
+            [{} if v is None else {'VarCharValue': str(v).lower() if isinstance(v, bool) else str(v)} for v in row]
+            for row in execution['_rows']]
+        start = int(NextToken or 0)
+        page = rows[start:start + MaxResults]
+        response = {
+            'UpdateCount': 0,
+            'ResultSet': {'Rows': [{'Data': row} for row in page],
+                          'ResultSetMetadata': {'ColumnInfo': columns}}
+        }
+        if start + MaxResults < len(rows):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def get_table_metadata(self, CatalogName: str, DatabaseName: str, TableName: str) -> Dict:
+        self.calls['get_table_metadata'] += 1
+        table = self.tables.get(self._table_name(f"{DatabaseName}.{TableName}"))
+        if table is None:
+            self._error('MetadataException', f"Table {DatabaseName}.{TableName} not found", 'GetTableMetadata')
+        return {'TableMetadata': table}
+
+    def expire(self, execution_id: str):
+        """Delete a query's output files, as an S3 lifecycle rule on the results bucket would"""
+        self.executions[execution_id]['_expired'] = True
@@ -0,0 +1,320 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+import itertools
+import logging
+import re
+
+from athena_client import AthenaClient, AthenaQueryError, sql_literal
+
+
+# Java date format tokens used in partition projection -> strftime
+_JAVA_DATE_TOKENS = (('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'))
+
+
+def java_date_format(pattern: str) -> str:
+    """projection.<key>.format (yyyy/MM/dd) as a strftime format (%Y/%m/%d)"""
+    for java, python in _JAVA_DATE_TOKENS:
+        pattern = pattern.replace(java, python)
+    return pattern
+
+
+def _format_day(day: date, fmt: str) -> str:
+    # %-m / %-d (unpadded) isn't portable strftime, so expand them by hand
+    fmt = fmt.replace('%-m', str(day.month)).replace('%-d', str(day.day))
+    return day.strftime(fmt)
+
+
+def _to_utc(value) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return _to_utc(datetime.fromisoformat(str(value).replace('Z', '+00:00')))
+
+
+class LogTableLayout:
+    def __init__(self,
+                 table: str,
+                 date_keys: Dict[str, str] = None,
+                 enum_keys: Dict[str, Optional[List[str]]] = None,
+                 time_column: Optional[str] = 'eventtime',
+                 time_format: str = '%Y-%m-%dT%H:%M:%SZ'):
+        """
+        Partition layout of a log table, so every query can be given partition predicates
+
+        Args:
+            table: Table name, optionally database-qualified
+            date_keys: Partition column -> strftime format of its value for a day, e.g.
+                       {'year': '%Y', 'month': '%m', 'day': '%d'} or {'dt': '%Y/%m/%d'}
+            enum_keys: Other partition columns (region, account) -> their values; None for injected
+                       keys, which every query must give values for
+            time_column: Event time column, filtered to the exact window inside the day partitions;
+                         None if the window is whole days only
+            time_format: strftime format of time_column values (CloudTrail: ISO 8601 strings)
+        """
+        if not date_keys:
+            raise ValueError(f"{table} needs at least one date partition key")
+        self.table = table
+        self.date_keys = dict(date_keys)
+        self.enum_keys = dict(enum_keys or {})
+        self.time_column = time_column
+        self.time_format = time_format
+
+    @classmethod
+    def from_table_metadata(cls, client, database: str, table: str, catalog: str = 'AwsDataCatalog',
+                            time_column: Optional[str] = 'eventtime',
+                            time_format: str = '%Y-%m-%dT%H:%M:%SZ') -> 'LogTableLayout':
+        """
+        Read the layout from the table's partition projection properties (get_table_metadata)
+
+        Date keys come from projection.<key>.type = date (its format), or integer / enum keys named
+        year, month and day; enum keys keep their projected values, injected keys have None.
+
+        Raises:
+            ValueError: if the table has no date partition key
+        """
+        metadata = client.get_table_metadata(CatalogName=catalog, DatabaseName=database,
+                                             TableName=table)['TableMetadata']
+        parameters = metadata.get('Parameters', {})
+        date_keys, enum_keys = {}, {}
+        for key in (k['Name'] for k in metadata.get('PartitionKeys', [])):
+            kind = parameters.get(f"projection.{key}.type", '').lower()
+            if kind == 'date':
+                date_keys[key] = java_date_format(parameters.get(f"projection.{key}.format", 'yyyy/MM/dd'))
+            elif key.lower() in ('year', 'month', 'day'):
+                padded = kind != 'integer' or parameters.get(f"projection.{key}.digits", '1') != '1'
+                date_keys[key] = {'year': '%Y', 'month': '%m' if padded else '%-m',
+                                  'day': '%d' if padded else '%-d'}[key.lower()]
+            elif kind == 'enum':
+                enum_keys[key] = [v.strip() for v in parameters.get(f"projection.{key}.values", '').split(',')]
+            else:
+                enum_keys[key] = None
+        return cls(f"{database}.{table}", date_keys, enum_keys, time_column, time_format)
+
+
+class LogQueryBuilder:
+    def __init__(self, layout: LogTableLayout, split_days: int = 1):
+        """
+        Queries over a time window that always carry partition predicates, split per day
+
+        Args:
+            layout: Partition layout of the table
+            split_days: Days per query; a wider window becomes several queries run in parallel
+        """
+        self.layout = layout
+        self.split_days = split_days
+        self.logger = logging.getLogger(__name__)
+
+    def windows(self, start, end) -> List[Tuple[datetime, datetime]]:
+        """[start, end) cut at UTC midnight into pieces of split_days days"""
+        start, end = _to_utc(start), _to_utc(end)
+        if end <= start:
+            raise ValueError(f"Empty time window: {start} to {end}")
+        pieces = []
+        low = start
+        while low < end:
+            midnight = datetime(low.year, low.month, low.day, tzinfo=timezone.utc)
+            high = min(end, midnight + timedelta(days=self.split_days))
+            pieces.append((low, high))
+            low = high
+        return pieces
+
+    def partition_predicate(self, first_day: date, last_day: date) -> str:
+        """Predicates on the date keys selecting exactly first_day..last_day; keys are quoted (`timestamp` is reserved)"""
+        days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        keys = list(self.layout.date_keys.items())
+        if len(keys) == 1:
+            key, fmt = keys[0]
+            values = [_format_day(d, fmt) for d in days]
+            if len(values) == 1:
+                return f'"{key}" = {sql_literal(values[0])}'
+            # Zero-padded year-first formats sort as strings, so a range selects exactly these days
+            if re.fullmatch(r"[^%]*%Y[^%]*%m[^%]*%d[^%]*", fmt) and sorted(values) == values:
+                return f'"{key}" BETWEEN {sql_literal(values[0])} AND {sql_literal(values[-1])}'
+            return f'"{key}" IN ({", ".join(sql_literal(v) for v in values)})'
+
+        # Several keys (year / month / day): equality on all but the last, IN on the last
+        groups = []
+        for prefix, group in itertools.groupby(days, key=lambda d: tuple(_format_day(d, f) for _, f in keys[:-1])):
+            terms = [f'"{k}" = {sql_literal(v)}' for (k, _), v in zip(keys[:-1], prefix)]
+            last_key, last_fmt = keys[-1]
+            values = list(dict.fromkeys(_format_day(d, last_fmt) for d in group))
+            terms.append(f'"{last_key}" = {sql_literal(values[0])}' if len(values) == 1
+                         else f'"{last_key}" IN ({", ".join(sql_literal(v) for v in values)})')
+            groups.append(' AND '.join(terms))
+        return groups[0] if len(groups) == 1 else '(' + ' OR '.join(f"({g})" for g in groups) + ')'
+
+    def _enum_predicates(self, enum_values: Dict[str, List]) -> List[str]:
+        predicates = []
+        for key, projected in self.layout.enum_keys.items():
+            values = (enum_values or {}).get(key)
+            if values is None:
+                if projected is None:
+                    raise ValueError(f"{self.layout.table} has injected partition key {key}; give its values")
+                continue
+            unknown = [v for v in values if projected is not None and v not in projected]
+            if unknown:
+                raise ValueError(f"{key} values {unknown} are not among the projected values of {self.layout.table}")
+            predicates.append(f'"{key}" IN ({", ".join(sql_literal(v) for v in values)})')
+        for key in enum_values or {}:
+            if key not in self.layout.enum_keys:
+                raise ValueError(f"{key} is not a partition key of {self.layout.table}")
+        return predicates
+
+    def build(self,
+              select: str,
+              start,
+              end,
+              where: str = None,
+              parameters: List = None,
+              enum_values: Dict[str, List] = None,
+              limit: int = None) -> List[Dict]:
+        """
+        One query per window piece, each restricted to its own partitions
+
+        Args:
+            select: Select list, e.g. 'eventtime, eventname, requestparameters'
+            start: Window start (inclusive), datetime / date / ISO string, UTC if naive
+            end: Window end (exclusive)
+            where: Extra condition with ? placeholders
+            parameters: Values for the placeholders in where
+            enum_values: Values for enum / injected partition keys, e.g. {'region': ['us-east-1']}
+            limit: LIMIT for each query
+
+        Returns:
+            Query dicts for AthenaClient.execute_many: name, sql, parameters, partition_range
+        """
+        enum_predicates = self._enum_predicates(enum_values)
+        queries = []
+        for low, high in self.windows(start, end):
+            first_day = low.date()
+            last_day = (high - timedelta(microseconds=1)).date()
+            predicates = [self.partition_predicate(first_day, last_day)] + enum_predicates
+            query_parameters = []
+            if self.layout.time_column:
+                predicates.append(f"{self.layout.time_column} >= ? AND {self.layout.time_column} < ?")
+                query_parameters += [low.strftime(self.layout.time_format), high.strftime(self.layout.time_format)]
+            if where:
+                predicates.append(f"({where})")
+                query_parameters += list(parameters or [])
+            sql = f"SELECT {select}\nFROM {self.layout.table}\nWHERE " + '\n  AND '.join(predicates)
+            if limit:
+                sql += f"\nLIMIT {int(limit)}"
+            queries.append({
+                'name': first_day.isoformat() if first_day == last_day else f"{first_day}..{last_day}",
+                'sql': sql,
+                'parameters': query_parameters,
+                'partition_range': (first_day.isoformat(), last_day.isoformat())
+            })
+        return queries
+
+
+class LogSearch:
+    def __init__(self, client: AthenaClient, builder: LogQueryBuilder):
+        """
+        Run a builder's per-day queries in parallel and merge their rows as they stream
+
+        After (or during) a run, `queries` has each query's state, bytes scanned and whether
+        its result was reused, and `bytes_scanned` the total.
+        """
+        self.client = client
+        self.builder = builder
+        self.queries: List[Dict] = []
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def bytes_scanned(self) -> int:
+        return sum(q.get('bytes_scanned') or 0 for q in self.queries)
+
+    def _record(self, result: Dict):
+        self.queries.append({k: result.get(k) for k in
+                             ('name', 'state', 'query_execution_id', 'bytes_scanned', 'cached', 'total_ms', 'error')})
+        if result['status'] == 'success':
+            self.logger.info(f"{result['name']}: {result['bytes_scanned']:,} bytes scanned"
+                             f"{' (reused result)' if result['cached'] else ''}")
+
+    def rows(self, select: str, start, end, ordered: bool = False, limit: int = None, **build_options) -> Iterator[Dict]:
+        """
+        Rows of every piece of the window
+
+        Args:
+            select, start, end, build_options: As for LogQueryBuilder.build (where, parameters, enum_values)
+            ordered: Yield the pieces in time order; otherwise each piece streams as soon as it finishes.
+                     Either way only finished query ids are held back, never rows
+            limit: Stop after this many rows in all, stopping the queries still running
+
+        Raises:
+            AthenaQueryError: if any piece fails, so a partial answer is never mistaken for a full one
+        """
+        queries = self.builder.build(select, start, end, limit=limit, **build_options)
+        self.queries = []
+        finished: Dict[int, Dict] = {}
+        next_index = 0
+        remaining = limit
+        results = self.client.execute_many(queries)
+        try:
+            for result in results:
+                self._record(result)
+                if result['status'] != 'success':
+                    raise AthenaQueryError(f"Query for {result['name']} {result.get('state')}: {result.get('error')}")
+                finished[result['index']] = result
+                ready = []
+                if ordered:
+                    while next_index in finished:
+                        ready.append(finished.pop(next_index))
+                        next_index += 1
+                else:
+                    ready = [finished.pop(result['index'])]
+                for piece in ready:
+                    for row in self.client.iter_rows(piece['query_execution_id']):
+                        yield row
+                        if remaining is not None:
+                            remaining -= 1
+                            if remaining <= 0:
+                                return
+        finally:
+            results.close()
+            self.logger.info(f"{len(self.queries)} of {len(queries)} queries finished, "
+                             f"{self.bytes_scanned:,} bytes scanned")
+
+
+# Partition projection DDL for a CloudTrail table the layout below reads:
+#   PARTITIONED BY (region string, `timestamp` string)
+#   TBLPROPERTIES ('projection.enabled'='true',
+#                  'projection.region.type'='enum', 'projection.region.values'='us-east-1,us-west-2',
+#                  'projection.timestamp.type'='date', 'projection.timestamp.format'='yyyy/MM/dd',
+#                  'projection.timestamp.range'='2023/01/01,NOW', 'projection.timestamp.interval.unit'='DAYS',
+#                  'storage.location.template'='s3://bucket/AWSLogs/123456789012/CloudTrail/${region}/${timestamp}')
+CLOUDTRAIL_LAYOUT = LogTableLayout('cloudtrail_logs', date_keys={'timestamp': '%Y/%m/%d'},
+                                   enum_keys={'region': ['us-east-1', 'us-west-2']})
+
+# The Snowflake query history export of enable-snowflake-log-access-athena.md, partitioned by date_partition
+SNOWFLAKE_LOGS_LAYOUT = LogTableLayout('snowflake_logs_partitioned', date_keys={'date_partition': '%Y-%m-%d'},
+                                       time_column='start_time', time_format='%Y-%m-%d %H:%M:%S')
+
+
+# Example usage
+if __name__ == "__main__":
+    from athena_client import ResultCache, like_contains
+
+    athena = AthenaClient(
+        database='cloudtrail_analysis',
+        output_location='s3://your-query-results-bucket/folder/',
+        max_concurrent=8,
+        cache=ResultCache('athena_result_cache.json')
+    )
+    layout = LogTableLayout.from_table_metadata(athena.client, 'cloudtrail_analysis', 'cloudtrail_logs')
+    search = LogSearch(athena, LogQueryBuilder(layout))
+
+    # A week of GetObject / PutObject on one bucket: seven day queries, each reading one day's partitions
+    for row in search.rows(
+            "eventtime, eventname, sourceipaddress, requestparameters",
+            start='2024-11-06', end='2024-11-13',
+            where="eventname IN ('GetObject', 'PutObject') AND requestparameters LIKE ? ESCAPE '\\'",
+            parameters=[like_contains('your-bucket-name')],
+            enum_values={'region': ['us-east-1']}):
+        print(row['eventtime'], row['eventname'], row['sourceipaddress'])
+
+    for q in search.queries:
+        print(f"{q['name']}: {q['state']}, {q['bytes_scanned']:,} bytes scanned{' (reused)' if q['cached'] else ''}")
+    print(f"Total: {search.bytes_scanned:,} bytes scanned")
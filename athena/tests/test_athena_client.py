@@ -0,0 +1,126 @@
+from datetime import date
+
+import pytest
+
+from athena_client import AthenaClient, AthenaQueryError, ResultCache, like_contains, normalize_sql, sql_literal
+from athena_stub import AthenaStub
+
+
+ROWS = [
+    {'eventtime': f'2024-01-{day:02d}T00:00:00Z', 'eventname': name, 'awsregion': 'us-east-1',
+     'sourceipaddress': '10.0.0.1', 'useragent': 'aws-cli', 'requestparameters': f'{{"key": "{key}"}}',
+     'responseelements': '', 'bytes': day * 10, 'day': f'{day:02d}'}
+    for day in range(1, 11)
+    for name, key in (('GetObject', f'data/file_{day}.csv'), ('PutObject', f'data/50%_off_{day}.csv'))
+]
+
+
+@pytest.fixture
+def stub():
+    stub = AthenaStub(database='logs', latency=0.01)
+    stub.add_table('logs.cloudtrail', ROWS, partition_columns=('day',))
+    return stub
+
+
+@pytest.fixture
+def athena(stub):
+    return AthenaClient('logs', 's3://results/', client=stub, poll_initial=0.005, poll_max=0.02, cache=ResultCache())
+
+
+def test_literals():
+    assert sql_literal("it's") == "'it''s'"
+    assert sql_literal(None) == 'NULL'
+    assert sql_literal(True) == 'TRUE'
+    assert sql_literal(3) == '3'
+    assert sql_literal(date(2024, 1, 2)) == "DATE '2024-01-02'"
+    assert like_contains('50%_off') == '%50\\%\\_off%'
+
+
+def test_normalize_sql_ignores_layout_but_not_literals():
+    assert normalize_sql("SELECT  a -- note\nFROM t WHERE b = 'X Y';") == "select a from t where b = 'X Y'"
+    assert normalize_sql("select a from t where b = 'x y'") != normalize_sql("select a from t where b = 'X Y'")
+
+
+def test_query_binds_parameters_and_types_rows(athena, stub):
+    rows = list(athena.query("SELECT eventname, bytes FROM cloudtrail WHERE day = ? AND eventname = ?",
+                             ['03', 'GetObject']))
+
+    assert rows == [{'eventname': 'GetObject', 'bytes': 30}]
+    execution = next(iter(stub.executions.values()))
+    assert execution['ExecutionParameters'] == ["'03'", "'GetObject'"]
+    assert '?' in execution['Query']
+
+
+def test_results_are_paged(stub):
+    athena = AthenaClient('logs', 's3://results/', client=stub, poll_initial=0.005, page_size=3)
+    rows = list(athena.query("SELECT eventname FROM cloudtrail"))
+
+    assert len(rows) == len(ROWS)
+    # 21 rows with the header, three per page
+    assert stub.calls['get_query_results'] == 7
+
+
+def test_partition_predicates_prune_bytes_scanned(athena):
+    everything = athena.execute("SELECT COUNT(*) FROM cloudtrail")
+    one_day = athena.execute("SELECT COUNT(*) FROM cloudtrail WHERE day = ?", ['05'])
+
+    assert 0 < one_day['bytes_scanned'] < everything['bytes_scanned']
+
+
+def test_repeated_query_reuses_the_result(athena, stub):
+    days = ('2024-01-05', '2024-01-05')
+    first = athena.execute("SELECT COUNT(*) FROM cloudtrail WHERE day = ?", ['05'], partition_range=days)
+    again = athena.execute("select count(*)  from cloudtrail where day = ?", ['05'], partition_range=days)
+
+    assert not first['cached'] and again['cached']
+    assert again['query_execution_id'] == first['query_execution_id']
+    assert again['bytes_scanned'] == 0
+    assert stub.calls['start_query_execution'] == 1
+
+
+def test_expired_result_is_run_again(athena, stub):
+    first = athena.execute("SELECT COUNT(*) FROM cloudtrail")
+    stub.expire(first['query_execution_id'])
+    again = athena.execute("SELECT COUNT(*) FROM cloudtrail")
+
+    assert not again['cached']
+    assert again['query_execution_id'] != first['query_execution_id']
+
+
+def test_failed_query_raises(athena):
+    with pytest.raises(AthenaQueryError):
+        athena.execute("SELECT no_such_column FROM cloudtrail")
+
+
+def test_execute_many_limits_concurrency_and_keeps_failures(stub):
+    stub.max_concurrent_queries = 2
+    athena = AthenaClient('logs', 's3://results/', client=stub, poll_initial=0.005, poll_max=0.02, max_concurrent=2)
+    queries = [{'name': f'day_{d}', 'sql': "SELECT COUNT(*) FROM cloudtrail WHERE day = ?", 'parameters': [f'{d:02d}']}
+               for d in range(1, 6)]
+    queries.append({'name': 'broken', 'sql': "SELECT no_such_column FROM cloudtrail"})
+
+    results = {r['name']: r for r in athena.execute_many(queries)}
+
+    assert len(results) == 6
+    assert results['broken']['status'] == 'error'
+    assert all(results[f'day_{d}']['status'] == 'success' for d in range(1, 6))
+
+
+def test_closing_execute_many_stops_running_queries(athena, stub):
+    cached = athena.execute("SELECT COUNT(*) FROM cloudtrail")
+    stub.latency = 5
+    # The two slow queries are submitted first; the cached one then comes back at once
+    results = athena.execute_many([{'sql': f"SELECT COUNT(*) FROM cloudtrail WHERE day = '0{d}'"} for d in (1, 2)] +
+                                  [{'sql': "SELECT COUNT(*) FROM cloudtrail"}])
+    assert next(results)['query_execution_id'] == cached['query_execution_id']
+    results.close()
+
+    states = [e['Status']['State'] for e in stub.executions.values()]
+    assert states.count('CANCELLED') == 2
+
+
+def test_s3_log_search_matches_wildcards_literally(athena):
+    rows = list(athena.query_s3_logs('cloudtrail', '50%_off_3'))
+
+    assert [r['eventname'] for r in rows] == ['PutObject']
+    assert list(athena.query_s3_logs('cloudtrail', '50_off')) == []
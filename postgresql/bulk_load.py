@@ -0,0 +1,438 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import argparse
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:  # generate_bookings still works without the driver
+    psycopg2 = None
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_pg')
+# Columns that point at another table's key. The join exercises keep rows with no match on purpose,
+# so these are indexed by default and only become (NOT VALID) constraints on request.
+FOREIGN_KEYS = {
+    'bookings': [('facid', 'facilities', 'facid'), ('memid', 'members', 'memid')],
+    'employees': [('dept_id', 'departments', 'dept_id')],
+    'orders': [('customer_id', 'customers', 'customer_id')],
+    'products': [('category_id', 'categories', 'category_id')]
+}
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*$",
+                           re.IGNORECASE | re.DOTALL)
+_TABLE_PRIMARY_KEY = re.compile(r"^(?:CONSTRAINT\s+(\w+)\s+)?PRIMARY\s+KEY\s*\(([^)]*)\)$", re.IGNORECASE)
+_COPY = re.compile(r"^\s*COPY\s+(\w+)\s*\(([^)]*)\)\s*FROM\s+'([^']+)'", re.IGNORECASE)
+
+
+def _split_columns(body: str) -> List[str]:
+    """Column and constraint definitions of a CREATE TABLE body, split on top-level commas"""
+    parts, depth, current = [], 0, []
+    for ch in body:
+        if ch == ',' and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+            continue
+        depth += (ch == '(') - (ch == ')')
+        current.append(ch)
+    parts.append(''.join(current).strip())
+    return [p for p in parts if p]
+
+
+def parse_init_sql(path: str = os.path.join(CONFIG_DIR, 'init.sql')) -> Dict[str, Dict]:
+    """
+    The tables init.sql creates and loads, with their keys taken out of the column list
+
+    Returns:
+        {table: {'columns': [column definitions without PRIMARY KEY], 'primary_key': [columns],
+        'constraint': primary key constraint name, 'csv': file name}}; names are lower-cased as
+        Postgres folds them
+    """
+    with open(path) as f:
+        text = '\n'.join(line.split('--', 1)[0] for line in f)
+    tables = {}
+    for statement in text.split(';'):
+        create = _CREATE_TABLE.match(statement)
+        if create:
+            name = create.group(1).lower()
+            columns, primary_key, constraint = [], [], f"{name}_pkey"
+            for part in _split_columns(create.group(2)):
+                table_key = _TABLE_PRIMARY_KEY.match(' '.join(part.split()))
+                if table_key:
+                    constraint = (table_key.group(1) or constraint).lower()
+                    primary_key = [c.strip().lower() for c in table_key.group(2).split(',')]
+                    continue
+                if re.search(r"\bPRIMARY\s+KEY\b", part, re.IGNORECASE):
+                    primary_key = [part.split()[0].lower()]
+                    part = re.sub(r"\s*\bPRIMARY\s+KEY\b", '', part, flags=re.IGNORECASE)
+                columns.append(' '.join(part.split()))
+            tables[name] = {'columns': columns, 'primary_key': primary_key, 'constraint': constraint}
+            continue
+        copy = _COPY.match(statement)
+        if copy and copy.group(1).lower() in tables:
+            tables[copy.group(1).lower()]['csv'] = os.path.basename(copy.group(3))
+    return tables
+
+
+def generate_bookings(target: str, scale: float, source: str = os.path.join(CONFIG_DIR, 'bookings.csv')) -> Dict:
+    """
+    Write a bookings CSV scale times the size of the bundled one
+
+    Each copy of the original rows gets new bookids and its starttimes moved forward by the span of
+    the original data (rounded up to whole weeks), so the facility and member mix, the time-of-day and
+    the day-of-week patterns are those of the real data, and facid/memid still match facilities.csv
+    and members.csv. A fractional scale ends with part of a copy.
+
+    Returns:
+        Dictionary with path, rows and seconds
+    """
+    started = time.monotonic()
+    with open(source) as f:
+        header = f.readline()
+        rows = []
+        for line in f:
+            bookid, facid, memid, starttime, slots = line.rstrip('\r\n').split(',')
+            rows.append((int(bookid), facid, memid, datetime.strptime(starttime, '%Y-%m-%d %H:%M:%S'), slots))
+    first = min(r[3] for r in rows)
+    weeks = math.ceil((max(r[3] for r in rows) - first + timedelta(days=1)) / timedelta(weeks=1))
+    span = timedelta(weeks=weeks)
+    stride = max(r[0] for r in rows) + 1
+    total = int(round(len(rows) * scale))
+
+    written = 0
+    with open(target, 'w') as f:
+        f.write(header)
+        copy = 0
+        while written < total:
+            offset = span * copy
+            lines = [
+                f"{bookid + stride * copy},{facid},{memid},{(starttime + offset):%Y-%m-%d %H:%M:%S},{slots}\n"
+                for bookid, facid, memid, starttime, slots in rows[:total - written]
+            ]
+            f.writelines(lines)
+            written += len(lines)
+            copy += 1
+    return {'path': target, 'rows': written, 'seconds': time.monotonic() - started}
+
+
+class _FileRange:
+    """Bytes [start, end) of an open file, read by COPY FROM STDIN without loading the chunk into memory"""
+
+    def __init__(self, f, start: int, end: int):
+        f.seek(start)
+        self.f = f
+        self.remaining = end - start
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        line = self.f.readline(self.remaining if size is None or size < 0 else min(size, self.remaining))
+        self.remaining -= len(line)
+        return line
+
+
+class PostgresBulkLoader:
+    def __init__(self,
+                 connection_params: Dict,
+                 data_dir: str = CONFIG_DIR,
+                 init_sql: str = None,
+                 max_workers: int = 4,
+                 chunk_bytes: int = 64 * 1024 ** 2,
+                 maintenance_work_mem: str = '256MB',
+                 foreign_key_constraints: bool = False):
+        """
+        Load the config_pg CSV files with COPY FROM STDIN, tables and chunks in parallel, keys afterwards
+
+        init.sql declares every primary key up front and COPYs the files one after another, so each
+        row pays for index maintenance and one table loads at a time. This loader creates the same
+        tables without keys, streams every file (split into newline-aligned chunks of chunk_bytes)
+        through a pool of connections, then builds the primary keys and foreign-key indexes in one
+        pass per index and ANALYZEs the tables.
+
+        Args:
+            connection_params: psycopg2.connect arguments (host, port, user, password, dbname)
+            data_dir: Directory holding the CSV files named in init.sql
+            init_sql: Schema to load; config_pg/init.sql by default
+            max_workers: Connections (and concurrent COPY / CREATE INDEX statements)
+            chunk_bytes: Files larger than this are split into chunks loaded concurrently; chunks are
+                         cut at newlines, so a quoted field must not contain one
+            maintenance_work_mem: Memory each index build may use before spilling to disk
+            foreign_key_constraints: Also add the FOREIGN_KEYS as NOT VALID constraints (new rows are
+                                     checked; the exercises' unmatched rows are left alone)
+        """
+        if psycopg2 is None:
+            raise ImportError("PostgresBulkLoader needs psycopg2: pip install psycopg2")
+        self.connection_params = connection_params
+        self.data_dir = data_dir
+        self.tables = parse_init_sql(init_sql or os.path.join(CONFIG_DIR, 'init.sql'))
+        self.max_workers = max_workers
+        self.chunk_bytes = chunk_bytes
+        self.maintenance_work_mem = maintenance_work_mem
+        self.foreign_key_constraints = foreign_key_constraints
+        self.pool = None
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _execute(self, sql: str, settings: Tuple[str, ...] = ()) -> int:
+        """Run one statement on a pooled connection and commit; returns its rowcount"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                for setting in settings:
+                    cursor.execute(setting)
+                cursor.execute(sql)
+                rowcount = cursor.rowcount
+            conn.commit()
+            return rowcount
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _run_all(self, statements: List[str], settings: Tuple[str, ...] = ()) -> List[Dict]:
+        """Run independent statements concurrently, one connection each"""
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._execute, sql, settings): sql for sql in statements}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    results.append({'sql': futures[future], 'status': 'success'})
+                except Exception as e:
+                    self.logger.error(f"{futures[future]} failed: {str(e)}")
+                    results.append({'sql': futures[future], 'status': 'error', 'error': str(e)})
+        return results
+
+    def _chunks(self, path: str) -> Tuple[str, List[Tuple[int, int]]]:
+        """The file's header columns and the (start, end) byte ranges of its data, cut at newlines"""
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.readline().decode().strip()
+            start = f.tell()
+            ranges = []
+            while start < size:
+                f.seek(min(start + self.chunk_bytes, size))
+                if f.tell() < size:
+                    f.readline()
+                end = f.tell()
+                ranges.append((start, end))
+                start = end
+        return header, ranges
+
+    def _copy_chunk(self, table: str, columns: str, path: str, start: int, end: int) -> int:
+        """COPY one byte range of a file into the table; returns the rows loaded"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor, open(path, 'rb') as f:
+                # Nothing is lost on a crash mid-load that a rerun wouldn't redo anyway
+                cursor.execute("SET synchronous_commit TO off")
+                cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                                   _FileRange(f, start, end))
+                rows = cursor.rowcount
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def create_tables(self, tables: List[str]):
+        """Drop and recreate the tables without primary keys"""
+        for table in tables:
+            self._execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+            self._execute(f"CREATE TABLE {table} (\n  " + ",\n  ".join(self.tables[table]['columns']) + "\n)")
+
+    def load_tables(self, files: Dict[str, str]) -> Dict[str, Dict]:
+        """
+        COPY every (table, file) at once, big files as several chunks
+
+        Returns:
+            {table: {status, rows, chunks, seconds, rows_per_second}}; seconds run from the table's
+            first chunk starting to its last finishing
+        """
+        report = {table: {'status': 'success', 'rows': 0, 'chunks': 0, 'seconds': 0.0, 'rows_per_second': None,
+                          'started': None, 'finished': None}
+                  for table in files}
+        work = []
+        for table, path in files.items():
+            columns, ranges = self._chunks(path)
+            report[table]['chunks'] = len(ranges)
+            work.extend((table, columns, path, start, end) for start, end in ranges)
+        # Biggest chunks first, so one large file isn't left running alone at the end
+        work.sort(key=lambda w: w[4] - w[3], reverse=True)
+
+        def timed(table, columns, path, start, end):
+            started = time.monotonic()
+            rows = self._copy_chunk(table, columns, path, start, end)
+            return started, time.monotonic(), rows
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(timed, *w): w[0] for w in work}
+            for future in as_completed(futures):
+                entry = report[futures[future]]
+                try:
+                    started, finished, rows = future.result()
+                except Exception as e:
+                    self.logger.error(f"COPY into {futures[future]} failed: {str(e)}")
+                    entry.update({'status': 'error', 'error': str(e)})
+                    continue
+                entry['rows'] += rows
+                entry['started'] = min(started, entry['started'] or started)
+                entry['finished'] = max(finished, entry['finished'] or finished)
+
+        for entry in report.values():
+            started, finished = entry.pop('started'), entry.pop('finished')
+            if started is not None:
+                entry['seconds'] = finished - started
+                entry['rows_per_second'] = entry['rows'] / entry['seconds'] if entry['seconds'] else None
+        return report
+
+    def create_indexes(self, tables: List[str]) -> List[Dict]:
+        """
+        Primary keys and foreign-key column indexes of the loaded tables, each built in one pass
+
+        The primary keys go first, concurrently across tables: ADD CONSTRAINT takes an ACCESS EXCLUSIVE
+        lock, so it would only queue behind (and block) another build on its table. The plain index
+        builds follow, all at once, since CREATE INDEX takes a SHARE lock that builds on the same table
+        hold together. The optional constraints come last, since they need the referenced primary keys.
+        """
+        settings = (f"SET maintenance_work_mem TO '{self.maintenance_work_mem}'",)
+        primary_keys = [
+            f"ALTER TABLE {table} ADD CONSTRAINT {self.tables[table]['constraint']} "
+            f"PRIMARY KEY ({', '.join(self.tables[table]['primary_key'])})"
+            for table in tables if self.tables[table]['primary_key']
+        ]
+        indexes = [
+            f"CREATE INDEX {table}_{column}_idx ON {table} ({column})"
+            for table in tables for column, _, _ in FOREIGN_KEYS.get(table, [])
+        ]
+        results = self._run_all(primary_keys, settings)
+        results += self._run_all(indexes, settings)
+        if self.foreign_key_constraints:
+            loaded = set(self.tables)
+            for table in tables:
+                for column, referenced, key in FOREIGN_KEYS.get(table, []):
+                    if referenced not in loaded:
+                        continue
+                    sql = (f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey FOREIGN KEY ({column}) "
+                           f"REFERENCES {referenced} ({key}) NOT VALID")
+                    results.extend(self._run_all([sql]))
+        return results
+
+    def load(self, tables: List[str] = None, files: Dict[str, str] = None) -> Dict:
+        """
+        Recreate, load, index and ANALYZE the tables
+
+        Args:
+            tables: Tables to load; every table in init.sql by default
+            files: {table: path} replacing the data_dir file of a table, e.g. a generated bookings file
+
+        Returns:
+            Dictionary with status, per-table load results (rows, chunks, seconds, rows_per_second),
+            index results and per-phase timings in seconds (create, load, index, analyze)
+        """
+        tables = [t.lower() for t in (tables or list(self.tables))]
+        unknown = set(tables) - set(self.tables)
+        if unknown:
+            raise ValueError(f"Tables not in init.sql: {sorted(unknown)}")
+        files = {**{t: os.path.join(self.data_dir, self.tables[t]['csv']) for t in tables},
+                 **{t.lower(): p for t, p in (files or {}).items()}}
+        timings = {}
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, self.max_workers, **self.connection_params)
+        try:
+            started = time.monotonic()
+            self.create_tables(tables)
+            timings['create'] = time.monotonic() - started
+
+            self.logger.info(f"Loading {len(tables)} tables with {self.max_workers} connections...")
+            started = time.monotonic()
+            loaded = self.load_tables({t: files[t] for t in tables})
+            timings['load'] = time.monotonic() - started
+
+            # A partly loaded table would only fail its key build; leave it for a rerun
+            complete = [t for t in tables if loaded[t]['status'] == 'success']
+            self.logger.info("Building primary keys and foreign-key indexes...")
+            started = time.monotonic()
+            indexes = self.create_indexes(complete)
+            timings['index'] = time.monotonic() - started
+
+            started = time.monotonic()
+            analyzed = self._run_all([f"ANALYZE {t}" for t in complete])
+            timings['analyze'] = time.monotonic() - started
+        finally:
+            self.pool.closeall()
+            self.pool = None
+
+        failed = len(complete) < len(tables) or any(r['status'] != 'success' for r in indexes + analyzed)
+        return {
+            'status': 'error' if failed else 'success',
+            'tables': loaded,
+            'indexes': indexes,
+            'timings': timings,
+            'rows': sum(t['rows'] for t in loaded.values()),
+            'rows_per_second': sum(t['rows'] for t in loaded.values()) / timings['load'] if timings['load'] else None
+        }
+
+    @staticmethod
+    def format_report(report: Dict) -> str:
+        lines = [f"{'table':<12} {'rows':>12} {'chunks':>6} {'seconds':>8} {'rows/s':>12} status",
+                 '-' * 60]
+        for table, entry in sorted(report['tables'].items(), key=lambda item: -item[1]['rows']):
+            rate = '-' if entry['rows_per_second'] is None else f"{entry['rows_per_second']:,.0f}"
+            lines.append(f"{table:<12} {entry['rows']:>12,} {entry['chunks']:>6} {entry['seconds']:>8.2f} "
+                         f"{rate:>12} {entry['status']}")
+        lines.append('')
+        lines.append('  '.join(f"{phase} {seconds:.2f}s" for phase, seconds in report['timings'].items()))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # Defaults match docker-compose.yml
+    parser = argparse.ArgumentParser(description="Load the config_pg tables with parallel COPY")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='testdb')
+    parser.add_argument('--password', default='testdb')
+    parser.add_argument('--dbname', default='testdb')
+    parser.add_argument('--tables', nargs='+', help="Tables to load (default: every table in init.sql)")
+    parser.add_argument('--workers', type=int, default=4, help="Connections used for COPY and index builds")
+    parser.add_argument('--chunk-mb', type=float, default=64, help="Split files larger than this into chunks")
+    parser.add_argument('--scale', type=float,
+                        help="Load a generated bookings file this many times the size of bookings.csv")
+    parser.add_argument('--foreign-key-constraints', action='store_true',
+                        help="Also add the foreign keys as NOT VALID constraints")
+    args = parser.parse_args()
+
+    overrides = {}
+    work_dir = tempfile.mkdtemp(prefix='bookings_') if args.scale else None
+    loader = PostgresBulkLoader(
+        {'host': args.host, 'port': args.port, 'user': args.user, 'password': args.password,
+         'dbname': args.dbname},
+        max_workers=args.workers,
+        chunk_bytes=int(args.chunk_mb * 1024 ** 2),
+        foreign_key_constraints=args.foreign_key_constraints
+    )
+    try:
+        if work_dir:
+            generated = generate_bookings(os.path.join(work_dir, 'bookings.csv'), args.scale)
+            print(f"Generated {generated['rows']:,} bookings in {generated['seconds']:.1f}s")
+            overrides['bookings'] = generated['path']
+        report = loader.load(args.tables, files=overrides)
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(PostgresBulkLoader.format_report(report))
+    print(f"Overall status: {report['status']}")
@@ -0,0 +1,131 @@
+from typing import Dict, List
+import argparse
+import json
+import logging
+import time
+import uuid
+
+from pyspark.sql import DataFrame
+from pyspark.sql.functions import col, when
+
+from spark_history_updater import SNOWFLAKE_SOURCE, SparkHistoryUpdater, create_spark_session, normalise_operations
+
+
+def legacy_frame(updater: SparkHistoryUpdater, operations: List[Dict]) -> DataFrame:
+    """
+    The original solution1.1 approach: every history column, cached, one left join per operation
+    in sequence on full source tables, and every row written back
+    """
+    history_df = updater.read(f"SELECT * FROM {updater.table} WHERE {updater.predicate}")
+    history_df.cache()
+    frame = history_df
+    for i, op in enumerate(normalise_operations(operations)):
+        source = updater.spark.read \
+            .format(SNOWFLAKE_SOURCE) \
+            .options(**updater.snowflake_options) \
+            .option("dbtable", op['source_table']) \
+            .load()
+        source = source.select(*[col(c).alias(f"_op{i}_{c}") for c in source.columns])
+        condition = [col(history) == col(f"_op{i}_{source_column}")
+                     for history, source_column in op['join_keys'].items()]
+        frame = frame.join(source, condition, 'left')
+        for target, source_column in op['update_columns'].items():
+            value = col(f"_op{i}_{source_column}")
+            frame = frame.withColumn(target, when(value.isNotNull(), value).otherwise(col(target)))
+    return frame.select(*history_df.columns)
+
+
+def _plan_shape(frame: DataFrame) -> Dict:
+    """Shuffle and broadcast exchanges in the physical plan"""
+    plan = frame._jdf.queryExecution().executedPlan().toString()
+    broadcasts = plan.count('BroadcastExchange')
+    return {'shuffle_exchanges': plan.count('Exchange') - broadcasts, 'broadcast_exchanges': broadcasts}
+
+
+class HistoryUpdateBenchmark:
+    def __init__(self, updater: SparkHistoryUpdater):
+        """
+        Compare the single-pass updater with the original sequential approach
+
+        Each strategy runs against its own zero-copy CLONE of the table, so both start
+        from the same data and the real table is never touched.
+
+        Args:
+            updater: Configured updater; its table is cloned per strategy
+        """
+        self.updater = updater
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _measure(self, name: str, operations: List[Dict]) -> Dict:
+        table = self.updater.table
+        clone = f"{table}_bench_{name}_{uuid.uuid4().hex[:6]}"
+        conn = self.updater._connect()
+        conn.cursor().execute(f"CREATE TABLE {clone} CLONE {table}")
+        self.updater.table = clone
+        try:
+            started = time.monotonic()
+            if name == 'single_pass':
+                frame, columns = self.updater.build(operations)
+            else:
+                frame = legacy_frame(self.updater, operations)
+                columns = [c for c in frame.columns
+                           if c not in self.updater.key_columns and c != self.updater.timestamp_column]
+            shape = _plan_shape(frame)
+            result = self.updater.write_back(frame, columns)
+            elapsed = time.monotonic() - started
+        finally:
+            self.updater.table = table
+            conn.cursor().execute(f"DROP TABLE IF EXISTS {clone}")
+            conn.close()
+        return {
+            'strategy': name,
+            'status': result['status'],
+            'seconds': elapsed,
+            'rows_staged': result.get('rows_staged'),
+            'rows_merged': result.get('rows_merged'),
+            'columns_written': len(columns),
+            **shape
+        }
+
+    def run(self, operations: List[Dict], strategies: List[str] = ('legacy', 'single_pass')) -> List[Dict]:
+        results = []
+        for name in strategies:
+            self.logger.info(f"Benchmarking {name}")
+            results.append(self._measure(name, operations))
+        return results
+
+    @staticmethod
+    def format_report(results: List[Dict]) -> str:
+        header = f"{'strategy':<12} {'seconds':>8} {'staged':>12} {'merged':>12} {'columns':>7} {'shuffles':>8} {'broadcasts':>10}"
+        lines = [header, '-' * len(header)]
+        for r in results:
+            lines.append(f"{r['strategy']:<12} {r['seconds']:>8.1f} {str(r['rows_staged']):>12} "
+                         f"{str(r['rows_merged']):>12} {r['columns_written']:>7} "
+                         f"{r['shuffle_exchanges']:>8} {r['broadcast_exchanges']:>10}")
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare single-pass and sequential Spark history updates")
+    parser.add_argument('--options', required=True, help="JSON file with the Spark Snowflake connector options")
+    parser.add_argument('--operations', required=True, help="JSON file with the list of update operations")
+    parser.add_argument('--table', default='history')
+    parser.add_argument('--keys', nargs='+', default=['id'])
+    parser.add_argument('--predicate', default="effective_date > '2022-10-01'")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.options) as f:
+        snowflake_options = json.load(f)
+    with open(args.operations) as f:
+        update_operations = json.load(f)
+
+    benchmark = HistoryUpdateBenchmark(SparkHistoryUpdater(
+        create_spark_session("History Update Benchmark"), snowflake_options,
+        table=args.table, key_columns=tuple(args.keys), predicate=args.predicate))
+    results = benchmark.run(update_operations)
+    print(HistoryUpdateBenchmark.format_report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,343 @@
+from typing import Dict, List, Tuple
+import logging
+import re
+import time
+import uuid
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import broadcast, col, when
+import snowflake.connector
+
+
+SNOWFLAKE_SOURCE = "net.snowflake.spark.snowflake"
+
+
+class OperationConflictError(ValueError):
+    """Raised when update operations can't be applied in one join pass without changing their result"""
+
+
+def create_spark_session(app_name: str = "History Table Updates", shuffle_partitions: int = 200) -> SparkSession:
+    """Spark session with the Snowflake connector jars; tune shuffle partitions and memory to the cluster"""
+    return SparkSession.builder \
+        .appName(app_name) \
+        .config("spark.sql.shuffle.partitions", str(shuffle_partitions)) \
+        .config("spark.memory.fraction", "0.8") \
+        .config("spark.executor.memory", "16g") \
+        .config("spark.jars", "snowflake-jdbc-3.13.22.jar,spark-snowflake_2.12-2.11.0-spark_3.3.jar") \
+        .getOrCreate()
+
+
+def parse_join_condition(condition: str, source_table: str) -> Dict[str, str]:
+    """
+    'history.id = update_table_1.id AND history.dt = update_table_1.dt' -> {'id': 'id', 'dt': 'dt'}
+
+    Returns:
+        History column -> source column for each equality
+    """
+    keys = {}
+    for part in re.split(r"\s+AND\s+", condition.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r"\s*(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\s*", part)
+        if not match:
+            raise ValueError(f"Only equality join conditions (a.x = b.y AND ...) are supported: {condition}")
+        left_table, left_column, right_table, right_column = match.groups()
+        if left_table.lower() == source_table.lower():
+            left_column, right_column = right_column, left_column
+        keys[left_column] = right_column
+    return keys
+
+
+def normalise_operations(operations: List[Dict]) -> List[Dict]:
+    """
+    Bring update operations to one shape and check they can share a join pass
+
+    Each operation has a source_table, update_columns {history column: source column}, and either
+    join_keys {history column: source column} or a join_condition string. Optional keys:
+    where (filter on the source, pushed into Snowflake), broadcast (force on/off),
+    deduplicate (keep one source row per join key, default True) and order_by (an ORDER BY
+    expression on the source, e.g. 'loaded_at DESC'; the first row per join key in that order is
+    kept, so it must not tie within a key). Without order_by, a key whose source rows disagree
+    on the updated values fails the run instead of one of them being picked arbitrarily.
+
+    Applied in sequence, a later operation joins on the values earlier ones wrote. One join pass
+    joins every source on the original values, so that case is rejected rather than silently changed.
+
+    Raises:
+        ValueError: if there are no operations
+        OperationConflictError: if an operation joins on a column an earlier one updates
+    """
+    if not operations:
+        raise ValueError("No update operations given")
+    normalised = []
+    assigned = {}
+    for i, op in enumerate(operations):
+        source = op['source_table']
+        join_keys = op.get('join_keys') or parse_join_condition(op['join_condition'], source)
+        update_columns = {target: value.split('.')[-1] for target, value in op['update_columns'].items()}
+        for column in join_keys:
+            if column.lower() in assigned:
+                raise OperationConflictError(
+                    f"Operation {i} ({source}) joins on {column}, which operation {assigned[column.lower()]} "
+                    f"updates; run it as a separate pass")
+        for target in update_columns:
+            assigned.setdefault(target.lower(), i)
+        normalised.append({
+            'source_table': source,
+            'join_keys': join_keys,
+            'update_columns': update_columns,
+            'where': op.get('where'),
+            'broadcast': op.get('broadcast'),
+            'deduplicate': op.get('deduplicate', True),
+            'order_by': op.get('order_by')
+        })
+    return normalised
+
+
+class SparkHistoryUpdater:
+    def __init__(self,
+                 spark: SparkSession,
+                 snowflake_options: Dict,
+                 table: str = 'history',
+                 key_columns: Tuple[str, ...] = ('id',),
+                 predicate: str = "effective_date > '2022-10-01'",
+                 broadcast_threshold_bytes: int = 512 * 1024 * 1024,
+                 timestamp_column: str = 'last_updated'):
+        """
+        Apply many update operations to a large Snowflake table in one Spark join pass
+
+        Only the columns the operations need are read, with the predicate and projection pushed
+        into Snowflake; small source tables are broadcast so the large side is never shuffled; all
+        operations are folded into one multi-way join; and only rows whose values changed are
+        written back, through a transient stage table and a single MERGE.
+
+        Args:
+            spark: Spark session with the Snowflake connector
+            snowflake_options: Spark Snowflake connector options (sfURL, sfUser, ...)
+            table: Table to update
+            key_columns: Columns identifying a row, used to merge back
+            predicate: Which rows of the table may change
+            broadcast_threshold_bytes: Sources up to this size (from INFORMATION_SCHEMA) are broadcast
+            timestamp_column: Set to CURRENT_TIMESTAMP() on merged rows; None to leave alone
+        """
+        self.spark = spark
+        self.snowflake_options = snowflake_options
+        self.table = table
+        self.key_columns = list(key_columns)
+        self.predicate = predicate
+        self.broadcast_threshold_bytes = broadcast_threshold_bytes
+        self.timestamp_column = timestamp_column
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _connect(self):
+        """Plain connector session for the statements Spark can't run (sizes, stage DDL, MERGE)"""
+        options = self.snowflake_options
+        return snowflake.connector.connect(
+            account=options['sfURL'].split('.snowflakecomputing.com')[0],
+            user=options['sfUser'],
+            password=options.get('sfPassword'),
+            database=options['sfDatabase'],
+            schema=options['sfSchema'],
+            warehouse=options.get('sfWarehouse')
+        )
+
+    def read(self, query: str) -> DataFrame:
+        """Load the result of a query; Snowflake runs it, so its projection and filters never reach Spark"""
+        return self.spark.read \
+            .format(SNOWFLAKE_SOURCE) \
+            .options(**self.snowflake_options) \
+            .option("query", query) \
+            .load()
+
+    def _table_bytes(self, conn, tables: List[str]) -> Dict[str, int]:
+        """Stored bytes of each table, from INFORMATION_SCHEMA (no warehouse scan)"""
+        names = ', '.join(f"'{t.split('.')[-1].upper()}'" for t in set(tables))
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT TABLE_NAME, BYTES
+                FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME IN ({names})
+                """)
+            return {name.lower(): size or 0 for name, size in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def _source_query(self, i: int, op: Dict) -> str:
+        """Projected, filtered and de-duplicated source, with columns renamed so sources can't clash"""
+        select = [f"{source} AS _op{i}_k_{history}" for history, source in op['join_keys'].items()]
+        select += [f"{source} AS _op{i}_v_{target}" for target, source in op['update_columns'].items()]
+        # One row per key, so a source can't multiply history rows; done in Snowflake, not in a Spark shuffle.
+        # Without a tiebreaker only exact duplicates collapse; _conflicting_keys rejects the rest.
+        distinct = 'DISTINCT ' if op['deduplicate'] and not op['order_by'] else ''
+        query = f"SELECT {distinct}{', '.join(select)} FROM {op['source_table']}"
+        if op['where']:
+            query += f" WHERE {op['where']}"
+        if op['deduplicate'] and op['order_by']:
+            keys = ', '.join(op['join_keys'].values())
+            query += f" QUALIFY ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {op['order_by']}) = 1"
+        return query
+
+    def _source_frame(self, i: int, op: Dict) -> DataFrame:
+        """Source of operation i, read through Snowflake"""
+        return self.read(self._source_query(i, op))
+
+    def _conflicting_keys(self, conn, i: int, op: Dict, limit: int = 5) -> List[tuple]:
+        """Join keys with more than one distinct set of values in a de-duplicated source without order_by"""
+        keys = ', '.join(f"_op{i}_k_{history}" for history in op['join_keys'])
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT {keys}
+                FROM ({self._source_query(i, op)})
+                GROUP BY {keys}
+                HAVING COUNT(*) > 1
+                LIMIT {limit}
+                """)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def build(self, operations: List[Dict]) -> Tuple[DataFrame, List[str]]:
+        """
+        Plan every operation as one multi-way join over the needed history columns
+
+        Returns:
+            (frame of changed rows with the key columns and updated columns, updated columns)
+
+        Raises:
+            OperationConflictError: if operations conflict, or a source without order_by has
+                                    different values for one join key
+        """
+        ops = normalise_operations(operations)
+        targets = list(dict.fromkeys(t for op in ops for t in op['update_columns']))
+        join_columns = [c for op in ops for c in op['join_keys']]
+        history_columns = list(dict.fromkeys(self.key_columns + join_columns + targets))
+        frame = self.read(f"SELECT {', '.join(history_columns)} FROM {self.table} WHERE {self.predicate}")
+
+        conn = self._connect()
+        try:
+            sizes = self._table_bytes(conn, [op['source_table'] for op in ops])
+            for i, op in enumerate(ops):
+                if op['deduplicate'] and not op['order_by']:
+                    conflicts = self._conflicting_keys(conn, i, op)
+                    if conflicts:
+                        raise OperationConflictError(
+                            f"Operation {i} ({op['source_table']}) has different values for the same join key, "
+                            f"e.g. {conflicts}; add an order_by to pick one row per key")
+        finally:
+            conn.close()
+
+        def is_broadcast(op):
+            if op['broadcast'] is not None:
+                return op['broadcast']
+            return sizes.get(op['source_table'].split('.')[-1].lower(), float('inf')) <= self.broadcast_threshold_bytes
+
+        # Broadcast joins first; shuffled ones grouped by join keys so Spark can reuse one exchange of history
+        order = sorted(range(len(ops)), key=lambda i: (not is_broadcast(ops[i]), sorted(ops[i]['join_keys'])))
+        for i in order:
+            op = ops[i]
+            source = self._source_frame(i, op)
+            if is_broadcast(op):
+                source = broadcast(source)
+            else:
+                self.logger.info(f"{op['source_table']} is above the broadcast threshold; it will be shuffled")
+            condition = [col(history) == col(f"_op{i}_k_{history}") for history in op['join_keys']]
+            frame = frame.join(source, condition, 'left')
+
+        # Later operations win where they have a value, as when applied in sequence
+        new_values = {t: col(t) for t in targets}
+        for i, op in enumerate(ops):
+            for target in op['update_columns']:
+                value = col(f"_op{i}_v_{target}")
+                new_values[target] = when(value.isNotNull(), value).otherwise(new_values[target])
+
+        changed = None
+        for target in targets:
+            differs = ~new_values[target].eqNullSafe(col(target))
+            changed = differs if changed is None else changed | differs
+        changed_rows = frame.where(changed).select(
+            *[col(k) for k in self.key_columns], *[new_values[t].alias(t) for t in targets])
+        return changed_rows, targets
+
+    def write_back(self, frame: DataFrame, columns: List[str]) -> Dict:
+        """
+        Stage frame in a transient table and MERGE it into the table in one statement
+
+        Args:
+            frame: Key columns plus columns
+            columns: Columns to set on matched rows
+        """
+        timings = {}
+        stage = f"{self.table}_stage_{uuid.uuid4().hex[:8]}"
+        keys = ', '.join(self.key_columns)
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            # Same column types as the table; TRANSIENT skips fail-safe storage for a throwaway table
+            cursor.execute(f"""
+                CREATE TRANSIENT TABLE {stage} AS
+                SELECT {keys}, {', '.join(columns)} FROM {self.table} WHERE FALSE
+                """)
+
+            started = time.monotonic()
+            frame.write \
+                .format(SNOWFLAKE_SOURCE) \
+                .options(**self.snowflake_options) \
+                .option("dbtable", stage) \
+                .mode("append") \
+                .save()
+            timings['stage'] = time.monotonic() - started
+
+            started = time.monotonic()
+            cursor.execute(f"SELECT COUNT(*) FROM {stage}")
+            rows_staged = cursor.fetchone()[0]
+            set_clause = ', '.join(f"h.{c} = s.{c}" for c in columns)
+            if self.timestamp_column:
+                set_clause += f", h.{self.timestamp_column} = CURRENT_TIMESTAMP()"
+            cursor.execute(f"""
+                MERGE INTO {self.table} h
+                USING {stage} s
+                ON {' AND '.join(f"h.{k} = s.{k}" for k in self.key_columns)}
+                WHEN MATCHED THEN UPDATE SET {set_clause}
+                """)
+            rows_merged = cursor.rowcount
+            timings['merge'] = time.monotonic() - started
+            return {
+                'status': 'success',
+                'rows_staged': rows_staged,
+                'rows_merged': rows_merged,
+                'timings': timings
+            }
+        except Exception as e:
+            self.logger.error(f"Write-back failed: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'timings': timings}
+        finally:
+            # A session that broke mid-MERGE fails here too; that mustn't replace the error result
+            cleanup = f"DROP TABLE IF EXISTS {stage}"
+            try:
+                cursor.execute(cleanup)
+            except Exception as e:
+                self.logger.warning(f"Cleanup failed ({cleanup}): {str(e)}")
+            cursor.close()
+            conn.close()
+
+    def run(self, operations: List[Dict]) -> Dict:
+        """
+        Apply the operations and merge the changed rows
+
+        Nothing is cached: the plan is read from Snowflake once, while the stage table is written.
+
+        Returns:
+            Dictionary with status, rows_staged, rows_merged and timings in seconds
+        """
+        started = time.monotonic()
+        try:
+            changed_rows, targets = self.build(operations)
+        except Exception as e:
+            self.logger.error(f"Planning the update failed: {str(e)}")
+            return {'status': 'error', 'error': str(e)}
+        plan_seconds = time.monotonic() - started
+        result = self.write_back(changed_rows, targets)
+        result['timings'] = {'plan': plan_seconds, **result.get('timings', {})}
+        self.logger.info(f"Merged {result.get('rows_merged')} changed rows into {self.table}")
+        return result
@@ -0,0 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple, Union
+import asyncio
+import logging
+import threading
+import time
+
+from connection_pool import get_pool
+from partition_planner import PartitionPlanner, table_from_update
+from query_profiler import tag_params
+from run_journal import new_run_id
+from sql_template import SqlTemplate, bind_connection_params
+
+
+class _Run:
+    """State of one run_statements call, kept apart so concurrent runs on one engine don't share it"""
+
+    def __init__(self, run_id: str, io_threads: int):
+        self.run_id = run_id
+        self.cancelled = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=io_threads)
+
+    async def call(self, fn, *args):
+        """Run a short blocking connector call on this run's small I/O thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args))
+
+
+class AsyncUpdateEngine:
+    def __init__(self,
+                 connection_params: Dict,
+                 max_in_flight: Union[Dict[str, int], int] = 8,
+                 pool_options: Dict = None,
+                 planner: PartitionPlanner = None,
+                 poll_interval: float = 0.5,
+                 max_poll_interval: float = 10.0,
+                 io_threads: int = 4):
+        """
+        Run partition statements as Snowflake async queries from one asyncio loop
+
+        Statements are submitted with cursor.execute_async and their status is polled,
+        so no thread sits blocked for the length of a statement. One pooled session per
+        warehouse carries all of that warehouse's queries. Partition bounds are sent as bind
+        values, so sessions use paramstyle='qmark' unless connection_params sets another paramstyle.
+
+        Args:
+            connection_params: Snowflake connection parameters
+            max_in_flight: Statements running at once per warehouse, either one number for
+                           every warehouse or {warehouse: limit}
+            pool_options: Options for the shared session pools
+            planner: Partition planner (range on search_dt by default)
+            poll_interval: First delay between status polls; grows to max_poll_interval
+            max_poll_interval: Longest delay between status polls
+            io_threads: Threads used for the short submit/poll round trips
+        """
+        self.connection_params = bind_connection_params(connection_params)
+        self.max_in_flight = max_in_flight
+        self.pool_options = pool_options or {}
+        self.planner = planner or PartitionPlanner()
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.io_threads = io_threads
+        self._runs: Dict[str, _Run] = {}
+        self._runs_lock = threading.Lock()
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _limit_for(self, warehouse: str) -> int:
+        if isinstance(self.max_in_flight, dict):
+            return self.max_in_flight.get(warehouse, 1)
+        return self.max_in_flight
+
+    def cancel(self, run_id: str = None):
+        """
+        Cancel a run (every run of this engine if run_id is None): its queued statements are
+        skipped and its running ones are aborted server-side
+        """
+        with self._runs_lock:
+            runs = [run for run in self._runs.values() if run_id is None or run.run_id == run_id]
+        self.logger.warning(f"Cancelling all in-flight statements of {run_id or 'every run'}")
+        for run in runs:
+            run.cancelled.set()
+
+    @staticmethod
+    def _cancel_query(conn, query_id: str):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT SYSTEM$CANCEL_QUERY('{query_id}')")
+        finally:
+            cursor.close()
+
+    async def _run_statement(self, run: _Run, partition_id: int, sql: str, params: List, warehouse: str, conn,
+                             semaphore: asyncio.Semaphore) -> Dict:
+        """Submit one statement asynchronously and poll it to completion"""
+        result = {'partition_id': partition_id, 'warehouse': warehouse, 'run_id': run.run_id}
+        async with semaphore:
+            if run.cancelled.is_set():
+                return {**result, 'status': 'cancelled'}
+
+            started = time.monotonic()
+            query_id = None
+            cursor = conn.cursor()
+            try:
+                await run.call(partial(cursor.execute_async, sql, params or None,
+                                       _statement_params=tag_params(run.run_id, partition_id, warehouse)))
+                query_id = cursor.sfqid
+                delay = self.poll_interval
+                while True:
+                    if run.cancelled.is_set():
+                        await run.call(self._cancel_query, conn, query_id)
+                        return {**result, 'query_id': query_id, 'status': 'cancelled'}
+                    status = await run.call(conn.get_query_status, query_id)
+                    if not conn.is_still_running(status):
+                        break
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 1.5, self.max_poll_interval)
+
+                # Raises the statement's own error if it failed
+                await run.call(conn.get_query_status_throw_if_error, query_id)
+                await run.call(cursor.get_results_from_sfqid, query_id)
+                row = await run.call(cursor.fetchone)
+                return {
+                    **result,
+                    'query_id': query_id,
+                    'rows_updated': row[0] if row else cursor.rowcount,
+                    'elapsed_seconds': time.monotonic() - started,
+                    'status': 'success'
+                }
+            except asyncio.CancelledError:
+                if query_id:
+                    await asyncio.shield(run.call(self._cancel_query, conn, query_id))
+                raise
+            except Exception as e:
+                self.logger.error(f"Partition {partition_id} failed on warehouse {warehouse}: {str(e)}")
+                return {**result, 'query_id': query_id, 'status': 'error', 'error': str(e)}
+
+    async def run_statements(self, statements: List[Tuple], run_id: str = None) -> List[Dict]:
+        """
+        Execute (partition_id, sql, warehouse) or (partition_id, sql, warehouse, params) statements,
+        at most max_in_flight per warehouse
+
+        Every statement is tagged with run_id (a new one if omitted) for QueryProfiler, and
+        cancel(run_id) stops only this run. Several runs may share the engine, each with its
+        own run_id.
+
+        Returns:
+            List of results in statement order
+
+        Raises:
+            ValueError: If a run with the same run_id is already running on this engine
+        """
+        statements = [(s[0], s[1], s[2], s[3] if len(s) > 3 else None) for s in statements]
+        warehouses = list(dict.fromkeys(s[2] for s in statements))
+        pools = {wh: get_pool(self.connection_params, wh, **self.pool_options) for wh in warehouses}
+        semaphores = {wh: asyncio.Semaphore(self._limit_for(wh)) for wh in warehouses}
+
+        run_id = run_id or new_run_id()
+        with self._runs_lock:
+            if run_id in self._runs:
+                raise ValueError(f"Run {run_id} is already running on this engine")
+            run = self._runs[run_id] = _Run(run_id, self.io_threads)
+
+        sessions = {}
+        try:
+            for wh in warehouses:
+                sessions[wh] = await run.call(pools[wh].acquire)
+            return await asyncio.gather(*[
+                self._run_statement(run, partition_id, sql, params, wh, sessions[wh], semaphores[wh])
+                for partition_id, sql, wh, params in statements
+            ])
+        finally:
+            for wh, conn in sessions.items():
+                pools[wh].release(conn)
+            with self._runs_lock:
+                del self._runs[run.run_id]
+            run.executor.shutdown(wait=False)
+
+    async def parallel_update(self,
+                              update_sql: str,
+                              num_partitions: int = 64,
+                              warehouses: Union[List[str], str] = None,
+                              partition_mode: str = 'auto',
+                              table_name: str = None,
+                              run_id: str = None) -> List[Dict]:
+        """
+        Plan partitions and run them as async queries, spread round-robin over the warehouses
+
+        Args:
+            update_sql: SQL UPDATE statement; each partition's predicate is ANDed with its WHERE, if any
+            num_partitions: Number of partition statements; can be far more than the thread count
+            warehouses: List of warehouses, a single warehouse, or None for the connection default
+            partition_mode: 'range', 'hash' or 'auto', as for the other updaters
+            table_name: Table to sample for range mode; parsed from update_sql if omitted
+            run_id: Tag for the run's statements and the id cancel() takes; a new one if omitted
+        """
+        if isinstance(warehouses, str) or warehouses is None:
+            warehouses = [warehouses]
+
+        def plan():
+            with get_pool(self.connection_params, warehouses[0], **self.pool_options).connection() as conn:
+                return self.planner.plan(conn, table_name or table_from_update(update_sql),
+                                         num_partitions, mode=partition_mode)
+
+        predicates = (await asyncio.to_thread(plan))['predicates']
+        template = SqlTemplate.parse(update_sql)
+        paramstyle = self.connection_params['paramstyle']
+        statements = []
+        for i, predicate in enumerate(predicates):
+            # Same text for every same-shaped partition; the bounds travel as bind values
+            sql, params = template.render(predicate, paramstyle=paramstyle)
+            statements.append((i, sql, warehouses[i % len(warehouses)], params))
+        return await self.run_statements(statements, run_id)
+
+    def run(self, update_sql: str, **kwargs) -> List[Dict]:
+        """Blocking entry point for scripts: asyncio.run(parallel_update(...))"""
+        return asyncio.run(self.parallel_update(update_sql, **kwargs))
+
+
+# Example usage
+if __name__ == "__main__":
+    conn_params = {
+        'user': 'your_username',
+        'password': 'your_password',
+        'account': 'your_account',
+        'database': 'your_database',
+        'schema': 'your_schema'
+    }
+
+    # 256 partition statements over three warehouses, from a handful of threads
+    engine = AsyncUpdateEngine(conn_params, max_in_flight={'WH1': 16, 'WH2': 16, 'WH3': 8})
+    results = engine.run(
+        "UPDATE your_table SET status = 'PROCESSED' WHERE status = 'PENDING'",
+        num_partitions=256,
+        warehouses=['WH1', 'WH2', 'WH3']
+    )
+
+    total_rows = sum(r['rows_updated'] for r in results if r['status'] == 'success')
+    print(f"Total rows updated: {total_rows}")
+    for r in results:
+        if r['status'] != 'success':
+            print(f"Partition {r['partition_id']} on {r['warehouse']}: {r['status']} {r.get('error', '')}")
+
+    # From another thread (e.g. a signal handler or UI), engine.cancel() stops every run of the engine,
+    # engine.cancel(run_id) just one of them
@@ -0,0 +1,263 @@
+from typing import Callable, Dict, List
+import argparse
+import json
+import logging
+import time
+
+from async_engine import AsyncUpdateEngine
+from concurrency_controller import AIMDController
+from connection_pool import close_all_pools, pool_metrics
+from local_backend import LocalBackend
+from micro_batch import MicroBatchPolicy
+from multi_warehouse_parallel import MultiWarehouseUpdater
+from parallel_update_using_temp_tables import TempTableParallelUpdater
+from simple_parallel_update import SimpleParallelUpdater
+from warehouse_lifecycle import WarehouseLifecycle
+
+
+# {table} is filled in per strategy; the temp-table updater needs its your_table placeholder
+UPDATE_TEMPLATE = "UPDATE {table} SET amount = amount + 1, status = 'PROCESSED' WHERE effective_date >= '2023-01-01'"
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile; None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+class UpdateBenchmark:
+    def __init__(self,
+                 num_partitions: int = 8,
+                 warehouses: List[str] = None,
+                 backend_options: Dict = None,
+                 clustered: bool = True):
+        """
+        Compare the update strategies on a synthetic history table in a LocalBackend
+
+        Every strategy runs the same UPDATE against the same table, with the pools closed
+        in between so each one pays for its own logins.
+
+        Args:
+            num_partitions: Partitions (or chunks per warehouse slot) per strategy
+            warehouses: Warehouses for the multi-warehouse, chunked and async strategies
+            backend_options: LocalBackend options (latency, connect_latency, lock_mode, ...)
+            clustered: Generate the table in search_dt order, so range partitions prune
+        """
+        self.num_partitions = num_partitions
+        self.warehouses = warehouses or ['WH1', 'WH2']
+        self.backend_options = backend_options or {}
+        self.clustered = clustered
+        self.strategies: Dict[str, Callable] = {
+            'simple_range': lambda ctx: self._simple(ctx, 'range'),
+            'simple_hash': lambda ctx: self._simple(ctx, 'hash'),
+            'simple_adaptive': self._simple_adaptive,
+            'simple_micro_batch': self._simple_micro_batch,
+            'multi_warehouse': self._multi_warehouse,
+            'multi_warehouse_warm': self._multi_warehouse_warm,
+            'chunked': self._chunked,
+            'temp_table': self._temp_table,
+            'async': self._async
+        }
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    # Each strategy returns (run_id, rows changed in the base table, failed partitions)
+
+    def _simple(self, ctx: Dict, mode: str):
+        results = SimpleParallelUpdater(ctx['params'], pool_options=ctx['pool_options']).parallel_update(
+            UPDATE_TEMPLATE.format(table=ctx['table']), self.num_partitions, partition_mode=mode)
+        return self._summarise(results)
+
+    def _simple_adaptive(self, ctx: Dict):
+        # Four times the partitions, with the controller choosing how many run at once
+        updater = SimpleParallelUpdater(ctx['params'], pool_options=ctx['pool_options'],
+                                        concurrency_controller=AIMDController(max_concurrency=self.num_partitions))
+        results = updater.parallel_update(
+            UPDATE_TEMPLATE.format(table=ctx['table']), self.num_partitions * 4, partition_mode='range')
+        return self._summarise(results)
+
+    def _simple_micro_batch(self, ctx: Dict):
+        # Range partitions, each committed as four batches
+        policy = MicroBatchPolicy(batch_rows=max(1, ctx['rows'] // (self.num_partitions * 4)))
+        updater = SimpleParallelUpdater(ctx['params'], pool_options=ctx['pool_options'], micro_batch=policy)
+        results = updater.parallel_update(UPDATE_TEMPLATE.format(table=ctx['table']), self.num_partitions,
+                                          partition_mode='range')
+        return self._summarise(results)
+
+    def _multi_warehouse(self, ctx: Dict):
+        warehouses = [self.warehouses[i % len(self.warehouses)] for i in range(self.num_partitions)]
+        results = MultiWarehouseUpdater(ctx['params'], pool_options=ctx['pool_options']).parallel_update(
+            UPDATE_TEMPLATE.format(table=ctx['table']), self.num_partitions, warehouses, partition_mode='range')
+        return self._summarise(results)
+
+    def _multi_warehouse_warm(self, ctx: Dict):
+        # The same run, with every warehouse resumed at once while the partitions are planned
+        warehouses = [self.warehouses[i % len(self.warehouses)] for i in range(self.num_partitions)]
+        lifecycle = WarehouseLifecycle(ctx['params'], pool_options=ctx['pool_options'], poll_interval=0.05)
+        updater = MultiWarehouseUpdater(ctx['params'], pool_options=ctx['pool_options'], lifecycle=lifecycle)
+        results = updater.parallel_update(
+            UPDATE_TEMPLATE.format(table=ctx['table']), self.num_partitions, warehouses, partition_mode='range')
+        return self._summarise(results)
+
+    def _chunked(self, ctx: Dict):
+        report = MultiWarehouseUpdater(ctx['params'], pool_options=ctx['pool_options']).chunked_update(
+            UPDATE_TEMPLATE.format(table=ctx['table']),
+            {wh: max(1, self.num_partitions // len(self.warehouses)) for wh in self.warehouses},
+            num_chunks=self.num_partitions * 4,
+            partition_mode='range')
+        run_id, rows, failed = self._summarise(report['results'])
+        return report['run_id'], rows, failed
+
+    def _temp_table(self, ctx: Dict):
+        result = TempTableParallelUpdater(ctx['params'], pool_options=ctx['pool_options']).parallel_update(
+            ctx['table'], UPDATE_TEMPLATE.format(table='your_table'), self.num_partitions, partition_mode='range')
+        failed = [r['partition_id'] for r in result.get('partition_results', []) if r['status'] != 'success']
+        if result['status'] == 'error':
+            failed = failed or ['all']
+        rows = (result.get('merge_result') or {}).get('rows_merged', 0)
+        return result.get('run_id'), rows, failed
+
+    def _async(self, ctx: Dict):
+        engine = AsyncUpdateEngine(ctx['params'], max_in_flight=self.num_partitions,
+                                   pool_options=ctx['pool_options'], poll_interval=0.05)
+        results = engine.run(UPDATE_TEMPLATE.format(table=ctx['table']), num_partitions=self.num_partitions,
+                             warehouses=self.warehouses, partition_mode='range')
+        return self._summarise(results)
+
+    @staticmethod
+    def _summarise(results: List[Dict]):
+        run_id = results[0]['run_id'] if results else None
+        rows = sum(r['rows_updated'] for r in results if r['status'] == 'success')
+        failed = [r['partition_id'] for r in results if r['status'] != 'success']
+        return run_id, rows, failed
+
+    def _measure(self, backend: LocalBackend, name: str, table: str, table_rows: int) -> Dict:
+        close_all_pools()
+        # Every strategy starts from suspended warehouses and pays its own resumes
+        backend.suspend_all_warehouses()
+        backend.reset_stats()
+        ctx = {
+            'params': {'account': 'local', 'user': 'benchmark', 'database': backend.path},
+            'pool_options': {'connect': backend.connect, 'max_size': self.num_partitions},
+            'table': table,
+            'rows': table_rows
+        }
+        started = time.monotonic()
+        run_id, rows, failed = self.strategies[name](ctx)
+        elapsed = time.monotonic() - started
+
+        tag = f'"run_id": "{run_id}"'
+        entries = [e for e in backend.query_log if e['query_tag'] and tag in e['query_tag']]
+        latencies = [e['elapsed_seconds'] for e in entries if '"phase": "update"' in e['query_tag']]
+        connections = backend.connection_stats()
+        pools = pool_metrics()
+        close_all_pools()
+        return {
+            'strategy': name,
+            'rows_updated': rows,
+            'failed_partitions': failed,
+            'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else None,
+            'partition_p50_seconds': _percentile(latencies, 0.50),
+            'partition_p99_seconds': _percentile(latencies, 0.99),
+            'lock_wait_seconds': sum(e['lock_wait_seconds'] for e in entries),
+            'queued_seconds': sum(e['queued_seconds'] for e in entries),
+            'compile_seconds': sum(e['compilation_seconds'] for e in entries),
+            'provisioning_seconds': sum(e['provisioning_seconds'] for e in entries),
+            'statements': len(backend.query_log),
+            'connections_opened': connections['connections'],
+            'connect_seconds': connections['connect_seconds'],
+            'pool_wait_seconds': sum(p['total_wait_seconds'] for p in pools)
+        }
+
+    def run(self, row_counts: List[int], strategies: List[str] = None, table: str = 'history') -> List[Dict]:
+        """
+        Generate a table of each size and run every strategy on it
+
+        Returns:
+            One result per (row count, strategy) with throughput, p50/p99 partition
+            latency, lock wait, warehouse queueing, waits for warehouses to resume,
+            compilation and connection overhead
+        """
+        strategies = strategies or list(self.strategies)
+        unknown = set(strategies) - set(self.strategies)
+        if unknown:
+            raise ValueError(f"Unknown strategies: {sorted(unknown)}")
+
+        results = []
+        for rows in row_counts:
+            backend = LocalBackend(**self.backend_options)
+            try:
+                generated = backend.create_history_table(table, rows=rows, clustered=self.clustered)
+                for name in strategies:
+                    self.logger.info(f"Benchmarking {name} on {rows} rows")
+                    result = self._measure(backend, name, table, rows)
+                    result.update({'table_rows': rows, 'generate_seconds': generated['seconds']})
+                    results.append(result)
+            finally:
+                backend.close()
+        return results
+
+    @staticmethod
+    def format_report(results: List[Dict]) -> str:
+        def fmt(value, spec='.3f'):
+            return '-' if value is None else format(value, spec)
+
+        header = (f"{'rows':>11} {'strategy':<20} {'seconds':>8} {'rows/s':>10} {'p50 s':>7} {'p99 s':>7} "
+                  f"{'lock s':>7} {'queue s':>7} {'prov s':>7} {'comp s':>7} {'conns':>5} {'conn s':>7} {'failed':>6}")
+        lines = [header, '-' * len(header)]
+        for r in results:
+            lines.append(
+                f"{r['table_rows']:>11} {r['strategy']:<20} {fmt(r['seconds'], '.2f'):>8} "
+                f"{fmt(r['rows_per_second'], ',.0f'):>10} {fmt(r['partition_p50_seconds']):>7} "
+                f"{fmt(r['partition_p99_seconds']):>7} {fmt(r['lock_wait_seconds'], '.2f'):>7} "
+                f"{fmt(r['queued_seconds'], '.2f'):>7} {fmt(r['provisioning_seconds'], '.2f'):>7} "
+                f"{fmt(r['compile_seconds'], '.2f'):>7} "
+                f"{r['connections_opened']:>5} "
+                f"{fmt(r['connect_seconds'], '.2f'):>7} {len(r['failed_partitions']):>6}")
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the parallel update strategies against a local backend")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000],
+                        help="Table sizes to generate, e.g. --rows 1000000 10000000 100000000")
+    parser.add_argument('--strategies', nargs='+', default=None,
+                        help="Subset of: simple_range simple_hash simple_adaptive simple_micro_batch "
+                             "multi_warehouse multi_warehouse_warm chunked temp_table async")
+    parser.add_argument('--partitions', type=int, default=8)
+    parser.add_argument('--warehouses', nargs='+', default=['WH1', 'WH2'])
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every statement")
+    parser.add_argument('--latency-jitter', type=float, default=0.2)
+    parser.add_argument('--connect-latency', type=float, default=0.3, help="Seconds per login")
+    parser.add_argument('--compile-latency', type=float, default=0.0,
+                        help="Seconds to compile a statement text the first time (a tenth for a repeat)")
+    parser.add_argument('--resume-latency', type=float, default=0.0,
+                        help="Seconds a suspended warehouse takes to resume")
+    parser.add_argument('--lock-mode', choices=['table', 'none'], default='table')
+    parser.add_argument('--warehouse-concurrency', type=int, default=8)
+    parser.add_argument('--unclustered', action='store_true', help="Scatter search_dt instead of ordering by it")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    benchmark = UpdateBenchmark(
+        num_partitions=args.partitions,
+        warehouses=args.warehouses,
+        backend_options={
+            'latency': args.latency,
+            'latency_jitter': args.latency_jitter,
+            'connect_latency': args.connect_latency,
+            'compile_latency': args.compile_latency,
+            'resume_latency': args.resume_latency,
+            'lock_mode': args.lock_mode,
+            'warehouse_concurrency': args.warehouse_concurrency
+        },
+        clustered=not args.unclustered
+    )
+    results = benchmark.run(args.rows, args.strategies)
+    print(UpdateBenchmark.format_report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,78 @@
+from typing import Callable, Dict, List, Union
+import logging
+import queue
+import threading
+import time
+
+
+class ChunkScheduler:
+    def __init__(self, warehouses: Union[Dict[str, int], List[str], str], default_concurrency: int = 4):
+        """
+        Feed many small chunks from one shared queue to per-warehouse worker pools
+
+        Each warehouse gets as many worker threads as it can run statements concurrently.
+        A worker pulls the next chunk as soon as it finishes one, so a warehouse that draws
+        a fast chunk keeps taking work from the others and the job ends with the last chunk.
+
+        Args:
+            warehouses: {warehouse: concurrency}, a list of warehouses, or a single warehouse
+            default_concurrency: Workers per warehouse when only names are given
+        """
+        if isinstance(warehouses, str):
+            warehouses = [warehouses]
+        if isinstance(warehouses, list):
+            warehouses = {wh: default_concurrency for wh in warehouses}
+        if not warehouses or any(n < 1 for n in warehouses.values()):
+            raise ValueError(f"Every warehouse needs a concurrency of at least 1: {warehouses}")
+        self.warehouses = warehouses
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, chunks: List, execute: Callable[[int, object, str], Dict]) -> Dict:
+        """
+        Run execute(chunk_id, chunk, warehouse) for every chunk
+
+        Returns:
+            Dictionary with per-chunk results and per-warehouse chunk counts / busy time
+        """
+        work = queue.Queue()
+        for chunk_id, chunk in enumerate(chunks):
+            work.put((chunk_id, chunk))
+
+        results = []
+        per_warehouse = {wh: {'chunks': 0, 'busy_seconds': 0.0} for wh in self.warehouses}
+        lock = threading.Lock()
+
+        def worker(warehouse: str):
+            while True:
+                try:
+                    chunk_id, chunk = work.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.monotonic()
+                try:
+                    result = execute(chunk_id, chunk, warehouse)
+                except Exception as e:
+                    self.logger.error(f"Chunk {chunk_id} failed on warehouse {warehouse}: {str(e)}")
+                    result = {'partition_id': chunk_id, 'warehouse': warehouse, 'status': 'error', 'error': str(e)}
+                elapsed = time.monotonic() - started
+                with lock:
+                    results.append(result)
+                    per_warehouse[warehouse]['chunks'] += 1
+                    per_warehouse[warehouse]['busy_seconds'] += elapsed
+
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=worker, args=(wh,), name=f"{wh}-{n}", daemon=True)
+            for wh, concurrency in self.warehouses.items()
+            for n in range(min(concurrency, len(chunks)))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return {
+            'results': results,
+            'warehouses': per_warehouse,
+            'elapsed_seconds': time.monotonic() - started
+        }
@@ -0,0 +1,262 @@
+from typing import Dict, List, Optional
+import json
+import logging
+import re
+
+from partition_planner import numeric_expr
+
+
+def column_type(snowflake_type: str) -> Optional[str]:
+    """PartitionPlanner column_type for a DESC TABLE type; None for types it can't range on"""
+    upper = (snowflake_type or '').upper()
+    if upper.startswith('TIMESTAMP') or upper.startswith('DATETIME'):
+        return 'timestamp'
+    if upper.startswith('DATE'):
+        return 'date'
+    if re.match(r"^(NUMBER|NUMERIC|DECIMAL|INT|INTEGER|BIGINT|SMALLINT|TINYINT|BYTEINT|FLOAT|DOUBLE|REAL)\b", upper):
+        return 'number'
+    return None
+
+
+class ColumnProfiler:
+    def __init__(self,
+                 sample_percent: Optional[float] = None,
+                 top_k: int = 10,
+                 quantiles: int = 64,
+                 clustering_information: bool = True):
+        """
+        Profile every candidate column of a table in one pass, with sketches instead of exact counts
+
+        COUNT(DISTINCT col) is a full scan per column; here one statement computes, for all
+        columns together, HLL distinct counts, APPROX_TOP_K heavy hitters, MIN / MAX and an
+        APPROX_PERCENTILE_ACCUMULATE quantile grid. SYSTEM$CLUSTERING_INFORMATION (metadata only)
+        then gives each column's micro-partition overlap and depth, and the columns are ranked
+        as clustering keys. PartitionPlanner.from_profile() ranges on the profile without sampling.
+
+        Args:
+            sample_percent: Block-sample this percentage of the table (None reads it in full)
+            top_k: Heavy hitters kept per column
+            quantiles: Steps in the quantile grid of number, date and timestamp columns
+            clustering_information: Call SYSTEM$CLUSTERING_INFORMATION for each column
+        """
+        self.sample_percent = sample_percent
+        self.top_k = top_k
+        self.quantiles = quantiles
+        self.clustering_information = clustering_information
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _query(conn, sql: str) -> List[tuple]:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _column_types(self, conn, table: str) -> Dict[str, Optional[str]]:
+        """Column -> planner column_type, in table order"""
+        return {name.lower(): column_type(sf_type) for name, sf_type, *_ in self._query(conn, f"DESC TABLE {table}")}
+
+    def _clustering_key(self, conn, table: str) -> Optional[str]:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SHOW TABLES LIKE '{table.split('.')[-1]}'")
+            columns = [d[0].lower() for d in cursor.description]
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if not row or 'cluster_by' not in columns:
+            return None
+        return row[columns.index('cluster_by')] or None
+
+    def _sketch_sql(self, table: str, columns: List[str], types: Dict[str, Optional[str]], where: str = None) -> str:
+        """One scan: every aggregate in a CTE, quantile estimates read off the accumulated digests"""
+        aggregates = ["COUNT(*) AS row_count"]
+        outputs = ["row_count"]
+        for i, column in enumerate(columns):
+            aggregates += [f"HLL({column}) AS c{i}_distinct", f"COUNT({column}) AS c{i}_non_null",
+                           f"MIN({column}) AS c{i}_min", f"MAX({column}) AS c{i}_max",
+                           f"APPROX_TOP_K({column}, {self.top_k}) AS c{i}_top"]
+            outputs += [f"c{i}_distinct", f"c{i}_non_null", f"c{i}_min", f"c{i}_max", f"c{i}_top"]
+            if types.get(column):
+                aggregates.append(f"APPROX_PERCENTILE_ACCUMULATE({numeric_expr(column, types[column])}) AS c{i}_digest")
+                outputs += [f"APPROX_PERCENTILE_ESTIMATE(c{i}_digest, {j / self.quantiles:.6f})"
+                            for j in range(1, self.quantiles)]
+        sample = f" SAMPLE SYSTEM ({self.sample_percent})" if self.sample_percent else ""
+        where_clause = f" WHERE {where}" if where else ""
+        return f"""
+            WITH sketch AS (
+                SELECT {', '.join(aggregates)}
+                FROM {table}{sample}{where_clause}
+            )
+            SELECT {', '.join(outputs)} FROM sketch
+            """
+
+    def _cluster_info(self, conn, table: str, column: str) -> Optional[Dict]:
+        try:
+            value = self._query(conn, f"SELECT SYSTEM$CLUSTERING_INFORMATION('{table}', '({column})')")[0][0]
+        except Exception as e:
+            self.logger.warning(f"No clustering information for {table}.{column}: {str(e)}")
+            return None
+        info = json.loads(value) if isinstance(value, str) else value
+        return {k: info.get(k) for k in ('total_partition_count', 'total_constant_partition_count',
+                                         'average_overlaps', 'average_depth', 'partition_depth_histogram')}
+
+    def profile(self, conn, table: str, columns: List[str] = None, where: str = None) -> Dict:
+        """
+        Sketch the candidate columns of a table and rank them as clustering keys
+
+        Args:
+            conn: Open Snowflake session
+            table: Table to profile
+            columns: Candidate columns or expressions (default: every column of the table)
+            where: Optional filter, e.g. the rows the parallel update will touch
+
+        Returns:
+            Dictionary with the table, where, sample_percent, row_count, clustering_key,
+            per-column stats under 'columns' and the clustering-key 'ranking'
+        """
+        table_types = self._column_types(conn, table)
+        columns = [c.lower() for c in columns] if columns else list(table_types)
+        types = {c: table_types.get(c) for c in columns}
+        row = self._query(conn, self._sketch_sql(table, columns, types, where))[0]
+
+        row_count = row[0]
+        scale = 100.0 / self.sample_percent if self.sample_percent else 1.0
+        position = 1
+        stats = {}
+        for column in columns:
+            distinct, non_null, low, high, top = row[position:position + 5]
+            position += 5
+            quantiles = None
+            if types[column]:
+                quantiles = list(row[position:position + self.quantiles - 1])
+                position += self.quantiles - 1
+            top = json.loads(top) if isinstance(top, str) else (top or [])
+            heavy_hitters = [(value, int(count * scale)) for value, count in top]
+            stats[column] = {
+                'type': types[column],
+                'distinct': distinct,
+                'non_null': int(non_null * scale),
+                'null_fraction': 1 - non_null / row_count if row_count else 0.0,
+                'distinct_ratio': min(1.0, distinct / non_null) if non_null else 0.0,
+                'min': low,
+                'max': high,
+                'heavy_hitters': heavy_hitters,
+                'top_share': top[0][1] / non_null if top and non_null else 0.0,
+                'quantiles': quantiles,
+                'clustering': self._cluster_info(conn, table, column) if self.clustering_information else None
+            }
+
+        profile = {
+            'table': table,
+            'where': where,
+            'sample_percent': self.sample_percent,
+            'row_count': int(row_count * scale),
+            'clustering_key': self._clustering_key(conn, table),
+            'columns': stats
+        }
+        profile['ranking'] = self.rank(profile)
+        self.logger.info(f"Profiled {len(columns)} columns of {table} in one "
+                         f"{'sampled ' if self.sample_percent else ''}scan")
+        return profile
+
+    @staticmethod
+    def rank(profile: Dict) -> List[Dict]:
+        """
+        Score each column as a clustering key, best first
+
+        The score multiplies four factors in [0, 1]:
+            pruning     - distinct values per micro-partition; fewer values than partitions can't prune
+            balance     - 1 - share of the most frequent value; one heavy value fills many partitions
+            maintenance - 1 - half the distinct ratio; near-unique keys cost the most to recluster
+            order       - how close the column already is to clustered (depth 1 of N partitions = 1),
+                          worth half the score: ordered columns prune today and recluster cheaply
+        """
+        ranking = []
+        for column, s in profile['columns'].items():
+            info = s.get('clustering') or {}
+            partitions = info.get('total_partition_count') or 0
+            reasons = []
+            pruning = min(1.0, s['distinct'] / partitions) if partitions else 1.0
+            if partitions and s['distinct'] < partitions:
+                reasons.append(f"{s['distinct']} distinct values for {partitions} micro-partitions")
+            balance = 1.0 - s['top_share']
+            if s['top_share'] > 0.1:
+                value, _ = s['heavy_hitters'][0]
+                reasons.append(f"{value!r} is {s['top_share']:.0%} of rows")
+            maintenance = 1.0 - 0.5 * s['distinct_ratio']
+            if s['distinct_ratio'] > 0.5:
+                reasons.append("near-unique; consider clustering on a coarser expression of it")
+            order = 0.0
+            if partitions:
+                depth = info.get('average_depth') or partitions
+                order = 1.0 - min(1.0, (depth - 1) / max(1, partitions - 1))
+                reasons.append(f"average depth {depth:g} of {partitions} micro-partitions")
+            score = pruning * balance * maintenance * (0.5 + 0.5 * order) * (1.0 - s['null_fraction'])
+            ranking.append({
+                'column': column,
+                'score': round(score, 4),
+                'pruning': round(pruning, 4),
+                'balance': round(balance, 4),
+                'maintenance': round(maintenance, 4),
+                'order': round(order, 4),
+                'reasons': reasons
+            })
+        return sorted(ranking, key=lambda r: -r['score'])
+
+    @staticmethod
+    def format_report(profile: Dict) -> str:
+        header = f"{'column':<20} {'score':>6} {'distinct':>12} {'nulls':>6} {'top share':>9} {'depth':>8}  notes"
+        lines = [f"{profile['table']}: {profile['row_count']:,} rows, clustered by {profile['clustering_key']}",
+                 header, '-' * len(header)]
+        for r in profile['ranking']:
+            s = profile['columns'][r['column']]
+            depth = (s.get('clustering') or {}).get('average_depth')
+            lines.append(f"{r['column']:<20} {r['score']:>6.3f} {s['distinct']:>12,} {s['null_fraction']:>6.1%} "
+                         f"{s['top_share']:>9.1%} {str(depth):>8}  {'; '.join(r['reasons'])}")
+        return '\n'.join(lines)
+
+    @staticmethod
+    def to_json(profile: Dict, path: str):
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2, default=str)
+
+    @staticmethod
+    def from_json(path: str) -> Dict:
+        with open(path) as f:
+            return json.load(f)
+
+
+# Example usage
+if __name__ == "__main__":
+    import snowflake.connector
+    from partition_planner import PartitionPlanner
+    from simple_parallel_update import SimpleParallelUpdater
+
+    connection_params = {
+        'user': 'your_username',
+        'password': 'your_password',
+        'account': 'your_account',
+        'warehouse': 'your_warehouse',
+        'database': 'your_database',
+        'schema': 'your_schema'
+    }
+    conn = snowflake.connector.connect(**connection_params)
+
+    # 1% block sample of the whole table, one statement for every column
+    profiler = ColumnProfiler(sample_percent=1)
+    profile = profiler.profile(conn, 'your_table',
+                               columns=['search_dt', 'effective_date', 'status', 'category', 'search_id'])
+    conn.close()
+    print(ColumnProfiler.format_report(profile))
+    ColumnProfiler.to_json(profile, 'your_table_profile.json')
+
+    # The updater's planner ranges on the best-ranked column, with boundaries from the profile
+    planner = PartitionPlanner.from_profile(ColumnProfiler.from_json('your_table_profile.json'))
+    updater = SimpleParallelUpdater(connection_params, planner=planner)
+    results = updater.parallel_update(
+        "UPDATE your_table SET status = 'PROCESSED' WHERE status = 'PENDING'", num_partitions=8)
+    print(f"Partitions succeeded: {sum(1 for r in results if r['status'] == 'success')}")
@@ -0,0 +1,181 @@
+from contextlib import contextmanager
+from typing import Dict, List
+import logging
+import threading
+import time
+
+
+class AIMDController:
+    def __init__(self,
+                 initial: int = 2,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 16,
+                 increase: int = 1,
+                 decrease_factor: float = 0.5,
+                 contention_threshold: float = 0.3,
+                 tolerance: float = 0.05):
+        """
+        Additive-increase / multiplicative-decrease limit on concurrent partition statements
+
+        Statements on one table queue behind each other's table lock, so past some level more
+        concurrency only adds lock wait. After every window of completed statements (one per
+        running slot) the controller records rows per second for the window's limit, and looks at
+        the share of the statements' time spent waiting on locks or in the warehouse queue:
+            - a failed statement: limit * decrease_factor
+            - throughput fell versus the best level measured below it: settle back at that level
+            - contention above contention_threshold: keep adding slots only while each level beats
+              every lower one by more than tolerance, otherwise settle at the level with the most
+              rows per second (a first contended window probes limit * decrease_factor instead)
+            - otherwise: limit + increase
+
+        Under a table lock every level above one shows lock wait, so contention only decides which
+        way to probe; the level kept is always the one with the best measured throughput.
+
+        Args:
+            initial: Starting concurrency
+            min_concurrency: Lowest concurrency
+            max_concurrency: Highest concurrency (also the number of worker threads to start)
+            increase: Slots added after a clean window
+            decrease_factor: Multiplier applied to the limit on failures, and to probe a lower level
+            contention_threshold: (lock wait + queued) / elapsed above which no higher level is tried
+            tolerance: Relative throughput change that counts as worse or better than another level
+        """
+        if not 1 <= min_concurrency <= initial <= max_concurrency:
+            raise ValueError(f"Need 1 <= min_concurrency <= initial <= max_concurrency, got "
+                             f"{min_concurrency}, {initial}, {max_concurrency}")
+        if not 0 < decrease_factor < 1:
+            raise ValueError(f"decrease_factor must be between 0 and 1, got {decrease_factor}")
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.contention_threshold = contention_threshold
+        self.tolerance = tolerance
+
+        self.limit = initial
+        self.best_concurrency = initial
+        self.best_rows_per_second = 0.0
+        self.level_rows_per_second: Dict[int, float] = {}  # mean over the windows run at each limit
+        self._level_windows: Dict[int, int] = {}
+        self.settled = False
+        self.decisions: List[Dict] = []
+        self._active = 0
+        self._window: List[Dict] = []
+        self._window_started = time.monotonic()
+        self._cond = threading.Condition()
+        self.logger = logging.getLogger(__name__)
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the current limit's slots for the duration of a statement"""
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def record(self, rows: int, elapsed: float, lock_wait: float = 0.0, queued: float = 0.0, failed: bool = False):
+        """
+        Feed back one finished statement
+
+        Args:
+            rows: Rows the statement changed
+            elapsed: Wall-clock seconds of the statement as seen by the client
+            lock_wait: Seconds it was blocked on a lock (TRANSACTION_BLOCKED_TIME)
+            queued: Seconds it waited in the warehouse queue
+            failed: The statement failed (lock timeouts, too many lock waiters, ...)
+        """
+        with self._cond:
+            self._window.append({'rows': rows or 0, 'elapsed': elapsed, 'lock_wait': lock_wait,
+                                 'queued': queued, 'failed': failed})
+            if len(self._window) >= self.limit:
+                self._adjust()
+                self._cond.notify_all()
+
+    def _adjust(self):
+        """Close the current window and move the limit. Caller holds the lock."""
+        window, self._window = self._window, []
+        now = time.monotonic()
+        seconds = max(now - self._window_started, 1e-9)
+        self._window_started = now
+
+        busy = sum(s['elapsed'] for s in window) or 1e-9
+        contention = sum(s['lock_wait'] + s['queued'] for s in window) / busy
+        rows_per_second = sum(s['rows'] for s in window) / seconds
+        failures = sum(1 for s in window if s['failed'])
+
+        previous = self.limit
+        if not failures:
+            # A window with failed statements says nothing about what its level can do
+            count = self._level_windows.get(previous, 0)
+            mean = self.level_rows_per_second.get(previous, 0.0)
+            self.level_rows_per_second[previous] = (mean * count + rows_per_second) / (count + 1)
+            self._level_windows[previous] = count + 1
+            self.best_concurrency, self.best_rows_per_second = max(
+                self.level_rows_per_second.items(), key=lambda level: level[1])
+
+        lower = max(self.min_concurrency, int(self.limit * self.decrease_factor))
+        if failures:
+            self.limit = lower
+            self.settled = False
+            action = 'decrease'
+        elif self.settled:
+            action = 'hold'
+        elif self.limit > self.best_concurrency and \
+                self.level_rows_per_second[self.limit] < self.best_rows_per_second * (1 - self.tolerance):
+            # More statements stopped paying off: go back to the best level measured and stay there
+            self.limit = self.best_concurrency
+            self.settled = True
+            action = 'settle'
+        elif self.limit < self.best_concurrency:
+            # A lower level was probed and lost: carry on from the best one
+            self.limit = self.best_concurrency
+            action = 'increase'
+        elif contention > self.contention_threshold:
+            below = [rate for level, rate in self.level_rows_per_second.items() if level < self.limit]
+            if not below and lower < self.limit:
+                self.limit = lower
+                action = 'decrease'
+            elif below and self.level_rows_per_second[self.limit] > max(below) * (1 + self.tolerance):
+                # Waiting, but still more rows per second than any lower level: keep probing
+                self.limit = min(self.max_concurrency, self.limit + self.increase)
+                action = 'increase' if self.limit > previous else 'hold'
+            else:
+                self.limit = self.best_concurrency
+                self.settled = True
+                action = 'settle'
+        else:
+            self.limit = min(self.max_concurrency, self.limit + self.increase)
+            action = 'increase' if self.limit > previous else 'hold'
+
+        decision = {
+            'action': action,
+            'from': previous,
+            'to': self.limit,
+            'rows_per_second': rows_per_second,
+            'contention': contention,
+            'failures': failures,
+            'statements': len(window)
+        }
+        self.decisions.append(decision)
+        self.logger.info(
+            f"Concurrency {action}: {previous} -> {self.limit} "
+            f"({rows_per_second:,.0f} rows/s, {contention:.0%} lock/queue wait, {failures} failed, "
+            f"{len(window)} statements)")
+
+    def summary(self) -> Dict:
+        """Where the controller ended up and every decision it took"""
+        with self._cond:
+            return {
+                'final_concurrency': self.limit,
+                'best_concurrency': self.best_concurrency,
+                'best_rows_per_second': self.best_rows_per_second,
+                'rows_per_second_by_level': dict(self.level_rows_per_second),
+                'settled': self.settled,
+                'decisions': list(self.decisions)
+            }
@@ -0,0 +1,304 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import logging
+import threading
+import time
+
+try:
+    import snowflake.connector
+except ImportError:  # only a custom connect factory (e.g. LocalBackend.connect) can be used
+    snowflake = None
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled session becomes available within the wait timeout"""
+
+
+class ConnectionPool:
+    def __init__(self,
+                 connection_params: Dict,
+                 warehouse: str = None,
+                 min_size: int = 1,
+                 max_size: int = 8,
+                 max_idle_seconds: float = 300,
+                 health_check_interval: float = 60,
+                 connect: Callable = None):
+        """
+        Pool of Snowflake sessions bound to one set of connection params and one warehouse
+
+        Args:
+            connection_params: Parameters passed to snowflake.connector.connect
+            warehouse: Warehouse the sessions run on (overrides connection_params['warehouse'])
+            min_size: Sessions kept open even when idle
+            max_size: Upper bound on open sessions; acquire() waits once reached
+            max_idle_seconds: Idle sessions above min_size are closed after this long
+            health_check_interval: Sessions idle longer than this are pinged before reuse
+            connect: Connection factory, defaults to snowflake.connector.connect; this is where
+                     another backend plugs in, e.g. LocalBackend.connect for local runs
+        """
+        if connect is None and snowflake is None:
+            raise ImportError("snowflake-connector-python is required unless a connect factory is given")
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self.connection_params = connection_params.copy()
+        if warehouse:
+            self.connection_params['warehouse'] = warehouse
+        self.warehouse = self.connection_params.get('warehouse')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_interval = health_check_interval
+        self._connect = connect or snowflake.connector.connect
+
+        self._idle: List[tuple] = []  # (connection, returned_at), most recently used last
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._metrics = {
+            'created': 0,
+            'reused': 0,
+            'evicted_idle': 0,
+            'failed_health_checks': 0,
+            'acquisitions': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0
+        }
+        self.logger = logging.getLogger(__name__)
+
+        for _ in range(min_size):
+            conn = self._new_connection()
+            self._open += 1
+            self._idle.append((conn, time.monotonic()))
+
+    def _new_connection(self):
+        conn = self._connect(**self.connection_params)
+        with self._cond:
+            self._metrics['created'] += 1
+        return conn
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            self.logger.warning(f"Error closing pooled session: {str(e)}")
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        """Cheap liveness check; only round-trips if the session sat idle for a while"""
+        is_closed = getattr(conn, 'is_closed', None)
+        if callable(is_closed) and is_closed():
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except Exception as e:
+            self.logger.warning(f"Pooled session on warehouse {self.warehouse} failed health check: {str(e)}")
+            return False
+
+    def _take_expired(self) -> List:
+        """
+        Take sessions idle past max_idle_seconds out of the pool, keeping min_size open
+
+        Caller holds the lock, and closes the returned sessions after releasing it.
+        """
+        now = time.monotonic()
+        keep, expired = [], []
+        # Oldest first, so the most recently used sessions are the ones kept
+        for conn, returned_at in self._idle:
+            if self._open > self.min_size and now - returned_at > self.max_idle_seconds:
+                expired.append(conn)
+                self._open -= 1
+                self._metrics['evicted_idle'] += 1
+            else:
+                keep.append((conn, returned_at))
+        self._idle = keep
+        return expired
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Borrow a session, opening a new one if below max_size, otherwise wait for a release
+
+        Only bookkeeping happens under the lock; health-check pings, logins and closing expired
+        sessions are network calls and run after it is released, so waiters aren't held up.
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        while True:
+            conn, idle_for, expired = None, None, []
+            try:
+                with self._cond:
+                    while True:
+                        if self._closed:
+                            raise RuntimeError("Connection pool is closed")
+                        expired += self._take_expired()
+
+                        if self._idle:
+                            conn, returned_at = self._idle.pop()
+                            idle_for = time.monotonic() - returned_at
+                            break
+
+                        if self._open < self.max_size:
+                            # Reserve the slot, then log in outside the lock
+                            self._open += 1
+                            break
+
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise PoolTimeoutError(
+                                f"No session available on warehouse {self.warehouse} after {timeout}s "
+                                f"(max_size={self.max_size})")
+                        self._cond.wait(remaining)
+            finally:
+                for old in expired:
+                    self._close_quietly(old)
+
+            # The popped session is counted as borrowed while it is checked
+            if conn is None or self._is_healthy(conn, idle_for):
+                break
+            self._close_quietly(conn)
+            with self._cond:
+                self._open -= 1
+                self._metrics['failed_health_checks'] += 1
+                self._cond.notify()
+
+        waited = time.monotonic() - started
+        reused = conn is not None
+        if conn is None:
+            try:
+                conn = self._new_connection()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            if reused:
+                self._metrics['reused'] += 1
+            self._metrics['acquisitions'] += 1
+            self._metrics['total_wait_seconds'] += waited
+            self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], waited)
+        return conn
+
+    def grow(self, max_size: int):
+        """
+        Raise max_size for callers that need more concurrent sessions than the pool was created with
+
+        The pool never shrinks here: sessions already borrowed may exceed a smaller bound.
+        """
+        with self._cond:
+            if max_size > self.max_size:
+                self.logger.info(f"Growing pool on warehouse {self.warehouse}: max_size {self.max_size} -> {max_size}")
+                self.max_size = max_size
+                self._cond.notify_all()
+
+    def release(self, conn, discard: bool = False):
+        """Return a session to the pool; discard=True closes it instead (e.g. after a broken session)"""
+        with self._cond:
+            close = discard or self._closed
+            if close:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if close:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Context manager that borrows a session for the duration of the block"""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            # A failed statement does not poison the session, but a dropped one would
+            is_closed = getattr(conn, 'is_closed', None)
+            discard = callable(is_closed) and is_closed()
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def metrics(self) -> Dict:
+        """Snapshot of pool usage, including time callers spent waiting for a session"""
+        with self._cond:
+            snapshot = dict(self._metrics)
+            snapshot['warehouse'] = self.warehouse
+            snapshot['open'] = self._open
+            snapshot['idle'] = len(self._idle)
+            snapshot['avg_wait_seconds'] = (
+                snapshot['total_wait_seconds'] / snapshot['acquisitions']
+                if snapshot['acquisitions'] else 0.0
+            )
+            return snapshot
+
+    def close(self):
+        """Close every idle session; sessions still borrowed are closed when released"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._open -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+_pools: Dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(connection_params: Dict, warehouse: str = None) -> tuple:
+    params = {k: v for k, v in connection_params.items() if k != 'warehouse'}
+    return (
+        tuple(sorted((k, repr(v)) for k, v in params.items())),
+        (warehouse or connection_params.get('warehouse') or '').upper()
+    )
+
+
+def get_pool(connection_params: Dict, warehouse: str = None, **pool_options) -> ConnectionPool:
+    """
+    Return the shared pool for (connection params, warehouse), creating it on first use
+
+    pool_options (min_size, max_idle_seconds, ...) only apply when the pool is created; a larger
+    max_size than the existing pool's grows it, a smaller one is ignored.
+    """
+    key = _pool_key(connection_params, warehouse)
+    with _pools_lock:
+        pool = _pools.get(key)
+    if pool is None or pool._closed:
+        # Opening min_size sessions means logins; the global lock isn't held for them, so callers
+        # for other warehouses (and pool_metrics / close_all_pools) don't wait on this one
+        created = ConnectionPool(connection_params, warehouse=warehouse, **pool_options)
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None or pool._closed:
+                pool = _pools[key] = created
+                created = None
+        if created is None:
+            return pool
+        # Another caller created the pool first; keep theirs
+        created.close()
+    if 'max_size' in pool_options:
+        pool.grow(pool_options['max_size'])
+    return pool
+
+
+def pool_metrics() -> List[Dict]:
+    """Metrics for every shared pool, one entry per (connection params, warehouse)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.metrics() for pool in pools]
+
+
+def close_all_pools():
+    """Close every shared pool, e.g. at the end of a job"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
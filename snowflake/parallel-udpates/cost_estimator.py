@@ -0,0 +1,118 @@
+from typing import Dict, List
+import json
+import logging
+import re
+
+
+# Nodes (= credits per hour) per warehouse size
+WAREHOUSE_NODES = {
+    'XSMALL': 1, 'SMALL': 2, 'MEDIUM': 4, 'LARGE': 8, 'XLARGE': 16,
+    'XXLARGE': 32, 'XXXLARGE': 64, 'X4LARGE': 128, 'X5LARGE': 256, 'X6LARGE': 512
+}
+
+
+def warehouse_size_key(size: str) -> str:
+    """
+    The WAREHOUSE_NODES key for a size as Snowflake accepts or shows it
+
+    'X-Small', 'XSMALL', '2X-Large', 'X2LARGE' and 'XXLARGE' all map to the same key.
+
+    Raises:
+        ValueError: If the size is not a Snowflake warehouse size
+    """
+    key = re.sub(r"[\s_-]", '', str(size)).upper()
+    multiple = re.fullmatch(r"(?:X(\d)|(\d)X)LARGE", key)
+    if multiple:
+        n = int(multiple.group(1) or multiple.group(2))
+        key = 'X' * n + 'LARGE' if n <= 3 else f"X{n}LARGE"
+    if key not in WAREHOUSE_NODES:
+        raise ValueError(f"Unknown warehouse size: {size}")
+    return key
+
+
+class CostEstimator:
+    def __init__(self, warehouse_size: str = 'MEDIUM', scan_bytes_per_node_second: float = 200 * 1024 ** 2):
+        """
+        Estimate what a partitioned update will scan, from EXPLAIN only (nothing is executed)
+
+        Args:
+            warehouse_size: Size used for the warehouse-seconds / credits projection
+            scan_bytes_per_node_second: Assumed scan throughput of one warehouse node; a rough
+                                        planning figure, calibrate it from QUERY_HISTORY for real tables
+        """
+        self.warehouse_size = warehouse_size_key(warehouse_size)
+        self.scan_bytes_per_node_second = scan_bytes_per_node_second
+        self.logger = logging.getLogger(__name__)
+
+    def explain(self, conn, sql: str) -> Dict:
+        """partitionsTotal / partitionsAssigned / bytesAssigned from EXPLAIN USING JSON"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN USING JSON {sql}")
+            plan = json.loads(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+        stats = plan.get('GlobalStats', {})
+        return {
+            'partitions_total': stats.get('partitionsTotal', 0),
+            'partitions_assigned': stats.get('partitionsAssigned', 0),
+            'bytes_assigned': stats.get('bytesAssigned', 0)
+        }
+
+    def estimate(self, conn, base_sql: str, partition_sqls: List[str], mode: str = None,
+                 shared_sqls: List[str] = None) -> Dict:
+        """
+        Compare the partitioned statements against the same work done as one statement
+
+        Args:
+            conn: Open Snowflake session
+            base_sql: The statement without any partition predicate
+            partition_sqls: The statements the updater would run, one per partition
+            mode: Partitioning mode, echoed into the report
+            shared_sqls: Statements the run issues once however it is partitioned (e.g. a staging
+                         scan); added to both sides of the comparison and to the projection
+
+        Returns:
+            Dictionary with per-partition EXPLAIN stats, scan amplification (partitioned bytes /
+            single-statement bytes), pruning ratio and projected warehouse-seconds and credits
+        """
+        base = self.explain(conn, base_sql)
+        partitions = []
+        for i, sql in enumerate(partition_sqls):
+            stats = self.explain(conn, sql)
+            stats['partition_id'] = i
+            partitions.append(stats)
+
+        shared = [self.explain(conn, sql) for sql in shared_sqls or []]
+        shared_bytes = sum(s['bytes_assigned'] for s in shared)
+
+        bytes_total = shared_bytes + sum(p['bytes_assigned'] for p in partitions)
+        assigned_total = sum(p['partitions_assigned'] for p in partitions)
+        table_partitions = base['partitions_total'] or max((p['partitions_total'] for p in partitions), default=0)
+        nodes = WAREHOUSE_NODES[self.warehouse_size]
+        warehouse_seconds = bytes_total / (self.scan_bytes_per_node_second * nodes)
+
+        report = {
+            'mode': mode,
+            'num_partitions': len(partitions),
+            'table_micro_partitions': table_partitions,
+            'base': base,
+            'partitions': partitions,
+            'shared': shared,
+            'bytes_to_scan': bytes_total,
+            'micro_partitions_to_scan': assigned_total + sum(s['partitions_assigned'] for s in shared),
+            # 1.0 means partitioning adds no extra scanning; N means every partition rescans the table
+            'scan_amplification': (bytes_total / (base['bytes_assigned'] + shared_bytes))
+            if base['bytes_assigned'] + shared_bytes else None,
+            # Share of the table each partition statement skips, on average
+            'pruning_ratio': (1 - assigned_total / (table_partitions * len(partitions)))
+            if table_partitions and partitions else None,
+            'warehouse_size': self.warehouse_size,
+            'projected_warehouse_seconds': warehouse_seconds,
+            'projected_credits': warehouse_seconds * nodes / 3600
+        }
+        if report['scan_amplification'] and report['scan_amplification'] > 1.5:
+            self.logger.warning(
+                f"Partitioned statements scan {report['scan_amplification']:.1f}x the bytes of a single statement; "
+                f"the partition predicates are not pruning (try partition_mode='range')")
+        return report
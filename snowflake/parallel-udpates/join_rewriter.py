@@ -0,0 +1,510 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+import uuid
+
+from cost_estimator import CostEstimator
+from partition_planner import table_from_update
+from query_profiler import QueryProfiler
+from update_statement import find_keywords, mask_literals, mask_nested, referenced_identifiers, split_conjuncts
+
+
+_IDENT = r"[A-Za-z_][\w$]*"
+_TABLE = r"[A-Za-z_][\w.$]*"
+_ALIAS = (rf"(?:\s+(?:AS\s+)?(?!(?:WHERE|SET|ON|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|USING|WHEN|GROUP|ORDER|"
+          rf"LIMIT|QUALIFY|HAVING|UNION)\b)({_IDENT}))?")
+_SELECT_JOIN = re.compile(rf"\bFROM\s+({_TABLE}){_ALIAS}\s+(?:INNER\s+)?JOIN\s+({_TABLE}){_ALIAS}\s+ON\b",
+                          re.IGNORECASE)
+_SELECT_FROM = re.compile(rf"\bFROM\s+({_TABLE}){_ALIAS}", re.IGNORECASE)
+_MERGE = re.compile(rf"^\s*MERGE\s+INTO\s+({_TABLE}){_ALIAS}\s+USING\s+({_TABLE}){_ALIAS}\s+ON\b", re.IGNORECASE)
+_UPDATE = re.compile(rf"^\s*UPDATE\s+({_TABLE}){_ALIAS}\s+SET\b", re.IGNORECASE)
+_DELETE = re.compile(rf"^\s*DELETE\s+FROM\s+({_TABLE}){_ALIAS}(?:\s+USING\s+({_TABLE}){_ALIAS})?", re.IGNORECASE)
+_SUBQUERY_IN = re.compile(rf"({_IDENT}(?:\.{_IDENT})?)\s+(NOT\s+)?IN\s*\(\s*SELECT\b", re.IGNORECASE)
+_SIMPLE_SUBQUERY = re.compile(
+    rf"^\s*SELECT\s+(?:DISTINCT\s+)?({_IDENT}(?:\.{_IDENT})?)\s+FROM\s+({_TABLE}){_ALIAS}(?:\s+WHERE\s+(.*))?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_EQUALITY = re.compile(rf"^\s*({_IDENT})\.({_IDENT})\s*=\s*({_IDENT})\.({_IDENT})\s*$")
+_CLAUSE_KEYWORDS = ('WHERE', 'GROUP', 'ORDER', 'LIMIT', 'QUALIFY', 'HAVING', 'UNION', 'JOIN', 'WHEN')
+
+
+def _qualifiers(text: str) -> set:
+    """Lower-cased table aliases a condition qualifies columns with (a.col -> a)"""
+    return {q.lower() for q in re.findall(rf"\b({_IDENT})\s*\.\s*[A-Za-z_\"]", mask_literals(text))}
+
+
+def _has_subquery(text: str) -> bool:
+    return re.search(r"\bSELECT\b", mask_literals(text), re.IGNORECASE) is not None
+
+
+def _closing_paren(text: str, open_index: int) -> int:
+    """Index of the parenthesis closing the one at open_index, skipping literals"""
+    masked = mask_literals(text)
+    depth = 0
+    for i in range(open_index, len(masked)):
+        if masked[i] == '(':
+            depth += 1
+        elif masked[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError(f"Unbalanced parentheses: {text[open_index:open_index + 80]}")
+
+
+class JoinRewriter:
+    def __init__(self,
+                 small_table_bytes: int = 256 * 1024 * 1024,
+                 max_in_list: int = 1000,
+                 cost_estimator: CostEstimator = None,
+                 profiler: QueryProfiler = None):
+        """
+        Rewrite very-large-to-small join statements so the large side prunes
+
+        Snowflake prunes micro-partitions at compile time from predicates on the scanned table
+        alone; a join to a 100 MB table says nothing about which partitions of a 200 GB one can
+        be skipped. Using the small side's actual sizes and keys, the rewriter:
+            - prefilters the small side: its own WHERE / ON terms move into a derived table
+            - pushes its distinct join keys into the large side as a literal IN list, or as a
+              BETWEEN range when there are too many keys and the large table is clustered on the key
+            - replaces col IN (SELECT ...) on a small table with its literal values
+            - replaces col NOT IN (SELECT ...) with NOT EXISTS, when the subquery column has no NULLs
+
+        Literal lists reflect the small table when rewrite() ran; rewrite again for each execution.
+
+        Args:
+            small_table_bytes: Tables up to this size count as the small side
+            max_in_list: Most distinct keys pushed as a literal IN list
+            cost_estimator: EXPLAIN-based byte estimates for compare()
+            profiler: Reads measured BYTES_SCANNED for compare(execute=True)
+        """
+        self.small_table_bytes = small_table_bytes
+        self.max_in_list = max_in_list
+        self.cost_estimator = cost_estimator or CostEstimator()
+        self.profiler = profiler or QueryProfiler()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _query(conn, sql: str) -> List[tuple]:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _table_stats(self, conn, tables: List[str]) -> Dict[str, Dict]:
+        """Bytes, rows and clustering key per table, from INFORMATION_SCHEMA (no scan)"""
+        names = ', '.join(f"'{t.split('.')[-1].strip(chr(34)).upper()}'" for t in set(tables))
+        rows = self._query(conn, f"""
+            SELECT TABLE_NAME, BYTES, ROW_COUNT, CLUSTERING_KEY
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_NAME IN ({names})
+            """)
+        return {name.lower(): {'bytes': size or 0, 'row_count': count or 0, 'clustering_key': key}
+                for name, size, count, key in rows}
+
+    @staticmethod
+    def _literal(value) -> str:
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bool):
+            return 'TRUE' if value else 'FALSE'
+        if isinstance(value, (int, float, Decimal)):
+            return str(value)
+        if isinstance(value, datetime):
+            return f"'{value.isoformat(sep=' ')}'::TIMESTAMP_NTZ"
+        if isinstance(value, date):
+            return f"'{value.isoformat()}'::DATE"
+        return "'" + str(value).replace("'", "''") + "'"
+
+    # --- statement shapes ----------------------------------------------
+
+    @staticmethod
+    def _clause_end(body: str, start: int, keywords: Tuple[str, ...] = _CLAUSE_KEYWORDS) -> int:
+        found = find_keywords(body[start:], keywords)
+        return start + min(found.values()) if found else len(body)
+
+    @staticmethod
+    def _reference(table: str, alias: Optional[str]) -> Dict:
+        return {'table': table, 'alias': alias, 'name': (alias or table.split('.')[-1]).lower()}
+
+    def _shape(self, body: str) -> Optional[Dict]:
+        """
+        The two-table join a statement makes, with the spans of the clauses to rewrite
+
+        Returns:
+            None if the statement isn't a two-table inner join, UPDATE ... FROM, DELETE ... USING
+            or MERGE ... USING; otherwise the two tables, the clause holding the join terms,
+            the clause pushed predicates go into, and where the small side's reference sits
+        """
+        masked = mask_nested(body)
+        merge = _MERGE.match(masked)
+        if merge:
+            on_start = merge.end() - len('ON')
+            on_end = self._clause_end(body, merge.end(), ('WHEN',))
+            return {
+                'kind': 'merge',
+                'tables': [self._reference(merge.group(1), merge.group(2)),
+                           self._reference(merge.group(3), merge.group(4))],
+                'spans': [(merge.start(3), merge.end(4) if merge.group(4) else merge.end(3))],
+                'join_clause': ('ON', on_start, on_end),
+                'push_clause': ('ON', on_start, on_end),
+                # Moving ON terms into USING changes which source rows count as NOT MATCHED
+                'prefilter': not re.search(r"\bNOT\s+MATCHED\b", masked, re.IGNORECASE),
+                'target_fixed': True
+            }
+
+        update = _UPDATE.match(masked)
+        delete = _DELETE.match(masked)
+        if update or delete:
+            match = update or delete
+            positions = find_keywords(body, ('FROM', 'WHERE') if update else ('WHERE',))
+            if 'WHERE' not in positions:
+                return None
+            where = ('WHERE', positions['WHERE'], self._clause_end(body, positions['WHERE'] + len('WHERE')))
+            if update:
+                if 'FROM' not in positions:
+                    return None
+                source = re.match(rf"\s*({_TABLE}){_ALIAS}\s*$", masked[positions['FROM'] + 4:positions['WHERE']])
+                if not source:
+                    return None
+                offset = positions['FROM'] + 4
+                small = (source.group(1), source.group(2),
+                         offset + source.start(1), offset + (source.end(2) if source.group(2) else source.end(1)))
+            else:
+                if not delete.group(3):
+                    return None
+                small = (delete.group(3), delete.group(4),
+                         delete.start(3), delete.end(4) if delete.group(4) else delete.end(3))
+            return {
+                'kind': 'update' if update else 'delete',
+                'tables': [self._reference(match.group(1), match.group(2)), self._reference(small[0], small[1])],
+                'spans': [(small[2], small[3])],
+                'join_clause': where,
+                'push_clause': where,
+                'prefilter': True,
+                'target_fixed': True
+            }
+
+        join = _SELECT_JOIN.search(masked)
+        if join and len(re.findall(r"\bJOIN\b", masked, re.IGNORECASE)) == 1:
+            on_start = join.end() - len('ON')
+            on_end = self._clause_end(body, join.end())
+            positions = find_keywords(body[on_end:], ('WHERE',))
+            if 'WHERE' in positions:
+                where_start = on_end + positions['WHERE']
+                push = ('WHERE', where_start, self._clause_end(body, where_start + len('WHERE')))
+            else:
+                push = ('WHERE', on_end, on_end)
+            return {
+                'kind': 'select',
+                'tables': [self._reference(join.group(1), join.group(2)),
+                           self._reference(join.group(3), join.group(4))],
+                'spans': [(join.start(1), join.end(2) if join.group(2) else join.end(1)),
+                          (join.start(3), join.end(4) if join.group(4) else join.end(3))],
+                'join_clause': ('ON', on_start, on_end),
+                'push_clause': push,
+                'prefilter': True,
+                'target_fixed': False
+            }
+        return None
+
+    def _outer_reference(self, body: str) -> Optional[str]:
+        """Qualifier for bare columns of the statement's single outer table, for correlated subqueries"""
+        masked = mask_nested(body)
+        for pattern in (_UPDATE, _DELETE):
+            match = pattern.match(masked)
+            if match:
+                return match.group(2) or match.group(1)
+        froms = _SELECT_FROM.findall(masked)
+        if len(froms) == 1 and not re.search(r"\bJOIN\b", masked, re.IGNORECASE):
+            return froms[0][1] or froms[0][0]
+        return None
+
+    # --- rewrites ------------------------------------------------------
+
+    def _key_predicate(self, conn, big: Dict, big_column: str, small: Dict, small_column: str,
+                       prefilter: List[str], big_stats: Dict, report: Dict) -> Optional[str]:
+        """IN list or clustered range on the large side covering every key the small side can match"""
+        source = f"{small['table']} {small['alias']}" if small['alias'] else small['table']
+        column = f"{small['name']}.{small_column}"
+        where = f" WHERE {' AND '.join(prefilter)}" if prefilter else ''
+        distinct, low, high = self._query(
+            conn, f"SELECT COUNT(DISTINCT {column}), MIN({column}), MAX({column}) FROM {source}{where}")[0]
+        target = f"{big['name']}.{big_column}"
+        cluster_key = big_stats.get('clustering_key') or ''
+        clustered = big_column.lower() in referenced_identifiers(cluster_key)
+        if not distinct:
+            report['notes'].append(f"{small['table']} has no {small_column} values to match; the join returns nothing")
+            return None
+        if distinct <= self.max_in_list:
+            values = [row[0] for row in self._query(
+                conn, f"SELECT DISTINCT {column} FROM {source}{where} ORDER BY 1")
+                if row[0] is not None]
+            report['rewrites'].append(f"pushed {len(values)} distinct {small['table']}.{small_column} values "
+                                      f"into {big['table']} as an IN list")
+            if not clustered:
+                report['notes'].append(f"{big['table']} is not clustered on {big_column}; the IN list prunes only "
+                                       f"as far as {big_column} is naturally ordered")
+            return f"{target} IN ({', '.join(self._literal(v) for v in values)})"
+        if clustered:
+            report['rewrites'].append(f"pushed the {small['table']}.{small_column} range into {big['table']}, "
+                                      f"which is clustered on {big_column}")
+            return f"{target} BETWEEN {self._literal(low)} AND {self._literal(high)}"
+        report['notes'].append(f"{distinct} distinct {small_column} values is over max_in_list and {big['table']} "
+                               f"is not clustered on {big_column}; nothing pushed")
+        return None
+
+    def _rewrite_join(self, conn, body: str, report: Dict) -> str:
+        shape = self._shape(body)
+        if not shape:
+            return body
+        stats = self._table_stats(conn, [t['table'] for t in shape['tables']])
+        for t in shape['tables']:
+            t['stats'] = stats.get(t['table'].split('.')[-1].strip('"').lower(), {})
+        report['tables'].update({t['table']: t['stats'] for t in shape['tables']})
+
+        big, small = shape['tables']
+        if not shape['target_fixed'] and small['stats'].get('bytes', 0) > big['stats'].get('bytes', 0):
+            big, small = small, big
+        if small['stats'].get('bytes') is None or small['stats']['bytes'] > self.small_table_bytes:
+            report['notes'].append(f"No side is under small_table_bytes ({self.small_table_bytes}); join left as is")
+            return body
+        small_span = shape['spans'][shape['tables'].index(small)] if len(shape['spans']) > 1 else shape['spans'][0]
+
+        kind, start, end = shape['join_clause']
+        join_terms = split_conjuncts(body[start + len(kind):end])
+        pairs = []
+        prefilter = []
+        kept = []
+        for term in join_terms:
+            equality = _EQUALITY.match(term)
+            if equality and {equality.group(1).lower(), equality.group(3).lower()} == {big['name'], small['name']}:
+                if equality.group(1).lower() == big['name']:
+                    pairs.append((equality.group(2), equality.group(4)))
+                else:
+                    pairs.append((equality.group(4), equality.group(2)))
+                kept.append(term)
+            elif shape['prefilter'] and not _has_subquery(term) and _qualifiers(term) == {small['name']}:
+                prefilter.append(term)
+            else:
+                kept.append(term)
+        if not pairs:
+            report['notes'].append("No a.col = b.col join terms found; join left as is")
+            return body
+
+        pushed = [p for p in (self._key_predicate(conn, big, big_column, small, small_column,
+                                                  prefilter, big['stats'], report)
+                              for big_column, small_column in pairs) if p]
+
+        edits = []
+        push_kind, push_start, push_end = shape['push_clause']
+        if (push_kind, push_start, push_end) == shape['join_clause']:
+            kept += pushed
+        else:
+            existing = split_conjuncts(body[push_start + len(push_kind):push_end]) if push_end > push_start else []
+            remaining = []
+            for term in existing:
+                if shape['prefilter'] and not _has_subquery(term) and _qualifiers(term) == {small['name']}:
+                    prefilter.append(term)
+                else:
+                    remaining.append(term)
+            terms = remaining + pushed
+            edits.append((push_start, push_end, f"{push_kind} {' AND '.join(terms)}\n" if terms else ''))
+        edits.append((start, end, f"{kind} {' AND '.join(kept)}\n"))
+
+        if prefilter:
+            source = f"{small['table']} {small['alias']}" if small['alias'] else small['table']
+            edits.append((small_span[0], small_span[1],
+                          f"(SELECT * FROM {source} WHERE {' AND '.join(prefilter)}) {small['name']}"))
+            report['rewrites'].append(f"prefiltered {small['table']} on {' AND '.join(prefilter)} before the join")
+
+        # Spans never overlap, so apply from the end to keep earlier offsets valid
+        for edit_start, edit_end, text in sorted(edits, reverse=True):
+            body = body[:edit_start] + text + body[edit_end:]
+        return body
+
+    def _rewrite_subqueries(self, conn, body: str, report: Dict) -> str:
+        """IN (SELECT ...) on small tables to literals, NOT IN (SELECT ...) to NOT EXISTS"""
+        outer = self._outer_reference(body)
+        position = 0
+        counter = 0
+        while True:
+            match = _SUBQUERY_IN.search(mask_literals(body), position)
+            if not match:
+                return body
+            open_index = body.index('(', match.end(2) if match.group(2) else match.start() + len(match.group(1)))
+            close_index = _closing_paren(body, open_index)
+            position = match.end()
+            inner = _SIMPLE_SUBQUERY.match(body[open_index + 1:close_index])
+            if not inner:
+                continue
+            expression = match.group(1)
+            column, table, alias, where = inner.groups()
+            column = column.split('.')[-1]
+            source = f"{table} {alias}" if alias else table
+            where_sql = f" WHERE {where.strip()}" if where else ''
+
+            if match.group(2):
+                nulls, total = self._query(conn, f"SELECT COUNT(*) - COUNT({column}), COUNT(*) FROM {source}{where_sql}")[0]
+                if nulls:
+                    report['notes'].append(f"{table}.{column} has NULLs, so {expression} NOT IN (...) is never true; "
+                                           f"left as is - this is probably a bug in the statement")
+                    continue
+                if not total:
+                    report['notes'].append(f"The {table} subquery is empty, so NOT IN keeps every row; left as is")
+                    continue
+                if '.' not in expression:
+                    if not outer:
+                        report['notes'].append(f"Can't tell which table {expression} belongs to; NOT IN left as is")
+                        continue
+                    expression = f"{outer}.{expression}"
+                inner_alias = alias or f"_ni{counter}"
+                counter += 1
+                condition = f"{inner_alias}.{column} = {expression}" + (f" AND ({where.strip()})" if where else '')
+                replacement = (f"({expression} IS NOT NULL AND NOT EXISTS "
+                               f"(SELECT 1 FROM {table} {inner_alias} WHERE {condition}))")
+                report['rewrites'].append(f"{expression} NOT IN (SELECT {column} FROM {table}) -> NOT EXISTS")
+            else:
+                size = self._table_stats(conn, [table]).get(table.split('.')[-1].lower(), {}).get('bytes')
+                if size is None or size > self.small_table_bytes:
+                    continue
+                values = self._query(conn, f"SELECT DISTINCT {column} FROM {source}{where_sql} "
+                                           f"ORDER BY 1 LIMIT {self.max_in_list + 1}")
+                if len(values) > self.max_in_list:
+                    continue
+                literals = [self._literal(v[0]) for v in values if v[0] is not None] or ['NULL']
+                replacement = f"{expression} IN ({', '.join(literals)})"
+                report['rewrites'].append(f"{expression} IN (SELECT {column} FROM {table}) -> {len(values)} literal values")
+
+            body = body[:match.start()] + replacement + body[close_index + 1:]
+            position = match.start() + len(replacement)
+
+    def rewrite(self, conn, sql: str) -> Dict:
+        """
+        Rewrite one statement for pruning on its large side
+
+        Returns:
+            Dictionary with the original and rewritten sql, the rewrites applied, notes on
+            what was left alone and why, and the INFORMATION_SCHEMA stats of the joined tables
+        """
+        report = {'original_sql': sql, 'sql': sql, 'rewrites': [], 'notes': [], 'tables': {}}
+        body = sql.strip().rstrip(';')
+        body = self._rewrite_join(conn, body, report)
+        body = self._rewrite_subqueries(conn, body, report)
+        report['sql'] = body
+        if not report['rewrites']:
+            report['notes'].append("Nothing to rewrite")
+        return report
+
+    # --- measuring -----------------------------------------------------
+
+    @staticmethod
+    def _written_table(sql: str) -> Optional[str]:
+        text = sql.lstrip()
+        if re.match(r"^(UPDATE|DELETE|MERGE)\b", text, re.IGNORECASE):
+            return table_from_update(text)
+        match = re.match(rf"^(?:INSERT\s+(?:OVERWRITE\s+)?INTO|CREATE\s+(?:OR\s+REPLACE\s+)?"
+                         rf"(?:\w+\s+)?TABLE)\s+({_TABLE})", text, re.IGNORECASE)
+        return match.group(1) if match else None
+
+    def _measure(self, conn, sql: str) -> Dict:
+        """Run the statement and read BYTES_SCANNED; statements that write do so on a clone"""
+        target = self._written_table(sql)
+        scratch = None
+        if target:
+            scratch = f"{target.split('.')[-1].strip(chr(34))}_jr_{uuid.uuid4().hex[:6]}"
+            if not re.match(r"^\s*CREATE\b", sql, re.IGNORECASE):
+                self._query(conn, f"CREATE TABLE {scratch} CLONE {target}")
+            masked = mask_literals(sql)
+            for match in reversed(list(re.finditer(rf"(?<![\w.$\"]){re.escape(target)}(?![\w$])", masked,
+                                                   re.IGNORECASE))):
+                sql = sql[:match.start()] + scratch + sql[match.end():]
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            if cursor.description:
+                cursor.fetchall()
+            query_id = cursor.sfqid
+        finally:
+            cursor.close()
+            if scratch:
+                self._query(conn, f"DROP TABLE IF EXISTS {scratch}")
+        stats = self.profiler.statement_stats(conn, query_id)
+        return {'query_id': query_id, 'bytes_scanned': stats['bytes_scanned'],
+                'execution_seconds': stats['execution_seconds']}
+
+    def compare(self, conn, sql: str, execute: bool = False) -> Dict:
+        """
+        Rewrite a statement and compare bytes scanned before and after
+
+        Args:
+            conn: Open Snowflake session
+            sql: Statement to rewrite
+            execute: Also run both versions (writes go to zero-copy clones) and report the
+                     measured BYTES_SCANNED from QUERY_HISTORY_BY_SESSION, not only EXPLAIN's estimate
+
+        Returns:
+            The rewrite() report plus 'before' and 'after' scan figures and bytes_saved
+        """
+        report = self.rewrite(conn, sql)
+        for label, statement in (('before', sql), ('after', report['sql'])):
+            scan = {'explain_bytes': None}
+            try:
+                scan['explain_bytes'] = self.cost_estimator.explain(conn, statement)['bytes_assigned']
+            except Exception as e:
+                self.logger.warning(f"EXPLAIN failed for the {label} statement: {str(e)}")
+            if execute:
+                scan.update(self._measure(conn, statement))
+            report[label] = scan
+
+        key = 'bytes_scanned' if execute else 'explain_bytes'
+        before, after = report['before'].get(key), report['after'].get(key)
+        report['bytes_saved'] = before - after if before is not None and after is not None else None
+        report['scan_ratio'] = after / before if before and after is not None else None
+        return report
+
+
+# Example usage
+if __name__ == "__main__":
+    import snowflake.connector
+
+    conn = snowflake.connector.connect(
+        user='your_username',
+        password='your_password',
+        account='your_account',
+        warehouse='your_warehouse',
+        database='your_database',
+        schema='your_schema'
+    )
+    rewriter = JoinRewriter()
+
+    statements = [
+        # 200 GB mortgage_pool joined to the 100 MB security table
+        """
+        SELECT m.*
+        FROM mortgage_pool m
+        JOIN security s ON m.sec_id = s.sec_id AND m.effective_date = s.effective_date
+        WHERE s.status = 'ACTIVE'
+        """,
+        # exercise2's DELETE
+        "DELETE FROM tmp_table WHERE col1 NOT IN (SELECT col1 FROM security)",
+        # Method 1 of join-very_large-and-small-table.md
+        """
+        MERGE INTO large_table l
+        USING small_lookup_table s
+            ON l.join_key = s.join_key
+        WHEN MATCHED THEN
+            UPDATE SET l.column1 = s.new_value1, l.last_updated = CURRENT_TIMESTAMP()
+        """
+    ]
+    for statement in statements:
+        report = rewriter.compare(conn, statement)
+        print(report['sql'])
+        for rewrite in report['rewrites']:
+            print(f"  rewrite: {rewrite}")
+        for note in report['notes']:
+            print(f"  note: {note}")
+        print(f"  bytes (EXPLAIN): {report['before']['explain_bytes']} -> {report['after']['explain_bytes']}")
+    conn.close()
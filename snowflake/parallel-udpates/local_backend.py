@@ -0,0 +1,1783 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple, Union
+import bisect
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from cost_estimator import WAREHOUSE_NODES, warehouse_size_key
+from partition_planner import table_from_update
+from update_statement import (condition_clauses, find_keywords, mask_literals, mask_nested, parse_update,
+                              split_conjuncts, split_top_level, table_references)
+
+
+class LocalBackendError(Exception):
+    """Error raised by the local backend, worded like the Snowflake error it stands in for"""
+
+
+# Statement types that run on a warehouse (and so take a concurrency slot)
+_WAREHOUSE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'CREATE', 'COPY')
+# Statement texts the emulated plan cache keeps (LocalBackend compile_latency)
+_PLAN_CACHE_SIZE = 1000
+# Finished statements whose status and result stay readable by query id (get_query_status)
+_FINISHED_QUERIES = 1000
+# Statement types that take the table lock, as UPDATE/DELETE/MERGE do in Snowflake
+_LOCKING_STATEMENTS = ('UPDATE', 'DELETE', 'MERGE')
+
+_CAST = re.compile(r"::\s*[A-Za-z_]\w*(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?")
+_DATE_UNIT = re.compile(r"\b(DATE_PART|DATEADD|DATEDIFF)\s*\(\s*'?([A-Za-z_]+)'?\s*,", re.IGNORECASE)
+_NILADIC = re.compile(r"\b(CURRENT_TIMESTAMP|CURRENT_DATE|CURRENT_TIME|SYSDATE)\s*\(\s*\)", re.IGNORECASE)
+_SAMPLE = re.compile(r"\s+(?:TABLE)?SAMPLE\s+(?:SYSTEM|BLOCK|BERNOULLI|ROW)?\s*\(\s*[\d.]+\s*\)", re.IGNORECASE)
+_QUERY_HISTORY = re.compile(r"TABLE\s*\(\s*INFORMATION_SCHEMA\.(QUERY_HISTORY(?:_BY_SESSION)?)\s*\(", re.IGNORECASE)
+_PERCENTILE = re.compile(r"^APPROX_PERCENTILE\s*\((.*),\s*([\d.]+)\s*\)$", re.IGNORECASE | re.DOTALL)
+_CREATE = re.compile(
+    r"^CREATE\s+(OR\s+REPLACE\s+)?(?:(?:LOCAL\s+|GLOBAL\s+)?(TEMPORARY|TEMP|TRANSIENT|VOLATILE)\s+)?"
+    r"TABLE\s+(IF\s+NOT\s+EXISTS\s+)?([\w.$\"]+)\s*(.*)$", re.IGNORECASE | re.DOTALL)
+_CLUSTER_BY = re.compile(r"\bCLUSTER\s+BY\s*(?:LINEAR\s*)?\((.*)\)\s*$", re.IGNORECASE | re.DOTALL)
+_CREATE_STAGE = re.compile(r"^CREATE\s+(OR\s+REPLACE\s+)?(?:(TEMPORARY|TEMP)\s+)?STAGE\s+(IF\s+NOT\s+EXISTS\s+)?([\w.$\"]+)",
+                           re.IGNORECASE)
+# @stage, @stage/prefix/ or '@stage/prefix/'; the user stage @~ and table stages @%t included
+_STAGE_LOCATION = r"'?@([\w.$\"~%]+)(/[^\s']*)?'?"
+_PUT = re.compile(rf"^PUT\s+'?file://([^'\s]+)'?\s+{_STAGE_LOCATION}(.*)$", re.IGNORECASE | re.DOTALL)
+_COPY_INTO = re.compile(rf"^COPY\s+INTO\s+([\w.$\"]+)\s+FROM\s+{_STAGE_LOCATION}(.*)$", re.IGNORECASE | re.DOTALL)
+_STAGE_COMMAND = re.compile(rf"^(REMOVE|RM|LIST|LS)\s+{_STAGE_LOCATION}(.*)$", re.IGNORECASE | re.DOTALL)
+_IDENTIFIER = re.compile(r"\bIDENTIFIER\s*\(\s*(\?|%s|:\d+|'[^']*')\s*\)", re.IGNORECASE)
+# Bind placeholders, and the %% a pyformat statement writes for a literal percent sign
+_PLACEHOLDER = re.compile(r"\?|%s|%%|:\d+\b")
+_STAGE_OPTION = re.compile(r"\b(\w+)\s*=\s*(\([^)]*\)|'[^']*'|\S+)")
+_ALTER_WAREHOUSE = re.compile(r"^ALTER\s+WAREHOUSE\s+(?:IF\s+EXISTS\s+)?([\w$\"]+)\s+(.*)$", re.IGNORECASE | re.DOTALL)
+# Sizes as SHOW WAREHOUSES prints them
+_SIZE_NAMES = {'XSMALL': 'X-Small', 'SMALL': 'Small', 'MEDIUM': 'Medium', 'LARGE': 'Large', 'XLARGE': 'X-Large',
+               'XXLARGE': '2X-Large', 'XXXLARGE': '3X-Large', 'X4LARGE': '4X-Large', 'X5LARGE': '5X-Large',
+               'X6LARGE': '6X-Large'}
+# Snowflake bills at least this many seconds each time a warehouse resumes
+_MINIMUM_BILLED_SECONDS = 60
+# UPDATE t alias SET / DELETE FROM t alias: SQLite only accepts the alias after AS
+_DML_ALIAS = re.compile(r"^(\s*(?:UPDATE|DELETE\s+FROM)\s+[\w.$\"]+\s+)(?!AS\b|SET\b|WHERE\b|USING\b)([A-Za-z_]\w*)\b",
+                        re.IGNORECASE)
+
+_SNOWFLAKE_TIME_FORMAT = (('YYYY', '%Y'), ('HH24', '%H'), ('MI', '%M'), ('SS', '%S'),
+                          ('FF3', '{ms}'), ('FF', '{ms}'), ('MM', '%m'), ('DD', '%d'))
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    parsed = datetime.fromisoformat(str(value).strip().replace('T', ' '))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _format_datetime(value: datetime, like) -> str:
+    # Keep dates as dates so comparisons with 'YYYY-MM-DD' literals still work
+    if isinstance(like, str) and len(like.strip()) == 10:
+        return value.strftime('%Y-%m-%d')
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def _sf_hash(*values) -> int:
+    """Deterministic signed 64-bit hash standing in for Snowflake HASH()"""
+    value = int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=8).digest(), 'big', signed=True)
+    # ABS() of the smallest 64-bit integer overflows in SQLite
+    return value if value != -2 ** 63 else value + 1
+
+
+def _sf_mod(a, b):
+    if a is None or b is None or b == 0:
+        return None
+    if isinstance(a, int) and isinstance(b, int):
+        # Snowflake MOD keeps the sign of the dividend
+        remainder = abs(a) % abs(b)
+        return remainder if a >= 0 else -remainder
+    return a - b * int(a / b)
+
+
+def _sf_concat(*values):
+    if any(v is None for v in values):
+        return None
+    return ''.join(str(v) for v in values)
+
+
+def _sf_to_char(value, fmt=None):
+    if value is None:
+        return None
+    if fmt is None:
+        return str(value)
+    moment = _to_datetime(value)
+    pattern = fmt
+    for token, replacement in _SNOWFLAKE_TIME_FORMAT:
+        pattern = pattern.replace(token, replacement)
+    return moment.strftime(pattern).replace('{ms}', f"{moment.microsecond // 1000:03d}")
+
+
+def _sf_date_part(unit, value):
+    if value is None:
+        return None
+    moment = _to_datetime(value)
+    unit = unit.upper()
+    if unit == 'EPOCH_MILLISECOND':
+        return int(moment.timestamp() * 1000)
+    if unit in ('EPOCH', 'EPOCH_SECOND'):
+        return int(moment.timestamp())
+    if unit in ('DAYOFWEEK', 'DOW'):
+        return moment.isoweekday() % 7
+    return getattr(moment, unit.lower().rstrip('s'))
+
+
+def _sf_dateadd(unit, amount, value):
+    if value is None or amount is None:
+        return None
+    moment = _to_datetime(value)
+    unit = unit.lower().rstrip('s')
+    if unit in ('year', 'month'):
+        months = moment.month - 1 + int(amount) * (12 if unit == 'year' else 1)
+        moment = moment.replace(year=moment.year + months // 12, month=months % 12 + 1)
+    else:
+        unit = {'millisecond': 'milliseconds', 'ms': 'milliseconds'}.get(unit, unit + 's')
+        moment = moment + timedelta(**{unit: amount})
+    return _format_datetime(moment, value)
+
+
+def _sf_datediff(unit, start, end):
+    if start is None or end is None:
+        return None
+    seconds = (_to_datetime(end) - _to_datetime(start)).total_seconds()
+    per_unit = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+    return int(seconds // per_unit.get(unit.lower().rstrip('s'), 86400))
+
+
+class _ApproxPercentile:
+    """APPROX_PERCENTILE over a fixed-size reservoir sample"""
+    SAMPLE_SIZE = 100000
+
+    def __init__(self):
+        self.values = []
+        self.seen = 0
+        self.fraction = 0.5
+        self.rng = random.Random(0)
+
+    def step(self, value, fraction):
+        if value is None:
+            return
+        self.fraction = fraction
+        self.seen += 1
+        if len(self.values) < self.SAMPLE_SIZE:
+            self.values.append(value)
+        else:
+            slot = self.rng.randrange(self.seen)
+            if slot < self.SAMPLE_SIZE:
+                self.values[slot] = value
+
+    def finalize(self):
+        return _quantiles(self.values, [self.fraction])[0]
+
+
+class _PercentileAccumulate(_ApproxPercentile):
+    """APPROX_PERCENTILE_ACCUMULATE: the reservoir itself, as JSON, for APPROX_PERCENTILE_ESTIMATE"""
+
+    def step(self, value, fraction=0.5):
+        super().step(value, fraction)
+
+    def finalize(self):
+        return json.dumps(sorted(self.values))
+
+
+@functools.lru_cache(maxsize=16)
+def _percentile_state(state: str) -> List:
+    return json.loads(state)
+
+
+def _sf_percentile_estimate(state, fraction):
+    if state is None:
+        return None
+    return _quantiles(_percentile_state(state), [fraction])[0]
+
+
+class _HyperLogLog:
+    """HLL / APPROX_COUNT_DISTINCT: HyperLogLog with 2^12 registers (about 1.6% standard error)"""
+    PRECISION = 12
+
+    def __init__(self):
+        self.registers = [0] * (1 << self.PRECISION)
+
+    def step(self, value):
+        if value is None:
+            return
+        digest = int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), 'big')
+        index = digest >> (64 - self.PRECISION)
+        rest = digest & ((1 << (64 - self.PRECISION)) - 1)
+        rank = (64 - self.PRECISION) - rest.bit_length() + 1
+        self.registers[index] = max(self.registers[index], rank)
+
+    def finalize(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting while most registers are still empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class _ApproxTopK:
+    """APPROX_TOP_K(expr, k) with a Space-Saving style sketch; returns [[value, count], ...] as JSON"""
+    COUNTERS = 1000
+
+    def __init__(self):
+        self.counters = {}
+        self.floor = 0
+        self.k = 1
+
+    def step(self, value, k=1):
+        if value is None:
+            return
+        self.k = k
+        if value in self.counters:
+            self.counters[value] += 1
+            return
+        # A newcomer may have been evicted before, so it starts from the largest evicted count
+        self.counters[value] = self.floor + 1
+        if len(self.counters) >= 2 * max(self.COUNTERS, k):
+            kept = sorted(self.counters.items(), key=lambda item: -item[1])
+            self.floor = kept[max(self.COUNTERS, k)][1]
+            self.counters = dict(kept[:max(self.COUNTERS, k)])
+
+    def finalize(self):
+        top = sorted(self.counters.items(), key=lambda item: -item[1])[:self.k]
+        return json.dumps([[value, count] for value, count in top])
+
+
+def _quantiles(values: List, fractions: List[float]) -> List:
+    if not values:
+        return [None] * len(fractions)
+    values = sorted(values)
+    return [values[min(int(round(f * (len(values) - 1))), len(values) - 1)] for f in fractions]
+
+
+def _result(description=None, rows=None, rowcount=-1) -> Dict:
+    return {'description': description, 'rows': rows or [], 'rowcount': rowcount}
+
+
+def _dml_result(kind: str, count: int) -> Dict:
+    columns = {
+        'UPDATE': ('number of rows updated', 'number of multi-joined rows updated'),
+        'DELETE': ('number of rows deleted',),
+        'INSERT': ('number of rows inserted',)
+    }[kind]
+    row = (count, 0) if kind == 'UPDATE' else (count,)
+    return _result([(c, None, None, None, None, None, None) for c in columns], [row], count)
+
+
+def _stage_options(text: str) -> Dict[str, str]:
+    """KEY = value options of PUT / COPY / CREATE STAGE, keys upper-case and quotes removed"""
+    return {m.group(1).upper(): m.group(2).strip("'") for m in _STAGE_OPTION.finditer(text or '')}
+
+
+def _resolve_identifiers(text: str, params) -> Tuple[str, object]:
+    """Write IDENTIFIER(?) / IDENTIFIER('name') table names into the text, taking their values out of params"""
+    if 'IDENTIFIER' not in text.upper():
+        return text, params
+    masked = mask_literals(text)
+    values = list(params) if isinstance(params, (list, tuple)) else None
+    pyformat = '%s' in masked
+    pieces, position, taken = [], 0, 0
+    numbered = set()
+    for match in _IDENTIFIER.finditer(masked):
+        if match.group(1).startswith("'"):
+            name = text[match.start(1) + 1:match.end(1) - 1]
+        elif match.group(1).startswith(':'):
+            if values is None:
+                raise LocalBackendError("002141 (42601): IDENTIFIER() needs a positional bind value")
+            number = int(match.group(1)[1:])
+            name = values[number - 1]
+            numbered.add(number)
+        else:
+            if values is None:
+                raise LocalBackendError("002141 (42601): IDENTIFIER() needs a positional bind value")
+            # Placeholders before this one, less the IDENTIFIER values already taken out
+            index = sum(1 for p in _PLACEHOLDER.findall(masked[:match.start()]) if p != '%%') - taken
+            name = values.pop(index)
+            taken += 1
+        pieces.append(text[position:match.start()] + name)
+        position = match.end()
+    pieces.append(text[position:])
+    text = ''.join(pieces)
+    if numbered:
+        # Drop the numbered values that were names and renumber the placeholders after them
+        values = [v for i, v in enumerate(values, 1) if i not in numbered]
+        masked = mask_literals(text)
+        pieces, position = [], 0
+        for match in re.finditer(r":(\d+)\b", masked):
+            number = int(match.group(1))
+            pieces.append(text[position:match.start()] + f":{number - sum(1 for n in numbered if n < number)}")
+            position = match.end()
+        text = ''.join(pieces) + text[position:]
+    if pyformat and values is not None and not values:
+        # pyformat with every value used as a name: the connector still interpolates, collapsing %%
+        text = text.replace('%%', '%')
+    return text, (tuple(values) if values is not None else params)
+
+
+def _inline_params(text: str, params) -> str:
+    """The statement with positional bind values written in as literals, for pruning estimates"""
+    if not isinstance(params, (list, tuple)) or not params:
+        return text
+    masked = mask_literals(text)
+    # pyformat is interpolated everywhere, literals included; qmark and numeric only outside them
+    placeholders = re.finditer(r"%[s%]", text) if '%s' in masked else re.finditer(r"\?|:\d+\b", masked)
+    pieces, position, index = [], 0, 0
+    for match in placeholders:
+        placeholder = match.group(0)
+        if placeholder == '%%':
+            value = '%'
+        else:
+            if placeholder.startswith(':'):
+                index = int(placeholder[1:]) - 1
+            if index >= len(params):
+                return text
+            value = params[index]
+            value = 'NULL' if value is None else \
+                str(value).upper() if isinstance(value, bool) else \
+                repr(value) if isinstance(value, (int, float)) else "'" + str(value).replace("'", "''") + "'"
+            index += 1
+        pieces.append(text[position:match.start()] + value)
+        position = match.end()
+    return ''.join(pieces) + text[position:]
+
+
+def _sqlite_value(value):
+    """A value read from a Parquet file, as the updaters' tables store it"""
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class LocalCursor:
+    """DB-API cursor with the parts of the Snowflake cursor the updaters use"""
+
+    def __init__(self, connection: 'LocalConnection'):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.sfqid = None
+        self._rows = []
+        self._position = 0
+
+    def _load(self, query_id: str, result: Dict):
+        self.sfqid = query_id
+        self.description = result['description']
+        self.rowcount = result['rowcount']
+        self._rows = result['rows']
+        self._position = 0
+
+    def execute(self, command: str, params=None, _statement_params: Dict = None, **kwargs):
+        query_id, result = self.connection._run(command, params, _statement_params)
+        self._load(query_id, result)
+        return self
+
+    def executemany(self, command: str, seqparams):
+        total = 0
+        for params in seqparams:
+            self.execute(command, params)
+            total += max(self.rowcount, 0)
+        self.rowcount = total
+        return self
+
+    def execute_async(self, command: str, params=None, _statement_params: Dict = None, **kwargs) -> Dict:
+        self.sfqid = self.connection._submit(command, params, _statement_params)
+        return {'queryId': self.sfqid}
+
+    def get_results_from_sfqid(self, query_id: str):
+        self._load(query_id, self.connection.backend._wait_for(query_id))
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._rows = []
+
+
+class LocalConnection:
+    """One emulated Snowflake session: a SQLite connection with its own TEMPORARY tables"""
+
+    def __init__(self, backend: 'LocalBackend', params: Dict):
+        self.backend = backend
+        self.warehouse = (params.get('warehouse') or 'DEFAULT').upper()
+        self.session_id = next(backend._session_ids)
+        self._db = sqlite3.connect(backend.path, timeout=backend.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        self._db.execute("""
+            CREATE TABLE information_schema.tables (
+                table_catalog, table_schema, table_name, table_type, row_count, bytes, clustering_key)
+            """)
+        self._db.execute("""
+            CREATE TABLE information_schema.query_history (
+                query_id, query_text, query_type, session_id, warehouse_name, query_tag, execution_status,
+                error_message, start_time, end_time, total_elapsed_time, compilation_time, execution_time,
+                queued_provisioning_time, queued_repair_time, queued_overload_time, transaction_blocked_time,
+                bytes_scanned, bytes_spilled_to_local_storage, bytes_spilled_to_remote_storage, rows_produced)
+            """)
+        for name, fn, arity in (('HASH', _sf_hash, -1), ('MOD', _sf_mod, 2), ('CONCAT', _sf_concat, -1),
+                                ('TO_CHAR', _sf_to_char, 1), ('TO_CHAR', _sf_to_char, 2),
+                                ('TO_VARCHAR', _sf_to_char, 1), ('TO_VARCHAR', _sf_to_char, 2),
+                                ('DATE_PART', _sf_date_part, 2), ('DATEADD', _sf_dateadd, 3),
+                                ('DATEDIFF', _sf_datediff, 3), ('NVL', lambda a, b: b if a is None else a, 2),
+                                ('APPROX_PERCENTILE_ESTIMATE', _sf_percentile_estimate, 2)):
+            self._db.create_function(name, arity, fn, deterministic=True)
+        self._db.create_aggregate('APPROX_PERCENTILE', 2, _ApproxPercentile)
+        for name in ('HLL', 'APPROX_COUNT_DISTINCT'):
+            self._db.create_aggregate(name, 1, _HyperLogLog)
+        self._db.create_aggregate('APPROX_PERCENTILE_ACCUMULATE', 1, _PercentileAccumulate)
+        self._db.create_aggregate('APPROX_TOP_K', 1, _ApproxTopK)
+        self._db.create_aggregate('APPROX_TOP_K', 2, _ApproxTopK)
+        # Concurrent cursors share the session, but SQLite runs one statement per connection at a time
+        self._db_lock = threading.RLock()
+        # TEMPORARY stages: name -> directory, dropped with the session
+        self._stages: Dict[str, str] = {}
+        self._closed = False
+
+    # --- connector API -------------------------------------------------
+
+    def cursor(self) -> LocalCursor:
+        return LocalCursor(self)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            with self._db_lock:
+                self._db.close()
+            for directory in self._stages.values():
+                shutil.rmtree(directory, ignore_errors=True)
+            self._stages = {}
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def commit(self):
+        """Statements autocommit, as in Snowflake's default session settings"""
+
+    def rollback(self):
+        """Statements autocommit, as in Snowflake's default session settings"""
+
+    def get_query_status(self, query_id: str) -> str:
+        return self.backend._async_status(query_id)
+
+    def get_query_status_throw_if_error(self, query_id: str) -> str:
+        status = self.backend._async_status(query_id)
+        if status in ('FAILED_WITH_ERROR', 'ABORTED'):
+            self.backend._wait_for(query_id)  # raises the statement's error
+        return status
+
+    @staticmethod
+    def is_still_running(status: str) -> bool:
+        return status in ('RUNNING', 'QUEUED', 'RESUMING_WAREHOUSE', 'BLOCKED')
+
+    # --- execution -----------------------------------------------------
+
+    def _run(self, command: str, params, statement_params: Dict, query_id: str = None) -> Tuple[str, Dict]:
+        if self._closed:
+            raise LocalBackendError("390111 (08001): Session no longer exists")
+        query_id = query_id or self.backend._new_query_id()
+        return query_id, self.backend._execute(self, query_id, command, params, statement_params or {})
+
+    def _submit(self, command: str, params, statement_params: Dict) -> str:
+        query_id = self.backend._new_query_id()
+        self.backend._start_async(query_id, lambda: self._run(command, params, statement_params, query_id)[1])
+        return query_id
+
+    def _is_temp_table(self, name: str) -> bool:
+        row = self._db.execute(
+            "SELECT 1 FROM temp.sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE",
+            (name.split('.')[-1].strip('"'),)).fetchone()
+        return row is not None
+
+    def _locked_table(self, statement_type: str, text: str):
+        """The shared table a DML statement locks, or None (temporary tables are private to the session)"""
+        if statement_type not in _LOCKING_STATEMENTS:
+            return None
+        table = table_from_update(text).split('.')[-1].strip('"').upper()
+        with self._db_lock:
+            return None if self._is_temp_table(table) else table
+
+    def _dispatch(self, text: str, params) -> Dict:
+        upper = text.upper()
+        if upper.startswith('SHOW TABLES'):
+            return self._show_tables(text)
+        if upper.startswith('SHOW WAREHOUSES'):
+            return self._show_warehouses(text)
+        if _ALTER_WAREHOUSE.match(text):
+            return self._alter_warehouse(text)
+        if re.match(r"^DESC(?:RIBE)?\s+TABLE\s+", upper):
+            return self._describe(text.split()[-1])
+        if upper.startswith('EXPLAIN'):
+            return self._explain(text)
+        if upper.startswith(('USE ', 'ALTER SESSION', 'ALTER WAREHOUSE')):
+            match = re.match(r"^USE\s+WAREHOUSE\s+([\w$\"]+)", text, re.IGNORECASE)
+            if match:
+                self.warehouse = match.group(1).strip('"').upper()
+            return _result([('status',) + (None,) * 6], [('Statement executed successfully.',)], 0)
+        if 'SYSTEM$CANCEL_QUERY' in upper:
+            query_id = re.search(r"SYSTEM\$CANCEL_QUERY\s*\(\s*'([^']+)'", text, re.IGNORECASE).group(1)
+            cancelled = self.backend.cancel(query_id)
+            return _result([('status',) + (None,) * 6], [(f"query [{query_id}] {'terminated' if cancelled else 'not found'}.",)], 1)
+        if 'SYSTEM$CLUSTERING_INFORMATION' in upper:
+            return self._clustering_information(text)
+        if re.match(r"^INSERT\s+(FIRST|ALL)\b", upper):
+            return self._insert_multi(_inline_params(text, params))
+        if upper.startswith('MERGE'):
+            return self._merge(_inline_params(text, params))
+        if _CREATE_STAGE.match(text):
+            return self._create_stage(text)
+        if re.match(r"^DROP\s+STAGE\b", upper):
+            return self._drop_stage(text)
+        if upper.startswith('PUT'):
+            return self._put(text)
+        if upper.startswith('COPY'):
+            return self._copy_into(text)
+        if _STAGE_COMMAND.match(text):
+            return self._stage_command(text)
+        if upper.startswith('CREATE'):
+            return self._create(text)
+        if re.match(r"^ALTER\s+TABLE\s+[\w.$\"]+\s+CLUSTER\s+BY", upper):
+            table = text.split()[2]
+            self.backend.set_cluster_by(table, _CLUSTER_BY.search(text).group(1))
+            return _result([('status',) + (None,) * 6], [('Statement executed successfully.',)], 0)
+        if 'INFORMATION_SCHEMA.TABLES' in upper:
+            self._refresh_information_schema()
+        if 'INFORMATION_SCHEMA.QUERY_HISTORY' in upper:
+            text = self._query_history(text)
+        if re.match(r"^SELECT\s+APPROX_PERCENTILE\s*\(", upper):
+            percentiles = self._approx_percentiles(text, params)
+            if percentiles is not None:
+                return percentiles
+        return self._sqlite(text, params)
+
+    def _translate(self, sql: str) -> str:
+        """Rewrite the Snowflake-only syntax the updaters emit into SQLite"""
+        sql = _CAST.sub('', sql)
+        sql = _NILADIC.sub(lambda m: 'CURRENT_TIMESTAMP' if m.group(1).upper() == 'SYSDATE' else m.group(1), sql)
+        sql = _DATE_UNIT.sub(lambda m: f"{m.group(1)}('{m.group(2).upper()}',", sql)
+        sql = _SAMPLE.sub('', sql)
+        sql = _DML_ALIAS.sub(r"\1AS \2", sql)
+        return re.sub(r"\bIFF\s*\(", 'IIF(', sql, flags=re.IGNORECASE)
+
+    @staticmethod
+    def _bind(sql: str, params):
+        """
+        Placeholders to SQLite's: pyformat (%s, %(name)s, %% for a percent sign, interpolated everywhere
+        as the connector does), qmark (?) and numeric (:1) outside literals
+        """
+        if params is None:
+            return sql, ()
+        if isinstance(params, dict):
+            return re.sub(r"%\((\w+)\)s|%%", lambda m: f":{m.group(1)}" if m.group(1) else '%', sql), params
+        if '%s' in mask_literals(sql):
+            return re.sub(r"%[s%]", lambda m: '?' if m.group(0) == '%s' else '%', sql), tuple(params)
+        masked = mask_literals(sql)
+        pieces, position = [], 0
+        for match in re.finditer(r":(\d+)\b", masked):
+            pieces.append(sql[position:match.start()] + f"?{match.group(1)}")
+            position = match.end()
+        return ''.join(pieces) + sql[position:], tuple(params)
+
+    def _sqlite(self, sql: str, params=None) -> Dict:
+        sql, bound = self._bind(self._translate(sql), params)
+        statement_type = sql.lstrip().split(None, 1)[0].upper()
+        with self._db_lock:
+            cursor = self._db.execute(sql, bound)
+            if cursor.description:
+                return _result(cursor.description, cursor.fetchall(), cursor.rowcount)
+            if statement_type in ('UPDATE', 'DELETE', 'INSERT'):
+                return _dml_result(statement_type, cursor.rowcount)
+            return _result([('status',) + (None,) * 6], [('Statement executed successfully.',)], 0)
+
+    def _script(self, statements: List[str]) -> List[int]:
+        """Run translated statements in one transaction, returning each one's row count"""
+        counts = []
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql in statements:
+                    counts.append(self._db.execute(self._translate(sql)).rowcount)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return counts
+
+    def _table_names(self, pattern: str = '%') -> List[Tuple[str, str]]:
+        with self._db_lock:
+            return self._db.execute("""
+                SELECT name, 'main' FROM main.sqlite_master WHERE type = 'table' AND name LIKE ?
+                UNION ALL
+                SELECT name, 'temp' FROM temp.sqlite_master WHERE type = 'table' AND name LIKE ?
+                """, (pattern, pattern)).fetchall()
+
+    def _show_tables(self, text: str) -> Dict:
+        match = re.search(r"LIKE\s+'([^']*)'", text, re.IGNORECASE)
+        columns = ('created_on', 'name', 'database_name', 'schema_name', 'kind', 'comment', 'cluster_by', 'rows')
+        rows = []
+        for name, schema in self._table_names(match.group(1) if match else '%'):
+            with self._db_lock:
+                count = self._db.execute(f'SELECT COUNT(*) FROM {schema}."{name}"').fetchone()[0]
+            rows.append((None, name.upper(), 'LOCAL', 'PUBLIC', 'TEMPORARY' if schema == 'temp' else 'TABLE',
+                         '', self.backend.cluster_keys.get(name.upper(), ''), count))
+        return _result([(c,) + (None,) * 6 for c in columns], rows, len(rows))
+
+    def _show_warehouses(self, text: str) -> Dict:
+        match = re.search(r"LIKE\s+'([^']*)'", text, re.IGNORECASE)
+        columns = ('name', 'state', 'type', 'size', 'running', 'queued', 'is_default', 'is_current',
+                   'auto_resume', 'resumed_on')
+        rows = [(w['name'], w['state'], 'STANDARD', _SIZE_NAMES[w['size']], w['running'], 0, 'N',
+                 'Y' if w['name'] == self.warehouse else 'N', 'true',
+                 w['resumed_on'].isoformat() if w['resumed_on'] else None)
+                for w in self.backend.show_warehouses(match.group(1) if match else '%')]
+        return _result([(c,) + (None,) * 6 for c in columns], rows, len(rows))
+
+    def _alter_warehouse(self, text: str) -> Dict:
+        """RESUME [IF SUSPENDED], SUSPEND and SET WAREHOUSE_SIZE; other properties are accepted and ignored"""
+        name, action = _ALTER_WAREHOUSE.match(text).groups()
+        action = action.strip()
+        if re.match(r"^RESUME\b", action, re.IGNORECASE):
+            self.backend.resume_warehouse(name, if_suspended=bool(re.search(r"\bIF\s+SUSPENDED\b", action, re.IGNORECASE)))
+        elif re.match(r"^SUSPEND\b", action, re.IGNORECASE):
+            self.backend.suspend_warehouse(name)
+        elif re.match(r"^SET\b", action, re.IGNORECASE):
+            options = _stage_options(action)
+            if 'WAREHOUSE_SIZE' in options:
+                self.backend.resize_warehouse(name, options['WAREHOUSE_SIZE'],
+                                              wait=options.get('WAIT_FOR_COMPLETION', '').upper() == 'TRUE')
+        return _result([('status',) + (None,) * 6], [('Statement executed successfully.',)], 0)
+
+    def _describe(self, table: str) -> Dict:
+        with self._db_lock:
+            info = self._db.execute(f'PRAGMA table_info("{table.split(".")[-1].strip(chr(34))}")').fetchall()
+        if not info:
+            raise LocalBackendError(f"002003 (42S02): Table '{table.upper()}' does not exist or not authorized.")
+        columns = ('name', 'type', 'kind', 'null?', 'default', 'primary key')
+        rows = [(name.upper(), col_type or 'VARCHAR', 'COLUMN', 'N' if notnull else 'Y', default, 'Y' if pk else 'N')
+                for _, name, col_type, notnull, default, pk in info]
+        return _result([(c,) + (None,) * 6 for c in columns], rows, len(rows))
+
+    def _table_bytes(self, name: str, schema: str = 'main') -> int:
+        with self._db_lock:
+            try:
+                row = self._db.execute(f"SELECT SUM(pgsize) FROM dbstat('{schema}') WHERE name = ?", (name,)).fetchone()
+                return row[0] or 0
+            except sqlite3.Error:
+                page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+                page_count = self._db.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+                return page_size * page_count
+
+    def _refresh_information_schema(self):
+        rows = []
+        for name, schema in self._table_names():
+            with self._db_lock:
+                count = self._db.execute(f'SELECT COUNT(*) FROM {schema}."{name}"').fetchone()[0]
+            rows.append(('LOCAL', 'PUBLIC', name.upper(), 'LOCAL TEMPORARY' if schema == 'temp' else 'BASE TABLE',
+                         count, self._table_bytes(name, schema), self.backend.cluster_keys.get(name.upper())))
+        with self._db_lock:
+            self._db.execute("DELETE FROM information_schema.tables")
+            self._db.executemany("INSERT INTO information_schema.tables VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _query_history(self, text: str) -> str:
+        """Swap TABLE(INFORMATION_SCHEMA.QUERY_HISTORY[_BY_SESSION](...)) for a snapshot of the query log"""
+        match = _QUERY_HISTORY.search(text)
+        depth = 0
+        end = len(text)
+        for i in range(text.index('(', match.start()), len(text)):
+            if text[i] == '(':
+                depth += 1
+            elif text[i] == ')':
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        limit = re.search(r"RESULT_LIMIT\s*=>\s*(\d+)", text[match.start():end], re.IGNORECASE)
+        by_session = match.group(1).upper().endswith('_BY_SESSION')
+
+        with self.backend._lock:
+            entries = [e for e in self.backend.query_log if not by_session or e['session_id'] == self.session_id]
+        entries = entries[-int(limit.group(1)) if limit else -100:]
+        ms = lambda seconds: int(round(seconds * 1000))
+        rows = [(
+            e['query_id'], e['query_text'], e['statement_type'], e['session_id'], e['warehouse'], e['query_tag'],
+            e['status'], e['error'], e['start_time'].isoformat(), e['end_time'].isoformat(),
+            ms(e['elapsed_seconds']), ms(e['compilation_seconds']),
+            ms(e['elapsed_seconds'] - e['compilation_seconds'] - e['provisioning_seconds'] - e['queued_seconds']
+               - e['lock_wait_seconds']),
+            ms(e['provisioning_seconds']), 0, ms(e['queued_seconds']), ms(e['lock_wait_seconds']),
+            e['bytes_scanned'], 0, 0, e['rows']
+        ) for e in entries]
+        with self._db_lock:
+            self._db.execute("DELETE FROM information_schema.query_history")
+            self._db.executemany(f"INSERT INTO information_schema.query_history VALUES ({', '.join('?' * 21)})", rows)
+        return f"{text[:match.start()]}information_schema.query_history{text[end:]}"
+
+    def _approx_percentiles(self, text: str, params) -> Dict:
+        """Several APPROX_PERCENTILEs of one expression (the planner's query) from a single pass"""
+        select_end = find_keywords(text, ('FROM',)).get('FROM')
+        if select_end is None:
+            return None
+        items = [_PERCENTILE.match(item) for item in split_top_level(text[len('SELECT'):select_end])]
+        if not all(items) or len({m.group(1).strip() for m in items}) != 1:
+            return None
+        rng = random.Random(0)
+        sample = []
+        seen = 0
+        sql, bound = self._bind(self._translate(f"SELECT {items[0].group(1)} {text[select_end:]}"), params)
+        with self._db_lock:
+            for (value,) in self._db.execute(sql, bound):
+                if value is None:
+                    continue
+                seen += 1
+                if len(sample) < _ApproxPercentile.SAMPLE_SIZE:
+                    sample.append(value)
+                else:
+                    slot = rng.randrange(seen)
+                    if slot < _ApproxPercentile.SAMPLE_SIZE:
+                        sample[slot] = value
+        row = tuple(_quantiles(sample, [float(m.group(2)) for m in items]))
+        return _result([(f"APPROX_PERCENTILE_{i}",) + (None,) * 6 for i in range(len(items))], [row], 1)
+
+    def _clustering_information(self, text: str) -> Dict:
+        """SYSTEM$CLUSTERING_INFORMATION from the min/max of the key in each emulated micro-partition"""
+        match = re.search(r"SYSTEM\$CLUSTERING_INFORMATION\s*\(\s*'([^']+)'\s*(?:,\s*'([^']*)')?\s*\)",
+                          text, re.IGNORECASE)
+        if not match:
+            raise LocalBackendError(f"001003 (42000): Cannot parse clustering information call: {text[:80]}")
+        table = match.group(1).split('.')[-1].strip('"')
+        keys = match.group(2) or self.backend.cluster_keys.get(table.upper())
+        if not keys:
+            raise LocalBackendError(
+                f"000005 (XX000): Invalid clustering keys or table {table.upper()} is not clustered")
+        keys = re.sub(r"^\s*LINEAR\s*\((.*)\)\s*$", r"(\1)", keys, flags=re.IGNORECASE | re.DOTALL)
+        columns = split_top_level(keys.strip()[1:-1] if keys.strip().startswith('(') else keys)
+        schema = 'temp' if self._is_temp_table(table) else 'main'
+        size = self.backend.rows_per_micro_partition
+        key_sql = ', '.join(self._translate(c) for c in columns)
+        with self._db_lock:
+            rows = self._db.execute(
+                f'SELECT (rowid - 1) / {size}, {key_sql} FROM {schema}."{table}" ORDER BY rowid').fetchall()
+        ranges = {}
+        for partition, *values in rows:
+            if any(v is None for v in values):
+                continue
+            value = tuple(values)
+            low, high = ranges.get(partition, (value, value))
+            ranges[partition] = (min(low, value), max(high, value))
+        intervals = list(ranges.values())
+        lows = sorted(low for low, _ in intervals)
+        highs = sorted(high for _, high in intervals)
+
+        def depth(point) -> int:
+            # Partitions whose [low, high] covers point
+            return bisect.bisect_right(lows, point) - bisect.bisect_left(highs, point)
+
+        overlaps = []
+        depths = []
+        for low, high in intervals:
+            overlaps.append(bisect.bisect_right(lows, high) - bisect.bisect_left(highs, low) - 1)
+            depths.append(max(depth(low), depth(high)))
+        histogram = {}
+        for d in depths:
+            bucket = d if d <= 16 else 1 << (d - 1).bit_length()
+            histogram[f"{bucket:05d}"] = histogram.get(f"{bucket:05d}", 0) + 1
+        info = {
+            'cluster_by_keys': f"LINEAR({', '.join(c.strip() for c in columns)})",
+            'total_partition_count': len(intervals),
+            'total_constant_partition_count': sum(1 for (low, high), o in zip(intervals, overlaps)
+                                                  if low == high and o == 0),
+            'average_overlaps': round(sum(overlaps) / len(intervals), 4) if intervals else 0.0,
+            'average_depth': round(sum(depths) / len(depths), 4) if depths else 0.0,
+            'partition_depth_histogram': dict(sorted(histogram.items()))
+        }
+        return _result([(f"SYSTEM$CLUSTERING_INFORMATION('{match.group(1)}')",) + (None,) * 6],
+                       [(json.dumps(info),)], 1)
+
+    def _explain(self, text: str) -> Dict:
+        """EXPLAIN USING JSON GlobalStats, with micro-partitions modelled as fixed runs of rowids"""
+        body = re.sub(r"^EXPLAIN\s+(?:USING\s+\w+\s+)?", '', text, flags=re.IGNORECASE).strip()
+        stats = self.backend.scan_stats(self, body)
+        if stats is None:
+            raise LocalBackendError(f"001003 (42000): Cannot explain statement: {body[:80]}")
+        plan = {'GlobalStats': stats, 'Operations': [[{'id': 0, 'operation': 'Result'}]]}
+        return _result([('content',) + (None,) * 6], [(json.dumps(plan),)], 1)
+
+    def _create(self, text: str) -> Dict:
+        match = _CREATE.match(text)
+        if not match:
+            return self._sqlite(text)
+        replace, kind, if_not_exists, name, rest = match.groups()
+        cluster = _CLUSTER_BY.search(rest)
+        if cluster:
+            self.backend.set_cluster_by(name, rest[cluster.start(1):cluster.end(1)])
+            rest = rest[:cluster.start()].rstrip()
+        temp = (kind or '').upper() in ('TEMPORARY', 'TEMP', 'VOLATILE')
+        if re.match(r"^LIKE\s+", rest, re.IGNORECASE):
+            rest = f"AS SELECT * FROM {rest.split(None, 1)[1].strip()} WHERE 0"
+        elif re.match(r"^CLONE\s+", rest, re.IGNORECASE):
+            # Zero-copy in Snowflake; a copy in rowid order here, so micro-partitions and clustering match
+            source = rest.split(None, 1)[1].strip()
+            rest = f"AS SELECT * FROM {source} ORDER BY rowid"
+            if source.split('.')[-1].strip('"').upper() in self.backend.cluster_keys:
+                self.backend.cluster_keys[name.split('.')[-1].strip('"').upper()] = \
+                    self.backend.cluster_keys[source.split('.')[-1].strip('"').upper()]
+        statements = []
+        if replace:
+            statements.append(f"DROP TABLE IF EXISTS {'temp.' if temp else ''}{name}")
+        statements.append(f"CREATE {'TEMP ' if temp else ''}TABLE {if_not_exists or ''}{name} {rest}")
+        self._script(statements)
+        return _result([('status',) + (None,) * 6], [(f"Table {name.upper()} successfully created.",)], 0)
+
+    # --- stages --------------------------------------------------------
+
+    @staticmethod
+    def _stage_name(name: str) -> str:
+        return name.split('.')[-1].strip('"').upper()
+
+    def _stage_directory(self, name: str, prefix: str = None) -> str:
+        """Directory holding a stage's files (the session's temporary stages first), or under its prefix"""
+        key = self._stage_name(name)
+        with self.backend._lock:
+            directory = self._stages.get(key) or self.backend._stages.get(key)
+        if directory is None and (key == '~' or key.startswith('%')):
+            # The user stage @~ and every table's stage @%table always exist
+            directory = self.backend._named_stage(key)
+        if directory is None:
+            raise LocalBackendError(f"002003 (02000): SQL compilation error:\n"
+                                    f"Stage '{key}' does not exist or not authorized.")
+        return os.path.join(directory, *[p for p in (prefix or '').split('/') if p])
+
+    def _stage_files(self, name: str, prefix: str, pattern: str = None) -> List[Tuple[str, str]]:
+        """(path, path relative to the stage) of every file under a stage location, in name order"""
+        root = self._stage_directory(name)
+        location = self._stage_directory(name, prefix)
+        candidates = [location] if os.path.isfile(location) else \
+            [os.path.join(d, f) for d, _, files in os.walk(location) for f in files]
+        files = []
+        for path in sorted(candidates):
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            if pattern is None or re.fullmatch(pattern, relative):
+                files.append((path, relative))
+        return files
+
+    def _create_stage(self, text: str) -> Dict:
+        replace, kind, if_not_exists, name = _CREATE_STAGE.match(text).groups()
+        key = self._stage_name(name)
+        with self.backend._lock:
+            existing = self._stages.get(key) or self.backend._stages.get(key)
+        if existing and if_not_exists:
+            return _result([('status',) + (None,) * 6], [(f"{key} already exists, statement succeeded.",)], 0)
+        if existing and not replace:
+            raise LocalBackendError(f"002002 (42710): SQL compilation error:\nObject '{key}' already exists.")
+        if existing:
+            self._drop_stage(f"DROP STAGE {key}")
+        if kind:
+            self._stages[key] = self.backend._new_stage_directory(key)
+        else:
+            self.backend._named_stage(key)
+        return _result([('status',) + (None,) * 6], [(f"Stage area {key} successfully created.",)], 0)
+
+    def _drop_stage(self, text: str) -> Dict:
+        match = re.match(r"^DROP\s+STAGE\s+(IF\s+EXISTS\s+)?([\w.$\"]+)", text, re.IGNORECASE)
+        key = self._stage_name(match.group(2))
+        with self.backend._lock:
+            directory = self._stages.pop(key, None) or self.backend._stages.pop(key, None)
+        if directory is None and not match.group(1):
+            raise LocalBackendError(f"002003 (02000): SQL compilation error:\n"
+                                    f"Stage '{key}' does not exist or not authorized.")
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+        message = f"{key} successfully dropped." if directory else \
+            f"Drop statement executed successfully ({key} already dropped)."
+        return _result([('status',) + (None,) * 6], [(message,)], 0)
+
+    def _put(self, text: str) -> Dict:
+        """PUT file://... @stage: copies the files as they are (AUTO_COMPRESS is not applied)"""
+        match = _PUT.match(text)
+        if not match:
+            raise LocalBackendError(f"001003 (42000): Cannot parse PUT statement: {text[:80]}")
+        source, stage, prefix, rest = match.groups()
+        options = _stage_options(rest)
+        sources = sorted(glob.glob(os.path.expanduser(source)))
+        if not sources:
+            raise LocalBackendError(f"253006: File doesn't exist: ['{source}']")
+        directory = self._stage_directory(stage, prefix)
+        os.makedirs(directory, exist_ok=True)
+        overwrite = options.get('OVERWRITE', 'FALSE').upper() == 'TRUE'
+        rows = []
+        for path in sources:
+            name = os.path.basename(path)
+            target = os.path.join(directory, name)
+            size = os.path.getsize(path)
+            status = 'SKIPPED' if os.path.exists(target) and not overwrite else 'UPLOADED'
+            if status == 'UPLOADED':
+                shutil.copyfile(path, target)
+            compression = {'.parquet': 'PARQUET', '.gz': 'GZIP', '.zst': 'ZSTD'}.get(
+                os.path.splitext(name)[1].lower(), 'NONE')
+            rows.append((name, name, size, size, compression, compression, status, ''))
+        columns = ('source', 'target', 'source_size', 'target_size', 'source_compression',
+                   'target_compression', 'status', 'message')
+        return _result([(c,) + (None,) * 6 for c in columns], rows, len(rows))
+
+    def _copy_into(self, text: str) -> Dict:
+        """
+        COPY INTO <table> FROM @stage for Parquet files, with MATCH_BY_COLUMN_NAME, PATTERN and PURGE
+
+        Every file loads in one transaction, as with ON_ERROR = ABORT_STATEMENT. Files are not
+        remembered after loading, so loading the same file twice loads it twice (FORCE = TRUE).
+        """
+        match = _COPY_INTO.match(text)
+        if not match:
+            raise LocalBackendError(f"001003 (42000): Cannot parse COPY statement: {text[:80]}")
+        table, stage, prefix, rest = match.groups()
+        options = _stage_options(rest)
+        file_format = options.get('FILE_FORMAT', options.get('TYPE', '')).upper()
+        if 'PARQUET' not in file_format:
+            raise LocalBackendError("001003 (42000): Only FILE_FORMAT = (TYPE = PARQUET) is emulated locally")
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise LocalBackendError("pyarrow is needed to COPY Parquet files into the local backend") from e
+
+        match_by = options.get('MATCH_BY_COLUMN_NAME', 'NONE').upper()
+        fold = (lambda name: name) if match_by == 'CASE_SENSITIVE' else str.lower
+        files = self._stage_files(stage, prefix, options.get('PATTERN'))
+        if not files:
+            return _result([('status',) + (None,) * 6], [('Copy executed with 0 files processed.',)], 0)
+
+        rows = []
+        with self._db_lock:
+            table_columns = [d[0] for d in self._db.execute(f"SELECT * FROM {table} LIMIT 0").description]
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for path, relative in files:
+                    parquet = pq.ParquetFile(path)
+                    names = parquet.schema_arrow.names
+                    if match_by == 'NONE':
+                        if len(names) != len(table_columns):
+                            raise LocalBackendError(
+                                f"100080 (22000): Number of columns in file ({len(names)}) does not match that "
+                                f"of the corresponding table ({len(table_columns)}), file '{relative}'")
+                        pairs = list(zip(table_columns, names))
+                    else:
+                        pairs = [(c, n) for c in table_columns for n in names if fold(c) == fold(n)]
+                        if not pairs:
+                            raise LocalBackendError(f"100088 (22000): No column of file '{relative}' "
+                                                    f"matches a column of table {table.upper()}")
+                    insert = f"INSERT INTO {table} ({', '.join(c for c, _ in pairs)}) " \
+                             f"VALUES ({', '.join('?' * len(pairs))})"
+                    loaded = 0
+                    for batch in parquet.iter_batches(batch_size=65536, columns=[n for _, n in pairs]):
+                        columns = [[_sqlite_value(v) for v in column.to_pylist()] for column in batch.columns]
+                        self._db.executemany(insert, zip(*columns))
+                        loaded += batch.num_rows
+                    rows.append((f"{self._stage_name(stage).lower()}/{relative}", 'LOADED', loaded, loaded,
+                                 1, 0, None, None, None, None))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if options.get('PURGE', 'FALSE').upper() == 'TRUE':
+            for path, _ in files:
+                os.remove(path)
+        columns = ('file', 'status', 'rows_parsed', 'rows_loaded', 'error_limit', 'errors_seen', 'first_error',
+                   'first_error_line', 'first_error_character', 'first_error_column_name')
+        return _result([(c,) + (None,) * 6 for c in columns], rows, sum(r[3] for r in rows))
+
+    def _stage_command(self, text: str) -> Dict:
+        """LIST @stage and REMOVE @stage, optionally under a prefix and filtered by PATTERN"""
+        command, stage, prefix, rest = _STAGE_COMMAND.match(text).groups()
+        files = self._stage_files(stage, prefix, _stage_options(rest).get('PATTERN'))
+        stage_name = self._stage_name(stage).lower()
+        if command.upper() in ('LIST', 'LS'):
+            rows = []
+            for path, relative in files:
+                with open(path, 'rb') as f:
+                    md5 = hashlib.md5(f.read()).hexdigest()
+                modified = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+                rows.append((f"{stage_name}/{relative}", os.path.getsize(path), md5,
+                             modified.strftime('%a, %d %b %Y %H:%M:%S GMT')))
+            columns = ('name', 'size', 'md5', 'last_modified')
+        else:
+            for path, _ in files:
+                os.remove(path)
+            rows = [(f"{stage_name}/{relative}", 'removed') for _, relative in files]
+            columns = ('name', 'result')
+        return _result([(c,) + (None,) * 6 for c in columns], rows, len(rows))
+
+    def _insert_multi(self, text: str) -> Dict:
+        """INSERT FIRST / INSERT ALL ... SELECT, as one INSERT per target over a materialised source"""
+        masked = mask_nested(text)
+        mode = re.match(r"^INSERT\s+(FIRST|ALL)\b", text, re.IGNORECASE).group(1).upper()
+        branches = [(text[m.start(1):m.end(1)].strip(), m.group(2))
+                    for m in re.finditer(r"\bWHEN\b(.*?)\bTHEN\s+INTO\s+([\w.$\"]+)", masked,
+                                         re.IGNORECASE | re.DOTALL)]
+        otherwise = re.search(r"\bELSE\s+INTO\s+([\w.$\"]+)", masked, re.IGNORECASE)
+        last_into = max([m.end() for m in re.finditer(r"\bINTO\s+[\w.$\"]+", masked, re.IGNORECASE)])
+        select = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE).search(masked, last_into)
+        if not branches or not select or masked[last_into:select.start()].strip():
+            raise LocalBackendError("001003 (42000): Only WHEN ... THEN INTO <table> branches are supported locally")
+        source = text[select.start():]
+
+        branch_case = ' '.join(f"WHEN {condition} THEN {i}" for i, (condition, _) in enumerate(branches))
+        staging = f"_insert_{mode.lower()}_{threading.get_ident()}"
+        statements = [
+            f"DROP TABLE IF EXISTS temp.{staging}",
+            f"CREATE TEMP TABLE {staging} AS SELECT _src.*, CASE {branch_case} ELSE -1 END AS _branch "
+            f"FROM ({source}) _src"
+        ]
+        with self._db_lock:
+            self._script(statements)
+            columns = [d[0] for d in self._db.execute(f"SELECT * FROM temp.{staging} LIMIT 0").description][:-1]
+            column_list = ', '.join(f'"{c}"' for c in columns)
+            inserts = []
+            for i, (condition, target) in enumerate(branches):
+                # INSERT ALL tests every condition; INSERT FIRST only the first true one
+                filter_sql = f"_branch = {i}" if mode == 'FIRST' else f"({condition})"
+                inserts.append(f"INSERT INTO {target} SELECT {column_list} FROM temp.{staging} WHERE {filter_sql}")
+            if otherwise:
+                inserts.append(f"INSERT INTO {otherwise.group(1)} SELECT {column_list} FROM temp.{staging} "
+                               f"WHERE _branch = -1")
+            try:
+                counts = self._script(inserts)
+            finally:
+                self._db.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        return _dml_result('INSERT', sum(counts))
+
+    def _merge(self, text: str) -> Dict:
+        """MERGE as UPDATE ... FROM / DELETE / INSERT ... SELECT in one transaction"""
+        masked = mask_nested(text)
+        head = re.match(r"^MERGE\s+INTO\s+([\w.$\"]+)(?:\s+(?:AS\s+)?(?!USING\b)([A-Za-z_]\w*))?\s+USING\s+",
+                        masked, re.IGNORECASE)
+        on = head and re.compile(r"\bON\b", re.IGNORECASE).search(masked, head.end())
+        whens = list(re.finditer(r"\bWHEN\s+(NOT\s+)?MATCHED\b", masked, re.IGNORECASE))
+        if not on or not whens:
+            raise LocalBackendError(f"001003 (42000): Cannot parse MERGE statement: {text[:80]}")
+        target = head.group(1)
+        alias = head.group(2) or target
+        source = text[head.end():on.start()].strip()
+        source_match = re.match(r"^(.*?\S)\s+(?:AS\s+)?([A-Za-z_]\w*)$", source, re.DOTALL)
+        if source_match:
+            source, source_alias = source_match.group(1), source_match.group(2)
+        else:
+            source_alias = source.split('.')[-1]
+        condition = text[on.end():whens[0].start()].strip()
+
+        clauses = []
+        for i, when in enumerate(whens):
+            end = whens[i + 1].start() if i + 1 < len(whens) else len(text)
+            clause_masked = masked[when.end():end]
+            then = re.search(r"\bTHEN\b", clause_masked, re.IGNORECASE)
+            extra = text[when.end():when.end() + then.start()].strip()
+            extra = re.sub(r"^AND\b", '', extra, flags=re.IGNORECASE).strip() or None
+            action = text[when.end() + then.end():end].strip()
+            clauses.append((bool(when.group(1)), extra, action))
+
+        needs_snapshot = any(not_matched for not_matched, _, _ in clauses)
+        snapshot = f"_merge_source_{threading.get_ident()}"
+        statements = []
+        if needs_snapshot:
+            # NOT MATCHED is decided against the target as it was before the MERGE
+            statements += [
+                f"DROP TABLE IF EXISTS temp.{snapshot}",
+                f"CREATE TEMP TABLE {snapshot} AS SELECT {source_alias}.*, EXISTS (SELECT 1 FROM {target} AS {alias} "
+                f"WHERE {condition}) AS _merge_matched FROM {source} AS {source_alias}"
+            ]
+            source = f"temp.{snapshot}"
+
+        kinds = []
+        earlier = {True: [], False: []}
+        for not_matched, extra, action in clauses:
+            guard = ''.join(f" AND NOT COALESCE(({c}), FALSE)" for c in earlier[not_matched])
+            guard += f" AND ({extra})" if extra else ''
+            earlier[not_matched].append(extra or 'TRUE')
+            verb = action.split(None, 1)[0].upper()
+            if not_matched:
+                match = re.match(r"^INSERT\s*(\((.*?)\))?\s*VALUES\s*\((.*)\)\s*$", action, re.IGNORECASE | re.DOTALL)
+                columns = f"({match.group(2)})" if match.group(1) else ''
+                matched_flag = f"{source_alias}._merge_matched"
+                statements.append(
+                    f"INSERT INTO {target} {columns} SELECT {match.group(3)} FROM {source} AS {source_alias} "
+                    f"WHERE NOT {matched_flag}{guard}")
+                kinds.append('inserted')
+            elif verb == 'UPDATE':
+                assignments = split_top_level(re.sub(r"^UPDATE\s+SET\s+", '', action, flags=re.IGNORECASE))
+                set_clause = ', '.join(
+                    f"{column.strip().split('.')[-1]} = {expression.strip()}"
+                    for column, _, expression in (a.partition('=') for a in assignments))
+                statements.append(f"UPDATE {target} AS {alias} SET {set_clause} FROM {source} AS {source_alias} "
+                                  f"WHERE {condition}{guard}")
+                kinds.append('updated')
+            elif verb == 'DELETE':
+                statements.append(
+                    f"DELETE FROM {target} WHERE rowid IN (SELECT {alias}.rowid FROM {target} AS {alias} "
+                    f"JOIN {source} AS {source_alias} ON {condition} WHERE TRUE{guard})")
+                kinds.append('deleted')
+
+        try:
+            counts = self._script(statements)[-len(kinds):]
+        finally:
+            if needs_snapshot:
+                with self._db_lock:
+                    self._db.execute(f"DROP TABLE IF EXISTS temp.{snapshot}")
+        totals = {kind: 0 for kind in ('inserted', 'updated', 'deleted') if kind in kinds}
+        for kind, count in zip(kinds, counts):
+            totals[kind] += count
+        description = [(f"number of rows {kind}",) + (None,) * 6 for kind in totals]
+        return _result(description, [tuple(totals.values())], sum(totals.values()))
+
+
+class LocalBackend:
+    def __init__(self,
+                 path: str = None,
+                 latency: Union[float, Callable[[str], float]] = 0.0,
+                 latency_jitter: float = 0.0,
+                 connect_latency: float = 0.0,
+                 compile_latency: float = 0.0,
+                 lock_mode: str = 'table',
+                 lock_timeout: float = 43200,
+                 max_lock_waiters: int = 20,
+                 warehouse_concurrency: int = 8,
+                 resume_latency: float = 0.0,
+                 warehouse_size: str = 'XSMALL',
+                 rows_per_micro_partition: int = 16000,
+                 busy_timeout: float = 600,
+                 track_bytes_scanned: bool = False,
+                 seed: int = 0):
+        """
+        SQLite stand-in for Snowflake, for exercising the updaters without an account
+
+        backend.connect is a drop-in for snowflake.connector.connect, so any updater runs
+        against it via pool_options={'connect': backend.connect}. Each connection is a
+        session with its own TEMPORARY tables; HASH, MOD, APPROX_PERCENTILE, HLL, APPROX_TOP_K,
+        INSERT FIRST, MERGE, CREATE ... LIKE, SHOW TABLES, DESC TABLE, EXPLAIN USING JSON,
+        SYSTEM$CLUSTERING_INFORMATION, stages (PUT, COPY INTO from Parquet) and warehouse
+        state (SHOW WAREHOUSES, ALTER WAREHOUSE RESUME / SUSPEND / SET WAREHOUSE_SIZE) are emulated.
+
+        Args:
+            path: SQLite database file; a throwaway file when omitted
+            latency: Seconds added to every statement, or a function of the SQL text
+            latency_jitter: Random +/- share of the latency (0.2 = +/-20%)
+            connect_latency: Seconds each new connection takes to log in
+            compile_latency: Seconds to compile a statement text not run recently; a repeat of one of the
+                             last 1000 texts compiles in a tenth of that. Bind values are not part of the
+                             text, so partition statements with bound ranges compile once
+            lock_mode: 'table' - UPDATE/DELETE/MERGE on the same table queue behind each other,
+                       as Snowflake's table locks do; 'none' - no emulated lock
+            lock_timeout: Seconds a statement waits for a table lock before failing (LOCK_TIMEOUT)
+            max_lock_waiters: Statements allowed to queue on one lock before new ones fail
+            warehouse_concurrency: Statements running at once per warehouse (MAX_CONCURRENCY_LEVEL);
+                                   further statements queue. None for unlimited
+            resume_latency: Seconds a suspended warehouse takes to start, paid by ALTER WAREHOUSE RESUME or
+                            by the first statement that auto-resumes it (QUEUED_PROVISIONING_TIME), and by
+                            SET WAREHOUSE_SIZE ... WAIT_FOR_COMPLETION = TRUE growing a running warehouse.
+                            Warehouses exist once named and start suspended; nothing auto-suspends them
+            warehouse_size: Size every warehouse starts at; credits are billed from it (warehouse_usage)
+            rows_per_micro_partition: Rowids per emulated micro-partition, for EXPLAIN pruning stats
+            busy_timeout: Seconds SQLite waits for its own write lock (SQLite runs one write at a time)
+            track_bytes_scanned: Work out BYTES_SCANNED for QUERY_HISTORY from the micro-partitions each
+                                 table's own predicates leave; costs an extra pass per table and statement
+            seed: Seed for the latency jitter
+        """
+        if lock_mode not in ('table', 'none'):
+            raise ValueError(f"Unknown lock_mode: {lock_mode}")
+        self._tempdir = None
+        if path is None:
+            self._tempdir = tempfile.mkdtemp(prefix='local_backend_')
+            path = os.path.join(self._tempdir, 'local.db')
+        self.path = path
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.connect_latency = connect_latency
+        self.compile_latency = compile_latency
+        self.lock_mode = lock_mode
+        self.lock_timeout = lock_timeout
+        self.max_lock_waiters = max_lock_waiters
+        self.warehouse_concurrency = warehouse_concurrency
+        self.resume_latency = resume_latency
+        self.warehouse_size = warehouse_size_key(warehouse_size)
+        self.rows_per_micro_partition = rows_per_micro_partition
+        self.busy_timeout = busy_timeout
+        self.track_bytes_scanned = track_bytes_scanned
+        self.cluster_keys: Dict[str, str] = {}
+        self.query_log: List[Dict] = []
+        # Named (non-temporary) stages: name -> directory
+        self._stages: Dict[str, str] = {}
+        self._stage_root = None
+
+        self._rng = random.Random(seed)
+        self._compiled: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._query_ids = itertools.count(1)
+        self._session_ids = itertools.count(1)
+        self._table_locks: Dict[str, Dict] = {}
+        self._warehouse_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._warehouses: Dict[str, Dict] = {}
+        self._running: Dict[str, Tuple[LocalConnection, threading.Event]] = {}
+        self._async: Dict[str, Dict] = {}
+        self._finished: OrderedDict = OrderedDict()
+        self._connection_stats = {'connections': 0, 'connect_seconds': 0.0}
+        self.logger = logging.getLogger(__name__)
+
+        with sqlite3.connect(self.path) as db:
+            db.execute("PRAGMA journal_mode = WAL")
+
+    # --- connections ---------------------------------------------------
+
+    def connect(self, **params) -> LocalConnection:
+        """Open a session; accepts (and ignores) the usual Snowflake connection parameters"""
+        started = time.monotonic()
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        conn = LocalConnection(self, params)
+        with self._lock:
+            self._connection_stats['connections'] += 1
+            self._connection_stats['connect_seconds'] += time.monotonic() - started
+        return conn
+
+    def connection_stats(self) -> Dict:
+        with self._lock:
+            return dict(self._connection_stats)
+
+    def reset_stats(self):
+        """Clear the query log and connection counters, e.g. between benchmark runs"""
+        with self._lock:
+            self.query_log = []
+            self._connection_stats = {'connections': 0, 'connect_seconds': 0.0}
+
+    def close(self):
+        """Remove the throwaway database file, if this backend created one"""
+        if self._stage_root:
+            shutil.rmtree(self._stage_root, ignore_errors=True)
+            self._stage_root = None
+        if self._tempdir:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def _new_stage_directory(self, name: str) -> str:
+        """An empty directory for a stage's files, under one root removed by close()"""
+        with self._lock:
+            if self._stage_root is None:
+                self._stage_root = tempfile.mkdtemp(prefix='local_stages_')
+            root = self._stage_root
+        return tempfile.mkdtemp(prefix=f"{name.strip('~%').lower() or 'user'}_", dir=root)
+
+    def _named_stage(self, name: str) -> str:
+        """Directory of a named stage, creating the stage if needed"""
+        with self._lock:
+            directory = self._stages.get(name)
+        if directory is None:
+            directory = self._new_stage_directory(name)
+            with self._lock:
+                directory = self._stages.setdefault(name, directory)
+        return directory
+
+    def set_cluster_by(self, table: str, expression: str):
+        """Record a clustering key, reported by SHOW TABLES for the partition planner"""
+        self.cluster_keys[table.split('.')[-1].strip('"').upper()] = f"LINEAR({expression.strip()})"
+
+    # --- warehouses ----------------------------------------------------
+
+    def _warehouse(self, name: str) -> Dict:
+        """A warehouse's state, created suspended on first use; the caller holds self._lock"""
+        name = name.strip('"').upper()
+        warehouse = self._warehouses.get(name)
+        if warehouse is None:
+            warehouse = self._warehouses[name] = {
+                'name': name, 'state': 'SUSPENDED', 'size': self.warehouse_size, 'ready_at': None,
+                'resumed_at': None, 'resumed_on': None, 'billed_until': None, 'credits': 0.0, 'resumes': 0
+            }
+        if warehouse['state'] == 'RESUMING' and time.monotonic() >= warehouse['ready_at']:
+            warehouse['state'] = 'STARTED'
+        return warehouse
+
+    @staticmethod
+    def _bill(warehouse: Dict, now: float):
+        """Add the credits a running warehouse used since it was last billed"""
+        if warehouse['billed_until'] is not None:
+            seconds = now - warehouse['billed_until']
+            warehouse['credits'] += seconds * WAREHOUSE_NODES[warehouse['size']] / 3600
+            warehouse['billed_until'] = now
+
+    def _start_warehouse(self, name: str) -> float:
+        """Resume a suspended warehouse; the seconds until it is started"""
+        with self._lock:
+            warehouse = self._warehouse(name)
+            now = time.monotonic()
+            if warehouse['state'] == 'SUSPENDED':
+                warehouse.update({
+                    'state': 'RESUMING' if self.resume_latency else 'STARTED',
+                    'ready_at': now + self.resume_latency, 'resumed_at': now,
+                    'resumed_on': datetime.now(timezone.utc), 'billed_until': now
+                })
+                warehouse['resumes'] += 1
+            return max(warehouse['ready_at'] - now, 0.0) if warehouse['state'] == 'RESUMING' else 0.0
+
+    def resume_warehouse(self, name: str, if_suspended: bool = False) -> float:
+        """ALTER WAREHOUSE ... RESUME: returns once the warehouse has started, with the seconds waited"""
+        with self._lock:
+            state = self._warehouse(name)['state']
+        if state != 'SUSPENDED' and not if_suspended:
+            raise LocalBackendError(f"090063 (22000): Invalid state. Warehouse '{name.upper()}' cannot be resumed "
+                                    f"because it is already {state.lower()}.")
+        wait = self._start_warehouse(name)
+        time.sleep(wait)
+        return wait
+
+    def suspend_warehouse(self, name: str):
+        """ALTER WAREHOUSE ... SUSPEND, billing at least a minute for the time since it resumed"""
+        with self._lock:
+            warehouse = self._warehouse(name)
+            if warehouse['state'] == 'SUSPENDED':
+                raise LocalBackendError(f"090064 (22000): Invalid state. Warehouse '{warehouse['name']}' "
+                                        f"cannot be suspended.")
+            now = time.monotonic()
+            self._bill(warehouse, now)
+            short = _MINIMUM_BILLED_SECONDS - (now - warehouse['resumed_at'])
+            if short > 0:
+                warehouse['credits'] += short * WAREHOUSE_NODES[warehouse['size']] / 3600
+            warehouse.update({'state': 'SUSPENDED', 'ready_at': None, 'billed_until': None})
+
+    def resize_warehouse(self, name: str, size: str, wait: bool = False):
+        """ALTER WAREHOUSE ... SET WAREHOUSE_SIZE; growing a running warehouse with wait takes resume_latency"""
+        size = warehouse_size_key(size)
+        with self._lock:
+            warehouse = self._warehouse(name)
+            running = warehouse['state'] != 'SUSPENDED'
+            self._bill(warehouse, time.monotonic())
+            grows = WAREHOUSE_NODES[size] > WAREHOUSE_NODES[warehouse['size']]
+            warehouse['size'] = size
+        if running and grows and wait:
+            time.sleep(self.resume_latency)
+
+    def show_warehouses(self, pattern: str = '%') -> List[Dict]:
+        """SHOW WAREHOUSES [LIKE pattern]; a pattern without wildcards names (and so creates) one warehouse"""
+        with self._lock:
+            if not re.search(r"[%_]", pattern.replace('\\_', '')):
+                self._warehouse(pattern.replace('\\_', '_'))
+            regex = re.compile('^' + ''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch)
+                                             for ch in pattern) + '$', re.IGNORECASE)
+            running = {}
+            for conn, _ in self._running.values():
+                running[conn.warehouse] = running.get(conn.warehouse, 0) + 1
+            return [{**self._warehouse(name), 'running': running.get(name, 0)}
+                    for name in sorted(self._warehouses) if regex.match(name)]
+
+    def warehouse_usage(self) -> Dict[str, Dict]:
+        """Per warehouse: state, size, number of resumes and credits billed so far"""
+        with self._lock:
+            now = time.monotonic()
+            usage = {}
+            for name in sorted(self._warehouses):
+                warehouse = self._warehouse(name)
+                credits = warehouse['credits']
+                if warehouse['billed_until'] is not None:
+                    credits += (now - warehouse['billed_until']) * WAREHOUSE_NODES[warehouse['size']] / 3600
+                usage[name] = {'state': warehouse['state'], 'size': warehouse['size'],
+                               'resumes': warehouse['resumes'], 'credits': credits}
+            return usage
+
+    def suspend_all_warehouses(self):
+        """Suspend every running warehouse, e.g. so each benchmark strategy starts cold"""
+        with self._lock:
+            names = [name for name in self._warehouses if self._warehouse(name)['state'] != 'SUSPENDED']
+        for name in names:
+            self.suspend_warehouse(name)
+
+    # --- statement execution -------------------------------------------
+
+    def _new_query_id(self) -> str:
+        return f"local-{next(self._query_ids):08d}"
+
+    def _statement_latency(self, sql: str) -> float:
+        base = self.latency(sql) if callable(self.latency) else self.latency
+        if base and self.latency_jitter:
+            with self._lock:
+                base *= 1 + self._rng.uniform(-self.latency_jitter, self.latency_jitter)
+        return max(base or 0.0, 0.0)
+
+    def _compile_seconds(self, text: str) -> float:
+        """Emulated compile time: full for a new text, a tenth for one still in the plan cache"""
+        if not self.compile_latency:
+            return 0.0
+        with self._lock:
+            cached = text in self._compiled
+            self._compiled[text] = True
+            self._compiled.move_to_end(text)
+            if len(self._compiled) > _PLAN_CACHE_SIZE:
+                self._compiled.popitem(last=False)
+        return self.compile_latency * (0.1 if cached else 1.0)
+
+    @contextmanager
+    def _warehouse_slot(self, warehouse: str, needed: bool):
+        """Queue for one of the warehouse's concurrency slots; yields the seconds spent queued"""
+        if not needed or not self.warehouse_concurrency:
+            yield 0.0
+            return
+        with self._lock:
+            slots = self._warehouse_slots.setdefault(
+                warehouse, threading.BoundedSemaphore(self.warehouse_concurrency))
+        started = time.monotonic()
+        slots.acquire()
+        try:
+            yield time.monotonic() - started
+        finally:
+            slots.release()
+
+    @contextmanager
+    def _table_lock(self, table: str, query_id: str):
+        """Hold the emulated table lock; yields the seconds spent waiting for it"""
+        if table is None or self.lock_mode == 'none':
+            yield 0.0
+            return
+        with self._lock:
+            state = self._table_locks.setdefault(table, {'cond': threading.Condition(self._lock),
+                                                         'holder': None, 'waiters': 0})
+            started = time.monotonic()
+            if state['holder'] is not None:
+                if state['waiters'] >= self.max_lock_waiters:
+                    raise LocalBackendError(
+                        f"000625 (57014): Statement '{query_id}' was aborted because the number of waiters "
+                        f"for the lock on table '{table}' exceeds the {self.max_lock_waiters} statements limit; "
+                        f"the table is locked by statement '{state['holder']}'.")
+                state['waiters'] += 1
+                try:
+                    deadline = started + self.lock_timeout
+                    while state['holder'] is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise LocalBackendError(
+                                f"000625 (57014): Statement '{state['holder']}' has locked table '{table}' and "
+                                f"this lock has not yet been released. Your statement '{query_id}' was aborted "
+                                f"after a lock wait of {self.lock_timeout}s (LOCK_TIMEOUT).")
+                        state['cond'].wait(remaining)
+                finally:
+                    state['waiters'] -= 1
+            state['holder'] = query_id
+        try:
+            yield time.monotonic() - started
+        finally:
+            with self._lock:
+                state['holder'] = None
+                state['cond'].notify()
+
+    def _execute(self, conn: LocalConnection, query_id: str, command: str, params, statement_params: Dict) -> Dict:
+        template = command.strip().rstrip(';').strip()
+        # The text is compiled (and logged) with its placeholders; IDENTIFIER(?) names are bound here
+        text, params = _resolve_identifiers(template, params)
+        statement_type = (text.split(None, 1) or [''])[0].upper()
+        cancel_event = threading.Event()
+        with self._lock:
+            self._running[query_id] = (conn, cancel_event)
+        entry = {
+            'query_id': query_id,
+            'session_id': conn.session_id,
+            'warehouse': conn.warehouse,
+            'query_tag': statement_params.get('QUERY_TAG'),
+            'statement_type': statement_type,
+            'query_text': template,
+            'start_time': datetime.now(timezone.utc),
+            'compilation_seconds': 0.0,
+            'provisioning_seconds': 0.0,
+            'queued_seconds': 0.0,
+            'lock_wait_seconds': 0.0,
+            'bytes_scanned': 0,
+            'rows': None,
+            'status': 'SUCCESS',
+            'error': None
+        }
+        if self.track_bytes_scanned and statement_type in _WAREHOUSE_STATEMENTS:
+            # Measured on the data as it is before the statement changes it
+            entry['bytes_scanned'] = (self.scan_stats(conn, _inline_params(text, params)) or {}).get(
+                'bytesAssigned', 0)
+        started = time.monotonic()
+        finished = None
+        try:
+            # Compilation happens before the statement needs a warehouse
+            entry['compilation_seconds'] = self._compile_seconds(template)
+            if cancel_event.wait(entry['compilation_seconds']):
+                raise LocalBackendError(f"000604 (57014): SQL execution canceled (statement '{query_id}')")
+            if statement_type in _WAREHOUSE_STATEMENTS:
+                # AUTO_RESUME: the first statement on a suspended warehouse waits for it to start
+                entry['provisioning_seconds'] = self._start_warehouse(conn.warehouse)
+                if cancel_event.wait(entry['provisioning_seconds']):
+                    raise LocalBackendError(f"000604 (57014): SQL execution canceled (statement '{query_id}')")
+            with self._warehouse_slot(conn.warehouse, statement_type in _WAREHOUSE_STATEMENTS) as queued:
+                entry['queued_seconds'] = queued
+                with self._table_lock(conn._locked_table(statement_type, text), query_id) as lock_wait:
+                    entry['lock_wait_seconds'] = lock_wait
+                    # The statement's simulated run time is spent holding its slot and lock
+                    if cancel_event.wait(self._statement_latency(text)):
+                        raise LocalBackendError(f"000604 (57014): SQL execution canceled (statement '{query_id}')")
+                    result = conn._dispatch(text, params)
+            entry['rows'] = result['rowcount']
+            finished = result
+            return result
+        except Exception as e:
+            entry['status'] = 'FAILED_WITH_ERROR'
+            entry['error'] = str(e)
+            if cancel_event.is_set():
+                raise LocalBackendError(f"000604 (57014): SQL execution canceled (statement '{query_id}')") from e
+            if isinstance(e, sqlite3.Error):
+                raise LocalBackendError(f"001003 (42000): SQL compilation error: {str(e)}") from e
+            raise
+        finally:
+            entry['elapsed_seconds'] = time.monotonic() - started
+            entry['end_time'] = datetime.now(timezone.utc)
+            with self._lock:
+                self._running.pop(query_id, None)
+                self.query_log.append(entry)
+                self._finished[query_id] = (entry['status'], finished, entry.get('error'))
+                if len(self._finished) > _FINISHED_QUERIES:
+                    self._finished.popitem(last=False)
+
+    def cancel(self, query_id: str) -> bool:
+        """SYSTEM$CANCEL_QUERY: stop a running statement (its latency wait or its SQLite step)"""
+        with self._lock:
+            running = self._running.get(query_id)
+        if running is None:
+            return False
+        conn, cancel_event = running
+        cancel_event.set()
+        conn._db.interrupt()
+        return True
+
+    # --- async queries -------------------------------------------------
+
+    def _start_async(self, query_id: str, run: Callable[[], Dict]):
+        state = {'status': 'RUNNING', 'result': None, 'error': None, 'done': threading.Event()}
+        with self._lock:
+            self._async[query_id] = state
+
+        def worker():
+            try:
+                state['result'] = run()
+                state['status'] = 'SUCCESS'
+            except Exception as e:
+                state['error'] = e
+                state['status'] = 'ABORTED' if '000604' in str(e) else 'FAILED_WITH_ERROR'
+            finally:
+                state['done'].set()
+
+        threading.Thread(target=worker, name=f"async-{query_id}", daemon=True).start()
+
+    def _async_status(self, query_id: str) -> str:
+        """Status of an async statement, or of a recent synchronous one (as Snowflake keeps for any query id)"""
+        with self._lock:
+            state = self._async.get(query_id)
+            finished = self._finished.get(query_id)
+        if state is not None:
+            return state['status']
+        if finished is not None:
+            return 'ABORTED' if finished[0] != 'SUCCESS' and '000604' in (finished[2] or '') else finished[0]
+        with self._lock:
+            if query_id in self._running:
+                return 'RUNNING'
+        raise LocalBackendError(f"000709 (02000): Statement {query_id} not found")
+
+    def _wait_for(self, query_id: str) -> Dict:
+        with self._lock:
+            state = self._async.get(query_id)
+            finished = self._finished.get(query_id)
+        if state is None and finished is not None:
+            status, result, error = finished
+            if status != 'SUCCESS':
+                raise LocalBackendError(error)
+            return result
+        if state is None:
+            raise LocalBackendError(f"000709 (02000): Statement {query_id} not found")
+        state['done'].wait()
+        if state['error'] is not None:
+            raise state['error']
+        return state['result']
+
+    # --- data and stats ------------------------------------------------
+
+    def micro_partition_stats(self, conn: LocalConnection, table: str, where: str = None) -> Dict:
+        """partitionsTotal / partitionsAssigned / bytesAssigned for a scan of table filtered by where"""
+        name = table.split('.')[-1].strip('"')
+        schema = 'temp' if conn._is_temp_table(name) else 'main'
+        size = self.rows_per_micro_partition
+        with conn._db_lock:
+            total = conn._db.execute(f'SELECT COALESCE((MAX(rowid) - 1) / {size} + 1, 0) FROM {schema}."{name}"').fetchone()[0]
+            assigned = total
+            if where:
+                assigned = conn._db.execute(
+                    f'SELECT COUNT(DISTINCT (rowid - 1) / {size}) FROM {schema}."{name}" WHERE {conn._translate(where)}'
+                ).fetchone()[0]
+        bytes_per_partition = conn._table_bytes(name, schema) / total if total else 0
+        return {
+            'partitionsTotal': total,
+            'partitionsAssigned': assigned,
+            'bytesAssigned': int(assigned * bytes_per_partition)
+        }
+
+    def scan_stats(self, conn: LocalConnection, text: str) -> Dict:
+        """
+        partitionsTotal / partitionsAssigned / bytesAssigned summed over every table a statement reads
+
+        Each table read is pruned only by WHERE / ON terms on that table alone (alias.col, or bare
+        columns when it is the only table read), like Snowflake's compile-time pruning; join terms
+        and subqueries prune nothing. None when the statement reads no table.
+        """
+        conjuncts = [c for clause in condition_clauses(text) for c in split_conjuncts(clause)
+                     if not re.search(r"\bSELECT\b", mask_literals(c), re.IGNORECASE)]
+        references = table_references(text)
+        totals = None
+        for reference in references:
+            name = reference['table'].split('.')[-1].strip('"')
+            if reference['table'].lower().startswith('information_schema.') or \
+                    not any(n.lower() == name.lower() for n, _ in conn._table_names(name)):
+                continue
+            alias = (reference['alias'] or name).lower()
+            terms = []
+            for conjunct in conjuncts:
+                qualifiers = {q.lower() for q in re.findall(r"\b([A-Za-z_]\w*)\s*\.\s*[A-Za-z_\"]",
+                                                            mask_literals(conjunct))}
+                if qualifiers - {alias, name.lower()} or (not qualifiers and len(references) > 1):
+                    continue
+                terms.append(re.sub(rf"\b(?:{re.escape(alias)}|{re.escape(name)})\s*\.\s*", '', conjunct,
+                                    flags=re.IGNORECASE))
+            stats = None
+            try:
+                stats = self.micro_partition_stats(conn, name, ' AND '.join(f"({t})" for t in terms) or None)
+            except sqlite3.Error:
+                # Some terms name another table's columns; keep the ones this table can evaluate
+                usable = []
+                for term in terms:
+                    try:
+                        self.micro_partition_stats(conn, name, term)
+                        usable.append(term)
+                    except sqlite3.Error:
+                        pass
+                stats = self.micro_partition_stats(conn, name, ' AND '.join(f"({t})" for t in usable) or None)
+            totals = {k: (totals or {}).get(k, 0) + v for k, v in stats.items()}
+        return totals
+
+    def create_history_table(self,
+                             table: str = 'history',
+                             rows: int = 1000000,
+                             clustered: bool = True,
+                             start: str = '2022-01-01',
+                             days: int = 730,
+                             batch_rows: int = 1000000) -> Dict:
+        """
+        Generate a synthetic history-shaped table
+
+        Columns: search_id (unique), search_dt (spread over `days` from `start`),
+        effective_date, status ('PENDING' for 1 row in 5), category, amount, col1.
+
+        clustered=True writes rows in search_dt order and records CLUSTER BY (search_dt),
+        so range partitions prune; False scatters search_dt over the whole table.
+        An index on search_id stands in for Snowflake's hash join in the merges, and for a
+        clustered table an index on search_dt stands in for micro-partition pruning.
+        """
+        start_epoch = int(_to_datetime(start).timestamp())
+        step = days * 86400 / max(rows, 1)
+        # Multiplying by a large prime permutes 0..rows-1, scattering search_dt
+        position = 'i' if clustered else f'(i * 2654435761) % {rows}'
+        started = time.monotonic()
+        with sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None) as db:
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute(f'DROP TABLE IF EXISTS "{table}"')
+            db.execute(f"""
+                CREATE TABLE "{table}" (
+                    search_id INTEGER NOT NULL,
+                    search_dt TIMESTAMP_NTZ NOT NULL,
+                    effective_date DATE,
+                    status VARCHAR(16),
+                    category VARCHAR(16),
+                    amount NUMBER(12, 2),
+                    col1 VARCHAR(32)
+                )
+                """)
+            for low in range(0, rows, batch_rows):
+                high = min(low + batch_rows, rows)
+                db.execute("BEGIN")
+                db.execute(f"""
+                    INSERT INTO "{table}"
+                    WITH RECURSIVE seq(i) AS (SELECT {low} UNION ALL SELECT i + 1 FROM seq WHERE i < {high - 1})
+                    SELECT
+                        i,
+                        strftime('%Y-%m-%d %H:%M:%f', {start_epoch} + {position} * {step}, 'unixepoch'),
+                        date({start_epoch} + {position} * {step}, 'unixepoch'),
+                        CASE WHEN i % 5 = 0 THEN 'PENDING' ELSE 'PROCESSED' END,
+                        CASE i % 3 WHEN 0 THEN 'STANDARD' WHEN 1 THEN 'PREMIUM' ELSE 'BASIC' END,
+                        (i % 100000) / 100.0,
+                        'value_' || (i % 100)
+                    FROM seq
+                    """)
+                db.execute("COMMIT")
+            db.execute(f'CREATE UNIQUE INDEX "{table}_search_id" ON "{table}" (search_id)')
+            if clustered:
+                db.execute(f'CREATE INDEX "{table}_search_dt" ON "{table}" (search_dt)')
+            db.execute("ANALYZE")
+        if clustered:
+            self.set_cluster_by(table, 'search_dt')
+        else:
+            self.cluster_keys.pop(table.upper(), None)
+        elapsed = time.monotonic() - started
+        self.logger.info(f"Generated {rows} rows in {table} in {elapsed:.1f}s (clustered={clustered})")
+        return {'table': table, 'rows': rows, 'clustered': clustered, 'seconds': elapsed}
+
+
+# Example usage
+if __name__ == "__main__":
+    from simple_parallel_update import SimpleParallelUpdater
+
+    backend = LocalBackend(latency=0.05, connect_latency=0.2)
+    backend.create_history_table('history', rows=100000)
+
+    updater = SimpleParallelUpdater({'account': 'local', 'user': 'local'},
+                                    pool_options={'connect': backend.connect})
+    results = updater.parallel_update(
+        "UPDATE history SET status = 'PROCESSED' WHERE status = 'PENDING'",
+        num_partitions=4,
+        partition_mode='range'
+    )
+    print(f"Total rows updated: {sum(r['rows_updated'] for r in results if r['status'] == 'success')}")
+    for entry in backend.query_log[-4:]:
+        print(f"{entry['query_id']}: {entry['elapsed_seconds']:.3f}s, lock wait {entry['lock_wait_seconds']:.3f}s")
+    backend.close()
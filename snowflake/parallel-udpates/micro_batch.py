@@ -0,0 +1,124 @@
+from typing import Dict, List
+import logging
+import math
+
+from partition_planner import PartitionPlanner
+from update_statement import parse_update
+
+
+class MicroBatchPolicy:
+    def __init__(self,
+                 batch_rows: int = None,
+                 batch_bytes: int = None,
+                 pause_seconds: float = 0.0,
+                 max_rows_per_second: float = None,
+                 max_batches: int = 256,
+                 planner: PartitionPlanner = None):
+        """
+        Split each partition's UPDATE into key-range batches that commit one by one
+
+        One UPDATE per partition holds the table lock for the whole partition, rewrites every
+        micro-partition it touches in one transaction and rolls all of it back on failure. Batches
+        bound all three: each is its own short transaction, other writers queue for at most one
+        batch, and a failed batch leaves the earlier ones committed (and journaled, so resume
+        continues from the failed batch rather than the start of the partition).
+
+        Args:
+            batch_rows: Target rows per batch, counted with the UPDATE's own WHERE
+            batch_bytes: Target stored bytes per batch (rows times the table's average row size);
+                         with both budgets, the smaller batch wins
+            pause_seconds: Sleep after each batch, giving queued readers and writers a turn
+            max_rows_per_second: Also sleep long enough to keep each partition under this rate
+            max_batches: Upper bound on batches per partition, whatever the budgets say
+            planner: Splits a partition into key ranges (APPROX_PERCENTILE over its range_column);
+                     the updater's planner when omitted
+        """
+        if not batch_rows and not batch_bytes:
+            raise ValueError("MicroBatchPolicy needs batch_rows or batch_bytes")
+        if max_batches < 1:
+            raise ValueError(f"max_batches must be at least 1: {max_batches}")
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.pause_seconds = pause_seconds
+        self.max_rows_per_second = max_rows_per_second
+        self.max_batches = max_batches
+        self.planner = planner
+        self.logger = logging.getLogger(__name__)
+
+    def _scalar(self, conn, sql: str):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return row[0] if row else None
+
+    def avg_row_bytes(self, conn, table_name: str) -> float:
+        """Average stored bytes per row of the table, from INFORMATION_SCHEMA (0 if unknown)"""
+        try:
+            value = self._scalar(conn, f"""
+                SELECT BYTES / NULLIF(ROW_COUNT, 0)
+                FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = UPPER('{table_name.split('.')[-1]}')
+                """)
+        except Exception as e:
+            self.logger.warning(f"Could not read the row size of {table_name}: {str(e)}")
+            return 0.0
+        return float(value) if value is not None else 0.0
+
+    def num_batches(self, rows: int, avg_row_bytes: float = 0.0) -> int:
+        """Batches needed to keep each one within the row and byte budgets"""
+        needed = 1
+        if self.batch_rows:
+            needed = max(needed, math.ceil(rows / self.batch_rows))
+        if self.batch_bytes and avg_row_bytes:
+            needed = max(needed, math.ceil(rows * avg_row_bytes / self.batch_bytes))
+        return min(needed, self.max_batches)
+
+    def plan(self, conn, update_sql: str, predicate: str, planner: PartitionPlanner) -> List[str]:
+        """
+        The batch predicates of one partition, each the partition predicate ANDed with a key range
+
+        Raises:
+            ValueError: If the UPDATE sets the batch key column; a row moved into a later batch's
+                        range would be updated again
+        """
+        planner = self.planner or planner
+        statement = parse_update(update_sql)
+        if planner.range_column.lower() in (c.lower() for c, _ in statement['assignments']):
+            raise ValueError(f"The update sets {planner.range_column}, so it can't be the micro-batch key")
+        table = statement['table'] + (f" {statement['alias']}" if statement['alias'] else '')
+        # With a FROM, the WHERE joins other tables; count and split on the partition alone
+        where = f"({statement['where']}) AND ({predicate})" if statement['where'] and not statement['from'] \
+            else predicate
+        rows = self._scalar(conn, f"SELECT COUNT(*) FROM {table} WHERE {where}") or 0
+        avg_bytes = self.avg_row_bytes(conn, statement['table']) if self.batch_bytes else 0.0
+        needed = self.num_batches(rows, avg_bytes)
+        if needed <= 1:
+            return [predicate]
+        boundaries = planner.sample_boundaries(conn, table, needed, where=where)
+        batches = [f"({predicate}) AND ({p})" for p in planner.range_predicates(boundaries)] \
+            if boundaries else [predicate]
+        self.logger.info(f"Partition of {rows} rows split into {len(batches)} batches on {planner.range_column}")
+        return batches
+
+    def pause(self, rows: int, elapsed: float) -> float:
+        """Seconds to wait after a batch of rows that took elapsed seconds"""
+        wait = self.pause_seconds
+        if self.max_rows_per_second:
+            wait = max(wait, rows / self.max_rows_per_second - elapsed)
+        return max(wait, 0.0)
+
+    @staticmethod
+    def batch_result(batch_id: int, rows: int, seconds: float, attempts: int, query_id: str = None) -> Dict:
+        """One committed batch, with its rows per second"""
+        return {
+            'batch_id': batch_id,
+            'status': 'success',
+            'rows_updated': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else None,
+            'attempts': attempts,
+            'query_id': query_id
+        }
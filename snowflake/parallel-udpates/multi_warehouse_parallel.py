@@ -1,66 +1,169 @@
-import snowflake.connector
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 import logging
 
+from chunk_scheduler import ChunkScheduler
+from connection_pool import get_pool
+from cost_estimator import CostEstimator
+from partition_planner import PartitionPlanner, table_from_update
+from query_profiler import tag_params
+from run_journal import RetryPolicy, RunJournal, execute_tracked, new_run_id
+from sql_template import SqlTemplate, bind_connection_params
+from staged_load import StagedLoader
+from update_fusion import fuse_updates
+from warehouse_lifecycle import WarehouseLifecycle
+
 
 class MultiWarehouseUpdater:
-    def __init__(self, base_connection_params: Dict):
+    def __init__(self,
+                 base_connection_params: Dict,
+                 pool_options: Dict = None,
+                 planner: PartitionPlanner = None,
+                 journal: RunJournal = None,
+                 retry_policy: RetryPolicy = None,
+                 cost_estimator: CostEstimator = None,
+                 lifecycle: WarehouseLifecycle = None):
         """
         Initialize with base Snowflake connection parameters
         The warehouse parameter will be overridden per partition if specified
+
+        Sessions come from one shared pool per warehouse, configured by pool_options
+        (min_size, max_size, max_idle_seconds, ...) on first use.
+        planner decides how the table is split (range on search_dt by default).
+        journal, if given, records every run so failed partitions can be resumed;
+        retry_policy controls backoff for transient errors (lock waits, suspended warehouses).
+        cost_estimator is used by dry runs.
+        lifecycle, if given, resumes and sizes every warehouse of a run while it is planned, and
+        suspends / sizes them back when the run ends or fails; its report is lifecycle.reports[run_id],
+        and is returned with the run's results.
+        Partition bounds are sent as bind values, so sessions use paramstyle='qmark' unless
+        base_connection_params sets another paramstyle.
         """
-        self.base_connection_params = base_connection_params
+        self.base_connection_params = bind_connection_params(base_connection_params)
+        self.pool_options = pool_options or {}
+        self.planner = planner or PartitionPlanner()
+        self.journal = journal
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cost_estimator = cost_estimator or CostEstimator()
+        self.lifecycle = lifecycle
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
+    def _plan_partitions(self, update_sql: str, num_partitions: int, partition_mode: str,
+                         table_name: str = None, warehouse: str = None) -> Dict:
+        """Sample the key distribution once and return the partition predicates"""
+        with get_pool(self.base_connection_params, warehouse, **self.pool_options).connection() as conn:
+            return self.planner.plan(conn, table_name or table_from_update(update_sql),
+                                     num_partitions, mode=partition_mode)
+
+    def _partitioned_sql(self, update_sql: str, predicate: str) -> Tuple[str, List]:
+        """Statement text and bind values for one partition; the text is shared by same-shaped partitions"""
+        return SqlTemplate.parse(update_sql).render(predicate, paramstyle=self.base_connection_params['paramstyle'])
+
+    def _start_warehouses(self, warehouses: List[str], table_name: str, run_id: str):
+        """Start resuming a run's warehouses (None is the connection's default) if there is a lifecycle"""
+        if self.lifecycle:
+            default = self.base_connection_params.get('warehouse')
+            self.lifecycle.start([w or default for w in warehouses], {'table': table_name}, run_id)
+
+    def _stop_warehouses(self, run_id: str) -> Dict:
+        if not self.lifecycle:
+            return None
+        report = self.lifecycle.stop(run_id)
+        self.logger.info(f"Run {run_id}: warehouses ready after {report['startup_seconds']:.1f}s, "
+                         f"~{report['estimated_credits']:.3f} credits")
+        return report
+
+    @staticmethod
+    def _with_lifecycle_report(results: List[Dict], warehouse_report: Dict) -> List[Dict]:
+        """Attach the run's lifecycle report (startup seconds, estimated credits) to every partition result"""
+        if warehouse_report:
+            for result in results:
+                result['warehouse_lifecycle'] = warehouse_report
+        return results
+
     def _execute_update(self,
                         partition_id: int,
                         update_sql: str,
-                        num_partitions: int,
-                        warehouse: str = None) -> Dict:
-        """Execute update for a single partition using specified warehouse"""
-        # Create connection params with specific warehouse if provided
-        conn_params = self.base_connection_params.copy()
-        if warehouse:
-            conn_params['warehouse'] = warehouse
-
-        conn = snowflake.connector.connect(**conn_params)
-        try:
-            cursor = conn.cursor()
-
-            # Use specified warehouse
-            if warehouse:
-                cursor.execute(f"USE WAREHOUSE {warehouse}")
-
-            partitioned_sql = f"""
-                {update_sql}
-                AND MOD(ABS(HASH(CONCAT(search_id, 
-                    TO_CHAR(search_dt, 'YYYY-MM-DD HH24:MI:SS')))), 
-                    {num_partitions}) = {partition_id}
-            """
-            cursor.execute(partitioned_sql)
-            return {
+                        predicate: str,
+                        warehouse: str,
+                        run_id: str) -> Dict:
+        """Execute update for a single partition using specified warehouse, retrying transient errors"""
+        # Pooled sessions are opened on their warehouse, so no USE WAREHOUSE round trip is needed
+        pool = get_pool(self.base_connection_params, warehouse, **self.pool_options)
+        # Journaled as the warehouse the statement actually ran on, so resume() goes back to it
+        warehouse = warehouse or pool.warehouse
+        sql, params = self._partitioned_sql(update_sql, predicate)
+
+        def run_statement():
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                execute_tracked(cursor, sql, params, _statement_params=tag_params(run_id, partition_id, warehouse))
+                return cursor.rowcount, cursor.sfqid
+
+        def recover(query_id):
+            with pool.connection() as conn:
+                status, row = self.retry_policy.settle(conn, query_id)
+            return status, ((row[0] if row else 0), query_id)
+
+        outcome, attempts, error = self.retry_policy.run(
+            run_statement, f"Partition {partition_id} on warehouse {warehouse}", recover=recover)
+        if error is None:
+            rows_updated, query_id = outcome
+            result = {
                 'partition_id': partition_id,
-                'warehouse': warehouse or conn_params.get('warehouse', 'default'),
-                'rows_updated': cursor.rowcount,
-                'status': 'success'
+                'warehouse': warehouse,
+                'rows_updated': rows_updated,
+                'status': 'success',
+                'attempts': attempts,
+                'query_id': query_id
             }
-        except Exception as e:
-            self.logger.error(f"Partition {partition_id} failed on warehouse {warehouse}: {str(e)}")
-            return {
+        else:
+            self.logger.error(f"Partition {partition_id} failed on warehouse {warehouse}: {str(error)}")
+            result = {
                 'partition_id': partition_id,
                 'warehouse': warehouse,
                 'status': 'error',
-                'error': str(e)
+                'error': str(error),
+                'attempts': attempts
             }
-        finally:
-            conn.close()
+        if self.journal:
+            self.journal.record_partition(run_id, result)
+        result['run_id'] = run_id
+        return result
+
+    def _run_partitions(self,
+                        update_sql: str,
+                        partitions: List[Tuple[int, str, str]],
+                        run_id: str) -> List[Dict]:
+        """Run (partition_id, predicate, warehouse) triples concurrently"""
+        if not partitions:
+            return []
+        with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+            futures = [
+                executor.submit(
+                    self._execute_update,
+                    partition_id,
+                    update_sql,
+                    predicate,
+                    warehouse,
+                    run_id
+                )
+                for partition_id, predicate, warehouse in partitions
+            ]
+            results = [future.result() for future in as_completed(futures)]
+        if self.journal:
+            status = self.journal.finish_run(run_id)
+            self.logger.info(f"Run {run_id} is {status}")
+        return results
 
     def parallel_update(self,
                         update_sql: str,
                         num_partitions: int = 4,
-                        warehouses: Union[List[str], str] = None) -> List[Dict]:
+                        warehouses: Union[List[str], str] = None,
+                        partition_mode: str = 'auto',
+                        table_name: str = None,
+                        dry_run: bool = False) -> Union[List[Dict], Dict]:
         """
         Execute update in parallel across partitions using specified warehouses
 
@@ -70,6 +173,15 @@ class MultiWarehouseUpdater:
             warehouses: Either a list of warehouse names (one per partition)
                        or a single warehouse name to use for all partitions
                        If None, uses the warehouse from connection params
+            partition_mode: 'range' (prunable ranges on the planner's column), 'hash'
+                            (MOD(HASH), for unclustered tables) or 'auto'
+            table_name: Table to sample for range mode; parsed from update_sql if omitted
+            dry_run: Only EXPLAIN the partition statements and return the cost estimate
+                     instead of a list of partition results
+
+        Returns:
+            One result per partition; with a lifecycle, each carries the run's 'warehouse_lifecycle'
+            report (startup seconds and estimated credits), as chunked_update's report does
         """
         # Handle warehouse specification
         if isinstance(warehouses, str):
@@ -82,18 +194,157 @@ class MultiWarehouseUpdater:
         else:
             warehouse_list = [None] * num_partitions
 
-        with ThreadPoolExecutor(max_workers=num_partitions) as executor:
-            futures = [
-                executor.submit(
-                    self._execute_update,
-                    i,
-                    update_sql,
-                    num_partitions,
-                    warehouse_list[i]
-                )
-                for i in range(num_partitions)
-            ]
-            return [future.result() for future in as_completed(futures)]
+        if dry_run:
+            plan = self._plan_partitions(update_sql, num_partitions, partition_mode, table_name, warehouse_list[0])
+            with get_pool(self.base_connection_params, warehouse_list[0], **self.pool_options).connection() as conn:
+                return self.cost_estimator.estimate(
+                    conn, update_sql, [SqlTemplate.parse(update_sql).inline(p) for p in plan['predicates']],
+                    plan['mode'])
+
+        run_id = new_run_id()
+        # The warehouses resume while the key distribution is sampled
+        self._start_warehouses(warehouse_list, table_name or table_from_update(update_sql), run_id)
+        try:
+            # A skewed key can yield fewer ranges than requested; those run on the first warehouses
+            plan = self._plan_partitions(update_sql, num_partitions, partition_mode, table_name, warehouse_list[0])
+            predicates = plan['predicates']
+            warehouse_list = warehouse_list[:len(predicates)]
+            if self.journal:
+                self.journal.start_run('MultiWarehouseUpdater', update_sql, predicates, warehouse_list, run_id=run_id)
+            if self.lifecycle:
+                self.lifecycle.wait_ready(run_id)
+            results = self._run_partitions(update_sql, list(zip(range(len(predicates)), predicates, warehouse_list)),
+                                           run_id)
+        finally:
+            warehouse_report = self._stop_warehouses(run_id)
+        return self._with_lifecycle_report(results, warehouse_report)
+
+    def resume(self, run_id: str, warehouse: str = None) -> List[Dict]:
+        """
+        Re-execute only the partitions of a journaled run that are pending or failed, on their original warehouses
+
+        Args:
+            run_id: Run to resume
+            warehouse: Warehouse for partitions that have none recorded, e.g. chunks of a
+                       chunked_update that never started; defaults to the connection's warehouse
+
+        Raises:
+            ValueError: If there is no journal, or a partition has no warehouse to run on
+        """
+        if not self.journal:
+            raise ValueError("resume() needs the updater to be created with a journal")
+        run = self.journal.get_run(run_id)
+        warehouse = warehouse or self.base_connection_params.get('warehouse')
+        pending = [
+            (p['partition_id'], p['predicate'], p['warehouse'] or warehouse)
+            for p in run['partitions'] if p['status'] != 'success'
+        ]
+        unassigned = [p[0] for p in pending if not p[2]]
+        if unassigned:
+            raise ValueError(f"Run {run_id}: partitions {unassigned} have no recorded warehouse and the connection "
+                             f"params have none; pass resume(run_id, warehouse=...)")
+        self.logger.info(f"Resuming run {run_id}: {len(pending)} of {len(run['partitions'])} partitions left")
+        if not pending:
+            return []
+        self._start_warehouses([p[2] for p in pending], table_from_update(run['update_sql']), run_id)
+        try:
+            if self.lifecycle:
+                self.lifecycle.wait_ready(run_id)
+            results = self._run_partitions(run['update_sql'], pending, run_id)
+        finally:
+            warehouse_report = self._stop_warehouses(run_id)
+        return self._with_lifecycle_report(results, warehouse_report)
+
+    def batch_update(self,
+                     update_sqls: List[str],
+                     num_partitions: int = 4,
+                     warehouses: Union[List[str], str] = None,
+                     partition_mode: str = 'auto') -> List[Dict]:
+        """
+        Execute several independent UPDATEs on one table as a single fused UPDATE per partition
+
+        The statements are rewritten into CASE WHEN column expressions, so the table is scanned
+        num_partitions times in total rather than once per statement per partition.
+        Raises FusionConflictError if the statements set the same column or read each other's targets.
+        """
+        return self.parallel_update(fuse_updates(update_sqls), num_partitions, warehouses, partition_mode)
+
+    def bulk_update(self,
+                    table_name: str,
+                    data,
+                    key_columns: List[str],
+                    update_columns: List[str] = None,
+                    insert_missing: bool = False,
+                    warehouse: str = None,
+                    **loader_options) -> Dict:
+        """
+        Apply values computed in Python (DataFrame, Arrow table or record batches) with one MERGE
+
+        The COPY and MERGE run on warehouse (default: the base connection's); one MERGE needs no
+        spreading across warehouses. loader_options are passed to StagedLoader.
+        """
+        loader = StagedLoader(self.base_connection_params, self.pool_options, warehouse=warehouse,
+                              retry_policy=self.retry_policy, **loader_options)
+        return loader.load_and_merge(table_name, data, key_columns, update_columns, insert_missing)
+
+    def chunked_update(self,
+                       update_sql: str,
+                       warehouses: Union[Dict[str, int], List[str], str],
+                       num_chunks: int = 64,
+                       partition_mode: str = 'auto',
+                       table_name: str = None) -> Dict:
+        """
+        Execute update as many small chunks pulled from a shared queue by every warehouse
+
+        Unlike parallel_update, the number of chunks is independent of the number of
+        warehouses, and a chunk is not pinned to a warehouse: whichever worker is free
+        takes the next one, so one slow chunk no longer leaves other warehouses idle.
+
+        Args:
+            update_sql: SQL UPDATE statement (without WHERE clause)
+            warehouses: {warehouse: concurrent statements}, a list of warehouses
+                        (4 concurrent statements each) or a single warehouse
+            num_chunks: Number of chunks to split the table into
+            partition_mode: 'range', 'hash' or 'auto', as for parallel_update
+            table_name: Table to sample for range mode; parsed from update_sql if omitted
+
+        Returns:
+            Dictionary with run_id, per-chunk results, per-warehouse chunk counts and elapsed time,
+            and with a lifecycle, 'warehouse_lifecycle' (startup seconds and estimated credits)
+        """
+        scheduler = ChunkScheduler(warehouses)
+        # Size each warehouse's pool to its worker count before the workers start borrowing;
+        # a pool already open from an earlier run is grown to fit
+        for warehouse, concurrency in scheduler.warehouses.items():
+            get_pool(self.base_connection_params, warehouse,
+                     **{**self.pool_options, 'max_size': max(concurrency, self.pool_options.get('max_size', 1))})
+
+        first_warehouse = next(iter(scheduler.warehouses))
+        run_id = new_run_id()
+        self._start_warehouses(list(scheduler.warehouses), table_name or table_from_update(update_sql), run_id)
+        try:
+            predicates = self._plan_partitions(update_sql, num_chunks, partition_mode,
+                                               table_name, first_warehouse)['predicates']
+            if self.journal:
+                # Chunks aren't pinned to a warehouse; each one's is journaled when it runs, and resume()
+                # puts chunks that never ran on its warehouse argument
+                self.journal.start_run('MultiWarehouseUpdater', update_sql, predicates, run_id=run_id)
+            if self.lifecycle:
+                self.lifecycle.wait_ready(run_id)
+            self.logger.info(f"Running {len(predicates)} chunks on {len(scheduler.warehouses)} warehouses")
+            report = scheduler.run(
+                predicates,
+                lambda chunk_id, predicate, warehouse: self._execute_update(
+                    chunk_id, update_sql, predicate, warehouse, run_id)
+            )
+            if self.journal:
+                self.journal.finish_run(run_id)
+        finally:
+            warehouse_report = self._stop_warehouses(run_id)
+        report['run_id'] = run_id
+        if warehouse_report:
+            report['warehouse_lifecycle'] = warehouse_report
+        return report
 
 
 # Example usage
@@ -176,3 +427,29 @@ if __name__ == "__main__":
         )
 
         # Process results...
+
+    # Example 4: Independent updates fused into one scan per partition
+    results = updater.batch_update(
+        [
+            "UPDATE your_table SET status = 'PROCESSED' WHERE status = 'PENDING'",
+            "UPDATE your_table SET amount = amount * 1.1 WHERE category = 'STANDARD'"
+        ],
+        num_partitions=4,
+        warehouses='LARGE_WAREHOUSE'
+    )
+
+    # Example 5: 64 chunks shared by two warehouses, whichever is free takes the next chunk
+    report = updater.chunked_update(
+        update_sql=update_sql,
+        warehouses={'WH_LARGE': 8, 'WH_MEDIUM': 4},
+        num_chunks=64
+    )
+    for wh, stats in report['warehouses'].items():
+        print(f"{wh}: {stats['chunks']} chunks, {stats['busy_seconds']:.1f}s busy")
+
+    # Example 6: Warehouses resumed together before the run, sized for it and suspended after
+    lifecycle = WarehouseLifecycle(conn_params, size_policy={'WH1': 'LARGE', 'WH2': 'LARGE'})
+    warm_updater = MultiWarehouseUpdater(conn_params, lifecycle=lifecycle)
+    results = warm_updater.parallel_update(update_sql, num_partitions=4, warehouses=['WH1', 'WH2', 'WH1', 'WH2'])
+    report = results[0]['warehouse_lifecycle']
+    print(f"Warehouses ready after {report['startup_seconds']:.1f}s, ~{report['estimated_credits']:.2f} credits")
@@ -1,162 +1,457 @@
-import snowflake.connector
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import logging
+import time
 import uuid
 
+from connection_pool import get_pool
+from cost_estimator import CostEstimator
+from partition_planner import PartitionPlanner
+from query_profiler import tag_params
+from run_journal import RetryPolicy, RunJournal, execute_tracked, new_run_id
+from sql_template import SqlTemplate, bind_connection_params, bind_predicate
+from staged_load import StagedLoader
+from update_statement import set_columns
+from watermark import Watermark
+
 
 class TempTableParallelUpdater:
-    def __init__(self, connection_params: Dict):
-        self.connection_params = connection_params
+    KEY_COLUMNS = ('search_id', 'search_dt')
+    ORIG_HASH_COLUMN = '_orig_hash'
+
+    def __init__(self,
+                 connection_params: Dict,
+                 pool_options: Dict = None,
+                 planner: PartitionPlanner = None,
+                 journal: RunJournal = None,
+                 retry_policy: RetryPolicy = None,
+                 cost_estimator: CostEstimator = None):
+        # Partition bounds and temp table names are bind values; qmark unless the caller chose a paramstyle
+        self.connection_params = bind_connection_params(connection_params)
+        self.pool_options = pool_options or {}
+        self.planner = planner or PartitionPlanner()
+        self.journal = journal
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cost_estimator = cost_estimator or CostEstimator()
         self.session_id = str(uuid.uuid4())[:8]  # For unique temp table names
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-    def _execute_sql(self, sql: str) -> Dict:
-        """Execute a SQL statement and return results"""
-        conn = snowflake.connector.connect(**self.connection_params)
+    def _execute_sql(self, conn, sql: str, statement_params: Dict = None, params: List = None) -> Dict:
+        """Execute a SQL statement on the given session and return results"""
         try:
             cursor = conn.cursor()
-            cursor.execute(sql)
-            return {'status': 'success', 'rowcount': cursor.rowcount}
+            cursor.execute(sql, params, _statement_params=statement_params)
+            return {'status': 'success', 'rowcount': cursor.rowcount, 'query_id': cursor.sfqid}
         except Exception as e:
             self.logger.error(f"SQL execution failed: {str(e)}")
             return {'status': 'error', 'error': str(e)}
+
+    def _run_concurrently(self, conn, statements: List[str]) -> List[Dict]:
+        """Run independent statements at once, one cursor each on the session that owns the temp tables"""
+        with ThreadPoolExecutor(max_workers=max(len(statements), 1)) as executor:
+            return list(executor.map(lambda sql: self._execute_sql(conn, sql), statements))
+
+    def _table_columns(self, conn, table_name: str) -> List[str]:
+        """Column names of a table, in table order"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"DESC TABLE {table_name}")
+            return [row[0] for row in cursor]
         finally:
-            conn.close()
+            cursor.close()
 
-    def _create_temp_tables(self, table_name: str, num_partitions: int) -> bool:
-        """Create temporary tables for each partition"""
+    def _tracked_columns(self, update_sql: str, columns: List[str]) -> List[str]:
+        """Non-key columns the UPDATE can change; all non-key columns if its SET list can't be parsed"""
+        non_key = [c for c in columns if c.lower() not in self.KEY_COLUMNS]
         try:
-            for i in range(num_partitions):
-                partition_sql = f"""
-                CREATE TEMPORARY TABLE tmp_{self.session_id}_p{i} AS
-                SELECT *
-                FROM {table_name}
-                WHERE MOD(ABS(HASH(CONCAT(search_id, 
-                      TO_CHAR(search_dt, 'YYYY-MM-DD HH24:MI:SS')))), 
-                      {num_partitions}) = {i}
-                """
-                result = self._execute_sql(partition_sql)
-                if result['status'] == 'error':
-                    self._cleanup_temp_tables(num_partitions)
-                    return False
+            targets = {c.strip('"').lower() for c in set_columns(update_sql)}
+        except ValueError as e:
+            self.logger.warning(f"Tracking every column, could not parse SET list: {str(e)}")
+            return non_key
+        if targets & set(self.KEY_COLUMNS):
+            self.logger.warning(f"UPDATE assigns merge key columns {self.KEY_COLUMNS}; those changes are not merged")
+        return [c for c in non_key if c.lower() in targets] or non_key
+
+    def _create_temp_tables(self, conn, table_name: str, partitions: List[Tuple[int, str]],
+                            tracked_columns: List[str], run_id: str, stage_filter: str = None) -> bool:
+        """
+        Create temporary tables for each partition
+
+        The empty tables are created concurrently, then filled by a single INSERT FIRST
+        so the source table is scanned once instead of once per partition. Each row also
+        stores a hash of its tracked columns so the merge can skip rows the update left alone.
+        stage_filter (an incremental run's window) becomes the scan's WHERE, so it can prune.
+        """
+        partition_ids = [i for i, _ in partitions]
+        try:
+            create_results = self._run_concurrently(conn, [
+                f"CREATE TEMPORARY TABLE tmp_{self.session_id}_p{i} LIKE {table_name}"
+                for i in partition_ids
+            ])
+            if not any(r['status'] == 'error' for r in create_results):
+                create_results = self._run_concurrently(conn, [
+                    f"ALTER TABLE tmp_{self.session_id}_p{i} ADD COLUMN {self.ORIG_HASH_COLUMN} NUMBER(19, 0)"
+                    for i in partition_ids
+                ])
+            if any(r['status'] == 'error' for r in create_results):
+                self._cleanup_temp_tables(conn, partition_ids)
+                return False
+
+            # Range bounds are bind values, so reruns with the same partition shapes reuse the text
+            bound = [bind_predicate(predicate) for _, predicate in partitions]
+            when_clauses = "\n".join(
+                f"                WHEN {text} THEN INTO tmp_{self.session_id}_p{i}"
+                for (i, _), (text, _) in zip(partitions, bound)
+            )
+            where_clause = ''
+            if stage_filter:
+                # Bound after the WHEN values, matching the order of the placeholders in the text
+                filter_text, filter_values = bind_predicate(stage_filter)
+                where_clause = f"\n                WHERE {filter_text}"
+                bound.append(('', filter_values))
+            stage_sql = SqlTemplate.render_text(f"""
+                INSERT FIRST
+{when_clauses}
+                SELECT *, HASH({', '.join(tracked_columns)})
+                FROM {table_name}{where_clause}
+                """, self.connection_params['paramstyle'])
+            result = self._execute_sql(conn, stage_sql, tag_params(run_id, phase='stage'),
+                                       [value for _, values in bound for value in values])
+            if result['status'] == 'error':
+                self._cleanup_temp_tables(conn, partition_ids)
+                return False
             return True
         except Exception as e:
             self.logger.error(f"Failed to create temp tables: {str(e)}")
-            self._cleanup_temp_tables(num_partitions)
+            self._cleanup_temp_tables(conn, partition_ids)
             return False
 
-    def _update_partition(self, partition_id: int, update_sql: str) -> Dict:
-        """Execute update on a single partition's temp table"""
-        conn = snowflake.connector.connect(**self.connection_params)
-        try:
+    def _update_partition(self, conn, partition_id: int, update_sql: str, run_id: str) -> Dict:
+        """Execute update on a single partition's temp table, retrying transient errors"""
+        def run_statement():
+            # Each partition gets its own cursor on the shared session that owns the temp tables
             cursor = conn.cursor()
-            # Modify the update SQL to use temp table
-            temp_table = f"tmp_{self.session_id}_p{partition_id}"
-            modified_sql = update_sql.replace(
-                "your_table", temp_table
-            )
-            cursor.execute(modified_sql)
+            # The statement's own target becomes IDENTIFIER(?), bound to this partition's temp table
+            sql, params = SqlTemplate.parse(update_sql).render(
+                table=f"tmp_{self.session_id}_p{partition_id}", paramstyle=self.connection_params['paramstyle'])
+            execute_tracked(cursor, sql, params, _statement_params=tag_params(run_id, partition_id))
+            return cursor.rowcount, cursor.sfqid
+
+        def recover(query_id):
+            status, row = self.retry_policy.settle(conn, query_id)
+            return status, ((row[0] if row else 0), query_id)
+
+        outcome, attempts, error = self.retry_policy.run(run_statement, f"Partition {partition_id}", recover=recover)
+        if error is None:
+            rows_updated, query_id = outcome
             return {
                 'partition_id': partition_id,
-                'rows_updated': cursor.rowcount,
-                'status': 'success'
+                'rows_updated': rows_updated,
+                'status': 'success',
+                'attempts': attempts,
+                'query_id': query_id
             }
+        self.logger.error(f"Partition {partition_id} failed: {str(error)}")
+        return {
+            'partition_id': partition_id,
+            'status': 'error',
+            'error': str(error),
+            'attempts': attempts
+        }
+
+    def _avg_row_bytes(self, conn, table_name: str) -> float:
+        """Average stored bytes per row of the base table, from INFORMATION_SCHEMA"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT BYTES / NULLIF(ROW_COUNT, 0)
+                FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = UPPER('{table_name.split('.')[-1]}')
+                """)
+            row = cursor.fetchone()
+            return float(row[0]) if row and row[0] is not None else 0.0
         except Exception as e:
-            self.logger.error(f"Partition {partition_id} failed: {str(e)}")
-            return {
-                'partition_id': partition_id,
-                'status': 'error',
-                'error': str(e)
-            }
+            self.logger.warning(f"Could not read table size of {table_name}: {str(e)}")
+            return 0.0
         finally:
-            conn.close()
+            cursor.close()
+
+    def _merge_temp_tables(self, conn, table_name: str, partition_ids: List[int],
+                           tracked_columns: List[str], all_columns: List[str], run_id: str) -> Dict:
+        """
+        Merge changed rows from the temp tables back into the original table
 
-    def _merge_temp_tables(self, table_name: str, num_partitions: int) -> Dict:
-        """Merge all temp tables back into the original table"""
+        Only rows whose tracked-column hash differs from the staged one are carried,
+        and only the tracked columns are set, so untouched rows and columns aren't rewritten.
+        """
+        keys = ", ".join(self.KEY_COLUMNS)
+        tracked = ", ".join(tracked_columns)
+        changed_rows = ' UNION ALL '.join([
+            f"SELECT {keys}, {tracked} FROM tmp_{self.session_id}_p{i} "
+            f"WHERE HASH({tracked}) IS DISTINCT FROM {self.ORIG_HASH_COLUMN}"
+            for i in partition_ids
+        ])
+        merge_sql = self._merge_statement(table_name, changed_rows, tracked_columns)
+
+        # Row counts of temp tables come from metadata, so this doesn't scan them
+        cursor = conn.cursor()
+        cursor.execute(' UNION ALL '.join([
+            f"SELECT COUNT(*) FROM tmp_{self.session_id}_p{i}" for i in partition_ids
+        ]))
+        rows_staged = sum(row[0] for row in cursor.fetchall())
+        cursor.close()
+
+        result = self._execute_sql(conn, merge_sql, tag_params(run_id, phase='merge'))
+        if result['status'] != 'success':
+            return result
+
+        # Estimate what a full-row merge of every staged row would have written on top of this one
+        avg_row_bytes = self._avg_row_bytes(conn, table_name)
+        non_key_count = len([c for c in all_columns if c.lower() not in self.KEY_COLUMNS]) or 1
+        rows_merged = result['rowcount']
+        rows_skipped = max(rows_staged - rows_merged, 0)
+        untouched_column_share = 1 - len(tracked_columns) / non_key_count
+        result.update({
+            'rows_staged': rows_staged,
+            'rows_merged': rows_merged,
+            'rows_skipped': rows_skipped,
+            'columns_set': tracked_columns,
+            'columns_skipped': non_key_count - len(tracked_columns),
+            'estimated_bytes_avoided': int(avg_row_bytes * (rows_skipped + rows_merged * untouched_column_share))
+        })
+        return result
+
+    def _merge_statement(self, table_name: str, changed_rows: str, tracked_columns: List[str]) -> str:
+        """MERGE of changed_rows (key columns plus tracked columns) into table_name on the key columns"""
         merge_sql = f"""
         MERGE INTO {table_name} t
         USING (
-            {' UNION ALL '.join([
-            f"SELECT * FROM tmp_{self.session_id}_p{i}"
-            for i in range(num_partitions)
-        ])}
+            {changed_rows}
         ) s
         ON t.search_id = s.search_id 
         AND t.search_dt = s.search_dt
         WHEN MATCHED THEN UPDATE SET
         """
+        return merge_sql + ", ".join([f"t.{col} = s.{col}" for col in tracked_columns])
 
-        # Get column list from the first temp table
-        conn = snowflake.connector.connect(**self.connection_params)
-        try:
-            cursor = conn.cursor()
-            cursor.execute(f"DESC TABLE tmp_{self.session_id}_p0")
-            columns = [row[0] for row in cursor if row[0].lower() not in ('search_id', 'search_dt')]
-            set_clause = ", ".join([f"t.{col} = s.{col}" for col in columns])
-            merge_sql += set_clause
+    def _estimate(self, conn, table_name: str, update_sql: str, predicates: List[str],
+                  stage_filter: str, mode: str) -> Dict:
+        """
+        EXPLAIN what each partition stages from table_name, and the MERGE back into it
 
-            return self._execute_sql(merge_sql)
-        finally:
-            conn.close()
+        Each partition is its INSERT FIRST branch, the slice of table_name that fills its temp
+        table, so per-partition pruning shows as it will in the run. The MERGE runs once whatever
+        the partitioning; the temp tables don't exist in a dry run, so it is explained with the
+        staged rows of table_name as its source.
+        """
+        tracked_columns = self._tracked_columns(update_sql, self._table_columns(conn, table_name))
+
+        def staged(columns: str, predicate: str = None) -> str:
+            where = ' AND '.join(f"({c})" for c in (stage_filter, predicate) if c)
+            return f"SELECT {columns} FROM {table_name}" + (f" WHERE {where}" if where else '')
 
-    def _cleanup_temp_tables(self, num_partitions: int):
-        """Clean up all temporary tables"""
-        for i in range(num_partitions):
-            self._execute_sql(f"DROP TABLE IF EXISTS tmp_{self.session_id}_p{i}")
+        merge = self._merge_statement(
+            table_name, staged(", ".join([*self.KEY_COLUMNS, *tracked_columns])), tracked_columns)
+        return self.cost_estimator.estimate(conn, staged('*'), [staged('*', p) for p in predicates], mode,
+                                            shared_sqls=[merge])
 
-    def parallel_update(self, table_name: str, update_sql: str, num_partitions: int = 4) -> Dict:
+    def _cleanup_temp_tables(self, conn, partition_ids: List[int]):
+        """Clean up all temporary tables concurrently"""
+        self._run_concurrently(conn, [
+            f"DROP TABLE IF EXISTS tmp_{self.session_id}_p{i}"
+            for i in partition_ids
+        ])
+
+    def parallel_update(self, table_name: str, update_sql: str, num_partitions: int = 4,
+                        partition_mode: str = 'auto', dry_run: bool = False,
+                        watermark: Watermark = None, full_refresh: bool = False) -> Dict:
         """
         Execute parallel updates using temporary tables
 
+        Snowflake TEMPORARY tables only exist in the session that created them, so the
+        whole run is pinned to one pooled session: staging, the concurrent partition
+        updates (one cursor each), the merge and the cleanup all see the same tables.
+
+        Without a journal the run is all-or-nothing. With a journal, partitions that
+        succeeded are merged even if others failed, and resume(run_id) redoes the rest.
+
         Args:
             table_name: Name of the table to update
-            update_sql: UPDATE statement to execute
+            update_sql: UPDATE statement to execute; its target table is found by parsing the
+                        statement and swapped for each partition's temp table
             num_partitions: Number of partitions to create
+            partition_mode: 'range' (prunable ranges on the planner's column), 'hash'
+                            (MOD(HASH), for unclustered tables) or 'auto'
+            dry_run: Only EXPLAIN each partition's staging slice and the merge back into table_name,
+                     and return the cost estimate
+            watermark: Only stage rows whose watermark column moved since the job's last successful
+                       run; needs a journal, which keeps the mark and advances it when this run succeeds
+            full_refresh: With watermark, stage the whole table again and reset the mark
 
         Returns:
-            Dictionary with update results
+            Dictionary with update results and per-phase timings in seconds
+            (stage, update, merge, cleanup), or the CostEstimator report for a dry run.
+            An incremental run that finds nothing new returns status 'success' with no partitions.
+
+        Raises:
+            ValueError: If watermark is given without a journal, or Watermark.window rejects the run
         """
+        if watermark and not self.journal:
+            raise ValueError("Incremental runs need the updater to be created with a journal")
+        pool = get_pool(self.connection_params, **self.pool_options)
+        window = None
+        if watermark:
+            with pool.connection() as conn:
+                window = watermark.window(conn, self.journal, table_name, update_sql, full_refresh)
+            if window['empty']:
+                self.logger.info(f"Job {watermark.job}: no rows changed since {window['low']}, nothing to update")
+                return {'status': 'success', 'partition_results': [], 'watermark': window}
+        stage_filter = window['predicate'] if window else None
+        try:
+            with pool.connection() as conn:
+                plan = self.planner.plan(conn, table_name, num_partitions, mode=partition_mode, where=stage_filter)
+                predicates = Watermark.restrict(plan['predicates'], window)
+                if dry_run:
+                    return self._estimate(conn, table_name, update_sql, predicates, stage_filter, plan['mode'])
+        except Exception as e:
+            self.logger.error(f"Parallel update failed: {str(e)}")
+            return {
+                'status': 'error',
+                'error': str(e)
+            }
+
+        run_id = new_run_id()
+        if self.journal:
+            options = {'table_name': table_name}
+            if window:
+                options.update({'stage_filter': stage_filter, 'watermark': Watermark.journal_options(window)})
+            run_id = self.journal.start_run('TempTableParallelUpdater', update_sql, predicates, options=options)
+        result = self._run(table_name, update_sql, list(enumerate(predicates)), run_id, stage_filter)
+        if window:
+            result['watermark'] = window
+        return result
+
+    def resume(self, run_id: str) -> Dict:
+        """Stage, update and merge only the partitions of a journaled run that are pending or failed"""
+        if not self.journal:
+            raise ValueError("resume() needs the updater to be created with a journal")
+        run = self.journal.get_run(run_id)
+        pending = [(p['partition_id'], p['predicate']) for p in run['partitions'] if p['status'] != 'success']
+        self.logger.info(f"Resuming run {run_id}: {len(pending)} of {len(run['partitions'])} partitions left")
+        if not pending:
+            return {'status': 'success', 'run_id': run_id, 'partition_results': []}
+        return self._run(run['options']['table_name'], run['update_sql'], pending, run_id,
+                         run['options'].get('stage_filter'))
+
+    def bulk_update(self,
+                    table_name: str,
+                    data,
+                    key_columns: List[str] = None,
+                    update_columns: List[str] = None,
+                    insert_missing: bool = False,
+                    **loader_options) -> Dict:
+        """
+        Apply values computed in Python (DataFrame, Arrow table or record batches) with one MERGE
+
+        The client-side counterpart of parallel_update: instead of temp tables filled by UPDATEs,
+        one temp table is filled by COPY from Parquet files. key_columns defaults to KEY_COLUMNS;
+        loader_options are passed to StagedLoader.
+        """
+        loader = StagedLoader(self.connection_params, self.pool_options,
+                              retry_policy=self.retry_policy, **loader_options)
+        return loader.load_and_merge(table_name, data, list(key_columns or self.KEY_COLUMNS),
+                                     update_columns, insert_missing)
+
+    def _run(self, table_name: str, update_sql: str, partitions: List[Tuple[int, str]], run_id: str,
+             stage_filter: str = None) -> Dict:
+        """Stage, update, merge and clean up the given (partition_id, predicate) pairs"""
+        timings = {}
+        partition_ids = [i for i, _ in partitions]
+        pool = get_pool(self.connection_params, **self.pool_options)
+        try:
+            conn = pool.acquire()
+        except Exception as e:
+            self.logger.error(f"Parallel update failed: {str(e)}")
+            return {
+                'status': 'error',
+                'error': str(e)
+            }
+
+        update_results = []
         try:
             # Step 1: Create temp tables
+            started = time.monotonic()
+            all_columns = self._table_columns(conn, table_name)
+            tracked_columns = self._tracked_columns(update_sql, all_columns)
             self.logger.info("Creating temporary partition tables...")
-            if not self._create_temp_tables(table_name, num_partitions):
-                return {'status': 'error', 'message': 'Failed to create temp tables'}
+            staged = self._create_temp_tables(conn, table_name, partitions, tracked_columns, run_id, stage_filter)
+            timings['stage'] = time.monotonic() - started
+            if not staged:
+                return {'status': 'error', 'message': 'Failed to create temp tables', 'timings': timings}
 
             # Step 2: Execute parallel updates
             self.logger.info("Executing parallel updates...")
-            with ThreadPoolExecutor(max_workers=num_partitions) as executor:
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
                 futures = [
-                    executor.submit(self._update_partition, i, update_sql)
-                    for i in range(num_partitions)
+                    executor.submit(self._update_partition, conn, i, update_sql, run_id)
+                    for i in partition_ids
                 ]
                 update_results = [future.result() for future in as_completed(futures)]
+            timings['update'] = time.monotonic() - started
 
-            # Check if all updates succeeded
-            if not all(r['status'] == 'success' for r in update_results):
+            # Check if all updates succeeded; a journaled run keeps the ones that did
+            succeeded = [r['partition_id'] for r in update_results if r['status'] == 'success']
+            if len(succeeded) < len(partitions) and not (self.journal and succeeded):
                 raise Exception("One or more partition updates failed")
 
             # Step 3: Merge results back
             self.logger.info("Merging results back to main table...")
-            merge_result = self._merge_temp_tables(table_name, num_partitions)
+            started = time.monotonic()
+            merge_result = self._merge_temp_tables(conn, table_name, succeeded,
+                                                   tracked_columns, all_columns, run_id)
+            timings['merge'] = time.monotonic() - started
+            if merge_result['status'] != 'success':
+                raise Exception(f"Merge failed: {merge_result['error']}")
 
-            return {
-                'status': 'success',
+            result = {
+                'status': 'success' if len(succeeded) == len(partitions) else 'partial',
                 'partition_results': update_results,
-                'merge_result': merge_result
+                'merge_result': merge_result,
+                'timings': timings,
+                'run_id': run_id
             }
+            if self.journal:
+                # A partition only counts as done once its rows are merged into the base table
+                for r in update_results:
+                    self.journal.record_partition(run_id, r)
+                self.journal.finish_run(run_id)
+            return result
 
         except Exception as e:
             self.logger.error(f"Parallel update failed: {str(e)}")
+            if self.journal:
+                attempted = {r['partition_id']: r for r in update_results}
+                for i in partition_ids:
+                    failed = dict(attempted.get(i, {'partition_id': i, 'attempts': 0}))
+                    failed.update({'status': 'error', 'error': failed.get('error') or str(e)})
+                    self.journal.record_partition(run_id, failed)
+                self.journal.finish_run(run_id)
             return {
                 'status': 'error',
-                'error': str(e)
+                'error': str(e),
+                'timings': timings,
+                'run_id': run_id
             }
 
         finally:
-            # Always clean up temp tables
-            self._cleanup_temp_tables(num_partitions)
+            # Always clean up temp tables, then hand the session back to the pool.
+            # timings is shared with the returned dict, so the cleanup time still shows up there.
+            started = time.monotonic()
+            self._cleanup_temp_tables(conn, partition_ids)
+            timings['cleanup'] = time.monotonic() - started
+            pool.release(conn)
 
 
 # Example usage
@@ -199,9 +494,15 @@ if __name__ == "__main__":
         for result in results['partition_results']:
             print(f"Partition {result['partition_id']}: {result['rows_updated']} rows updated")
 
+        print("\nPhase timings:")
+        for phase, seconds in results['timings'].items():
+            print(f"{phase}: {seconds:.1f}s")
+
         print(f"\nMerge Result: {results['merge_result']['status']}")
         if results['merge_result']['status'] == 'success':
             print(f"Total Rows Merged: {results['merge_result']['rowcount']}")
+            print(f"Rows Skipped (unchanged): {results['merge_result']['rows_skipped']}")
+            print(f"Estimated Bytes Not Rewritten: {results['merge_result']['estimated_bytes_avoided']}")
     else:
         print(f"Error: {results.get('error', 'Unknown error')}")
 
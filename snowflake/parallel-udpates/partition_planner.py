@@ -0,0 +1,230 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import logging
+import math
+import re
+
+
+DAY_MS = 86400 * 1000
+
+HASH_KEY_EXPR = "CONCAT(search_id, TO_CHAR(search_dt, 'YYYY-MM-DD HH24:MI:SS'))"
+
+
+def table_from_update(update_sql: str) -> str:
+    """Pull the target table out of an UPDATE/DELETE/MERGE statement"""
+    match = re.search(r"^\s*(?:UPDATE|DELETE\s+FROM|MERGE\s+INTO)\s+([\w.$\"]+)", update_sql, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Cannot find the target table in statement: {update_sql.strip()[:80]}")
+    return match.group(1)
+
+
+def hash_predicates(num_partitions: int, key_expr: str = HASH_KEY_EXPR) -> List[str]:
+    """MOD(HASH) split: even row counts, but every predicate scans the whole table"""
+    return [
+        f"MOD(ABS(HASH({key_expr})), {num_partitions}) = {i}"
+        for i in range(num_partitions)
+    ]
+
+
+def numeric_expr(column: str, column_type: str) -> str:
+    """Expression APPROX_PERCENTILE can take: the column itself, or epoch milliseconds for dates and timestamps"""
+    if column_type == 'number':
+        return column
+    return f"DATE_PART(EPOCH_MILLISECOND, {column})"
+
+
+class PartitionPlanner:
+    def __init__(self,
+                 range_column: str = 'search_dt',
+                 column_type: str = 'timestamp',
+                 hash_key_expr: str = HASH_KEY_EXPR,
+                 sample_percent: Optional[float] = None,
+                 profile: Optional[Dict] = None):
+        """
+        Split a table into N predicates for the parallel updaters
+
+        Range mode samples the key distribution once with APPROX_PERCENTILE and emits
+        contiguous, roughly equal-sized ranges on range_column. Those prune micro-partitions
+        when the table is clustered (or naturally ordered) on the column, unlike MOD(HASH).
+
+        Args:
+            range_column: Column used for range splits, usually the clustering key
+            column_type: 'timestamp', 'date' or 'number'
+            hash_key_expr: Expression hashed in hash mode
+            sample_percent: Block-sample this percentage of the table for the quantiles
+                            (None scans the column in full)
+            profile: ColumnProfiler.profile() output for the table; its quantiles of range_column
+                     replace the sampling scan when the job's filter matches the profiled one
+        """
+        if column_type not in ('timestamp', 'date', 'number'):
+            raise ValueError(f"Unsupported column_type: {column_type}")
+        self.range_column = range_column
+        self.column_type = column_type
+        self.hash_key_expr = hash_key_expr
+        self.sample_percent = sample_percent
+        self.profile = profile
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_profile(cls, profile: Dict, column: str = None, hash_key_expr: str = HASH_KEY_EXPR) -> 'PartitionPlanner':
+        """
+        Planner ranging on a profiled column: the given one, or the best-ranked column with quantiles
+
+        Raises:
+            ValueError: if the profile has no quantiles for any candidate column
+        """
+        if column is None:
+            ranked = [r['column'] for r in profile.get('ranking', [])
+                      if profile['columns'][r['column']].get('quantiles')]
+            if not ranked:
+                raise ValueError(f"Profile of {profile['table']} has no orderable column to range on")
+            column = ranked[0]
+        stats = profile['columns'][column]
+        if not stats.get('quantiles'):
+            raise ValueError(f"Profile of {profile['table']} has no quantiles for {column}")
+        return cls(range_column=column, column_type=stats['type'], hash_key_expr=hash_key_expr, profile=profile)
+
+    def profile_boundaries(self, num_partitions: int, where: str = None) -> Optional[List]:
+        """
+        The N-1 inner boundaries read off the profile's quantile grid, with no scan
+
+        Returns:
+            None when there is no usable profile: another column or filter, or more partitions than
+            the grid resolves
+        """
+        if not self.profile or self.profile.get('where') != where:
+            return None
+        stats = self.profile['columns'].get(self.range_column)
+        if not stats or not stats.get('quantiles') or stats.get('type') != self.column_type:
+            return None
+        grid = stats['quantiles']
+        steps = len(grid) + 1
+        if num_partitions > steps:
+            return None
+        return self._inner_boundaries(grid[round(i * steps / num_partitions) - 1] for i in range(1, num_partitions))
+
+    def _inner_boundaries(self, values) -> List:
+        """
+        Ascending distinct boundaries, each rounded down to what _literal can write
+
+        Epoch values can be fractional; a date is written as its day and a timestamp to the
+        millisecond, so two values that would render alike count as one boundary, never an
+        empty ">= d AND < d" range.
+        """
+        boundaries = []
+        for value in values:
+            if value is None:
+                continue
+            if self.column_type != 'number':
+                value = math.floor(float(value))
+                if self.column_type == 'date':
+                    value -= value % DAY_MS
+            # Heavy hitters collapse several quantiles onto one value; a range can't split them
+            if not boundaries or value > boundaries[-1]:
+                boundaries.append(value)
+        return boundaries
+
+    def _numeric_expr(self) -> str:
+        # APPROX_PERCENTILE only accepts numbers, so dates and timestamps go through epoch values
+        return numeric_expr(self.range_column, self.column_type)
+
+    def _literal(self, value) -> str:
+        if self.column_type == 'number':
+            return repr(value) if isinstance(value, float) else str(value)
+        ts = datetime.fromtimestamp(float(value) / 1000, tz=timezone.utc)
+        if self.column_type == 'date':
+            return f"'{ts.strftime('%Y-%m-%d')}'::DATE"
+        return f"'{ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}'::TIMESTAMP_NTZ"
+
+    def is_clustered_on_range_column(self, conn, table_name: str) -> bool:
+        """True if the table's clustering key mentions range_column, or its profile shows the column already ordered"""
+        if self.profile:
+            ranked = {r['column']: r for r in self.profile.get('ranking', [])}
+            if ranked.get(self.range_column, {}).get('order', 0) >= 0.9:
+                return True
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SHOW TABLES LIKE '{table_name.split('.')[-1]}'")
+            columns = [d[0].lower() for d in cursor.description]
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if not row or 'cluster_by' not in columns:
+            return False
+        cluster_by = row[columns.index('cluster_by')] or ''
+        return self.range_column.lower() in cluster_by.lower()
+
+    def sample_boundaries(self, conn, table_name: str, num_partitions: int, where: str = None) -> List:
+        """One pass over range_column returning the N-1 inner quantile boundaries (deduplicated)"""
+        boundaries = self.profile_boundaries(num_partitions, where)
+        if boundaries is not None:
+            self.logger.info(f"Range boundaries for {table_name} taken from its column profile; no sampling scan")
+            return boundaries
+        expr = self._numeric_expr()
+        quantiles = ", ".join(
+            f"APPROX_PERCENTILE({expr}, {i / num_partitions:.6f})"
+            for i in range(1, num_partitions)
+        )
+        sample = f" SAMPLE SYSTEM ({self.sample_percent})" if self.sample_percent else ""
+        where_clause = f" WHERE {where}" if where else ""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {quantiles} FROM {table_name}{sample}{where_clause}")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        return self._inner_boundaries(row or [])
+
+    def range_predicates(self, boundaries: List) -> List[str]:
+        """Contiguous ranges; the outer ones are open-ended so nothing outside the sample is lost"""
+        col = self.range_column
+        if not boundaries:
+            return ["TRUE"]
+        literals = [self._literal(b) for b in boundaries]
+        predicates = [f"({col} < {literals[0]} OR {col} IS NULL)"]
+        for low, high in zip(literals, literals[1:]):
+            predicates.append(f"{col} >= {low} AND {col} < {high}")
+        predicates.append(f"{col} >= {literals[-1]}")
+        return predicates
+
+    def plan(self, conn, table_name: str, num_partitions: int, mode: str = 'auto', where: str = None) -> Dict:
+        """
+        Build the partition predicates for a job
+
+        Args:
+            conn: Open Snowflake session used for sampling
+            table_name: Table being split
+            num_partitions: Desired number of partitions
+            mode: 'range', 'hash', or 'auto' (range if clustered on range_column, else hash)
+            where: Optional filter applied while sampling, e.g. the UPDATE's own WHERE
+
+        Returns:
+            Dictionary with mode, predicates and (for range mode) boundaries
+        """
+        if mode not in ('auto', 'range', 'hash'):
+            raise ValueError(f"Unknown partition mode: {mode}")
+        if mode == 'auto':
+            try:
+                mode = 'range' if self.is_clustered_on_range_column(conn, table_name) else 'hash'
+            except Exception as e:
+                self.logger.warning(f"Could not read clustering key of {table_name}, using hash mode: {str(e)}")
+                mode = 'hash'
+
+        if mode == 'hash' or num_partitions <= 1:
+            return {
+                'mode': 'hash',
+                'predicates': hash_predicates(num_partitions, self.hash_key_expr)
+            }
+
+        boundaries = self.sample_boundaries(conn, table_name, num_partitions, where)
+        predicates = self.range_predicates(boundaries)
+        if len(predicates) < num_partitions:
+            self.logger.info(
+                f"Key skew on {self.range_column}: planned {len(predicates)} ranges instead of {num_partitions}")
+        return {
+            'mode': 'range',
+            'column': self.range_column,
+            'boundaries': boundaries,
+            'predicates': predicates
+        }
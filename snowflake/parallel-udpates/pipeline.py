@@ -0,0 +1,450 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List
+import logging
+import time
+
+from connection_pool import get_pool
+from query_profiler import tag_params
+from run_journal import RetryPolicy, new_run_id
+from simple_parallel_update import SimpleParallelUpdater
+from update_fusion import FusionConflictError, fuse_updates
+
+
+class PipelineError(ValueError):
+    """Raised when a pipeline's steps are declared inconsistently"""
+
+
+class Step:
+    def __init__(self, name: str, kind: str, inputs: List[str], outputs: List[str], **spec):
+        """
+        One statement of a pipeline
+
+        Args:
+            name: Unique step name, used in results, logs and QUERY_TAG
+            kind: 'filter', 'select', 'insert', 'update', 'merge' or 'statement'
+            inputs: Tables the step reads
+            outputs: Tables the step creates or changes
+            spec: Kind-specific parts the SQL is rendered from
+        """
+        self.name = name
+        self.kind = kind
+        self.inputs = [t.lower() for t in inputs]
+        self.outputs = [t.lower() for t in outputs]
+        self.spec = spec
+        self.folded = [name]  # Declared steps this one stands for after folding
+        self.depends_on: List[str] = []
+
+
+class Pipeline:
+    def __init__(self,
+                 connection_params: Dict,
+                 pool_options: Dict = None,
+                 retry_policy: RetryPolicy = None,
+                 max_parallel: int = 4,
+                 fold: bool = True):
+        """
+        Declarative multi-step workflow over session-scoped temp tables
+
+        Steps declare the tables they read and write. Steps with no dependency between them
+        run at the same time, and chains of filters are folded into one CREATE TABLE AS SELECT
+        so the data is scanned and written once. TEMPORARY tables only exist in the session that
+        created them, so the whole pipeline runs on one pooled session with one cursor per step,
+        as the temp-table updater does.
+
+        Args:
+            connection_params: Snowflake connection parameters
+            pool_options: Options passed to get_pool (max_size, connect, ...)
+            retry_policy: Backoff for transient statement errors
+            max_parallel: Steps running at once
+            fold: Fold filter chains and fuse consecutive updates before running
+        """
+        self.connection_params = connection_params
+        self.pool_options = pool_options or {}
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.max_parallel = max_parallel
+        self.fold = fold
+        self.steps: List[Step] = []
+        self._temporary = set()
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _add(self, step: Step) -> 'Pipeline':
+        if any(s.name == step.name for s in self.steps):
+            raise PipelineError(f"Duplicate step name: {step.name}")
+        self.steps.append(step)
+        return self
+
+    def _creates(self, output: str, temporary: bool):
+        """Register a table the pipeline creates; each table is created by one step only"""
+        key = output.lower()
+        if any(s.kind in ('filter', 'select') and key in s.outputs for s in self.steps):
+            raise PipelineError(f"Table {output} is already created by another step")
+        if temporary:
+            self._temporary.add(key)
+        else:
+            self._temporary.discard(key)
+
+    # Declaring steps. Filters and joins refer to their source as alias a.
+
+    def filter(self, name: str, source: str, where: str = None, columns: List[str] = None,
+               output: str = None, temporary: bool = True) -> 'Pipeline':
+        """
+        Rows of source matching where, into a new table
+
+        Args:
+            name: Step name
+            source: Table to read, aliased as a
+            where: Condition on the source columns
+            columns: Plain column names to keep (all when None)
+            output: Table to create (defaults to the step name)
+            temporary: Create a session-scoped TEMPORARY table, dropped when the pipeline ends
+        """
+        output = output or name
+        self._creates(output, temporary)
+        return self._add(Step(name, 'filter', [source], [output], source=source,
+                              predicates=[where] if where else [], columns=columns, temporary=temporary))
+
+    def _join_filter(self, name: str, source: str, other: str, on: Dict[str, str], negate: bool,
+                     columns: List[str], output: str, temporary: bool) -> 'Pipeline':
+        if not on:
+            raise PipelineError(f"Step {name} needs at least one join column")
+        condition = ' AND '.join(f"a.{left} = b.{right}" for left, right in on.items())
+        predicate = f"{'NOT ' if negate else ''}EXISTS (SELECT 1 FROM {other} b WHERE {condition})"
+        self.filter(name, source, predicate, columns, output, temporary)
+        self.steps[-1].inputs.append(other.lower())
+        return self
+
+    def anti_join(self, name: str, source: str, other: str, on: Dict[str, str], columns: List[str] = None,
+                  output: str = None, temporary: bool = True) -> 'Pipeline':
+        """
+        Rows of source with no match in other (NOT EXISTS), into a new table
+
+        Args:
+            on: Source column -> other column pairs that must all be equal to match
+        """
+        return self._join_filter(name, source, other, on, True, columns, output, temporary)
+
+    def semi_join(self, name: str, source: str, other: str, on: Dict[str, str], columns: List[str] = None,
+                  output: str = None, temporary: bool = True) -> 'Pipeline':
+        """
+        Rows of source with at least one match in other (EXISTS), into a new table
+
+        Unlike an INNER JOIN this never duplicates source rows. It keeps what
+        DELETE ... WHERE col NOT IN (SELECT col FROM other) keeps, except around NULLs: NOT IN
+        also keeps rows whose col is NULL, and deletes nothing at all if other's col has a NULL.
+        """
+        return self._join_filter(name, source, other, on, False, columns, output, temporary)
+
+    def select(self, name: str, sql: str, inputs: List[str], output: str = None,
+               temporary: bool = True) -> 'Pipeline':
+        """Any SELECT over inputs, into a new table; never folded"""
+        output = output or name
+        self._creates(output, temporary)
+        return self._add(Step(name, 'select', inputs, [output], sql=sql, temporary=temporary))
+
+    def insert(self, name: str, target: str, source: str, columns: List[str] = None) -> 'Pipeline':
+        """INSERT the given columns (all by default) of source into an existing target, keeping its rows"""
+        return self._add(Step(name, 'insert', [source, target], [target],
+                              target=target, source=source, predicates=[], columns=columns))
+
+    def update(self, name: str, table: str, set_sql: str, where: str = None,
+               num_partitions: int = None) -> 'Pipeline':
+        """
+        UPDATE table SET set_sql [WHERE where]
+
+        Args:
+            num_partitions: Split the update with SimpleParallelUpdater on its own pooled sessions;
+                            only for permanent tables, which other sessions can see
+        """
+        if num_partitions and table.lower() in self._temporary:
+            raise PipelineError(f"Step {name}: temporary table {table} is only visible to the pipeline's "
+                                f"session and can't be updated in partitions")
+        sql = f"UPDATE {table} SET {set_sql}" + (f" WHERE {where}" if where else '')
+        return self._add(Step(name, 'update', [table], [table], sql=sql, num_partitions=num_partitions))
+
+    def merge(self, name: str, target: str, source: str, keys: List[str], columns: List[str]) -> 'Pipeline':
+        """MERGE the given columns of source back into target, matching on keys"""
+        return self._add(Step(name, 'merge', [source, target], [target],
+                              target=target, source=source, keys=keys, columns=columns))
+
+    def statement(self, name: str, sql: str, inputs: List[str] = (), outputs: List[str] = ()) -> 'Pipeline':
+        """Any other statement, run as given"""
+        return self._add(Step(name, 'statement', inputs, outputs, sql=sql))
+
+    # Planning
+
+    @staticmethod
+    def _copy(step: Step) -> Step:
+        copy = Step(step.name, step.kind, step.inputs, step.outputs, **step.spec)
+        copy.folded = list(step.folded)
+        return copy
+
+    @staticmethod
+    def _touches(step: Step, tables: List[str]) -> bool:
+        return any(t in step.inputs or t in step.outputs for t in tables)
+
+    def _fold_filters(self, steps: List[Step]) -> bool:
+        """Fold one filter into the filter or insert that reads its output; False when nothing can be folded"""
+        for i, first in enumerate(steps):
+            if first.kind != 'filter' or not first.spec['temporary']:
+                continue
+            table = first.outputs[0]
+            readers = [s for s in steps if table in s.inputs]
+            if len(readers) != 1 or readers[0].kind not in ('filter', 'insert') or \
+                    any(s is not first and table in s.outputs for s in steps):
+                continue
+            second = readers[0]
+            j = steps.index(second)
+            # The folded scan runs at the second step's place; nothing in between may change what the first read
+            if any(set(s.outputs) & set(first.inputs) for s in steps[i + 1:j]):
+                continue
+            # An insert reading the filter becomes INSERT ... SELECT with the filter's conditions
+            kept = {'target': second.spec['target']} if second.kind == 'insert' else \
+                {'temporary': second.spec['temporary']}
+            folded = Step(second.name, second.kind,
+                          first.inputs + [t for t in second.inputs if t != table], second.outputs,
+                          source=first.spec['source'],
+                          predicates=first.spec['predicates'] + second.spec['predicates'],
+                          columns=second.spec['columns'] or first.spec['columns'], **kept)
+            folded.folded = first.folded + second.folded
+            steps[j] = folded
+            del steps[i]
+            return True
+        return False
+
+    def _fuse_updates(self, steps: List[Step]) -> bool:
+        """Fuse an update with the next one on the same table; False when nothing can be fused"""
+        for i, first in enumerate(steps):
+            if first.kind != 'update' or first.spec['num_partitions']:
+                continue
+            table = first.outputs[0]
+            for j in range(i + 1, len(steps)):
+                second = steps[j]
+                if not self._touches(second, [table]):
+                    continue
+                if second.kind != 'update' or second.spec['num_partitions']:
+                    break
+                try:
+                    sql = fuse_updates([first.spec['sql'], second.spec['sql']])
+                except (FusionConflictError, ValueError) as e:
+                    self.logger.info(f"Not fusing {first.name} and {second.name}: {str(e)}")
+                    break
+                fused = Step(second.name, 'update', [table], [table], sql=sql, num_partitions=None)
+                fused.folded = first.folded + second.folded
+                steps[i] = fused
+                del steps[j]
+                return True
+        return False
+
+    @staticmethod
+    def _link(steps: List[Step]):
+        """Depend on the last writer of every table read or written, and on readers of tables overwritten"""
+        last_writer = {}
+        readers = {}
+        for step in steps:
+            depends = {last_writer[t] for t in step.inputs + step.outputs if t in last_writer}
+            for t in step.outputs:
+                depends.update(readers.get(t, []))
+            depends.discard(step.name)
+            step.depends_on = sorted(depends)
+            for t in step.inputs:
+                readers.setdefault(t, []).append(step.name)
+            for t in step.outputs:
+                last_writer[t] = step.name
+                readers[t] = []
+
+    def _render(self, step: Step) -> str:
+        spec = step.spec
+        if step.kind == 'filter':
+            columns = ', '.join(f"a.{c}" for c in spec['columns']) if spec['columns'] else 'a.*'
+            where = '\n            WHERE ' + '\n            AND '.join(spec['predicates']) if spec['predicates'] else ''
+            return f"""
+            CREATE OR REPLACE {'TEMPORARY ' if spec['temporary'] else ''}TABLE {step.outputs[0]} AS
+            SELECT {columns}
+            FROM {spec['source']} a{where}
+            """
+        if step.kind == 'insert':
+            columns = ', '.join(f"a.{c}" for c in spec['columns']) if spec['columns'] else 'a.*'
+            target_columns = f" ({', '.join(spec['columns'])})" if spec['columns'] else ''
+            where = '\n            WHERE ' + '\n            AND '.join(spec['predicates']) if spec['predicates'] else ''
+            return f"""
+            INSERT INTO {spec['target']}{target_columns}
+            SELECT {columns}
+            FROM {spec['source']} a{where}
+            """
+        if step.kind == 'select':
+            return f"CREATE OR REPLACE {'TEMPORARY ' if spec['temporary'] else ''}TABLE {step.outputs[0]} AS {spec['sql']}"
+        if step.kind == 'merge':
+            on = ' AND '.join(f"t.{k} = s.{k}" for k in spec['keys'])
+            set_clause = ', '.join(f"t.{c} = s.{c}" for c in spec['columns'])
+            return f"""
+            MERGE INTO {spec['target']} t
+            USING {spec['source']} s
+            ON {on}
+            WHEN MATCHED THEN UPDATE SET {set_clause}
+            """
+        return spec['sql']
+
+    def plan(self) -> List[Dict]:
+        """
+        The statements the pipeline will run, after folding, in declaration order
+
+        Returns:
+            List of dictionaries with step, kind, sql, depends_on and folded (declared steps it covers)
+        """
+        steps = [self._copy(s) for s in self.steps]
+        if self.fold:
+            while self._fold_filters(steps) or self._fuse_updates(steps):
+                pass
+        self._link(steps)
+        return [{
+            'step': s.name,
+            'kind': s.kind,
+            'outputs': s.outputs,
+            'sql': self._render(s),
+            'depends_on': s.depends_on,
+            'folded': s.folded,
+            'num_partitions': s.spec.get('num_partitions')
+        } for s in steps]
+
+    # Running
+
+    def _execute(self, conn, planned: Dict, run_id: str) -> Dict:
+        started = time.monotonic()
+        if planned['num_partitions']:
+            updater = SimpleParallelUpdater(self.connection_params, pool_options=self.pool_options,
+                                            retry_policy=self.retry_policy)
+            results = updater.parallel_update(planned['sql'], planned['num_partitions'])
+            failed = [r for r in results if r['status'] != 'success']
+            return {
+                'step': planned['step'],
+                'status': 'error' if failed else 'success',
+                'rowcount': sum(r['rows_updated'] for r in results if r['status'] == 'success'),
+                'partition_results': results,
+                'seconds': time.monotonic() - started,
+                **({'error': failed[0]['error']} if failed else {})
+            }
+
+        def run_statement():
+            # One cursor per step on the session that owns the temp tables
+            cursor = conn.cursor()
+            cursor.execute(planned['sql'], _statement_params=tag_params(run_id, phase=planned['step']))
+            return cursor.rowcount, cursor.sfqid
+
+        outcome, attempts, error = self.retry_policy.run(run_statement, f"Step {planned['step']}")
+        result = {'step': planned['step'], 'attempts': attempts, 'seconds': time.monotonic() - started}
+        if error is None:
+            rowcount, query_id = outcome
+            result.update({'status': 'success', 'rowcount': rowcount, 'query_id': query_id})
+        else:
+            self.logger.error(f"Step {planned['step']} failed: {str(error)}")
+            result.update({'status': 'error', 'error': str(error)})
+        return result
+
+    def _drop_temporary(self, conn, plan: List[Dict]):
+        """Drop the temp tables the plan creates; folded-away intermediates never existed"""
+        for step in plan:
+            table = step['outputs'][0] if step['kind'] in ('filter', 'select') else None
+            if table in self._temporary:
+                try:
+                    conn.cursor().execute(f"DROP TABLE IF EXISTS {table}")
+                except Exception as e:
+                    self.logger.warning(f"Could not drop {table}: {str(e)}")
+
+    def run(self) -> Dict:
+        """
+        Run every step once its dependencies have succeeded
+
+        A failed step skips everything that depends on it; independent branches still finish.
+        Temporary tables are dropped at the end, so results that must outlive the run go into
+        a permanent table (temporary=False) or are merged into one.
+
+        Returns:
+            Dictionary with status, run_id, per-step results in completion order and the plan
+        """
+        plan = self.plan()
+        run_id = new_run_id()
+        by_name = {s['step']: s for s in plan}
+        results: Dict[str, Dict] = {}
+        pool = get_pool(self.connection_params, **self.pool_options)
+        try:
+            conn = pool.acquire()
+        except Exception as e:
+            self.logger.error(f"Pipeline failed: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'run_id': run_id}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+                running = {}
+                while True:
+                    for name, planned in by_name.items():
+                        if name in results or name in running.values():
+                            continue
+                        states = [results.get(d, {}).get('status') for d in planned['depends_on']]
+                        if any(s in ('error', 'skipped') for s in states):
+                            results[name] = {'step': name, 'status': 'skipped',
+                                             'error': 'a step it depends on did not succeed'}
+                        elif all(s == 'success' for s in states):
+                            if planned['folded'] != [name]:
+                                self.logger.info(f"Step {name} runs folded steps {planned['folded']}")
+                            running[executor.submit(self._execute, conn, planned, run_id)] = name
+                    if not running:
+                        break
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        results[running.pop(future)] = result
+                        self.logger.info(f"Step {result['step']}: {result['status']} "
+                                         f"({result.get('rowcount')} rows, {result['seconds']:.1f}s)")
+        finally:
+            self._drop_temporary(conn, plan)
+            pool.release(conn)
+
+        failed = [r for r in results.values() if r['status'] != 'success']
+        return {
+            'status': 'error' if failed else 'success',
+            'run_id': run_id,
+            'step_results': list(results.values()),
+            'plan': plan
+        }
+
+
+# Example usage
+if __name__ == "__main__":
+    conn_params = {
+        'user': 'your_username',
+        'password': 'your_password',
+        'account': 'your_account',
+        'warehouse': 'your_warehouse',
+        'database': 'your_database',
+        'schema': 'your_schema'
+    }
+
+    # exercise2: INSERT ... NOT EXISTS mortgage_pool into tmp_table, DELETE ... NOT IN security, then UPDATE.
+    # The anti-join and the semi-join fold into one INSERT ... SELECT, so history is scanned once and the
+    # rows already in tmp_table stay. Unlike the DELETE, the security check only applies to the new rows;
+    # add the DELETE as a statement step if tmp_table can already hold rows outside security.
+    pipeline = Pipeline(conn_params)
+    pipeline.anti_join('not_in_pool', 'history', 'mortgage_pool', on={'col1': 'col2', 'col2': 'col2'},
+                       columns=['col1', 'col2', 'col3'])
+    pipeline.semi_join('in_security', 'not_in_pool', 'security', on={'col1': 'col1'})
+    pipeline.insert('load', 'tmp_table', 'in_security')
+    pipeline.update('flag', 'tmp_table', "col1 = -999, col2 = -999, col3 = -999")
+
+    for step in pipeline.plan():
+        print(f"{step['step']} (covers {step['folded']}, after {step['depends_on']}):{step['sql']}")
+
+    result = pipeline.run()
+    print(f"Pipeline {result['run_id']}: {result['status']}")
+    for step in result['step_results']:
+        print(f"{step['step']}: {step['status']} {step.get('rowcount', '')}")
+
+# exercise1: subset history, apply several updates to the subset, merge back
+"""
+pipeline = Pipeline(conn_params)
+pipeline.filter('recent', 'history', "a.effective_date > '2023-10-01'")
+pipeline.update('fix_status', 'recent', "status = 'PROCESSED'", where="status = 'PENDING'")
+pipeline.update('scale', 'recent', "amount = amount * 1.1", where="category = 'STANDARD'")
+pipeline.merge('merge_back', 'history', 'recent', keys=['search_id', 'search_dt'], columns=['status', 'amount'])
+pipeline.run()  # the two updates are fused into one statement
+"""
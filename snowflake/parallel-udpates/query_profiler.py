@@ -0,0 +1,258 @@
+from datetime import datetime, timedelta, timezone
+from statistics import mean, median, pstdev
+from typing import Dict, List
+import csv
+import json
+import logging
+
+
+TAG_APP = 'parallel_update'
+
+
+def make_query_tag(run_id: str, partition_id=None, warehouse: str = None, phase: str = 'update') -> str:
+    """QUERY_TAG for one statement of a run; JSON with sorted keys so it can be matched with LIKE"""
+    return json.dumps({
+        'app': TAG_APP,
+        'run_id': run_id,
+        'partition': partition_id,
+        'warehouse': warehouse,
+        'phase': phase
+    }, sort_keys=True)
+
+
+def tag_params(run_id: str, partition_id=None, warehouse: str = None, phase: str = 'update') -> Dict:
+    """
+    Statement parameters that set QUERY_TAG for a single statement:
+    cursor.execute(sql, _statement_params=tag_params(...))
+
+    Unlike ALTER SESSION SET QUERY_TAG this doesn't leak onto the pooled session and is
+    safe when several cursors share one session (the temp-table updater, the async engine).
+    """
+    return {'QUERY_TAG': make_query_tag(run_id, partition_id, warehouse, phase)}
+
+
+class QueryProfiler:
+    def __init__(self, source: str = 'information_schema'):
+        """
+        Pull query history for a tagged run and summarise it per partition
+
+        Args:
+            source: 'information_schema' (recent, 7 days, no latency) or
+                    'account_usage' (365 days, up to ~45 minutes behind)
+        """
+        if source not in ('information_schema', 'account_usage'):
+            raise ValueError(f"Unknown query history source: {source}")
+        self.source = source
+        self.logger = logging.getLogger(__name__)
+
+    def _history_sql(self, run_id: str, since: datetime) -> str:
+        tag_filter = f"QUERY_TAG LIKE '%\"run_id\": \"{run_id}\"%'"
+        columns = """
+            QUERY_ID, QUERY_TEXT, QUERY_TAG, WAREHOUSE_NAME, EXECUTION_STATUS, START_TIME, END_TIME,
+            TOTAL_ELAPSED_TIME, COMPILATION_TIME, EXECUTION_TIME,
+            QUEUED_PROVISIONING_TIME + QUEUED_REPAIR_TIME + QUEUED_OVERLOAD_TIME AS QUEUED_TIME,
+            QUEUED_PROVISIONING_TIME,
+            TRANSACTION_BLOCKED_TIME, BYTES_SCANNED,
+            BYTES_SPILLED_TO_LOCAL_STORAGE, BYTES_SPILLED_TO_REMOTE_STORAGE,
+            PARTITIONS_SCANNED, PARTITIONS_TOTAL, ROWS_UPDATED
+        """
+        if self.source == 'account_usage':
+            return f"""
+                SELECT {columns}
+                FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                WHERE START_TIME >= '{since.isoformat()}'::TIMESTAMP_LTZ
+                AND {tag_filter}
+            """
+        # INFORMATION_SCHEMA.QUERY_HISTORY has no partition columns; those come from operator stats
+        columns = columns.replace("PARTITIONS_SCANNED, PARTITIONS_TOTAL, ROWS_UPDATED",
+                                  "NULL AS PARTITIONS_SCANNED, NULL AS PARTITIONS_TOTAL, ROWS_PRODUCED AS ROWS_UPDATED")
+        return f"""
+            SELECT {columns}
+            FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY(
+                END_TIME_RANGE_START => '{since.isoformat()}'::TIMESTAMP_LTZ,
+                RESULT_LIMIT => 10000))
+            WHERE {tag_filter}
+        """
+
+    def fetch_queries(self, conn, run_id: str, since_hours: float = 24) -> List[Dict]:
+        """Every query tagged with run_id, with the partition/phase decoded from its tag"""
+        since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self._history_sql(run_id, since))
+            names = [d[0].lower() for d in cursor.description]
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+        for row in rows:
+            try:
+                tag = json.loads(row['query_tag'])
+            except (TypeError, ValueError):
+                tag = {}
+            row['partition_id'] = tag.get('partition')
+            row['phase'] = tag.get('phase')
+        return rows
+
+    def statement_stats(self, conn, query_id: str) -> Dict:
+        """
+        Queue and lock-wait seconds and bytes scanned of one statement just run on this session
+
+        QUERY_HISTORY_BY_SESSION needs no warehouse and has the statement as soon as it ends,
+        so it is cheap enough to call after every partition statement.
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT
+                    QUEUED_PROVISIONING_TIME + QUEUED_REPAIR_TIME + QUEUED_OVERLOAD_TIME,
+                    TRANSACTION_BLOCKED_TIME,
+                    EXECUTION_TIME,
+                    BYTES_SCANNED
+                FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 100))
+                WHERE QUERY_ID = '{query_id}'
+            """)
+            row = cursor.fetchone() or (0, 0, 0, 0)
+        finally:
+            cursor.close()
+        return {
+            'queued_seconds': (row[0] or 0) / 1000,
+            'lock_wait_seconds': (row[1] or 0) / 1000,
+            'execution_seconds': (row[2] or 0) / 1000,
+            'bytes_scanned': row[3] or 0
+        }
+
+    def operator_stats(self, conn, query_id: str) -> Dict:
+        """Micro-partition pruning and spill from GET_QUERY_OPERATOR_STATS for one query"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT
+                    SUM(OPERATOR_STATISTICS:pruning:partitions_scanned::NUMBER),
+                    SUM(OPERATOR_STATISTICS:pruning:partitions_total::NUMBER),
+                    SUM(OPERATOR_STATISTICS:spilling:bytes_spilled_local_storage::NUMBER),
+                    SUM(OPERATOR_STATISTICS:spilling:bytes_spilled_remote_storage::NUMBER)
+                FROM TABLE(GET_QUERY_OPERATOR_STATS('{query_id}'))
+            """)
+            row = cursor.fetchone() or (None, None, None, None)
+        finally:
+            cursor.close()
+        return {
+            'partitions_scanned': row[0],
+            'partitions_total': row[1],
+            'operator_bytes_spilled_local': row[2],
+            'operator_bytes_spilled_remote': row[3]
+        }
+
+    @staticmethod
+    def _skew(values: List[float]) -> Dict:
+        values = [v for v in values if v is not None]
+        if not values:
+            return {}
+        mid = median(values)
+        avg = mean(values)
+        return {
+            'min': min(values),
+            'median': mid,
+            'max': max(values),
+            'mean': avg,
+            # Slowest partition vs a typical one; 1.0 is perfectly balanced
+            'max_over_median': (max(values) / mid) if mid else None,
+            'coefficient_of_variation': (pstdev(values) / avg) if avg else None
+        }
+
+    @staticmethod
+    def _compilation(queries: List[Dict]) -> Dict:
+        """
+        Compile time of a run's statements, and what running the same text again saved
+
+        Statements that bind their partition bounds share one text per partition shape, and a
+        text that already ran compiles faster. The saving is the mean compile time of each text's
+        first run minus that of every later run of the same text.
+        """
+        seen = set()
+        first, repeated = [], []
+        for q in sorted(queries, key=lambda q: str(q['start_time'])):
+            text = ' '.join((q.get('query_text') or '').split())
+            (repeated if text in seen else first).append(q['compilation_time'] or 0)
+            seen.add(text)
+        first_mean = mean(first) if first else 0
+        return {
+            'statements': len(first) + len(repeated),
+            'distinct_texts': len(first),
+            'compilation_time': sum(first) + sum(repeated),
+            'first_run_mean': first_mean,
+            'repeat_run_mean': mean(repeated) if repeated else None,
+            'saved_compilation_time': sum(max(first_mean - c, 0) for c in repeated)
+        }
+
+    def report(self, conn, run_id: str, since_hours: float = 24, operator_stats: bool = False,
+               warehouse_report: Dict = None) -> Dict:
+        """
+        Per-partition timings and volumes for a run, plus a skew summary across partitions
+
+        Times are in milliseconds as QUERY_HISTORY reports them. A partition that was retried
+        has all of its attempts summed. 'compilation' shows how much compile time reusing
+        statement texts saved across the run's partition statements. 'provisioning_time' is the
+        time statements waited for a suspended warehouse to resume; warehouse_report (a
+        WarehouseLifecycle report) is included as 'warehouses', with startup time and credits.
+        """
+        queries = self.fetch_queries(conn, run_id, since_hours)
+        if operator_stats:
+            for q in queries:
+                stats = self.operator_stats(conn, q['query_id'])
+                q.update({k: v for k, v in stats.items() if v is not None})
+
+        fields = ('queued_time', 'compilation_time', 'execution_time', 'total_elapsed_time',
+                  'transaction_blocked_time', 'bytes_scanned', 'bytes_spilled_to_local_storage',
+                  'bytes_spilled_to_remote_storage', 'partitions_scanned', 'partitions_total', 'rows_updated')
+        partitions = {}
+        for q in queries:
+            if q['phase'] != 'update' or q['partition_id'] is None:
+                continue
+            entry = partitions.setdefault(q['partition_id'], {
+                'partition_id': q['partition_id'],
+                'warehouse': q['warehouse_name'],
+                'queries': 0,
+                **{f: 0 for f in fields}
+            })
+            entry['queries'] += 1
+            for f in fields:
+                entry[f] += q.get(f) or 0
+
+        rows = sorted(partitions.values(), key=lambda p: p['partition_id'])
+        return {
+            'run_id': run_id,
+            'queries': len(queries),
+            'partitions': rows,
+            'phases': {
+                phase: sum(q['total_elapsed_time'] or 0 for q in queries if q['phase'] == phase)
+                for phase in sorted({q['phase'] for q in queries if q['phase']})
+            },
+            'compilation': self._compilation([q for q in queries if q['phase'] == 'update']),
+            'provisioning_time': sum(q.get('queued_provisioning_time') or 0 for q in queries),
+            'warehouses': warehouse_report,
+            'skew': {
+                'execution_time': self._skew([p['execution_time'] for p in rows]),
+                'bytes_scanned': self._skew([p['bytes_scanned'] for p in rows]),
+                'transaction_blocked_time': self._skew([p['transaction_blocked_time'] for p in rows])
+            },
+            'totals': {f: sum(p[f] for p in rows) for f in fields}
+        }
+
+    @staticmethod
+    def to_json(report: Dict, path: str):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    @staticmethod
+    def to_csv(report: Dict, path: str):
+        """One row per partition, with the run_id on every row so files can be concatenated across runs"""
+        if not report['partitions']:
+            return
+        columns = ['run_id'] + list(report['partitions'][0].keys())
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for row in report['partitions']:
+                writer.writerow({'run_id': report['run_id'], **row})
@@ -0,0 +1,357 @@
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Snowflake errors raised before a statement ran, or after Snowflake aborted and rolled it back:
+# lock-wait aborts, suspended/resizing/overloaded warehouses, expired logins. Re-running the
+# statement is always safe. Lock errors are matched by code; the bare words ('locked', 'queued')
+# also appear in unrelated errors such as a locked user account.
+# Cancels (000604) and statement/warehouse timeouts (000630) are deliberately left out: a cancel
+# was asked for, and a timed-out statement would only time out again. Add them through
+# RetryPolicy(transient_patterns=...) to opt in.
+TRANSIENT_ERROR_PATTERNS = (
+    '000625',  # Lock wait timeout, or too many statements waiting on the lock
+    'is suspended',
+    'cannot be resumed',
+    'resizing',
+    'throttl',
+    '390114',  # Authentication token has expired
+)
+
+# Client-side failures: the request or its response was lost, so the statement may still have
+# run and committed on the server. Only retried once Snowflake says the query failed.
+UNCERTAIN_ERROR_PATTERNS = (
+    'timed out',
+    'connection reset',
+    'connection aborted',
+    'broken pipe',
+    'service unavailable',
+)
+
+# Query statuses after which nothing the statement did was committed
+_FAILED_STATUSES = ('FAILED_WITH_ERROR', 'FAILED_WITH_INCIDENT', 'ABORTED')
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def execute_tracked(cursor, sql: str, params=None, **kwargs):
+    """
+    cursor.execute, with the statement's query id kept on any error it raises (as error.sfqid)
+
+    Connector errors usually carry it already; a dropped connection may not, while the cursor
+    still knows the id the server gave the statement. Use a fresh cursor per statement.
+    """
+    try:
+        return cursor.execute(sql, params, **kwargs)
+    except Exception as e:
+        if getattr(e, 'sfqid', None) is None and getattr(cursor, 'sfqid', None):
+            try:
+                e.sfqid = cursor.sfqid
+            except AttributeError:
+                pass
+        raise
+
+
+class RetryPolicy:
+    def __init__(self,
+                 max_attempts: int = 4,
+                 base_delay: float = 2.0,
+                 max_delay: float = 60.0,
+                 transient_patterns: Tuple[str, ...] = TRANSIENT_ERROR_PATTERNS,
+                 uncertain_patterns: Tuple[str, ...] = UNCERTAIN_ERROR_PATTERNS,
+                 settle_timeout: float = 600.0,
+                 settle_poll_interval: float = 2.0):
+        """
+        Exponential backoff with full jitter for transient Snowflake errors
+
+        Args:
+            max_attempts: Total tries, including the first
+            base_delay: Delay cap before the second try; doubles on each retry
+            max_delay: Upper bound on any single delay
+            transient_patterns: Lower-case substrings of errors that are always safe to retry
+            uncertain_patterns: Lower-case substrings of client-side errors, retried only after
+                                the query's status shows it failed (see run)
+            settle_timeout: Longest wait for a still-running query before giving up on it
+            settle_poll_interval: Delay between status checks while waiting
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.transient_patterns = transient_patterns
+        self.uncertain_patterns = uncertain_patterns
+        self.settle_timeout = settle_timeout
+        self.settle_poll_interval = settle_poll_interval
+        self.logger = logging.getLogger(__name__)
+
+    def is_transient(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return any(pattern in message for pattern in self.transient_patterns)
+
+    def is_uncertain(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return not self.is_transient(error) and any(pattern in message for pattern in self.uncertain_patterns)
+
+    def settle(self, conn, query_id: str) -> Tuple[str, Optional[tuple]]:
+        """
+        Server-side outcome of a statement whose client call failed, waiting while it still runs
+
+        Returns:
+            ('success', first result row) if it committed, ('failed', None) if Snowflake reports it
+            failed or aborted, or ('unknown', None)
+        """
+        try:
+            deadline = time.monotonic() + self.settle_timeout
+            status = conn.get_query_status(query_id)
+            while conn.is_still_running(status) and time.monotonic() < deadline:
+                time.sleep(self.settle_poll_interval)
+                status = conn.get_query_status(query_id)
+            name = str(getattr(status, 'name', status)).upper()
+            if name == 'SUCCESS':
+                cursor = conn.cursor()
+                cursor.get_results_from_sfqid(query_id)
+                return 'success', cursor.fetchone()
+            if name in _FAILED_STATUSES:
+                return 'failed', None
+            self.logger.warning(f"Query {query_id} is {name}")
+        except Exception as e:
+            self.logger.warning(f"Could not read the status of query {query_id}: {str(e)}")
+        return 'unknown', None
+
+    def run(self, fn: Callable, description: str = 'statement',
+            recover: Callable[[str], Tuple[str, object]] = None) -> Tuple[object, int, Exception]:
+        """
+        Call fn until it succeeds, fails with a non-retryable error or attempts run out
+
+        Transient errors happen before the statement runs or after Snowflake rolled it back, so
+        fn is simply called again. Uncertain (client-side) errors don't say whether the statement
+        committed, and calling fn again could apply it twice. For those, recover(query_id) gives
+        the server's outcome, normally via settle: ('success', result) ends the run with that
+        result, ('failed', _) allows the retry, anything else stops. Without recover, or without
+        a query id on the error (see execute_tracked), an uncertain error is not retried.
+
+        Returns:
+            (result, attempts, error) - error is None on success
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return fn(), attempt, None
+            except Exception as e:
+                if self.is_uncertain(e):
+                    query_id = getattr(e, 'sfqid', None)
+                    status, result = recover(query_id) if recover and query_id else ('unknown', None)
+                    if status == 'success':
+                        self.logger.warning(f"{description} reported an error but committed as {query_id}: {str(e)}")
+                        return result, attempt, None
+                    if status != 'failed':
+                        self.logger.error(f"{description} may have committed (query {query_id or 'unknown'}); "
+                                          f"not retrying: {str(e)}")
+                        return None, attempt, e
+                elif not self.is_transient(e):
+                    return None, attempt, e
+                if attempt == self.max_attempts:
+                    return None, attempt, e
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                self.logger.warning(
+                    f"{description} failed (attempt {attempt}/{self.max_attempts}), "
+                    f"retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+
+
+class _CommittingConnection(closing):
+    """Like contextlib.closing, but commits on success and rolls back on error first"""
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.thing.commit()
+        else:
+            self.thing.rollback()
+        return super().__exit__(exc_type, exc, tb)
+
+
+class RunJournal:
+    def __init__(self, path: str = 'parallel_update_runs.db'):
+        """
+        Local SQLite record of parallel update runs and the state of each partition
+
+        Partition states are 'pending', 'success' or 'error'. A run can be resumed from
+        another process later, re-executing only the partitions that didn't succeed.
+        Incremental jobs also keep their high-water mark here (see watermark.Watermark), and
+        micro-batched partitions their batches, so a resume continues from the first unfinished one.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    updater TEXT NOT NULL,
+                    update_sql TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS partitions (
+                    run_id TEXT NOT NULL REFERENCES runs(run_id),
+                    partition_id INTEGER NOT NULL,
+                    predicate TEXT NOT NULL,
+                    warehouse TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    rows_updated INTEGER,
+                    error TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (run_id, partition_id)
+                );
+                CREATE TABLE IF NOT EXISTS batches (
+                    run_id TEXT NOT NULL REFERENCES runs(run_id),
+                    partition_id INTEGER NOT NULL,
+                    batch_id INTEGER NOT NULL,
+                    predicate TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    rows_updated INTEGER,
+                    seconds REAL,
+                    error TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (run_id, partition_id, batch_id)
+                );
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    job TEXT PRIMARY KEY,
+                    column_name TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    run_id TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        return _CommittingConnection(sqlite3.connect(self.path, timeout=30))
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def start_run(self, updater: str, update_sql: str, predicates: List[str],
+                  warehouses: List[str] = None, options: Dict = None, run_id: str = None) -> str:
+        """Record a new run with all of its partitions pending and return its run_id (a new one if not given)"""
+        run_id = run_id or new_run_id()
+        now = self._now()
+        warehouses = warehouses or [None] * len(predicates)
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (run_id, updater, update_sql, json.dumps(options or {}), now, now))
+            db.executemany(
+                "INSERT INTO partitions VALUES (?, ?, ?, ?, 'pending', 0, NULL, NULL, ?)",
+                [(run_id, i, predicate, warehouses[i], now) for i, predicate in enumerate(predicates)])
+        return run_id
+
+    def record_partition(self, run_id: str, result: Dict):
+        """Store the outcome of one partition from its result dict, and the warehouse it ran on if given"""
+        with self._lock, self._connect() as db:
+            db.execute("""
+                UPDATE partitions
+                SET status = ?, attempts = attempts + ?, rows_updated = ?, error = ?,
+                    warehouse = COALESCE(?, warehouse), updated_at = ?
+                WHERE run_id = ? AND partition_id = ?
+                """, (result['status'], result.get('attempts', 1), result.get('rows_updated'),
+                      result.get('error'), result.get('warehouse'), self._now(), run_id, result['partition_id']))
+
+    def start_batches(self, run_id: str, partition_id: int, predicates: List[str]):
+        """Record the batches a partition was split into, all pending"""
+        now = self._now()
+        with self._lock, self._connect() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO batches VALUES (?, ?, ?, ?, 'pending', 0, NULL, NULL, NULL, ?)",
+                [(run_id, partition_id, i, predicate, now) for i, predicate in enumerate(predicates)])
+
+    def record_batch(self, run_id: str, partition_id: int, result: Dict):
+        """Store the outcome of one batch from its result dict"""
+        with self._lock, self._connect() as db:
+            db.execute("""
+                UPDATE batches
+                SET status = ?, attempts = attempts + ?, rows_updated = ?, seconds = ?, error = ?, updated_at = ?
+                WHERE run_id = ? AND partition_id = ? AND batch_id = ?
+                """, (result['status'], result.get('attempts', 1), result.get('rows_updated'),
+                      result.get('seconds'), result.get('error'), self._now(),
+                      run_id, partition_id, result['batch_id']))
+
+    def get_batches(self, run_id: str, partition_id: int) -> List[Dict]:
+        """The batches of a partition, in order; empty if it was never split"""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute("SELECT * FROM batches WHERE run_id = ? AND partition_id = ? ORDER BY batch_id",
+                              (run_id, partition_id)).fetchall()
+        return [dict(r) for r in rows]
+
+    def finish_run(self, run_id: str) -> str:
+        """
+        Mark the run 'success' if every partition succeeded, else 'incomplete'
+
+        A successful incremental run also moves its job's high-water mark, in the same transaction,
+        and any earlier unfinished run of the job (covered by a full refresh) becomes 'superseded'.
+        """
+        with self._lock, self._connect() as db:
+            unfinished = db.execute(
+                "SELECT COUNT(*) FROM partitions WHERE run_id = ? AND status != 'success'", (run_id,)
+            ).fetchone()[0]
+            status = 'success' if unfinished == 0 else 'incomplete'
+            now = self._now()
+            db.execute("UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?", (status, now, run_id))
+            row = db.execute("SELECT options FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            watermark = json.loads(row[0]).get('watermark') if row else None
+            if status == 'success' and watermark and watermark.get('high') is not None:
+                db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)",
+                           (watermark['job'], watermark['column'], watermark['high'], run_id, now))
+                db.execute("""
+                    UPDATE runs SET status = 'superseded', updated_at = ?
+                    WHERE status NOT IN ('success', 'superseded') AND run_id != ?
+                      AND json_extract(options, '$.watermark.job') = ?
+                    """, (now, run_id, watermark['job']))
+        return status
+
+    def get_run(self, run_id: str) -> Dict:
+        """The run and all of its partitions"""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            run = db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if run is None:
+                raise KeyError(f"Unknown run_id: {run_id}")
+            partitions = db.execute(
+                "SELECT * FROM partitions WHERE run_id = ? ORDER BY partition_id", (run_id,)).fetchall()
+        run = dict(run)
+        run['options'] = json.loads(run['options'])
+        run['partitions'] = [dict(p) for p in partitions]
+        return run
+
+    def get_watermark(self, job: str) -> Optional[Dict]:
+        """The job's high-water mark (column_name, value literal, run_id, updated_at), or None before its first run"""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM watermarks WHERE job = ?", (job,)).fetchone()
+        return dict(row) if row else None
+
+    def open_runs(self, job: str) -> List[str]:
+        """Runs of an incremental job that are still running or incomplete, oldest first"""
+        with self._connect() as db:
+            rows = db.execute("""
+                SELECT run_id FROM runs
+                WHERE status IN ('running', 'incomplete') AND json_extract(options, '$.watermark.job') = ?
+                ORDER BY created_at
+                """, (job,)).fetchall()
+        return [r[0] for r in rows]
+
+    def unfinished_partitions(self, run_id: str) -> List[Dict]:
+        """Partitions still pending or failed"""
+        return [p for p in self.get_run(run_id)['partitions'] if p['status'] != 'success']
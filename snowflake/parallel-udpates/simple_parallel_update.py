@@ -1,60 +1,313 @@
-import snowflake.connector
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List
+from contextlib import nullcontext
+from typing import Dict, List, Tuple, Union
 import logging
+import time
+
+from concurrency_controller import AIMDController
+from connection_pool import get_pool
+from cost_estimator import CostEstimator
+from micro_batch import MicroBatchPolicy
+from partition_planner import PartitionPlanner, table_from_update
+from query_profiler import QueryProfiler, tag_params
+from run_journal import RetryPolicy, RunJournal, execute_tracked, new_run_id
+from sql_template import SqlTemplate, bind_connection_params
+from staged_load import StagedLoader
+from update_fusion import fuse_updates
+from watermark import Watermark
 
 
 class SimpleParallelUpdater:
-    def __init__(self, connection_params: Dict):
-        """Initialize with Snowflake connection parameters"""
-        self.connection_params = connection_params
+    def __init__(self,
+                 connection_params: Dict,
+                 pool_options: Dict = None,
+                 planner: PartitionPlanner = None,
+                 journal: RunJournal = None,
+                 retry_policy: RetryPolicy = None,
+                 cost_estimator: CostEstimator = None,
+                 concurrency_controller: AIMDController = None,
+                 micro_batch: MicroBatchPolicy = None):
+        """
+        Initialize with Snowflake connection parameters
+
+        pool_options (min_size, max_size, max_idle_seconds, ...) configure the shared
+        session pool on first use; sessions are reused across partitions and calls.
+        planner decides how the table is split (range on search_dt by default).
+        journal, if given, records every run so failed partitions can be resumed;
+        retry_policy controls backoff for transient errors (lock waits, suspended warehouses).
+        cost_estimator is used by dry runs.
+        concurrency_controller, if given, caps how many partition statements run at once and
+        moves that cap with the lock wait and queueing it sees; use it with many more
+        partitions than the expected concurrency.
+        micro_batch, if given, runs each partition as key-range batches that commit one at a
+        time, so no single transaction holds the table lock for a whole partition.
+        Partition bounds are sent as bind values, so sessions use paramstyle='qmark' unless
+        connection_params sets another paramstyle.
+        """
+        self.connection_params = bind_connection_params(connection_params)
+        self.pool_options = pool_options or {}
+        self.planner = planner or PartitionPlanner()
+        self.journal = journal
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cost_estimator = cost_estimator or CostEstimator()
+        self.concurrency_controller = concurrency_controller
+        self.micro_batch = micro_batch
+        self.profiler = QueryProfiler()
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-    def _execute_update(self, partition_id: int, update_sql: str, num_partitions: int) -> Dict:
-        """Execute update for a single partition"""
-        conn = snowflake.connector.connect(**self.connection_params)
-        try:
+    def _plan_partitions(self, update_sql: str, num_partitions: int, partition_mode: str,
+                         table_name: str = None, where: str = None) -> Dict:
+        """Sample the key distribution once (only rows matching where, if given) and return the partition predicates"""
+        with get_pool(self.connection_params, **self.pool_options).connection() as conn:
+            return self.planner.plan(conn, table_name or table_from_update(update_sql),
+                                     num_partitions, mode=partition_mode, where=where)
+
+    def _watermark_window(self, update_sql: str, watermark: Watermark, table_name: str = None,
+                          full_refresh: bool = False) -> Dict:
+        """The slice of the table an incremental run covers (see Watermark.window)"""
+        if not self.journal:
+            raise ValueError("Incremental runs need the updater to be created with a journal")
+        with get_pool(self.connection_params, **self.pool_options).connection() as conn:
+            return watermark.window(conn, self.journal, table_name or table_from_update(update_sql),
+                                    update_sql, full_refresh)
+
+    def _partitioned_sql(self, update_sql: str, predicate: str) -> Tuple[str, List]:
+        """Statement text and bind values for one partition; the text is shared by same-shaped partitions"""
+        return SqlTemplate.parse(update_sql).render(predicate, paramstyle=self.connection_params['paramstyle'])
+
+    def _run_statement(self, partition_id: int, update_sql: str, predicate: str, run_id: str) -> Tuple:
+        """Run one partition (or batch) statement once; returns (rowcount, query_id, seconds)"""
+        controller = self.concurrency_controller
+        with controller.slot() if controller else nullcontext(), \
+                get_pool(self.connection_params, **self.pool_options).connection() as conn:
             cursor = conn.cursor()
-            partitioned_sql = f"""
-                {update_sql}
-                AND MOD(ABS(HASH(CONCAT(search_id, 
-                    TO_CHAR(search_dt, 'YYYY-MM-DD HH24:MI:SS')))), 
-                    {num_partitions}) = {partition_id}
-            """
-            cursor.execute(partitioned_sql)
-            return {
+            sql, params = self._partitioned_sql(update_sql, predicate)
+            started = time.monotonic()
+            try:
+                execute_tracked(cursor, sql, params, _statement_params=tag_params(run_id, partition_id))
+            except Exception:
+                if controller:
+                    controller.record(0, time.monotonic() - started, failed=True)
+                raise
+            elapsed = time.monotonic() - started
+            if controller:
+                stats = self.profiler.statement_stats(conn, cursor.sfqid)
+                controller.record(cursor.rowcount, elapsed, stats['lock_wait_seconds'], stats['queued_seconds'])
+            return cursor.rowcount, cursor.sfqid, elapsed
+
+    def _recover(self, query_id: str) -> Tuple[str, Tuple]:
+        """Server-side outcome of a statement whose client call failed, shaped like _run_statement's result"""
+        with get_pool(self.connection_params, **self.pool_options).connection() as conn:
+            status, row = self.retry_policy.settle(conn, query_id)
+        return status, ((row[0] if row else 0), query_id, 0.0)
+
+    def _execute_batches(self, partition_id: int, update_sql: str, predicate: str, run_id: str) -> Dict:
+        """
+        Execute one partition as micro-batches, each committed on its own, pausing between them
+
+        The batches are journaled when the partition is split, so a resumed partition reruns
+        only the batches that never committed, with the same key ranges.
+        """
+        policy = self.micro_batch
+        stored = self.journal.get_batches(run_id, partition_id) if self.journal else []
+        committed = {b['batch_id']: b['rows_updated'] or 0 for b in stored if b['status'] == 'success'}
+        predicates = [b['predicate'] for b in stored]
+        if not predicates:
+            try:
+                with get_pool(self.connection_params, **self.pool_options).connection() as conn:
+                    predicates = policy.plan(conn, update_sql, predicate, self.planner)
+            except Exception as e:
+                self.logger.error(f"Partition {partition_id} could not be split into batches: {str(e)}")
+                return {'partition_id': partition_id, 'status': 'error', 'error': str(e), 'attempts': 0}
+            if self.journal:
+                self.journal.start_batches(run_id, partition_id, predicates)
+
+        batches, attempts, error = [], 0, None
+        for batch_id, batch_predicate in enumerate(predicates):
+            if batch_id in committed:
+                continue
+            outcome, batch_attempts, error = self.retry_policy.run(
+                lambda: self._run_statement(partition_id, update_sql, batch_predicate, run_id),
+                f"Partition {partition_id} batch {batch_id}", recover=self._recover)
+            attempts += batch_attempts
+            if error is not None:
+                batch = {'batch_id': batch_id, 'status': 'error', 'error': str(error), 'attempts': batch_attempts}
+            else:
+                rows, query_id, seconds = outcome
+                batch = MicroBatchPolicy.batch_result(batch_id, rows, seconds, batch_attempts, query_id)
+                committed[batch_id] = rows
+            if self.journal:
+                self.journal.record_batch(run_id, partition_id, batch)
+            batches.append(batch)
+            if error is not None:
+                # Later batches stay pending; the committed ones are kept
+                self.logger.error(f"Partition {partition_id} stopped at batch {batch_id}: {str(error)}")
+                break
+            if batch_id < len(predicates) - 1:
+                pause = policy.pause(batch['rows_updated'], batch['seconds'])
+                if pause:
+                    time.sleep(pause)
+
+        seconds = sum(b.get('seconds') or 0 for b in batches)
+        result = {
+            'partition_id': partition_id,
+            'rows_updated': sum(committed.values()),
+            'status': 'success' if error is None else 'error',
+            'attempts': attempts,
+            'batches': batches,
+            'rows_per_second': sum(b.get('rows_updated') or 0 for b in batches) / seconds if seconds else None
+        }
+        if error is not None:
+            result['error'] = f"Batch {batches[-1]['batch_id']}: {str(error)}"
+        return result
+
+    def _execute_update(self, partition_id: int, update_sql: str, predicate: str, run_id: str) -> Dict:
+        """Execute update for a single partition, retrying transient errors"""
+        if self.micro_batch:
+            result = self._execute_batches(partition_id, update_sql, predicate, run_id)
+            if self.journal:
+                self.journal.record_partition(run_id, result)
+            result['run_id'] = run_id
+            return result
+
+        outcome, attempts, error = self.retry_policy.run(
+            lambda: self._run_statement(partition_id, update_sql, predicate, run_id), f"Partition {partition_id}",
+            recover=self._recover)
+        if error is None:
+            rows_updated, query_id, _ = outcome
+            result = {
                 'partition_id': partition_id,
-                'rows_updated': cursor.rowcount,
-                'status': 'success'
+                'rows_updated': rows_updated,
+                'status': 'success',
+                'attempts': attempts,
+                'query_id': query_id
             }
-        except Exception as e:
-            self.logger.error(f"Partition {partition_id} failed: {str(e)}")
-            return {
+        else:
+            self.logger.error(f"Partition {partition_id} failed: {str(error)}")
+            result = {
                 'partition_id': partition_id,
                 'status': 'error',
-                'error': str(e)
+                'error': str(error),
+                'attempts': attempts
             }
-        finally:
-            conn.close()
+        if self.journal:
+            self.journal.record_partition(run_id, result)
+        result['run_id'] = run_id
+        return result
 
-    def parallel_update(self, update_sql: str, num_partitions: int = 4) -> List[Dict]:
+    def _run_partitions(self, update_sql: str, partitions: List[Tuple[int, str]], run_id: str) -> List[Dict]:
+        """Run (partition_id, predicate) pairs concurrently"""
+        if not partitions:
+            return []
+        workers = len(partitions)
+        if self.concurrency_controller:
+            # Enough threads for the controller's ceiling; its slots decide how many run at once
+            workers = min(workers, self.concurrency_controller.max_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._execute_update, partition_id, update_sql, predicate, run_id)
+                for partition_id, predicate in partitions
+            ]
+            results = [future.result() for future in as_completed(futures)]
+        if self.concurrency_controller:
+            summary = self.concurrency_controller.summary()
+            self.logger.info(
+                f"Concurrency ended at {summary['final_concurrency']}; best was {summary['best_concurrency']} "
+                f"at {summary['best_rows_per_second']:,.0f} rows/s")
+        if self.journal:
+            status = self.journal.finish_run(run_id)
+            self.logger.info(f"Run {run_id} is {status}")
+        return results
+
+    def parallel_update(self,
+                        update_sql: str,
+                        num_partitions: int = 4,
+                        partition_mode: str = 'auto',
+                        table_name: str = None,
+                        dry_run: bool = False,
+                        watermark: Watermark = None,
+                        full_refresh: bool = False) -> Union[List[Dict], Dict]:
         """
         Execute update in parallel across partitions
 
         Args:
             update_sql: SQL UPDATE statement (without WHERE clause)
             num_partitions: Number of parallel updates to perform
+            partition_mode: 'range' (prunable ranges on the planner's column), 'hash'
+                            (MOD(HASH), for unclustered tables) or 'auto'
+            table_name: Table to sample for range mode; parsed from update_sql if omitted
+            dry_run: Only EXPLAIN the partition statements and return the cost estimate
+            watermark: Only update rows whose watermark column moved since the job's last successful
+                       run; the mark is kept in the journal and advanced when this run succeeds
+            full_refresh: With watermark, cover the whole table again and reset the mark
 
         Returns:
-            List of results for each partition
+            List of results for each partition (empty when an incremental run finds nothing new),
+            or the CostEstimator report when dry_run is set. With micro_batch, each result also
+            lists its batches with their rows, seconds and rows per second.
+            Each result carries the run_id that tags its query (QUERY_TAG) for QueryProfiler.
         """
-        with ThreadPoolExecutor(max_workers=num_partitions) as executor:
-            futures = [
-                executor.submit(self._execute_update, i, update_sql, num_partitions)
-                for i in range(num_partitions)
-            ]
-            return [future.result() for future in as_completed(futures)]
+        window = self._watermark_window(update_sql, watermark, table_name, full_refresh) if watermark else None
+        if window and window['empty']:
+            self.logger.info(f"Job {watermark.job}: no rows changed since {window['low']}, nothing to update")
+            return []
+        where = window['predicate'] if window else None
+        plan = self._plan_partitions(update_sql, num_partitions, partition_mode, table_name, where)
+        predicates = Watermark.restrict(plan['predicates'], window)
+        if dry_run:
+            with get_pool(self.connection_params, **self.pool_options).connection() as conn:
+                return self.cost_estimator.estimate(
+                    conn, update_sql, [SqlTemplate.parse(update_sql).inline(p) for p in predicates], plan['mode'])
+        run_id = new_run_id()
+        if self.journal:
+            options = {'watermark': Watermark.journal_options(window)} if window else None
+            run_id = self.journal.start_run('SimpleParallelUpdater', update_sql, predicates, options=options)
+        return self._run_partitions(update_sql, list(enumerate(predicates)), run_id)
+
+    def resume(self, run_id: str) -> List[Dict]:
+        """
+        Re-execute only the partitions of a journaled run that are pending or failed
+
+        An incremental run keeps the window it was planned with, and moves the job's mark once it succeeds.
+        """
+        if not self.journal:
+            raise ValueError("resume() needs the updater to be created with a journal")
+        run = self.journal.get_run(run_id)
+        pending = [(p['partition_id'], p['predicate']) for p in run['partitions'] if p['status'] != 'success']
+        self.logger.info(f"Resuming run {run_id}: {len(pending)} of {len(run['partitions'])} partitions left")
+        return self._run_partitions(run['update_sql'], pending, run_id)
+
+    def batch_update(self,
+                     update_sqls: List[str],
+                     num_partitions: int = 4,
+                     partition_mode: str = 'auto') -> List[Dict]:
+        """
+        Execute several independent UPDATEs on one table as a single fused UPDATE per partition
+
+        The statements are rewritten into CASE WHEN column expressions, so the table is scanned
+        num_partitions times in total rather than once per statement per partition.
+        Raises FusionConflictError if the statements set the same column or read each other's targets.
+        """
+        return self.parallel_update(fuse_updates(update_sqls), num_partitions, partition_mode)
+
+    def bulk_update(self,
+                    table_name: str,
+                    data,
+                    key_columns: List[str],
+                    update_columns: List[str] = None,
+                    insert_missing: bool = False,
+                    **loader_options) -> Dict:
+        """
+        Apply values computed in Python (DataFrame, Arrow table or record batches) with one MERGE
+
+        For updates that can't be written as SET expressions. The rows are staged as Parquet and
+        COPY'd into a temporary table first; loader_options (chunk_rows, compression, max_workers,
+        work_dir) are passed to StagedLoader.
+        """
+        loader = StagedLoader(self.connection_params, self.pool_options,
+                              retry_policy=self.retry_policy, **loader_options)
+        return loader.load_and_merge(table_name, data, key_columns, update_columns, insert_missing)
 
 
 # Example usage
@@ -93,21 +346,20 @@ if __name__ == "__main__":
         """
     ]
 
-    # Execute each update in parallel
-    for update_sql in updates:
-        print(f"\nExecuting update: {update_sql[:50]}...")
-        results = updater.parallel_update(update_sql, num_partitions=4)
+    # The updates touch different columns, so run them as one fused scan per partition
+    print(f"\nExecuting {len(updates)} updates as one batch...")
+    results = updater.batch_update(updates, num_partitions=4)
 
-        # Print results
-        total_rows = sum(r['rows_updated'] for r in results if r['status'] == 'success')
-        print(f"Total rows updated: {total_rows}")
+    # Print results
+    total_rows = sum(r['rows_updated'] for r in results if r['status'] == 'success')
+    print(f"Total rows updated: {total_rows}")
 
-        # Check for any errors
-        errors = [r for r in results if r['status'] == 'error']
-        if errors:
-            print("Errors encountered:")
-            for error in errors:
-                print(f"Partition {error['partition_id']}: {error['error']}")
+    # Check for any errors
+    errors = [r for r in results if r['status'] == 'error']
+    if errors:
+        print("Errors encountered:")
+        for error in errors:
+            print(f"Partition {error['partition_id']}: {error['error']}")
 
 # Examples of different types of updates:
 """
@@ -134,4 +386,23 @@ results = updater.parallel_update('''
     WHERE amount < 1000 
     AND date_column < DATEADD(day, -30, CURRENT_DATE())
 ''')
+
+# Example 5: Batches of about 500k rows per partition, committed one at a time with a pause in
+# between, so other writers on the table get the lock between batches
+updater = SimpleParallelUpdater(conn_params, micro_batch=MicroBatchPolicy(batch_rows=500000, pause_seconds=2))
+results = updater.parallel_update("UPDATE history SET status = 'PROCESSED' WHERE effective_date > '2022-10-01'")
+for batch in results[0]['batches']:
+    print(f"Batch {batch['batch_id']}: {batch['rows_updated']} rows at {batch['rows_per_second']:,.0f} rows/s")
+
+# Example 6: Recurring job that only touches rows loaded since its last successful run
+updater = SimpleParallelUpdater(conn_params, journal=RunJournal('update_runs.db'))
+nightly = Watermark('history_status', column='search_dt')
+results = updater.parallel_update(
+    "UPDATE history SET status = 'PROCESSED' WHERE effective_date > '2022-10-01'", watermark=nightly
+)
+# Once in a while (or after changing the statement), cover everything again
+results = updater.parallel_update(
+    "UPDATE history SET status = 'PROCESSED' WHERE effective_date > '2022-10-01'", watermark=nightly,
+    full_refresh=True
+)
 """
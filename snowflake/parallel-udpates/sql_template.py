@@ -0,0 +1,166 @@
+from typing import Dict, List, Tuple
+import functools
+import re
+
+from update_statement import blank_comments, find_keywords, mask_literals, mask_nested
+
+# Placeholder kept in compiled text until it is rendered for a connection's paramstyle
+_MARK = '\x00'
+_TARGET = re.compile(r"^\s*(UPDATE|DELETE\s+FROM|MERGE\s+INTO)\s+([\w.$\"]+)"
+                     r"(?:\s+(?:AS\s+)?(?!(?:SET|WHERE|USING)\b)([A-Za-z_]\w*))?", re.IGNORECASE)
+# A constant compared with something: = 'x', >= '2024-01-01'::TIMESTAMP_NTZ, = 3
+_COMPARED_CONSTANT = re.compile(
+    r"(?P<op><=|>=|<>|!=|=|<|>)\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+    r"(?![\w.]))(?P<cast>\s*::\s*[A-Za-z_]\w*(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?)?")
+# Words a grouping parenthesis can follow; any other word before '(' is a function name
+_GROUPING_WORDS = {'AND', 'OR', 'NOT', 'WHERE', 'ON', 'WHEN', 'THEN', 'ELSE', 'IN', 'EXISTS'}
+PARAMSTYLES = ('qmark', 'numeric', 'format', 'pyformat')
+
+
+def bind_connection_params(connection_params: Dict) -> Dict:
+    """
+    Connection parameters with paramstyle='qmark' unless the caller chose one
+
+    The connector's default (pyformat) interpolates bind values into the text on the client,
+    so Snowflake still sees a different statement per partition; qmark sends the values
+    separately and the text stays the same.
+    """
+    if 'paramstyle' in connection_params:
+        return connection_params
+    return {**connection_params, 'paramstyle': 'qmark'}
+
+
+def _outside_calls(text: str) -> List[bool]:
+    """Per character: True unless it is inside a literal or a function call's parentheses"""
+    masked = mask_literals(text)
+    flags = []
+    calls = []  # one entry per open parenthesis: True when it opened a function call
+    for i, ch in enumerate(masked):
+        if ch == '(':
+            word = re.search(r"([\w$]*)\s*$", masked[:i]).group(1)
+            calls.append(bool(word) and word.upper() not in _GROUPING_WORDS)
+        flags.append(not any(calls) and (ch != '#' or text[i] == '#'))
+        if ch == ')' and calls:
+            calls.pop()
+    return flags
+
+
+@functools.lru_cache(maxsize=1024)
+def bind_predicate(predicate: str) -> Tuple[str, tuple]:
+    """
+    Lift the constants a predicate compares against into bind parameters
+
+    "search_dt >= '2024-01-01'::TIMESTAMP_NTZ AND search_dt < '2024-02-01'::TIMESTAMP_NTZ" becomes
+    "search_dt >= ?::TIMESTAMP_NTZ AND search_dt < ?::TIMESTAMP_NTZ" (with the internal placeholder)
+    and the two timestamps, so every inner range partition shares one text. Constants elsewhere
+    (function arguments such as a TO_CHAR format, the MOD divisor) stay in the text.
+    """
+    outside = _outside_calls(predicate)
+    parts, params = [], []
+    position = 0
+    for match in _COMPARED_CONSTANT.finditer(predicate):
+        # Only comparisons in the predicate's own logic, not inside literals or function arguments
+        if not outside[match.start()]:
+            continue
+        parts.append(predicate[position:match.start('op')])
+        parts.append(f"{match.group('op')} {_MARK}{match.group('cast') or ''}")
+        if match.group('string') is not None:
+            params.append(match.group('string')[1:-1].replace("''", "'"))
+        else:
+            number = match.group('number')
+            params.append(int(number) if re.fullmatch(r"-?\d+", number) else float(number))
+        position = match.end()
+    parts.append(predicate[position:])
+    return ''.join(parts), tuple(params)
+
+
+class SqlTemplate:
+    def __init__(self, sql: str):
+        """
+        An UPDATE / DELETE / MERGE parsed once, rendered per partition as fixed text plus bind values
+
+        The target table is found by parsing the statement head, not by searching for its name,
+        so the same name inside a literal or a column is never touched. Use SqlTemplate.parse()
+        to share one parsed template per statement text.
+
+        Raises:
+            ValueError: If the statement has no UPDATE / DELETE FROM / MERGE INTO target
+        """
+        self.sql = sql.strip().rstrip(';').strip()
+        match = _TARGET.match(mask_nested(self.sql))
+        if not match:
+            raise ValueError(f"Cannot find the target table in statement: {self.sql[:80]}")
+        self.statement_type = match.group(1).split()[0].upper()
+        self.table = match.group(2)
+        self.alias = match.group(3)
+        self._table_span = match.span(2)
+        self._where = find_keywords(self.sql, ('WHERE',)).get('WHERE') if self.statement_type != 'MERGE' else None
+        self._compiled: Dict[tuple, str] = {}
+
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def parse(cls, sql: str) -> 'SqlTemplate':
+        """The shared template for a statement text; parsing and compiled texts are reused across runs"""
+        return cls(sql)
+
+    def _compile(self, predicate_text: str = None, bind_table: bool = False) -> str:
+        """Statement text with the internal placeholder for each bind value"""
+        key = (predicate_text, bind_table)
+        if key in self._compiled:
+            return self._compiled[key]
+        sql = self.sql
+        if predicate_text is not None:
+            if self.statement_type == 'MERGE':
+                raise ValueError("A partition predicate can't be added to a MERGE statement")
+            if self._where is None:
+                sql = f"{sql}\nWHERE ({predicate_text})"
+            else:
+                # Parenthesised, so an OR in the statement's own condition can't swallow the partition filter;
+                # comments go, or a trailing -- would swallow the closing parenthesis
+                condition = blank_comments(sql[self._where + len('WHERE'):]).strip()
+                sql = f"{sql[:self._where]}WHERE ({condition})\n  AND ({predicate_text})"
+        if bind_table:
+            start, end = self._table_span
+            # Keep the original name as the alias, so table.column references still resolve
+            alias = '' if self.alias else f" AS {self.table.split('.')[-1]}"
+            sql = f"{sql[:start]}IDENTIFIER({_MARK}){alias}{sql[end:]}"
+        self._compiled[key] = sql
+        return sql
+
+    @staticmethod
+    def render_text(text: str, paramstyle: str = 'qmark') -> str:
+        """Replace the internal placeholders with the connection's paramstyle"""
+        if paramstyle not in PARAMSTYLES:
+            raise ValueError(f"Unknown paramstyle: {paramstyle}")
+        if _MARK not in text:
+            return text
+        if paramstyle == 'qmark':
+            return text.replace(_MARK, '?')
+        if paramstyle == 'numeric':
+            pieces = text.split(_MARK)
+            return ''.join(piece + (f":{i + 1}" if i + 1 < len(pieces) else '') for i, piece in enumerate(pieces))
+        # format / pyformat interpolate with %, so literal percent signs have to be doubled
+        return text.replace('%', '%%').replace(_MARK, '%s')
+
+    def render(self, predicate: str = None, table: str = None, paramstyle: str = 'qmark') -> Tuple[str, List]:
+        """
+        Statement text and bind values for one partition
+
+        Args:
+            predicate: Partition predicate ANDed with the statement's WHERE; its compared constants
+                       become bind values (see bind_predicate)
+            table: Run against this table instead of the target, via IDENTIFIER(?)
+            paramstyle: The connection's paramstyle (qmark, numeric, format or pyformat)
+
+        Returns:
+            (sql, params) for cursor.execute(sql, params); the sql is the same for every
+            predicate of the same shape
+        """
+        predicate_text, params = bind_predicate(predicate) if predicate is not None else (None, ())
+        values = ([table] if table is not None else []) + list(params)
+        text = self._compile(predicate_text, table is not None)
+        return self.render_text(text, paramstyle), values
+
+    def inline(self, predicate: str = None) -> str:
+        """The same statement with the predicate written in, for EXPLAIN and logs"""
+        return self._compile(predicate)
@@ -0,0 +1,324 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from connection_pool import get_pool
+from query_profiler import tag_params
+from run_journal import RetryPolicy, new_run_id
+
+
+def record_batches(data, chunk_rows: int = 1000000) -> Iterator:
+    """
+    pyarrow RecordBatches from a pandas DataFrame, an Arrow Table / RecordBatch / RecordBatchReader,
+    or any iterable of those; DataFrames and tables are cut into batches of at most chunk_rows
+    """
+    import pyarrow as pa
+
+    if isinstance(data, pa.RecordBatch):
+        yield data
+    elif isinstance(data, pa.Table):
+        yield from data.to_batches(max_chunksize=chunk_rows)
+    elif type(data).__module__.split('.')[0] == 'pandas':
+        for start in range(0, len(data), chunk_rows):
+            yield pa.RecordBatch.from_pandas(data.iloc[start:start + chunk_rows], preserve_index=False)
+    else:
+        for item in data:
+            if isinstance(item, pa.RecordBatch):
+                yield item
+            else:
+                yield from record_batches(item, chunk_rows)
+
+
+def _chunks(batches: Iterator, chunk_rows: int) -> Iterator:
+    """Regroup batches into Arrow tables of chunk_rows rows (the last one shorter), all with the first schema"""
+    import pyarrow as pa
+
+    schema = None
+    pending, pending_rows = [], 0
+    for batch in batches:
+        piece = pa.Table.from_batches([batch])
+        if schema is None:
+            schema = piece.schema
+        elif not piece.schema.equals(schema):
+            # e.g. a pandas chunk whose column was all None, so typed as null
+            piece = piece.select(schema.names).cast(schema)
+        while piece.num_rows:
+            take = min(piece.num_rows, chunk_rows - pending_rows)
+            pending.append(piece.slice(0, take))
+            pending_rows += take
+            piece = piece.slice(take)
+            if pending_rows == chunk_rows:
+                yield pa.concat_tables(pending)
+                pending, pending_rows = [], 0
+    if pending_rows:
+        yield pa.concat_tables(pending)
+
+
+def _prepend(first, rest: Iterator) -> Iterator:
+    yield first
+    yield from rest
+
+
+class StagedLoader:
+    def __init__(self,
+                 connection_params: Dict,
+                 pool_options: Dict = None,
+                 warehouse: str = None,
+                 chunk_rows: int = 1000000,
+                 compression: str = 'zstd',
+                 max_workers: int = 4,
+                 work_dir: str = None,
+                 retry_policy: RetryPolicy = None):
+        """
+        Apply values computed in Python to a table with one set-based MERGE
+
+        The data is written as compressed Parquet files of chunk_rows rows by max_workers threads,
+        each file PUT to a temporary stage as soon as it is written and deleted locally, then
+        COPY'd into a temporary staging table and merged into the target in one statement.
+        At most max_workers + 1 chunks are held in memory, however many rows there are.
+
+        Args:
+            connection_params: Snowflake connection parameters
+            pool_options: Options for the shared session pool (min_size, max_size, connect, ...)
+            warehouse: Warehouse for the COPY and MERGE (default: the connection's)
+            chunk_rows: Rows per Parquet file; Snowflake loads files in parallel, so aim for 100-250 MB
+                        of compressed data per file
+            compression: Parquet codec ('zstd', 'snappy', 'gzip', ...)
+            max_workers: Files written and PUT at once
+            work_dir: Directory for the local Parquet files (default: a temporary directory)
+            retry_policy: Backoff for transient errors on the MERGE
+        """
+        self.connection_params = connection_params
+        self.pool_options = pool_options or {}
+        self.warehouse = warehouse
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.max_workers = max(1, max_workers)
+        self.work_dir = work_dir
+        self.retry_policy = retry_policy or RetryPolicy()
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _execute(conn, sql: str, statement_params: Dict = None) -> List[Dict]:
+        """Run a statement and return its result rows as dicts keyed by lower-case column name"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, _statement_params=statement_params)
+            columns = [d[0].lower() for d in cursor.description or []]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _write_and_put(self, conn, chunk, path: str, location: str, statement_params: Dict) -> Dict:
+        """Write one chunk as Parquet, PUT it to the stage and remove the local file"""
+        import pyarrow.parquet as pq
+
+        pq.write_table(chunk, path, compression=self.compression)
+        size = os.path.getsize(path)
+        try:
+            # Parquet is compressed inside the file; AUTO_COMPRESS would only gzip it again
+            self._execute(conn, f"PUT 'file://{path}' {location} AUTO_COMPRESS = FALSE OVERWRITE = TRUE",
+                          statement_params)
+        finally:
+            os.remove(path)
+        return {'rows': chunk.num_rows, 'bytes': size}
+
+    def _stage_chunks(self, conn, chunks: Iterator, work_dir: str, location: str, statement_params: Dict) -> Dict:
+        """Write and PUT every chunk, keeping at most max_workers in flight"""
+        totals = {'files': 0, 'rows': 0, 'bytes': 0}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = set()
+            for i, chunk in enumerate(chunks):
+                if len(running) >= self.max_workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._add_file(totals, future.result())
+                path = os.path.join(work_dir, f"part_{i:06d}.parquet")
+                running.add(executor.submit(self._write_and_put, conn, chunk, path, location, statement_params))
+            for future in running:
+                self._add_file(totals, future.result())
+        return totals
+
+    @staticmethod
+    def _add_file(totals: Dict, written: Dict):
+        totals['files'] += 1
+        totals['rows'] += written['rows']
+        totals['bytes'] += written['bytes']
+
+    @staticmethod
+    def merge_sql(table: str, staging_table: str, key_columns: List[str], update_columns: List[str],
+                  insert_columns: List[str] = None, only_changed: bool = True) -> str:
+        """
+        MERGE of the staging table into the target
+
+        only_changed adds IS DISTINCT FROM guards, so rows whose values are already right are not
+        rewritten and their micro-partitions are left alone.
+        """
+        condition = ' AND '.join(f"t.{k} = s.{k}" for k in key_columns)
+        clauses = []
+        if update_columns:
+            changed = ''
+            if only_changed:
+                changed = ' AND (' + ' OR '.join(f"t.{c} IS DISTINCT FROM s.{c}" for c in update_columns) + ')'
+            assignments = ', '.join(f"{c} = s.{c}" for c in update_columns)
+            clauses.append(f"WHEN MATCHED{changed} THEN UPDATE SET {assignments}")
+        if insert_columns:
+            clauses.append(f"WHEN NOT MATCHED THEN INSERT ({', '.join(insert_columns)}) "
+                           f"VALUES ({', '.join(f's.{c}' for c in insert_columns)})")
+        return f"""
+            MERGE INTO {table} t
+            USING {staging_table} s
+            ON {condition}
+            {' '.join(clauses)}
+            """
+
+    def load_and_merge(self,
+                       table: str,
+                       data,
+                       key_columns: List[str],
+                       update_columns: List[str] = None,
+                       insert_missing: bool = False,
+                       only_changed: bool = True) -> Dict:
+        """
+        Stage data and MERGE it into table on key_columns
+
+        Args:
+            table: Target table
+            data: pandas DataFrame, Arrow Table / RecordBatch / RecordBatchReader, or an iterable of
+                  any of those; column names must be columns of the target
+            key_columns: Columns identifying a row; each key must appear at most once in data
+            update_columns: Columns to set (default: every non-key column of data)
+            insert_missing: Insert rows whose key is not in the target
+            only_changed: Skip matched rows whose values already equal the new ones
+
+        Returns:
+            Dictionary with status, run_id, table, files, rows_staged, bytes_written, rows_updated,
+            rows_inserted, attempts and per-phase seconds; error on failure
+        """
+        key_columns = [k.lower() for k in key_columns]
+        if not key_columns:
+            raise ValueError("key_columns is empty")
+        run_id = new_run_id()
+        started = time.monotonic()
+        seconds = {}
+        result = {'run_id': run_id, 'table': table, 'files': 0, 'rows_staged': 0, 'bytes_written': 0,
+                  'rows_updated': 0, 'rows_inserted': 0, 'attempts': 0}
+
+        chunks = _chunks(record_batches(data, self.chunk_rows), self.chunk_rows)
+        first = next(chunks, None)
+        if first is None:
+            self.logger.info(f"No rows to load into {table}")
+            return {**result, 'status': 'success', 'seconds': {'total': 0.0}}
+        columns = [name.lower() for name in first.schema.names]
+        bad = [c for c in columns if not re.fullmatch(r"[a-z_]\w*", c)]
+        if bad:
+            raise ValueError(f"Column names must be plain identifiers: {bad}")
+        missing_keys = [k for k in key_columns if k not in columns]
+        if missing_keys:
+            raise ValueError(f"Key columns not in data: {missing_keys}")
+        if update_columns is None:
+            update_columns = [c for c in columns if c not in key_columns]
+        update_columns = [c.lower() for c in update_columns]
+        if not update_columns and not insert_missing:
+            raise ValueError("Nothing to merge: no update_columns and insert_missing is False")
+
+        suffix = run_id.replace('-', '')[:12]
+        staging_table = f"{table.split('.')[-1]}_stage_{suffix}"
+        stage = f"bulk_{suffix}"
+        work_dir = tempfile.mkdtemp(prefix='staged_load_', dir=self.work_dir)
+        pool = get_pool(self.connection_params, self.warehouse, **self.pool_options)
+        # The stage and staging table are TEMPORARY, so every step runs on this one session
+        with pool.connection() as conn:
+            try:
+                self._execute(conn, f"CREATE TEMPORARY STAGE {stage} FILE_FORMAT = (TYPE = PARQUET)")
+                self._execute(conn, f"CREATE TEMPORARY TABLE {staging_table} AS "
+                                    f"SELECT {', '.join(columns)} FROM {table} LIMIT 0")
+
+                phase_started = time.monotonic()
+                totals = self._stage_chunks(conn, _prepend(first, chunks), work_dir, f"@{stage}/{run_id}/",
+                                            tag_params(run_id, warehouse=self.warehouse, phase='put'))
+                seconds['write_put'] = time.monotonic() - phase_started
+                result.update(files=totals['files'], bytes_written=totals['bytes'])
+
+                phase_started = time.monotonic()
+                loaded = self._execute(
+                    conn,
+                    f"COPY INTO {staging_table} FROM @{stage}/{run_id}/ FILE_FORMAT = (TYPE = PARQUET) "
+                    f"MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE ON_ERROR = ABORT_STATEMENT PURGE = TRUE",
+                    tag_params(run_id, warehouse=self.warehouse, phase='copy'))
+                seconds['copy'] = time.monotonic() - phase_started
+                result['rows_staged'] = sum(row.get('rows_loaded') or 0 for row in loaded)
+                if result['rows_staged'] != totals['rows']:
+                    raise RuntimeError(f"COPY loaded {result['rows_staged']} of the {totals['rows']} rows written")
+
+                keys = ', '.join(key_columns)
+                duplicates = self._execute(conn, f"SELECT COUNT(*) AS n FROM (SELECT {keys} FROM {staging_table} "
+                                                 f"GROUP BY {keys} HAVING COUNT(*) > 1) d")[0]['n']
+                if duplicates:
+                    raise ValueError(f"{duplicates} keys appear more than once in the data; "
+                                     f"the MERGE would be nondeterministic")
+
+                merge_sql = self.merge_sql(table, staging_table, key_columns, update_columns,
+                                           columns if insert_missing else None, only_changed)
+                phase_started = time.monotonic()
+                merged, attempts, error = self.retry_policy.run(
+                    lambda: self._execute(conn, merge_sql, tag_params(run_id, warehouse=self.warehouse,
+                                                                      phase='merge')),
+                    f"MERGE into {table}")
+                seconds['merge'] = time.monotonic() - phase_started
+                result['attempts'] = attempts
+                if error:
+                    raise error
+                result['rows_updated'] = merged[0].get('number of rows updated', 0)
+                result['rows_inserted'] = merged[0].get('number of rows inserted', 0)
+                result['status'] = 'success'
+                self.logger.info(f"Merged {result['rows_staged']} staged rows from {result['files']} files into "
+                                 f"{table}: {result['rows_updated']} updated, {result['rows_inserted']} inserted")
+            except Exception as e:
+                self.logger.error(f"Staged load into {table} failed: {str(e)}")
+                result.update(status='error', error=str(e))
+            finally:
+                for cleanup in (f"DROP TABLE IF EXISTS {staging_table}", f"DROP STAGE IF EXISTS {stage}"):
+                    try:
+                        self._execute(conn, cleanup)
+                    except Exception as e:
+                        self.logger.warning(f"Cleanup failed ({cleanup}): {str(e)}")
+                shutil.rmtree(work_dir, ignore_errors=True)
+        seconds['total'] = time.monotonic() - started
+        result['seconds'] = seconds
+        return result
+
+
+# Example usage
+if __name__ == "__main__":
+    import pyarrow as pa
+
+    connection_params = {
+        'user': 'your_username',
+        'password': 'your_password',
+        'account': 'your_account',
+        'warehouse': 'your_warehouse',
+        'database': 'your_database',
+        'schema': 'your_schema'
+    }
+
+    # New values computed in Python, streamed in batches rather than built as one table
+    def scored_batches():
+        for start in range(0, 10000000, 500000):
+            ids = list(range(start, start + 500000))
+            yield pa.RecordBatch.from_pydict({
+                'search_id': ids,
+                'amount': [(i % 1000) * 1.5 for i in ids],
+                'status': ['RESCORED'] * len(ids)
+            })
+
+    loader = StagedLoader(connection_params, chunk_rows=2000000, max_workers=4)
+    result = loader.load_and_merge('your_table', scored_batches(), key_columns=['search_id'])
+    print(f"{result['status']}: {result['rows_staged']} rows staged in {result['files']} files, "
+          f"{result['rows_updated']} rows updated in {result['seconds'].get('merge', 0):.1f}s")
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# The modules are run as scripts from their own directory and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connection_pool import close_all_pools  # noqa: E402
+from local_backend import LocalBackend  # noqa: E402
+
+
+HISTORY_ROWS = 2000
+
+
+@pytest.fixture
+def backend():
+    """LocalBackend with a clustered history table; pools are closed afterwards so each test logs in afresh"""
+    backend = LocalBackend(lock_mode='none')
+    backend.create_history_table('history', rows=HISTORY_ROWS)
+    close_all_pools()
+    yield backend
+    close_all_pools()
+    backend.close()
+
+
+@pytest.fixture
+def connection_params(backend):
+    return {'account': 'local', 'user': 'tests', 'database': backend.path}
+
+
+@pytest.fixture
+def pool_options(backend):
+    return {'connect': backend.connect, 'max_size': 4}
+
+
+@pytest.fixture
+def scalar(backend):
+    """scalar(sql): first column of the first row of a query, on a session of its own"""
+    def run(sql: str):
+        conn = backend.connect(account='local', database=backend.path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+        finally:
+            conn.close()
+    return run
@@ -0,0 +1,185 @@
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool, PoolTimeoutError, close_all_pools, get_pool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise Exception("Connection reset by peer")
+        self.conn.statements.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, **params):
+        self.params = params
+        self.closed = False
+        self.broken = False
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened():
+    """Connection factory recording every session it opens"""
+    sessions = []
+
+    def connect(**params):
+        sessions.append(FakeConnection(**params))
+        return sessions[-1]
+    connect.sessions = sessions
+    return connect
+
+
+@pytest.fixture(autouse=True)
+def no_shared_pools():
+    close_all_pools()
+    yield
+    close_all_pools()
+
+
+def test_min_size_sessions_open_up_front(opened):
+    ConnectionPool({'account': 'a'}, warehouse='WH1', min_size=2, connect=opened)
+
+    assert len(opened.sessions) == 2
+    assert all(s.params['warehouse'] == 'WH1' for s in opened.sessions)
+
+
+def test_released_session_is_reused(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=2, connect=opened)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert pool.metrics()['created'] == 1
+    assert pool.metrics()['reused'] == 1
+
+
+def test_acquire_times_out_at_max_size(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=1, connect=opened)
+    pool.acquire()
+
+    started = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+
+
+def test_waiter_gets_the_released_session(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=1, connect=opened)
+    conn = pool.acquire()
+    threading.Timer(0.05, pool.release, [conn]).start()
+
+    assert pool.acquire(timeout=5) is conn
+    assert pool.metrics()['max_wait_seconds'] > 0
+
+
+def test_grow_wakes_waiters(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=1, connect=opened)
+    pool.acquire()
+    threading.Timer(0.05, pool.grow, [2]).start()
+
+    second = pool.acquire(timeout=5)
+    assert second is opened.sessions[1]
+    assert pool.max_size == 2
+
+
+def test_grow_never_shrinks(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=4, connect=opened)
+    pool.grow(2)
+
+    assert pool.max_size == 4
+
+
+def test_closed_session_is_replaced(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=1, max_size=1, connect=opened)
+    opened.sessions[0].closed = True
+
+    conn = pool.acquire()
+    assert conn is opened.sessions[1]
+    assert pool.metrics()['failed_health_checks'] == 1
+    assert pool.metrics()['open'] == 1
+
+
+def test_stale_session_is_pinged_before_reuse(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=1, max_size=1, health_check_interval=0, connect=opened)
+    opened.sessions[0].broken = True
+
+    assert pool.acquire() is opened.sessions[1]
+    assert opened.sessions[0].closed
+
+
+def test_failed_login_frees_its_slot(opened):
+    attempts = []
+
+    def connect(**params):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Exception("390100: Incorrect username or password")
+        return opened(**params)
+
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=1, connect=connect)
+    with pytest.raises(Exception):
+        pool.acquire()
+    assert pool.acquire(timeout=0.1) is opened.sessions[0]
+
+
+def test_discarded_session_is_closed(opened):
+    pool = ConnectionPool({'account': 'a'}, min_size=0, max_size=1, connect=opened)
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+
+    assert conn.closed
+    assert pool.metrics()['open'] == 0
+
+
+def test_invalid_sizes(opened):
+    with pytest.raises(ValueError):
+        ConnectionPool({'account': 'a'}, min_size=3, max_size=2, connect=opened)
+
+
+def test_get_pool_is_shared_per_warehouse_and_grows(opened):
+    first = get_pool({'account': 'a'}, 'WH1', min_size=0, max_size=2, connect=opened)
+
+    assert get_pool({'account': 'a'}, 'WH1', connect=opened) is first
+    assert get_pool({'account': 'a'}, 'WH2', min_size=0, connect=opened) is not first
+    assert get_pool({'account': 'a'}, 'WH1', max_size=6, connect=opened) is first
+    assert first.max_size == 6
+
+
+def test_concurrent_get_pool_keeps_one_pool(opened):
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def get():
+        barrier.wait()
+        pools.append(get_pool({'account': 'a'}, 'WH1', min_size=1, connect=opened))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(p) for p in pools}) == 1
+    # Pools that lost the race were closed, along with the session each opened
+    assert sum(not s.closed for s in opened.sessions) == 1
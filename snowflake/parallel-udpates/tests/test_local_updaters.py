@@ -0,0 +1,85 @@
+import pytest
+
+from async_engine import AsyncUpdateEngine
+from multi_warehouse_parallel import MultiWarehouseUpdater
+from parallel_update_using_temp_tables import TempTableParallelUpdater
+from run_journal import RunJournal
+from simple_parallel_update import SimpleParallelUpdater
+
+
+UPDATE = "UPDATE history SET amount = amount + 1, status = 'PROCESSED' WHERE effective_date >= '2023-01-01'"
+# create_history_table spreads 2000 rows over 2022-2023, so half of them match
+MATCHING = 1000
+
+
+@pytest.fixture
+def before(scalar):
+    return scalar("SELECT SUM(amount) FROM history")
+
+
+def assert_updated_once(scalar, before):
+    """Every matching row got exactly one +1: none skipped, none updated by two partitions"""
+    assert scalar("SELECT SUM(amount) FROM history") == pytest.approx(before + MATCHING)
+    assert scalar("SELECT COUNT(*) FROM history WHERE effective_date >= '2023-01-01' AND status = 'PENDING'") == 0
+
+
+@pytest.mark.parametrize('mode', ['range', 'hash'])
+def test_simple_updater(connection_params, pool_options, scalar, before, mode):
+    results = SimpleParallelUpdater(connection_params, pool_options=pool_options).parallel_update(
+        UPDATE, num_partitions=4, partition_mode=mode)
+
+    assert all(r['status'] == 'success' for r in results)
+    assert sum(r['rows_updated'] for r in results) == MATCHING
+    assert len({r['run_id'] for r in results}) == 1
+    assert_updated_once(scalar, before)
+
+
+def test_simple_updater_with_commented_where(connection_params, pool_options, scalar, before):
+    update = UPDATE + "  -- only the second year\n"
+    results = SimpleParallelUpdater(connection_params, pool_options=pool_options).parallel_update(
+        update, num_partitions=4, partition_mode='range')
+
+    assert all(r['status'] == 'success' for r in results)
+    assert_updated_once(scalar, before)
+
+
+def test_simple_updater_resume(connection_params, pool_options, scalar, before, tmp_path):
+    journal = RunJournal(str(tmp_path / 'runs.db'))
+    updater = SimpleParallelUpdater(connection_params, pool_options=pool_options, journal=journal)
+    results = updater.parallel_update(UPDATE, num_partitions=4, partition_mode='range')
+    run_id = results[0]['run_id']
+
+    assert journal.get_run(run_id)['status'] == 'success'
+    # Nothing is left to redo, so resuming doesn't apply the update a second time
+    assert updater.resume(run_id) == []
+    assert_updated_once(scalar, before)
+
+
+def test_multi_warehouse_updater(connection_params, pool_options, scalar, before):
+    results = MultiWarehouseUpdater(connection_params, pool_options=pool_options).parallel_update(
+        UPDATE, num_partitions=4, warehouses=['WH1', 'WH2', 'WH1', 'WH2'], partition_mode='range')
+
+    assert all(r['status'] == 'success' for r in results)
+    # Results come back as partitions finish; each ran on the warehouse given for it
+    assert {r['partition_id']: r['warehouse'] for r in results} == {0: 'WH1', 1: 'WH2', 2: 'WH1', 3: 'WH2'}
+    assert_updated_once(scalar, before)
+
+
+def test_temp_table_updater(connection_params, pool_options, scalar, before):
+    result = TempTableParallelUpdater(connection_params, pool_options=pool_options).parallel_update(
+        'history', UPDATE.replace('history', 'your_table'), num_partitions=4, partition_mode='range')
+
+    assert result['status'] == 'success'
+    assert all(r['status'] == 'success' for r in result['partition_results'])
+    assert_updated_once(scalar, before)
+
+
+def test_async_engine(connection_params, pool_options, scalar, before):
+    engine = AsyncUpdateEngine(connection_params, max_in_flight=2, pool_options=pool_options, poll_interval=0.01)
+    results = engine.run(UPDATE, num_partitions=8, warehouses=['WH1', 'WH2'], partition_mode='range',
+                         run_id='async-test')
+
+    assert all(r['status'] == 'success' for r in results)
+    assert {r['run_id'] for r in results} == {'async-test'}
+    assert sum(r['rows_updated'] for r in results) == MATCHING
+    assert_updated_once(scalar, before)
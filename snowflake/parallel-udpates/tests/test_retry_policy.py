@@ -0,0 +1,126 @@
+import pytest
+
+from run_journal import TRANSIENT_ERROR_PATTERNS, RetryPolicy
+
+
+class QueryError(Exception):
+    """Connector-style error carrying the query id"""
+
+    def __init__(self, message: str, sfqid: str = None):
+        super().__init__(message)
+        self.sfqid = sfqid
+
+
+def failing(message: str):
+    def fn():
+        raise Exception(message)
+    return fn
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0)
+
+
+@pytest.mark.parametrize('message', [
+    "000625 (57014): Statement '01b2' has locked table 'HISTORY' in transaction 1 and this lock has not yet been released",
+    "000625 (57014): Number of waiters for this lock exceeds the 20 statements limit",
+    "000606 (57P03): Warehouse 'WH1' is suspended",
+    "Warehouse 'WH1' cannot be resumed because resource monitor has exceeded its quota",
+    "390114 (08001): Authentication token has expired. The user must authenticate again.",
+])
+def test_transient(policy, message):
+    error = Exception(message)
+    assert policy.is_transient(error)
+    assert not policy.is_uncertain(error)
+
+
+@pytest.mark.parametrize('message', [
+    "390102 (08004): User temporarily locked.",
+    "000604 (57014): SQL execution canceled",
+    "000630 (57014): Statement reached its statement or warehouse timeout of 60 second(s) and was canceled.",
+    "002003 (42S02): SQL compilation error: Object 'HISTORY' does not exist or not authorized.",
+    "100038 (22018): Numeric value 'abc' is not recognized",
+    "000606 (57P03): No active warehouse selected in the current session.",
+])
+def test_not_retried(policy, message):
+    error = Exception(message)
+    assert not policy.is_transient(error)
+    assert not policy.is_uncertain(error)
+
+
+@pytest.mark.parametrize('message', [
+    "Read timed out. (read timeout=600)",
+    "('Connection aborted.', ConnectionResetError(104, 'Connection reset by peer'))",
+    "[Errno 32] Broken pipe",
+    "503 Service Unavailable",
+])
+def test_uncertain(policy, message):
+    assert policy.is_uncertain(Exception(message))
+
+
+def test_cancels_are_opt_in():
+    policy = RetryPolicy(transient_patterns=TRANSIENT_ERROR_PATTERNS + ('000604',))
+    assert policy.is_transient(Exception("000604 (57014): SQL execution canceled"))
+
+
+def test_run_retries_transient_errors(policy):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Exception("Warehouse 'WH1' is suspended")
+        return 'done'
+
+    assert policy.run(fn) == ('done', 3, None)
+
+
+def test_run_gives_up_after_max_attempts(policy):
+    result, attempts, error = policy.run(failing("000625 lock wait timeout"))
+
+    assert (result, attempts) == (None, 3)
+    assert '000625' in str(error)
+
+
+def test_run_stops_on_permanent_errors(policy):
+    result, attempts, error = policy.run(failing("SQL compilation error"))
+
+    assert (result, attempts) == (None, 1)
+
+
+def test_uncertain_error_without_recover_is_not_retried(policy):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise QueryError("Read timed out.", sfqid='q1')
+
+    result, attempts, error = policy.run(fn)
+    assert (result, attempts, len(calls)) == (None, 1, 1)
+
+
+@pytest.mark.parametrize('outcome, expected', [
+    (('success', (5,)), ((5,), 1, False)),    # It committed: its result, no second run
+    (('failed', None), ('rerun', 2, False)),  # It rolled back: safe to run again
+    (('unknown', None), (None, 1, True)),     # Can't tell: stop rather than risk applying it twice
+])
+def test_uncertain_error_settles_before_retrying(policy, outcome, expected):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise QueryError("('Connection aborted.', ConnectionResetError(104, 'Connection reset by peer'))",
+                             sfqid='q1')
+        return 'rerun'
+
+    seen = []
+
+    def recover(query_id):
+        seen.append(query_id)
+        return outcome
+
+    result, attempts, error = policy.run(fn, recover=recover)
+    assert (result, attempts, error is not None) == expected
+    assert seen == ['q1']
@@ -0,0 +1,105 @@
+import pytest
+
+from sql_template import SqlTemplate, bind_connection_params, bind_predicate
+
+
+RANGE = "search_dt >= '2024-01-01'::TIMESTAMP_NTZ AND search_dt < '2024-02-01'::TIMESTAMP_NTZ"
+
+
+def test_bind_predicate_lifts_compared_constants():
+    text, params = bind_predicate(RANGE)
+
+    assert "'" not in text
+    assert text.count('::TIMESTAMP_NTZ') == 2
+    assert params == ('2024-01-01', '2024-02-01')
+
+
+def test_bind_predicate_keeps_function_arguments():
+    text, params = bind_predicate("MOD(ABS(HASH(CONCAT(search_id, TO_CHAR(search_dt, 'YYYY-MM-DD')))), 8) = 3")
+
+    assert "'YYYY-MM-DD'" in text
+    assert ', 8)' in text
+    assert params == (3,)
+
+
+def test_bind_predicate_values():
+    assert bind_predicate("status = 'it''s'")[1] == ("it's",)
+    assert bind_predicate("amount > -1.5")[1] == (-1.5,)
+    assert bind_predicate("col1 LIKE 'a = 1'")[1] == ()
+
+
+def test_same_shaped_partitions_share_text():
+    template = SqlTemplate("UPDATE history SET status = 'DONE' WHERE status = 'PENDING'")
+    first, first_params = template.render(RANGE)
+    second, second_params = template.render(
+        "search_dt >= '2024-02-01'::TIMESTAMP_NTZ AND search_dt < '2024-03-01'::TIMESTAMP_NTZ")
+
+    assert first == second
+    assert first_params != second_params
+
+
+@pytest.mark.parametrize('paramstyle, marker', [('qmark', '?'), ('numeric', ':1'), ('format', '%s'), ('pyformat', '%s')])
+def test_render_paramstyles(paramstyle, marker):
+    sql, params = SqlTemplate("UPDATE history SET status = 'DONE'").render("search_id = 7", paramstyle=paramstyle)
+
+    assert sql.endswith(f"WHERE (search_id = {marker})")
+    assert params == [7]
+
+
+def test_render_doubles_percent_for_format_styles():
+    sql, _ = SqlTemplate("UPDATE history SET col1 = 'a%'").render("search_id = 7", paramstyle='pyformat')
+
+    assert "'a%%'" in sql
+
+
+def test_render_parenthesises_the_statement_condition():
+    sql, _ = SqlTemplate("UPDATE history SET status = 'DONE' WHERE status = 'A' OR status = 'B'").render("search_id = 1")
+
+    assert "WHERE (status = 'A' OR status = 'B')\n  AND (search_id = ?)" in sql
+
+
+def test_render_drops_a_trailing_comment():
+    sql, _ = SqlTemplate("UPDATE history SET status = 'DONE' WHERE status = 'A' -- note, 'x'\n").render("search_id = 1")
+
+    assert '--' not in sql
+    assert sql.endswith("AND (search_id = ?)")
+
+
+def test_render_against_another_table():
+    sql, params = SqlTemplate("UPDATE db.s.history SET status = 'DONE' WHERE history.status = 'A'").render(
+        "search_id = 1", table='tmp_history_0')
+
+    assert sql.startswith("UPDATE IDENTIFIER(?) AS history SET")
+    assert params == ['tmp_history_0', 1]
+
+
+def test_target_is_parsed_from_the_head():
+    template = SqlTemplate("UPDATE history h SET col1 = 'UPDATE other SET' WHERE h.search_id > 0;")
+
+    assert (template.statement_type, template.table, template.alias) == ('UPDATE', 'history', 'h')
+
+
+def test_merge_takes_no_predicate():
+    template = SqlTemplate("MERGE INTO history t USING staged s ON t.search_id = s.search_id "
+                           "WHEN MATCHED THEN UPDATE SET t.status = s.status")
+    with pytest.raises(ValueError):
+        template.render("search_id = 1")
+
+
+def test_unparseable_statement():
+    with pytest.raises(ValueError):
+        SqlTemplate("SELECT * FROM history")
+
+
+def test_inline_keeps_literals():
+    assert SqlTemplate("DELETE FROM history").inline("search_id = 1") == "DELETE FROM history\nWHERE (search_id = 1)"
+
+
+def test_parse_is_shared():
+    sql = "UPDATE history SET status = 'DONE'"
+    assert SqlTemplate.parse(sql) is SqlTemplate.parse(sql)
+
+
+def test_bind_connection_params():
+    assert bind_connection_params({'account': 'a'})['paramstyle'] == 'qmark'
+    assert bind_connection_params({'account': 'a', 'paramstyle': 'pyformat'})['paramstyle'] == 'pyformat'
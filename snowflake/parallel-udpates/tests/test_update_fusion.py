@@ -0,0 +1,56 @@
+import pytest
+
+from update_fusion import FusionConflictError, fuse_updates
+
+
+def test_independent_updates_fuse():
+    sql = fuse_updates([
+        "UPDATE history SET status = 'PROCESSED' WHERE status = 'PENDING'",
+        "UPDATE history SET amount = amount * 1.1 WHERE category = 'STANDARD'",
+    ])
+
+    assert "status = CASE WHEN (status = 'PENDING') THEN 'PROCESSED' ELSE status END" in sql
+    assert "amount = CASE WHEN (category = 'STANDARD') THEN amount * 1.1 ELSE amount END" in sql
+    assert "WHERE ((status = 'PENDING') OR (category = 'STANDARD'))" in sql
+
+
+def test_update_without_where_covers_every_row():
+    sql = fuse_updates(["UPDATE history SET col1 = 'x'", "UPDATE history SET amount = 0 WHERE amount < 0"])
+
+    assert "CASE WHEN TRUE THEN 'x' ELSE col1 END" in sql
+
+
+def test_comments_in_where_are_dropped():
+    sql = fuse_updates(["UPDATE history SET col1 = 'x' WHERE amount > 0 -- positive\n",
+                        "UPDATE history SET status = 'A' WHERE amount < 0 /* negative */"])
+
+    assert '--' not in sql and '/*' not in sql
+
+
+@pytest.mark.parametrize('statements', [
+    # Same column assigned twice
+    ["UPDATE history SET status = 'A' WHERE amount > 0", "UPDATE history SET status = 'B' WHERE amount < 0"],
+    # The second reads what the first writes
+    ["UPDATE history SET status = 'A' WHERE amount > 0", "UPDATE history SET amount = 0 WHERE status = 'A'"],
+    # The first reads what the second writes, in its SET expression
+    ["UPDATE history SET col1 = status", "UPDATE history SET status = 'A'"],
+    # Different tables
+    ["UPDATE history SET status = 'A'", "UPDATE other SET status = 'B'"],
+    # A join
+    ["UPDATE history SET status = s.status FROM staged s WHERE history.search_id = s.search_id",
+     "UPDATE history SET amount = 0"],
+    # An aliased target
+    ["UPDATE history h SET status = 'A'", "UPDATE history SET amount = 0"],
+])
+def test_conflicts_are_refused(statements):
+    with pytest.raises(FusionConflictError):
+        fuse_updates(statements)
+
+
+def test_conflict_is_a_value_error():
+    assert issubclass(FusionConflictError, ValueError)
+
+
+def test_nothing_to_fuse():
+    with pytest.raises(ValueError):
+        fuse_updates([])
@@ -0,0 +1,74 @@
+from typing import List
+
+from update_statement import parse_update, referenced_identifiers
+
+
+class FusionConflictError(ValueError):
+    """Raised when UPDATE statements can't be combined without changing their result"""
+
+
+def fuse_updates(update_sqls: List[str]) -> str:
+    """
+    Combine independent UPDATE statements on one table into a single UPDATE
+
+        UPDATE t SET a = x WHERE c1;  UPDATE t SET b = y WHERE c2
+    becomes
+        UPDATE t SET a = CASE WHEN (c1) THEN x ELSE a END,
+                     b = CASE WHEN (c2) THEN y ELSE b END
+        WHERE ((c1) OR (c2))
+
+    so the table is scanned once instead of once per statement. Statements are only
+    fused when running them together gives the same result as running them in order:
+    same target table, no FROM clause, no column assigned twice, and no statement
+    reading a column another one assigns.
+
+    Raises:
+        FusionConflictError: if the statements can't be fused safely
+    """
+    if not update_sqls:
+        raise ValueError("No UPDATE statements to fuse")
+    parsed = [parse_update(sql) for sql in update_sqls]
+
+    tables = {p['table'].lower() for p in parsed}
+    if len(tables) > 1:
+        raise FusionConflictError(f"Statements target different tables: {sorted(tables)}")
+    for i, p in enumerate(parsed):
+        if p['from']:
+            raise FusionConflictError(f"Statement {i} joins other tables (FROM {p['from']}); run it on its own")
+        if p['alias']:
+            raise FusionConflictError(f"Statement {i} aliases the target table; remove the alias to fuse it")
+
+    assigned = {}
+    for i, p in enumerate(parsed):
+        for column, _ in p['assignments']:
+            key = column.lower().strip('"')
+            if key in assigned:
+                raise FusionConflictError(
+                    f"Column {column} is set by statements {assigned[key]} and {i}")
+            assigned[key] = i
+
+    for i, p in enumerate(parsed):
+        reads = referenced_identifiers(p['where'])
+        for _, expression in p['assignments']:
+            reads |= referenced_identifiers(expression)
+        for column in reads:
+            writer = assigned.get(column)
+            if writer is not None and writer != i:
+                raise FusionConflictError(
+                    f"Statement {i} reads {column}, which statement {writer} sets; "
+                    f"the fused result would depend on statement order")
+
+    set_clauses = []
+    conditions = []
+    for p in parsed:
+        condition = f"({p['where']})" if p['where'] else "TRUE"
+        conditions.append(condition)
+        for column, expression in p['assignments']:
+            set_clauses.append(f"{column} = CASE WHEN {condition} THEN {expression} ELSE {column} END")
+
+    set_sql = ",\n        ".join(set_clauses)
+    return f"""
+    UPDATE {parsed[0]['table']}
+    SET {set_sql}
+    WHERE ({' OR '.join(conditions)})
+    """
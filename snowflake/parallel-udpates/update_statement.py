@@ -0,0 +1,227 @@
+from typing import Dict, List, Tuple
+import re
+
+
+_WORD = re.compile(r"[A-Za-z_][\w$]*")
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_COMMENT_OR_QUOTED = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+
+
+def _top_level_positions(sql: str):
+    """Yield (index, char) for characters outside quotes, comments and parentheses"""
+    depth = 0
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            # Skip the literal / quoted identifier, honouring doubled quotes
+            i += 1
+            while i < n:
+                if sql[i] == ch:
+                    if i + 1 < n and sql[i + 1] == ch:
+                        i += 2
+                        continue
+                    break
+                if ch == "'" and sql[i] == '\\':
+                    i += 1
+                i += 1
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif depth == 0:
+            yield i, ch
+        i += 1
+
+
+def split_top_level(text: str, sep: str = ',') -> List[str]:
+    """Split on sep, ignoring separators inside parentheses, literals and comments"""
+    parts = []
+    start = 0
+    for i, ch in _top_level_positions(text):
+        if ch == sep:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p]
+
+
+def blank_comments(sql: str) -> str:
+    """Copy of sql with -- and /* */ comments turned into spaces, so offsets still line up"""
+    return _COMMENT_OR_QUOTED.sub(
+        lambda m: m.group(0) if m.group(0)[0] in ('\'', '"') else re.sub(r"[^\n]", ' ', m.group(0)), sql)
+
+
+def mask_nested(sql: str) -> str:
+    """Copy of sql with parentheses, literals and comments filled with '#', so offsets still line up"""
+    masked = ['#'] * len(sql)
+    for i, ch in _top_level_positions(sql):
+        masked[i] = ch
+    return ''.join(masked)
+
+
+def find_keywords(sql: str, keywords: Tuple[str, ...]) -> Dict[str, int]:
+    """Offset of the first top-level occurrence of each keyword (case-insensitive)"""
+    wanted = {k.upper() for k in keywords}
+    found = {}
+    previous = None
+    for i, ch in _top_level_positions(sql):
+        # Only test at word starts
+        if previous is not None and (previous.isalnum() or previous in '_$.'):
+            previous = ch
+            continue
+        previous = ch
+        match = _WORD.match(sql, i)
+        if match:
+            word = match.group(0).upper()
+            if word in wanted and word not in found:
+                found[word] = i
+    return found
+
+
+def parse_update(sql: str) -> Dict:
+    """
+    Break an UPDATE statement into its parts
+
+    Returns:
+        Dictionary with table, alias, assignments [(column, expression)], from and where
+        (from/where are None when absent)
+    """
+    body = sql.strip().rstrip(';')
+    match = re.match(r"\s*UPDATE\s+([\w.$\"]+)(?:\s+(?:AS\s+)?(?!SET\b)([A-Za-z_]\w*))?\s+SET\b",
+                     body, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Not an UPDATE ... SET statement: {body[:80]}")
+
+    set_start = match.end()
+    positions = find_keywords(body[set_start:], ('FROM', 'WHERE'))
+    ends = sorted(set_start + p for p in positions.values())
+    set_end = ends[0] if ends else len(body)
+
+    assignments = []
+    for part in split_top_level(body[set_start:set_end]):
+        column, eq, expression = part.partition('=')
+        if not eq:
+            raise ValueError(f"Cannot parse SET assignment: {part}")
+        column = column.strip().split('.')[-1]  # t.col -> col
+        assignments.append((column, expression.strip()))
+
+    from_clause = where_clause = None
+    if 'FROM' in positions:
+        from_start = set_start + positions['FROM'] + len('FROM')
+        from_end = set_start + positions['WHERE'] if 'WHERE' in positions else len(body)
+        from_clause = body[from_start:from_end].strip()
+    if 'WHERE' in positions:
+        where_clause = blank_comments(body[set_start + positions['WHERE'] + len('WHERE'):]).strip()
+
+    return {
+        'table': match.group(1),
+        'alias': match.group(2),
+        'assignments': assignments,
+        'from': from_clause,
+        'where': where_clause
+    }
+
+
+def set_columns(sql: str) -> List[str]:
+    """Columns an UPDATE statement assigns to, in statement order"""
+    return [column for column, _ in parse_update(sql)['assignments']]
+
+
+def referenced_identifiers(text: str) -> set:
+    """Lower-cased bare identifiers mentioned in an expression (t.col counts as col), ignoring literals"""
+    stripped = _LITERAL.sub("''", text or '')
+    return {match.group(0).lower().strip('"') for match in re.finditer(r'"[^"]+"|[A-Za-z_][\w$]*', stripped)}
+
+
+# Words that end a WHERE / ON condition at its own nesting level
+_CONDITION_END = {'GROUP', 'ORDER', 'LIMIT', 'QUALIFY', 'HAVING', 'UNION', 'MINUS', 'EXCEPT', 'INTERSECT',
+                  'WHEN', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'WHERE', 'SET', 'WINDOW'}
+_TABLE_REFERENCE = re.compile(
+    r"\b(FROM|JOIN|USING|UPDATE|INTO)\s+(?!(?:SET|SELECT|TABLE|LATERAL)\b)([A-Za-z_][\w.$]*)"
+    r"(?:\s+(?:AS\s+)?(?!(?:WHERE|SET|ON|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|USING|WHEN|GROUP|ORDER|LIMIT|"
+    r"QUALIFY|HAVING|UNION|MINUS|EXCEPT|INTERSECT|SELECT|VALUES|AS|SAMPLE|TABLESAMPLE)\b)([A-Za-z_]\w*))?",
+    re.IGNORECASE)
+
+
+def mask_literals(sql: str) -> str:
+    """Copy of sql with the inside of string literals filled with '#', so offsets still line up"""
+    return _LITERAL.sub(lambda m: "'" + '#' * (len(m.group(0)) - 2) + "'", sql)
+
+
+def split_conjuncts(condition: str) -> List[str]:
+    """Top-level AND terms of a condition; the whole condition if it has a top-level OR"""
+    masked = mask_nested(condition)
+    if re.search(r"\bOR\b", masked, re.IGNORECASE):
+        return [condition.strip()]
+    parts = []
+    start = 0
+    between = 0
+    for match in re.finditer(r"\b(AND|BETWEEN)\b", masked, re.IGNORECASE):
+        if match.group(1).upper() == 'BETWEEN':
+            between += 1
+        elif between:
+            between -= 1  # The AND of x BETWEEN a AND b
+        else:
+            parts.append(condition[start:match.start()].strip())
+            start = match.end()
+    parts.append(condition[start:].strip())
+    return [p for p in parts if p]
+
+
+def condition_clauses(sql: str) -> List[str]:
+    """Text of every WHERE and ON condition in a statement, at any nesting level"""
+    masked = mask_literals(sql)
+    clauses = []
+    for keyword in re.finditer(r"\b(WHERE|ON)\b", masked, re.IGNORECASE):
+        depth = 0
+        end = len(sql)
+        i = keyword.end()
+        while i < len(masked):
+            ch = masked[i]
+            if ch == '(':
+                depth += 1
+            elif ch == ')':
+                if depth == 0:
+                    end = i
+                    break
+                depth -= 1
+            elif depth == 0 and (ch.isalpha() or ch == '_') and not (masked[i - 1].isalnum() or masked[i - 1] in '_$.'):
+                word = _WORD.match(masked, i).group(0)
+                if word.upper() in _CONDITION_END:
+                    end = i
+                    break
+                i += len(word)
+                continue
+            i += 1
+        clauses.append(sql[keyword.end():end].strip())
+    return clauses
+
+
+def table_references(sql: str) -> List[Dict]:
+    """
+    Tables a statement reads, at any nesting level
+
+    INSERT targets are left out; MERGE INTO, UPDATE and DELETE FROM targets are read as well as written.
+    Function arguments like EXTRACT(YEAR FROM col) also match, so callers check the names exist.
+
+    Returns:
+        List of dictionaries with table and alias (None when the table has none)
+    """
+    masked = mask_literals(sql)
+    references = []
+    for match in _TABLE_REFERENCE.finditer(masked):
+        if match.group(1).upper() == 'INTO' and \
+                not re.search(r"\bMERGE\s+$", masked[:match.start()], re.IGNORECASE):
+            continue
+        references.append({'table': match.group(2), 'alias': match.group(3)})
+    return references
@@ -0,0 +1,333 @@
+from typing import Callable, Dict, List, Optional, Union
+import logging
+import time
+
+from connection_pool import get_pool
+from cost_estimator import WAREHOUSE_NODES, warehouse_size_key
+from query_profiler import tag_params
+from run_journal import new_run_id
+
+# Snowflake bills at least this many seconds each time a warehouse resumes
+MINIMUM_BILLED_SECONDS = 60
+
+
+class WarehouseNotReadyError(Exception):
+    """A warehouse did not reach the STARTED state within the lifecycle's ready_timeout"""
+
+
+class ScanSizePolicy:
+    def __init__(self,
+                 target_seconds: float = 600,
+                 scan_bytes_per_node_second: float = 200 * 1024 ** 2,
+                 min_size: str = 'XSMALL',
+                 max_size: str = 'XLARGE'):
+        """
+        Size each warehouse so the job's table is scanned in about target_seconds
+
+        The table's bytes are split evenly over the job's warehouses; each warehouse gets the
+        smallest size whose nodes scan its share in time, between min_size and max_size.
+        scan_bytes_per_node_second is the same planning figure CostEstimator uses.
+        """
+        self.target_seconds = target_seconds
+        self.scan_bytes_per_node_second = scan_bytes_per_node_second
+        self.min_size = warehouse_size_key(min_size)
+        self.max_size = warehouse_size_key(max_size)
+
+    def __call__(self, warehouse: str, job: Dict) -> Optional[str]:
+        table_bytes = job.get('table_bytes')
+        if not table_bytes:
+            return None
+        share = table_bytes / max(1, len(job.get('warehouses') or [warehouse]))
+        nodes = share / (self.scan_bytes_per_node_second * self.target_seconds)
+        low, high = WAREHOUSE_NODES[self.min_size], WAREHOUSE_NODES[self.max_size]
+        sizes = sorted((n, size) for size, n in WAREHOUSE_NODES.items() if low <= n <= high)
+        return next((size for n, size in sizes if n >= nodes), self.max_size)
+
+
+class WarehouseLifecycle:
+    def __init__(self,
+                 connection_params: Dict,
+                 pool_options: Dict = None,
+                 size_policy: Union[str, Dict[str, str], Callable[[str, Dict], Optional[str]]] = None,
+                 suspend_after: Optional[bool] = None,
+                 ready_timeout: float = 300,
+                 poll_interval: float = 1.0,
+                 control_warehouse: str = None):
+        """
+        Resume and size a job's warehouses before it starts, and put them back when it ends
+
+        Without it, each warehouse resumes when the first partition statement lands on it, so that
+        partition (and every one queued behind it) pays the cold start. Here all warehouses are
+        resized and resumed at once, asynchronously on one session, while the caller plans the job.
+
+        Args:
+            connection_params: Snowflake connection parameters
+            pool_options: Options for the control session's pool
+            size_policy: Size for the job - one size for every warehouse, {warehouse: size}, or a
+                         callable (warehouse, job) -> size or None (e.g. ScanSizePolicy). None keeps sizes
+            suspend_after: None suspends the warehouses that were suspended before the job, True
+                           suspends all of them, False none
+            ready_timeout: Seconds to wait for every warehouse to report STARTED
+            poll_interval: Seconds between SHOW WAREHOUSES polls while waiting
+            control_warehouse: Warehouse of the control session; ALTER and SHOW WAREHOUSES need none
+        """
+        self.connection_params = connection_params
+        self.pool_options = pool_options or {}
+        self.size_policy = size_policy
+        self.suspend_after = suspend_after
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.control_warehouse = control_warehouse
+        self.reports: Dict[str, Dict] = {}
+        self._jobs: Dict[str, Dict] = {}
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def _pool(self):
+        return get_pool(self.connection_params, self.control_warehouse, **self.pool_options)
+
+    @staticmethod
+    def _execute(conn, sql: str, statement_params: Dict = None) -> List[Dict]:
+        """Run a statement and return its rows as dicts keyed by lower-case column name"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, _statement_params=statement_params)
+            if not cursor.description:
+                return []
+            columns = [d[0].lower() for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _show(self, conn, warehouse: str) -> Optional[Dict]:
+        # LIKE is a pattern, so an underscore in the name has to be escaped
+        pattern = warehouse.replace('_', '\\_')
+        rows = self._execute(conn, f"SHOW WAREHOUSES LIKE '{pattern}'")
+        return next((r for r in rows if r['name'].upper() == warehouse.upper()), None)
+
+    def _table_bytes(self, conn, table_name: str) -> int:
+        try:
+            rows = self._execute(conn, f"""
+                SELECT BYTES
+                FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = UPPER('{table_name.split('.')[-1]}')
+                """)
+            return int(rows[0]['bytes'] or 0) if rows else 0
+        except Exception as e:
+            self.logger.warning(f"Could not read table size of {table_name}: {str(e)}")
+            return 0
+
+    def _job_size(self, warehouse: str, job: Dict) -> Optional[str]:
+        if self.size_policy is None:
+            return None
+        if isinstance(self.size_policy, str):
+            size = self.size_policy
+        elif isinstance(self.size_policy, dict):
+            size = self.size_policy.get(warehouse) or self.size_policy.get(warehouse.upper())
+        else:
+            size = self.size_policy(warehouse, job)
+        return warehouse_size_key(size) if size else None
+
+    def _submit(self, conn, sql: str, run_id: str, warehouse: str) -> str:
+        cursor = conn.cursor()
+        try:
+            cursor.execute_async(sql, _statement_params=tag_params(run_id, None, warehouse, 'warehouse'))
+            return cursor.sfqid
+        finally:
+            cursor.close()
+
+    def start(self, warehouses: List[str], job: Dict = None, run_id: str = None) -> str:
+        """
+        Resize the job's warehouses and start resuming them, without waiting
+
+        Suspended warehouses are resized first (instant while suspended), then every resume - and the
+        resize of any warehouse already running, with WAIT_FOR_COMPLETION - is submitted at once with
+        execute_async, so the warehouses start concurrently while the caller plans the job.
+        Follow with wait_ready() before dispatching work, and always with stop().
+
+        Args:
+            warehouses: Warehouse names; duplicates and None (the session default) are dropped
+            job: Facts for the size policy: 'table' (its bytes are looked up as 'table_bytes'),
+                 plus anything else the policy reads
+            run_id: Run to tag the statements with and file the report under; a new one if omitted
+
+        Returns:
+            The run_id
+        """
+        run_id = run_id or new_run_id()
+        names = list(dict.fromkeys(w.upper() for w in warehouses if w))
+        job = dict(job or {}, warehouses=names)
+        started = time.monotonic()
+        conn = self._pool().acquire()
+        state = {'conn': conn, 'started': started, 'queries': {}, 'warehouses': {}}
+        self._jobs[run_id] = state
+        try:
+            if job.get('table') and 'table_bytes' not in job and callable(self.size_policy):
+                job['table_bytes'] = self._table_bytes(conn, job['table'])
+            for name in names:
+                shown = self._show(conn, name)
+                if shown is None:
+                    raise ValueError(f"Warehouse {name} does not exist or is not authorized")
+                original_size = warehouse_size_key(shown['size'])
+                job_size = self._job_size(name, job)
+                state['warehouses'][name] = {
+                    'warehouse': name,
+                    'original_state': shown['state'].upper(),
+                    'original_size': original_size,
+                    'job_size': job_size or original_size,
+                    'startup_seconds': None,
+                    'errors': []
+                }
+                if job_size and job_size != original_size and shown['state'].upper() == 'SUSPENDED':
+                    self._execute(conn, f"ALTER WAREHOUSE {name} SET WAREHOUSE_SIZE = '{job_size}'",
+                                  tag_params(run_id, None, name, 'warehouse'))
+
+            for name, info in state['warehouses'].items():
+                if info['original_state'] == 'SUSPENDED':
+                    sql = f"ALTER WAREHOUSE {name} RESUME IF SUSPENDED"
+                elif info['job_size'] != info['original_size']:
+                    sql = f"ALTER WAREHOUSE {name} SET WAREHOUSE_SIZE = '{info['job_size']}' WAIT_FOR_COMPLETION = TRUE"
+                else:
+                    info['startup_seconds'] = 0.0
+                    continue
+                state['queries'][name] = self._submit(conn, sql, run_id, name)
+            self.logger.info(f"Run {run_id}: starting {len(state['queries'])} of {len(names)} warehouses")
+        except Exception:
+            self.stop(run_id)
+            raise
+        return run_id
+
+    def wait_ready(self, run_id: str) -> Dict:
+        """
+        Block until every warehouse started by start() reports STARTED
+
+        Raises:
+            WarehouseNotReadyError: If a warehouse is not ready within ready_timeout
+            Exception: The error of a failed RESUME / resize statement
+        """
+        state = self._jobs[run_id]
+        conn = state['conn']
+        pending = dict(state['queries'])
+        deadline = time.monotonic() + self.ready_timeout
+        while pending:
+            for name, query_id in list(pending.items()):
+                status = conn.get_query_status_throw_if_error(query_id)
+                if conn.is_still_running(status):
+                    continue
+                shown = self._show(conn, name)
+                if shown and shown['state'].upper() == 'STARTED':
+                    state['warehouses'][name]['startup_seconds'] = time.monotonic() - state['started']
+                    del pending[name]
+            if not pending:
+                break
+            if time.monotonic() > deadline:
+                raise WarehouseNotReadyError(
+                    f"Warehouses {sorted(pending)} not started after {self.ready_timeout}s")
+            time.sleep(self.poll_interval)
+        startup = time.monotonic() - state['started']
+        self.logger.info(f"Run {run_id}: warehouses ready after {startup:.1f}s")
+        return {'run_id': run_id, 'startup_seconds': startup,
+                'warehouses': {name: info['startup_seconds'] for name, info in state['warehouses'].items()}}
+
+    def _restore(self, conn, run_id: str, info: Dict, job_seconds: float, still_running: str = None):
+        """
+        Suspend and/or size back one warehouse; errors are recorded, not raised
+
+        still_running is the id of a RESUME / resize statement that didn't finish in time; the warehouse
+        is then left alone and reported as not restored, since a later ALTER could land before it.
+        """
+        name = info['warehouse']
+        tag = tag_params(run_id, None, name, 'warehouse')
+        suspend = self.suspend_after if self.suspend_after is not None else info['original_state'] == 'SUSPENDED'
+        info['suspended'] = False
+        if still_running:
+            info['errors'].append(f"Warehouse statement {still_running} still running after {self.ready_timeout}s; "
+                                  f"warehouse left as it is")
+            suspend = False
+        if suspend:
+            try:
+                self._execute(conn, f"ALTER WAREHOUSE {name} SUSPEND", tag)
+                info['suspended'] = True
+            except Exception as e:
+                # Already suspended (AUTO_SUSPEND got there first) is the state we wanted
+                if 'invalid state' in str(e).lower():
+                    info['suspended'] = True
+                else:
+                    info['errors'].append(str(e))
+        info['restored_size'] = info['job_size'] == info['original_size']
+        if not info['restored_size'] and not still_running:
+            try:
+                self._execute(conn, f"ALTER WAREHOUSE {name} SET WAREHOUSE_SIZE = '{info['original_size']}'", tag)
+                info['restored_size'] = True
+            except Exception as e:
+                info['errors'].append(str(e))
+        # A warehouse this job resumed is billed at least a minute; a running one for the job's time
+        running = max(job_seconds, MINIMUM_BILLED_SECONDS) if info['original_state'] == 'SUSPENDED' else job_seconds
+        info['running_seconds'] = running
+        info['estimated_credits'] = running * WAREHOUSE_NODES[info['job_size']] / 3600
+
+    def stop(self, run_id: str) -> Dict:
+        """
+        Put every warehouse back as it was, whether the job succeeded or failed
+
+        Each warehouse is suspended (see suspend_after), then sized back to its original size, which is
+        instant once it is suspended. Credits are estimated from the job size and how long the job held
+        the warehouse, with the 60 second minimum a resume is billed; WAREHOUSE_METERING_HISTORY has
+        the billed figures, by the hour.
+
+        Returns:
+            The run's report: per warehouse original state and size, job size, startup_seconds,
+            running_seconds, estimated_credits, suspended / restored_size and any errors, plus
+            the job's startup_seconds (until the last warehouse was ready) and total estimated_credits
+        """
+        state = self._jobs.pop(run_id)
+        conn = state['conn']
+        job_seconds = time.monotonic() - state['started']
+        infos = list(state['warehouses'].values())
+        try:
+            # A resume still running must finish first, or it could land after the suspend; one stuck
+            # past ready_timeout leaves its warehouse unrestored rather than hanging the job's cleanup
+            deadline = time.monotonic() + self.ready_timeout
+            still_running = {}
+            for name, query_id in state['queries'].items():
+                try:
+                    while conn.is_still_running(conn.get_query_status(query_id)):
+                        if time.monotonic() > deadline:
+                            still_running[name] = query_id
+                            break
+                        time.sleep(self.poll_interval)
+                except Exception as e:
+                    self.logger.warning(f"Run {run_id}: warehouse statement {query_id}: {str(e)}")
+            for info in infos:
+                self._restore(conn, run_id, info, job_seconds, still_running.get(info['warehouse']))
+        finally:
+            self._pool().release(conn)
+
+        for info in infos:
+            if info['errors']:
+                self.logger.error(f"Run {run_id}: could not restore warehouse {info['warehouse']}: {info['errors']}")
+        startups = [i['startup_seconds'] for i in infos if i['startup_seconds'] is not None]
+        report = {
+            'run_id': run_id,
+            'startup_seconds': max(startups, default=0.0),
+            'seconds': time.monotonic() - state['started'],
+            'estimated_credits': sum(i['estimated_credits'] for i in infos),
+            'warehouses': {i['warehouse']: i for i in infos}
+        }
+        self.reports[run_id] = report
+        return report
+
+    def run(self, warehouses: List[str], fn: Callable[[], object], job: Dict = None, run_id: str = None):
+        """
+        start(), wait_ready(), fn(), stop() - the warehouses are put back even if fn or the start fails
+
+        Returns:
+            (fn's result, the lifecycle report)
+        """
+        run_id = self.start(warehouses, job, run_id)
+        try:
+            self.wait_ready(run_id)
+            result = fn()
+        finally:
+            report = self.stop(run_id)
+        return result, report
@@ -0,0 +1,127 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+import logging
+
+from run_journal import RunJournal
+from update_statement import set_columns
+
+
+class Watermark:
+    def __init__(self,
+                 job: str,
+                 column: str = 'search_dt',
+                 column_type: str = 'timestamp',
+                 lookback_seconds: int = 0):
+        """
+        High-water mark of a recurring update job, so each run only touches rows changed since the last one
+
+        A run covers column > (the mark of the last successful run) AND column <= (MAX(column) when the
+        run starts); rows landing while it runs are left for the next one. The mark is kept in the
+        updater's RunJournal and only moves when the run (or its resume) succeeds.
+
+        Args:
+            job: Name of the recurring job; one mark per job
+            column: Column that grows whenever a row changes (a load or modified timestamp, a sequence)
+            column_type: 'timestamp', 'date' or 'number', for the literals written into predicates
+            lookback_seconds: Re-cover this many seconds before the mark, for rows that arrive late with
+                              an older timestamp (timestamp columns only); those rows are updated twice
+        """
+        if column_type not in ('timestamp', 'date', 'number'):
+            raise ValueError(f"Unsupported column_type: {column_type}")
+        if lookback_seconds and column_type != 'timestamp':
+            raise ValueError("lookback_seconds needs a timestamp column")
+        self.job = job
+        self.column = column
+        self.column_type = column_type
+        self.lookback_seconds = lookback_seconds
+        self.logger = logging.getLogger(__name__)
+
+    def literal(self, value) -> str:
+        """A value of the column as a SQL literal"""
+        if self.column_type == 'number':
+            if isinstance(value, Decimal):
+                return str(value)
+            return repr(value) if isinstance(value, float) else str(value)
+        if self.column_type == 'date':
+            text = value.isoformat() if isinstance(value, date) else str(value)[:10]
+            return f"'{text}'::DATE"
+        text = value.strftime('%Y-%m-%d %H:%M:%S.%f') if isinstance(value, datetime) else str(value)
+        return f"'{text}'::TIMESTAMP_NTZ"
+
+    def high_water_mark(self, conn, table_name: str) -> Optional[str]:
+        """MAX(column) of the table as a literal, or None for no rows"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT MAX({self.column}) FROM {table_name}")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return self.literal(row[0]) if row and row[0] is not None else None
+
+    def window(self, conn, journal: RunJournal, table_name: str, update_sql: str = None,
+               full_refresh: bool = False) -> Dict:
+        """
+        The slice of the table this run covers
+
+        Args:
+            conn: Open Snowflake session
+            journal: Where the job's mark and runs are kept
+            table_name: Table the job updates
+            update_sql: The job's UPDATE, checked not to set the watermark column (its own writes would
+                        count as changes, so every run would redo the last one)
+            full_refresh: Cover the whole table, and move the mark to MAX(column) if the run succeeds
+
+        Returns:
+            Dictionary with job, column, low and high literals, the predicate restricting the run
+            (None for the whole table), full_refresh, and empty (True when nothing changed)
+
+        Raises:
+            ValueError: If an earlier run of the job did not finish (resume it, or run a full refresh),
+                        the mark was kept on another column, or the UPDATE sets the column
+        """
+        if update_sql and self.column.lower() in (c.lower() for c in set_columns(update_sql)):
+            raise ValueError(f"The update sets {self.column}, so it can't be the watermark of job {self.job}")
+        stored = journal.get_watermark(self.job)
+        if not full_refresh:
+            open_runs = journal.open_runs(self.job)
+            if open_runs:
+                raise ValueError(f"Run {open_runs[0]} of job {self.job} did not finish; resume it before the "
+                                 f"next incremental run, or run a full refresh")
+            if stored and stored['column_name'].lower() != self.column.lower():
+                raise ValueError(f"Job {self.job} has its mark on {stored['column_name']}, not {self.column}; "
+                                 f"run a full refresh to move it")
+
+        high = self.high_water_mark(conn, table_name)
+        low = stored['value'] if stored and not full_refresh else None
+        window = {
+            'job': self.job,
+            'column': self.column,
+            'low': low,
+            'high': high,
+            'full_refresh': full_refresh or low is None,
+            'predicate': None,
+            # Nothing at or below the old mark changed, and nothing above it exists
+            'empty': low is not None and (high is None or high == low)
+        }
+        if low is not None and not window['empty']:
+            bound = f"DATEADD(second, {-self.lookback_seconds}, {low})" if self.lookback_seconds else low
+            window['predicate'] = f"{self.column} > {bound} AND {self.column} <= {high}"
+        elif low is None and high is not None:
+            # A first run or a full refresh covers every row, but still only up to the mark it will store
+            window['predicate'] = f"({self.column} <= {high} OR {self.column} IS NULL)"
+        self.logger.info(f"Job {self.job}: {'full refresh' if window['full_refresh'] else 'incremental'} run "
+                         f"covering {self.column} in ({low}, {high}]")
+        return window
+
+    @staticmethod
+    def restrict(predicates: List[str], window: Dict) -> List[str]:
+        """Partition predicates narrowed to the window"""
+        if not window or not window['predicate']:
+            return predicates
+        return [f"{window['predicate']} AND ({p})" for p in predicates]
+
+    @staticmethod
+    def journal_options(window: Dict) -> Dict:
+        """What RunJournal.finish_run needs to move the mark once the run succeeds"""
+        return {'job': window['job'], 'column': window['column'], 'high': window['high']}